@@ -0,0 +1,133 @@
+# benchmarks/bench_flatten.py
+"""
+Benchmark de l'aplatissement TEI → enrollments → events/attributes.
+
+Compare l'ancien chemin (clean_object_from_data récursif + copies de dicts + dict par ligne)
+au TrackerFlattener colonnaire, sur une réponse DHIS2 enregistrée ou générée.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_flatten --file outputs_files/teis_response.json
+    python -m benchmarks.bench_flatten --teis 5000 --repeat 3
+"""
+import argparse
+import copy
+import json
+import time
+from typing import Dict, List
+
+from benchmarks.dhis2_fixtures import generate_teis, uid
+from utils.functions import clean, clean_object_from_data
+from utils.tracker_flattener import TrackerFlattener
+
+KEYS_TO_REMOVE = ["lastUpdatedAtClient", "lastUpdatedByUserInfo", "createdByUserInfo", "storedBy", "href"]
+
+
+def legacy_flatten(raw_teis: List[Dict], program: str) -> Dict[str, int]:
+    """Reproduction de l'ancienne boucle de fetch_teis_enrollments_events_attributes (référence)."""
+    raw_teis = clean_object_from_data(raw_teis, KEYS_TO_REMOVE)
+    teis, enrollments, attributes, events = [], [], [], []
+    for tei in raw_teis:
+        tei = tei.copy()
+        is_tei_deleted = tei.get("deleted", False)
+        for enrollment in tei.pop("enrollments", []):
+            enrollment = enrollment.copy()
+            is_enrollment_deleted = enrollment.get("deleted", False)
+            for event in enrollment.pop("events", []):
+                event = event.copy()
+                if is_tei_deleted or is_enrollment_deleted or event.get("deleted", False):
+                    continue
+                row = {
+                    "id": event.get("event"), "due_date": event.get("dueDate"), "program": program,
+                    "program_stage_id": event.get("programStage"), "orgunit_id": event.get("orgUnit"),
+                    "enrollment_id": event.get("enrollment"), "tei_id": event.get("trackedEntityInstance"),
+                    "enrollment_status": event.get("enrollmentStatus"), "status": event.get("status"),
+                    "event_date": event.get("eventDate"), "attribute_category_options": event.get("attributeCategoryOptions"),
+                    "last_updated": event.get("lastUpdated"), "created": event.get("createdAtClient") or event.get("created"),
+                    "deleted": bool(event.get("deleted", False)), "attribute_option_combo": event.get("attributeOptionCombo"),
+                }
+                for dv in event.get("dataValues") or []:
+                    if dv.get("dataElement"):
+                        row[dv["dataElement"]] = dv.get("value")
+                events.append({k: clean(v) for k, v in row.items()})
+
+            row = {
+                "id": f"{enrollment.get('trackedEntityInstance')}-{enrollment.get('enrollment')}",
+                "tei_id": enrollment.get("trackedEntityInstance"), "enrollment_id": enrollment.get("enrollment"),
+                "orgunit_id": enrollment.get("orgUnit"), "program": program, "created": enrollment.get("created"),
+                "status": enrollment.get("status"), "deleted": enrollment.get("deleted"),
+            }
+            for attribute in enrollment.pop("attributes", []):
+                attribute = attribute.copy()
+                row[attribute.get("attribute")] = clean(attribute.get("value"))
+            attributes.append({k: clean(v) for k, v in row.items()})
+
+            if is_tei_deleted or is_enrollment_deleted:
+                continue
+            row = {
+                "id": enrollment.get("enrollment"), "program": program, "orgunit_id": enrollment.get("orgUnit"),
+                "tei_id": enrollment.get("trackedEntityInstance"), "tei_type": enrollment.get("trackedEntityType"),
+                "enrollment_date": enrollment.get("enrollmentDate"), "incident_date": enrollment.get("incidentDate"),
+                "last_updated": enrollment.get("lastUpdated"), "created": enrollment.get("createdAtClient") or enrollment.get("created"),
+                "status": enrollment.get("status"), "deleted": bool(enrollment.get("deleted", False)),
+            }
+            enrollments.append({k: clean(v) for k, v in row.items()})
+
+        if is_tei_deleted:
+            continue
+        row = {
+            "id": tei.get("trackedEntityInstance"), "orgunit_id": tei.get("orgUnit"),
+            "created": tei.get("createdAtClient") or tei.get("created"), "last_updated": tei.get("lastUpdated"),
+            "type": tei.get("trackedEntityType"), "deleted": bool(tei.get("deleted", False)), "program": program,
+        }
+        teis.append({k: clean(v) for k, v in row.items()})
+
+    return {"teis": len(teis), "enrollments": len(enrollments), "attributes": len(attributes), "events": len(events)}
+
+
+def columnar_flatten(raw_teis: List[Dict], program: str) -> Dict[str, int]:
+    flat = TrackerFlattener(program).add_teis(raw_teis).finish()
+    return {"teis": len(flat.teis), "enrollments": len(flat.enrollments), "attributes": len(flat.attributes), "events": len(flat.events)}
+
+
+def generate_response(n_teis: int, events_per_enrollment: int = 6, data_values_per_event: int = 25, seed: int = 42) -> List[Dict]:
+    """Réponse `trackedEntityInstances` synthétique au format DHIS2 2.3x."""
+    return generate_teis(uid("S", 0), n_teis, events_per_enrollment=events_per_enrollment, data_values_per_event=data_values_per_event, seed=seed)
+
+
+def _best_of(fn, raw, program, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        data = copy.deepcopy(raw)  # l'ancien chemin modifie les dicts en place
+        t0 = time.perf_counter()
+        result = fn(data, program)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de l'aplatissement des TEI DHIS2")
+    parser.add_argument("--file", help="Réponse DHIS2 enregistrée (JSON avec clé 'trackedEntityInstances' ou liste)")
+    parser.add_argument("--teis", type=int, default=2000, help="Nombre de TEI générés si --file absent")
+    parser.add_argument("--program", default="DdjHMnKg3wx")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        raw = raw.get("trackedEntityInstances", []) if isinstance(raw, dict) else raw
+    else:
+        raw = generate_response(args.teis)
+
+    legacy_s, legacy_counts = _best_of(legacy_flatten, raw, args.program, args.repeat)
+    columnar_s, columnar_counts = _best_of(columnar_flatten, raw, args.program, args.repeat)
+
+    print(f"TEIs en entrée     : {len(raw)}")
+    print(f"legacy (dicts)     : {legacy_s * 1000:9.1f} ms  {legacy_counts}")
+    print(f"columnar (buffers) : {columnar_s * 1000:9.1f} ms  {columnar_counts}")
+    print(f"speedup            : x{legacy_s / columnar_s:.2f}")
+
+
+if __name__ == "__main__":
+    main()
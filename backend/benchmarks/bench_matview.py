@@ -0,0 +1,214 @@
+# benchmarks/bench_matview.py
+"""
+Benchmark et test de régression du rafraîchissement de indicators_matview.
+
+Étapes (contre le Postgres local, POSTGRES_* du .env, base jetable !) :
+  1. (option --load) chargement d'un jeu de données synthétique (benchmarks.synthetic_data, COPY)
+  2. construction de la vue via build_materialize_view (postgresql/indicators_matview.sql)
+  3. N rafraîchissements complets puis N rafraîchissements CONCURRENTLY (chronométrés)
+  4. EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) du SELECT sous-jacent (pg_get_viewdef)
+Les résultats sont écrits en JSON. Avec --baseline, la commande échoue (code 1) si une
+médiane dépasse la référence de plus de --threshold (ex: 0.25 = +25%).
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_matview --load --orgunits 400 --agents-per-orgunit 5 --months 24 --out matview_baseline.json
+    python -m benchmarks.bench_matview --baseline matview_baseline.json --threshold 0.25 --out matview_run.json
+"""
+import argparse
+import hashlib
+import json
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from psycopg2 import sql
+
+from utils.config import config
+from utils.db import get_connection
+
+# Médianes comparées à la référence
+COMPARED_METRICS = ["build_ms", "full_refresh_ms", "concurrent_refresh_ms", "explain_execution_ms"]
+
+
+def _timed(cur, query) -> float:
+    started = time.perf_counter()
+    cur.execute(query)
+    return (time.perf_counter() - started) * 1000
+
+
+def table_counts(cur, tables: List[str]) -> Dict[str, Optional[int]]:
+    counts = {}
+    for table in tables:
+        cur.execute("SELECT to_regclass(%s);", (f'"{table}"',))
+        if cur.fetchone()[0] is None:
+            counts[table] = None
+            continue
+        cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+        counts[table] = cur.fetchone()[0]
+    return counts
+
+
+def summarize_plan(plan: Dict[str, Any], top: int = 10) -> Dict[str, Any]:
+    """Temps propre (hors enfants) et buffers des nœuds les plus coûteux."""
+    nodes = []
+
+    def walk(node: Dict[str, Any]):
+        loops = node.get("Actual Loops", 1) or 1
+        total = node.get("Actual Total Time", 0) * loops
+        children = node.get("Plans", [])
+        child_total = sum(c.get("Actual Total Time", 0) * (c.get("Actual Loops", 1) or 1) for c in children)
+        nodes.append({
+            "node": node.get("Node Type"),
+            "relation": node.get("Relation Name") or node.get("CTE Name") or node.get("Alias"),
+            "self_ms": round(max(0.0, total - child_total), 3),
+            "total_ms": round(total, 3),
+            "rows": node.get("Actual Rows", 0) * loops,
+            "shared_hit": node.get("Shared Hit Blocks", 0),
+            "shared_read": node.get("Shared Read Blocks", 0),
+            "temp_written": node.get("Temp Written Blocks", 0),
+        })
+        for child in children:
+            walk(child)
+
+    root = plan["Plan"]
+    walk(root)
+    return {
+        "planning_ms": plan.get("Planning Time"),
+        "execution_ms": plan.get("Execution Time"),
+        "shared_hit": root.get("Shared Hit Blocks", 0),
+        "shared_read": root.get("Shared Read Blocks", 0),
+        "temp_read": root.get("Temp Read Blocks", 0),
+        "temp_written": root.get("Temp Written Blocks", 0),
+        "top_nodes": sorted(nodes, key=lambda n: n["self_ms"], reverse=True)[:top],
+    }
+
+
+def run_benchmark(repeat: int, view: str) -> Dict[str, Any]:
+    from utils.build_views import build_materialize_view
+
+    started = time.perf_counter()
+    result, success = build_materialize_view()
+    build_ms = (time.perf_counter() - started) * 1000
+    if not success:
+        raise RuntimeError(f"build_materialize_view a échoué : {result}")
+
+    conn = get_connection()
+    if not conn:
+        raise RuntimeError("Connexion PostgreSQL impossible")
+    try:
+        with conn.cursor() as cur:
+            view_id = sql.Identifier(view)
+            full = [_timed(cur, sql.SQL("REFRESH MATERIALIZED VIEW {}").format(view_id)) for _ in range(repeat)]
+            concurrent = [_timed(cur, sql.SQL("REFRESH MATERIALIZED VIEW CONCURRENTLY {}").format(view_id)) for _ in range(repeat)]
+
+            cur.execute("SELECT pg_get_viewdef(%s::regclass, true)", (view,))
+            select_sql = cur.fetchone()[0].strip().rstrip(";")
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + select_sql)
+            raw_plan = cur.fetchone()[0]
+            plan = raw_plan[0] if isinstance(raw_plan, list) else json.loads(raw_plan)[0]
+
+            cur.execute("SHOW server_version")
+            server_version = cur.fetchone()[0]
+            counts = table_counts(cur, ["events", "attributes", "enrollments", "trackedEntityInstances", "organisationUnits", view])
+    finally:
+        conn.close()
+
+    summary = summarize_plan(plan)
+    return {
+        "build_ms": [round(build_ms, 1)],
+        "full_refresh_ms": [round(v, 1) for v in full],
+        "concurrent_refresh_ms": [round(v, 1) for v in concurrent],
+        "explain_execution_ms": [summary["execution_ms"]],
+        "plan_summary": summary,
+        "plan": plan,
+        "server_version": server_version,
+        "row_counts": counts,
+    }
+
+
+def medians(results: Dict[str, Any]) -> Dict[str, float]:
+    return {m: statistics.median(results[m]) for m in COMPARED_METRICS if results.get(m)}
+
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], threshold: float, min_delta_ms: float) -> List[str]:
+    """Liste des régressions : médiane > référence × (1 + threshold) et écart > min_delta_ms."""
+    regressions = []
+    for metric, value in current.items():
+        ref = baseline.get(metric)
+        if not ref:
+            continue
+        if value > ref * (1 + threshold) and value - ref > min_delta_ms:
+            regressions.append(f"{metric}: {value:.1f} ms vs {ref:.1f} ms (+{(value / ref - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du rafraîchissement de la vue matérialisée")
+    parser.add_argument("--repeat", type=int, default=3, help="Rafraîchissements par mode (complet / concurrent)")
+    parser.add_argument("--out", help="Fichier JSON des résultats")
+    parser.add_argument("--baseline", help="Résultats JSON de référence")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Régression tolérée (0.25 = +25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=50.0, help="Écart absolu minimal pour signaler une régression")
+    parser.add_argument("--load", action="store_true", help="Charge d'abord un jeu synthétique (tables tracker vidées)")
+    parser.add_argument("--orgunits", type=int, default=400)
+    parser.add_argument("--agents-per-orgunit", type=int, default=5)
+    parser.add_argument("--start", default="2024-01")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = None
+    if args.load:
+        from benchmarks.dhis2_fixtures import generate_orgunits
+        from benchmarks.synthetic_data import AscRcGenerator, load_into_postgres, month_range
+
+        generator = AscRcGenerator(month_range(args.start, args.months), agents_per_orgunit=args.agents_per_orgunit, seed=args.seed)
+        dataset = load_into_postgres(generator, generate_orgunits(args.orgunits), truncate=True)
+        dataset.update({"orgunits": args.orgunits, "agents_per_orgunit": args.agents_per_orgunit, "start": args.start, "months": args.months, "seed": args.seed})
+        print(f"📦 Jeu de données chargé : {dataset}")
+
+    with open(f"postgresql/{config.MATVIEW_NAME}.sql", "rb") as f:
+        sql_sha256 = hashlib.sha256(f.read()).hexdigest()
+
+    results = run_benchmark(args.repeat, config.MATVIEW_NAME)
+    current = medians(results)
+    output = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "view": config.MATVIEW_NAME,
+        "sql_sha256": sql_sha256,
+        "dataset": dataset,
+        "medians": current,
+        **results,
+    }
+
+    print(f"{'métrique':<24}{'médiane ms':>12}")
+    for metric, value in current.items():
+        print(f"{metric:<24}{value:>12.1f}")
+    print("Nœuds les plus coûteux (temps propre) :")
+    for node in results["plan_summary"]["top_nodes"][:5]:
+        print(f"  {node['self_ms']:>10.1f} ms  {node['node']} {node['relation'] or ''}  rows={node['rows']}  read={node['shared_read']}  temp={node['temp_written']}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline.get("medians", {}), args.threshold, args.min_delta_ms)
+        output["baseline"] = {"file": args.baseline, "sql_sha256": baseline.get("sql_sha256"), "medians": baseline.get("medians"), "regressions": regressions}
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2, default=str)
+
+    if regressions:
+        print(f"❌ Régression au-delà de {args.threshold:.0%} :")
+        for r in regressions:
+            print(f"   {r}")
+        sys.exit(1)
+    if args.baseline:
+        print("✅ Aucune régression par rapport à la référence")
+
+
+if __name__ == "__main__":
+    main()
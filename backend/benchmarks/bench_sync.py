@@ -0,0 +1,235 @@
+# benchmarks/bench_sync.py
+"""
+Benchmark de bout en bout de la synchronisation contre un DHIS2 factice.
+
+Démarre benchmarks.dhis2_mock_server dans un processus séparé, y redirige les
+clients DHIS2 source et destination, puis exécute contre le Postgres local
+(POSTGRES_* du .env, base jetable !) les étapes :
+    orgunits → dataelements → teis → matview → arrimage
+Pour chaque étape : durée, éléments/s, latence des requêtes p50/p99 (côté mock),
+RSS max du processus client, saturation des pools HTTP.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_sync --orgunits 100 --teis-per-orgunit 20 --latency-ms 80 --jitter-ms 30
+    python -m benchmarks.bench_sync --profile asc_rc --orgunits 400 --teis-per-orgunit 5 --months 24
+    python -m benchmarks.bench_sync --fixtures outputs_files/dhis2_fixtures --stages orgunits,teis --json bench_sync.json
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from benchmarks.dhis2_fixtures import PROGRAM_ID
+from benchmarks.dhis2_mock_server import add_mock_arguments
+from utils.config import config
+
+STAGES = ["orgunits", "dataelements", "teis", "matview", "arrimage"]
+
+# Endpoints du mock dont les éléments servis/reçus comptent pour chaque étape
+STAGE_ENDPOINTS = {
+    "orgunits": ["organisationUnits"],
+    "dataelements": ["dataElements"],
+    "teis": ["trackedEntityInstances"],
+    "matview": [],
+    "arrimage": ["dataValueSets.post"],
+}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class RssSampler:
+    """Échantillonne la RSS du processus (Linux : /proc/self/statm) pour en garder le pic par étape."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def current(self) -> int:
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except OSError:
+            # Repli : pic global du processus (non réinitialisable)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+class MockProcess:
+    """benchmarks.dhis2_mock_server lancé en sous-processus."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.port = args.mock_port or self._free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.cmd = [
+            sys.executable, "-m", "benchmarks.dhis2_mock_server", "--port", str(self.port),
+            "--orgunits", str(args.orgunits), "--teis-per-orgunit", str(args.teis_per_orgunit),
+            "--events-per-enrollment", str(args.events_per_enrollment), "--data-values-per-event", str(args.data_values_per_event),
+            "--deletion-rate", str(args.deletion_rate), "--latency-ms", str(args.latency_ms),
+            "--jitter-ms", str(args.jitter_ms), "--failure-rate", str(args.failure_rate),
+            "--profile", args.profile, "--start", args.start, "--months", str(args.months),
+        ]
+        if args.fixtures:
+            self.cmd += ["--fixtures", args.fixtures]
+        if args.no_gzip:
+            self.cmd.append("--no-gzip")
+        self.proc: Optional[subprocess.Popen] = None
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    def __enter__(self):
+        self.proc = subprocess.Popen(self.cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                if requests.get(f"{self.base_url}/__mock__/health", timeout=1).ok:
+                    return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError("Le serveur DHIS2 factice n'a pas démarré")
+
+    def __exit__(self, *exc):
+        if self.proc:
+            self.proc.terminate()
+            self.proc.wait(timeout=10)
+
+    def reset(self):
+        requests.post(f"{self.base_url}/__mock__/reset", timeout=5)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return requests.get(f"{self.base_url}/__mock__/stats", timeout=30).json()
+
+
+def point_clients_to(base_url: str):
+    """ Redirige les deux clients DHIS2 vers le mock (avant leur première instanciation). """
+    api = f"{base_url}/api"
+    config.DHIS2_URL, config.DHIS2_USER, config.DHIS2_PASS = api, "bench", "bench"
+    config.TOGO_DHIS2_URL, config.TOGO_DHIS2_USER, config.TOGO_DHIS2_PASS = api, "bench", "bench"
+    config.PROGRAM_TRACKER_ID = config.PROGRAM_TRACKER_ID or PROGRAM_ID
+    config.USE_SSL = False
+
+
+def stage_runners() -> Dict[str, Callable[[], Any]]:
+    # Imports tardifs : les clients lisent config à l'instanciation
+    from make_arrimate import Dhis2ArrimateMaker
+    from routes.sync_routes_utils import sync_dataelements, sync_orgunits, sync_teis_enrollments_events_attributes
+    from utils.build_views import build_materialize_view
+
+    return {
+        "orgunits": sync_orgunits,
+        "dataelements": sync_dataelements,
+        "teis": sync_teis_enrollments_events_attributes,
+        "matview": build_materialize_view,
+        "arrimage": lambda: Dhis2ArrimateMaker(send_to_dhis2=True).start_indicators_arrimage_with_dhis2(),
+    }
+
+
+def run_stage(name: str, runner: Callable[[], Any], mock: MockProcess) -> Dict[str, Any]:
+    from clients.http_transport import transport_stats
+
+    mock.reset()
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        try:
+            result, error = runner(), None
+            # Les fonctions de sync renvoient (résultat, status HTTP) sans lever d'exception
+            if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], int) and result[1] >= 400:
+                error = json.dumps(result[0], default=str, ensure_ascii=False)
+        except Exception as e:
+            result, error = None, str(e)
+        elapsed = time.perf_counter() - started
+
+    stats = mock.stats()
+    latencies = [ms for ep in stats.values() for ms in ep["latencies_ms"]]
+    items = sum(stats.get(ep, {}).get("items", 0) for ep in STAGE_ENDPOINTS[name])
+    return {
+        "stage": name,
+        "seconds": round(elapsed, 3),
+        "items": items,
+        "items_per_s": round(items / elapsed, 1) if elapsed and items else 0,
+        "requests": sum(ep["requests"] for ep in stats.values()),
+        "failures_injected": sum(ep["failures"] for ep in stats.values()),
+        "bytes": sum(ep["bytes"] for ep in stats.values()),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "peak_rss_mb": round(rss.peak / (1024 * 1024), 1),
+        "http_pools": transport_stats(),
+        "result": result if isinstance(result, (dict, list, tuple)) else repr(result),
+        "error": error,
+    }
+
+
+def print_report(rows: List[Dict[str, Any]]):
+    header = f"{'étape':<13}{'durée (s)':>10}{'éléments':>10}{'élém/s':>10}{'req':>7}{'503':>6}{'p50 ms':>9}{'p99 ms':>9}{'RSS max MB':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        fmt = lambda v: "-" if v is None else f"{v:.1f}"
+        print(f"{r['stage']:<13}{r['seconds']:>10.2f}{r['items']:>10}{r['items_per_s']:>10.1f}{r['requests']:>7}"
+              f"{r['failures_injected']:>6}{fmt(r['p50_ms']):>9}{fmt(r['p99_ms']):>9}{r['peak_rss_mb']:>12.1f}")
+        if r["error"]:
+            print(f"   ❌ {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de synchronisation contre un DHIS2 factice")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Étapes à exécuter, dans l'ordre ({','.join(STAGES)})")
+    parser.add_argument("--mock-port", type=int, default=0, help="Port du mock (0 = port libre)")
+    parser.add_argument("--json", help="Fichier de sortie JSON des résultats")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"Étapes inconnues : {unknown}")
+
+    with MockProcess(args) as mock:
+        point_clients_to(mock.base_url)
+        runners = stage_runners()
+        rows = [run_stage(name, runners[name], mock) for name in stages]
+
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "stages": rows}, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
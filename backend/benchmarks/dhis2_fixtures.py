@@ -0,0 +1,103 @@
+# benchmarks/dhis2_fixtures.py
+"""
+Génération de réponses DHIS2 synthétiques (format API 2.3x) pour les benchmarks :
+organisationUnits (avec path), dataElements et trackedEntityInstances.
+Les données sont déterministes (seed) afin que deux exécutions soient comparables.
+"""
+import random
+import zlib
+from typing import Dict, List, Optional
+
+PROGRAM_ID = "DdjHMnKg3wx"
+TEI_TYPE_ID = "MCPQUTHX1Ze"
+USER_INFO = {"uid": "usr0000001", "username": "admin", "firstName": "A", "surname": "B"}
+
+
+def uid(prefix: str, n: int) -> str:
+    """Identifiant de 11 caractères façon DHIS2 (préfixe + compteur)."""
+    return f"{prefix}{n:0{11 - len(prefix)}d}"
+
+
+def generate_orgunits(n_level5: int = 400, fan_out: int = 10) -> List[Dict]:
+    """Hiérarchie national → régions → districts → niveau 4 → niveau 5 (avec `path` et `parent`)."""
+    root_id = uid("N", 0)
+    orgunits = [{"id": root_id, "name": "National", "shortName": "National", "level": 1, "path": f"/{root_id}"}]
+    parents = orgunits
+    # Nombre d'unités par niveau : n_level5 au niveau 5, divisé par fan_out à chaque niveau au-dessus
+    sizes = {level: max(1, -(-n_level5 // fan_out ** (5 - level))) for level in (2, 3, 4, 5)}
+
+    for level, prefix in ((2, "R"), (3, "D"), (4, "C"), (5, "S")):
+        children = []
+        for n in range(sizes[level]):
+            parent = parents[n * len(parents) // sizes[level]]
+            ou_id = uid(prefix, n)
+            children.append({
+                "id": ou_id, "name": f"{prefix}-{n}", "shortName": f"{prefix}{n}", "level": level,
+                "path": f"{parent['path']}/{ou_id}",
+                "parent": {k: parent[k] for k in ("id", "name", "shortName", "level")},
+            })
+        orgunits.extend(children)
+        parents = children
+    return orgunits
+
+
+def generate_dataelements(de_ids: List[str]) -> List[Dict]:
+    return [
+        {"id": de_id, "name": f"DE {de_id}", "shortName": de_id, "code": de_id, "valueType": "TEXT",
+         "domainType": "TRACKER", "aggregationType": "NONE", "created": "2022-01-01T00:00:00.000"}
+        for de_id in de_ids
+    ]
+
+
+def generate_teis(
+    ou_id: str,
+    n_teis: int,
+    program: str = PROGRAM_ID,
+    events_per_enrollment: int = 6,
+    data_values_per_event: int = 25,
+    deletion_rate: float = 0.01,
+    seed: Optional[int] = None,
+) -> List[Dict]:
+    """TEIs d'un orgunit, chacun avec un enrollment, ses attributs et ses events."""
+    rnd = random.Random(seed if seed is not None else zlib.crc32(ou_id.encode()))
+    teis = []
+    for i in range(n_teis):
+        tei_id, enr_id = uid("T", rnd.getrandbits(32)), uid("E", rnd.getrandbits(32))
+        events = []
+        for j in range(events_per_enrollment):
+            events.append({
+                "event": uid("V", rnd.getrandbits(32)), "programStage": "uYjFHpdIZ1n", "orgUnit": ou_id,
+                "enrollment": enr_id, "trackedEntityInstance": tei_id, "enrollmentStatus": "ACTIVE",
+                "status": "COMPLETED", "eventDate": "2024-05-12T00:00:00.000", "dueDate": "2024-05-12T00:00:00.000",
+                "lastUpdated": "2024-05-13T10:11:12.000", "created": "2024-05-12T10:11:12.000",
+                "attributeOptionCombo": "HllvX50cXC0", "attributeCategoryOptions": "xYerKDKCefk",
+                "deleted": rnd.random() < deletion_rate, "href": "https://dhis2/api/events/x", "storedBy": "admin",
+                "createdByUserInfo": USER_INFO, "lastUpdatedByUserInfo": USER_INFO, "notes": [], "relationships": [],
+                "dataValues": [
+                    {"dataElement": uid("de", k), "value": rnd.choice(["true", "false", "BON ETAT", "12"]),
+                     "storedBy": "admin", "createdByUserInfo": USER_INFO, "lastUpdatedByUserInfo": USER_INFO,
+                     "providedElsewhere": False, "created": "2024-05-12T10:11:12.000"}
+                    for k in range(data_values_per_event)
+                ],
+            })
+        attributes = [
+            {"attribute": uid("at", k), "value": rnd.choice(["M", "F", "ASC", "1985", "true"]), "valueType": "TEXT",
+             "displayName": "x", "storedBy": "admin", "created": "2024-05-12T10:11:12.000"}
+            for k in range(20)
+        ]
+        teis.append({
+            "trackedEntityInstance": tei_id, "orgUnit": ou_id, "trackedEntityType": TEI_TYPE_ID,
+            "created": "2024-05-12T10:11:12.000", "lastUpdated": "2024-05-13T10:11:12.000", "deleted": False,
+            "href": "https://dhis2/api/trackedEntityInstances/x", "storedBy": "admin", "attributes": attributes,
+            "createdByUserInfo": USER_INFO, "lastUpdatedByUserInfo": USER_INFO, "relationships": [], "programOwners": [],
+            "enrollments": [{
+                "enrollment": enr_id, "trackedEntityInstance": tei_id, "orgUnit": ou_id, "program": program,
+                "trackedEntityType": TEI_TYPE_ID, "status": "ACTIVE", "enrollmentDate": "2024-01-02T00:00:00.000",
+                "incidentDate": "2024-01-02T00:00:00.000", "created": "2024-01-02T10:11:12.000",
+                "lastUpdated": "2024-05-13T10:11:12.000", "deleted": rnd.random() < deletion_rate,
+                "href": "https://dhis2/api/enrollments/x", "storedBy": "admin",
+                "createdByUserInfo": USER_INFO, "lastUpdatedByUserInfo": USER_INFO,
+                "notes": [], "relationships": [], "attributes": attributes, "events": events,
+            }],
+        })
+    return teis
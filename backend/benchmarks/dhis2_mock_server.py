@@ -0,0 +1,304 @@
+# benchmarks/dhis2_mock_server.py
+"""
+Serveur DHIS2 factice pour les benchmarks de synchronisation.
+
+Sert organisationUnits, dataElements, trackedEntityInstances (paging true/false)
+et dataValueSets (GET + POST), à partir de données générées (benchmarks.dhis2_fixtures)
+ou de réponses DHIS2 enregistrées (--fixtures DIR), avec latence et taux d'échec
+configurables. Tourne dans son propre processus pour ne pas fausser la mémoire
+mesurée côté client.
+
+Fixtures enregistrées (--fixtures DIR) :
+    DIR/organisationUnits.json, DIR/dataElements.json,
+    DIR/trackedEntityInstances.json            (filtré par orgUnit)
+    DIR/trackedEntityInstances/<ou_id>.json    (prioritaire si présent)
+Chaque fichier est soit la réponse DHIS2 brute ({"<clé>": [...]}), soit une liste.
+
+Usage (depuis backend/) :
+    python -m benchmarks.dhis2_mock_server --port 8089 --orgunits 400 --teis-per-orgunit 25 --latency-ms 80 --failure-rate 0.01
+
+Endpoints de contrôle :
+    GET  /__mock__/health   GET /__mock__/stats   POST /__mock__/reset
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, Response, request
+
+from benchmarks.dhis2_fixtures import PROGRAM_ID, generate_dataelements, generate_orgunits, generate_teis, uid
+
+
+class MockStats:
+    """Compteurs par endpoint (requêtes, échecs injectés, octets, éléments, durées de traitement)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, endpoint: str, status: int, nbytes: int, items: int, elapsed_ms: float):
+        with self._lock:
+            ep = self.endpoints.setdefault(endpoint, {"requests": 0, "failures": 0, "bytes": 0, "items": 0, "latencies_ms": []})
+            ep["requests"] += 1
+            ep["failures"] += status >= 500
+            ep["bytes"] += nbytes
+            ep["items"] += items
+            ep["latencies_ms"].append(round(elapsed_ms, 3))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return json.loads(json.dumps(self.endpoints))
+
+
+class MockDhis2:
+    def __init__(
+        self,
+        n_orgunits: int = 400,
+        teis_per_orgunit: int = 25,
+        events_per_enrollment: int = 6,
+        data_values_per_event: int = 25,
+        deletion_rate: float = 0.01,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        failure_rate: float = 0.0,
+        fixtures_dir: Optional[str] = None,
+        compress: bool = True,
+        profile: str = "generic",
+        start: str = "2024-01",
+        months: int = 12,
+        seed: int = 42,
+    ):
+        self.teis_per_orgunit = teis_per_orgunit
+        self.events_per_enrollment = events_per_enrollment
+        self.data_values_per_event = data_values_per_event
+        self.deletion_rate = deletion_rate
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.fixtures_dir = fixtures_dir
+        self.compress = compress
+        self.rnd = random.Random(seed)
+        self.rnd_lock = threading.Lock()
+        self.stats = MockStats()
+
+        # Profil asc_rc : TEI réalistes couvrant les colonnes de indicators_matview.sql
+        self.asc_rc = None
+        if profile == "asc_rc":
+            from benchmarks.synthetic_data import AscRcGenerator, month_range
+            self.asc_rc = AscRcGenerator(month_range(start, months), agents_per_orgunit=teis_per_orgunit, deletion_rate=deletion_rate, seed=seed)
+        de_ids = self.asc_rc.dataelement_ids if self.asc_rc else [uid("de", k) for k in range(data_values_per_event)]
+
+        self.orgunits = self._load_fixture("organisationUnits") or generate_orgunits(n_orgunits)
+        self.dataelements = self._load_fixture("dataElements") or generate_dataelements(de_ids)
+        self._recorded_teis = self._load_fixture("trackedEntityInstances")
+        self._encode_teis = lru_cache(maxsize=512)(self._encode_teis_uncached)
+
+    # ------------------------
+    # Données
+    # ------------------------
+    def _load_fixture(self, data_key: str, name: str = None) -> Optional[List[Dict]]:
+        if not self.fixtures_dir:
+            return None
+        path = os.path.join(self.fixtures_dir, f"{name or data_key}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data.get(data_key, []) if isinstance(data, dict) else data
+
+    def teis_for(self, ou_id: str) -> List[Dict]:
+        recorded = self._load_fixture("trackedEntityInstances", f"trackedEntityInstances/{ou_id}")
+        if recorded is not None:
+            return recorded
+        if self._recorded_teis is not None:
+            return [t for t in self._recorded_teis if t.get("orgUnit") == ou_id]
+        if self.asc_rc is not None:
+            return self.asc_rc.teis_for_orgunit(ou_id)
+        return generate_teis(
+            ou_id, self.teis_per_orgunit, program=PROGRAM_ID,
+            events_per_enrollment=self.events_per_enrollment, data_values_per_event=self.data_values_per_event,
+            deletion_rate=self.deletion_rate,
+        )
+
+    def _encode_teis_uncached(self, ou_id: str, page: Optional[int], page_size: int):
+        teis = self.teis_for(ou_id)
+        if page is None:
+            body = {"trackedEntityInstances": teis}
+            items = len(teis)
+        else:
+            page_count = max(1, -(-len(teis) // page_size))
+            chunk = teis[(page - 1) * page_size: page * page_size]
+            body = {"pager": {"page": page, "pageCount": page_count, "total": len(teis), "pageSize": page_size}, "trackedEntityInstances": chunk}
+            items = len(chunk)
+        return json.dumps(body, separators=(",", ":")).encode("utf-8"), items
+
+    # ------------------------
+    # Réponses
+    # ------------------------
+    def delay_and_maybe_fail(self) -> bool:
+        with self.rnd_lock:
+            delay = max(0.0, self.rnd.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+            fail = self.rnd.random() < self.failure_rate
+        if delay:
+            time.sleep(delay / 1000)
+        return fail
+
+    def respond(self, endpoint: str, started: float, body: bytes, items: int, status: int = 200) -> Response:
+        headers = {"Content-Type": "application/json"}
+        if self.compress and "gzip" in (request.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        headers["Content-Length"] = str(len(body))
+        self.stats.record(endpoint, status, len(body), items, (time.perf_counter() - started) * 1000)
+        return Response(body, status=status, headers=headers)
+
+    def failure(self, endpoint: str, started: float) -> Response:
+        body = json.dumps({"httpStatus": "Service Unavailable", "httpStatusCode": 503, "status": "ERROR"}).encode("utf-8")
+        return self.respond(endpoint, started, body, 0, status=503)
+
+
+def _paged_list(items: List[Dict], data_key: str):
+    """Liste DHIS2 avec ou sans pagination selon paging/page/pageSize."""
+    if request.args.get("paging", "true") == "false":
+        return {data_key: items}, len(items)
+    page, page_size = int(request.args.get("page", 1)), int(request.args.get("pageSize", 50))
+    chunk = items[(page - 1) * page_size: page * page_size]
+    pager = {"page": page, "pageCount": max(1, -(-len(items) // page_size)), "total": len(items), "pageSize": page_size}
+    return {"pager": pager, data_key: chunk}, len(chunk)
+
+
+def create_mock_app(mock: MockDhis2) -> Flask:
+    app = Flask(__name__)
+
+    @app.get("/api/organisationUnits")
+    @app.get("/api/organisationUnits.json")
+    def organisation_units():
+        started = time.perf_counter()
+        if mock.delay_and_maybe_fail():
+            return mock.failure("organisationUnits", started)
+        orgunits = mock.orgunits
+        level_filter = request.args.get("filter", "")
+        if level_filter.startswith("level:eq:"):
+            level = int(level_filter.rsplit(":", 1)[-1])
+            orgunits = [o for o in orgunits if o.get("level") == level]
+        body, items = _paged_list(orgunits, "organisationUnits")
+        return mock.respond("organisationUnits", started, json.dumps(body).encode("utf-8"), items)
+
+    @app.get("/api/dataElements")
+    @app.get("/api/dataElements.json")
+    def data_elements():
+        started = time.perf_counter()
+        if mock.delay_and_maybe_fail():
+            return mock.failure("dataElements", started)
+        body, items = _paged_list(mock.dataelements, "dataElements")
+        return mock.respond("dataElements", started, json.dumps(body).encode("utf-8"), items)
+
+    @app.get("/api/trackedEntityInstances")
+    @app.get("/api/trackedEntityInstances.json")
+    def tracked_entity_instances():
+        started = time.perf_counter()
+        if mock.delay_and_maybe_fail():
+            return mock.failure("trackedEntityInstances", started)
+        ou_id = request.args.get("ou")
+        if not ou_id:
+            return mock.respond("trackedEntityInstances", started, b'{"httpStatusCode":409,"message":"ou requis"}', 0, status=409)
+        paging = request.args.get("paging", "true") != "false"
+        page = int(request.args.get("page", 1)) if paging else None
+        body, items = mock._encode_teis(ou_id, page, int(request.args.get("pageSize", 50)))
+        return mock.respond("trackedEntityInstances", started, body, items)
+
+    @app.get("/api/dataValueSets")
+    @app.get("/api/dataValueSets.json")
+    def get_data_value_sets():
+        started = time.perf_counter()
+        if mock.delay_and_maybe_fail():
+            return mock.failure("dataValueSets", started)
+        return mock.respond("dataValueSets", started, b'{"dataValues":[]}', 0)
+
+    @app.post("/api/dataValueSets")
+    @app.post("/api/dataValueSets.json")
+    def post_data_value_sets():
+        started = time.perf_counter()
+        payload = request.get_json(silent=True) or {}
+        if mock.delay_and_maybe_fail():
+            return mock.failure("dataValueSets.post", started)
+        n = len(payload.get("dataValues") or [])
+        summary = {"status": "SUCCESS", "importCount": {"imported": n, "updated": 0, "ignored": 0, "deleted": 0}}
+        return mock.respond("dataValueSets.post", started, json.dumps(summary).encode("utf-8"), n)
+
+    @app.get("/__mock__/health")
+    def health():
+        return {"status": "ok"}
+
+    @app.get("/__mock__/stats")
+    def stats():
+        return mock.stats.snapshot()
+
+    @app.post("/__mock__/reset")
+    def reset():
+        mock.stats.reset()
+        return {"status": "ok"}
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Serveur DHIS2 factice (benchmarks)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_mock_arguments(parser)
+    return parser
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--orgunits", type=int, default=400, help="Nombre d'orgunits de niveau 5 générés")
+    parser.add_argument("--teis-per-orgunit", type=int, default=25)
+    parser.add_argument("--events-per-enrollment", type=int, default=6)
+    parser.add_argument("--data-values-per-event", type=int, default=25)
+    parser.add_argument("--deletion-rate", type=float, default=0.01)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latence moyenne injectée par requête")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Écart-type de la latence injectée")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Proportion de réponses 503")
+    parser.add_argument("--fixtures", help="Dossier de réponses DHIS2 enregistrées")
+    parser.add_argument("--no-gzip", action="store_true", help="Désactive la compression gzip des réponses")
+    parser.add_argument("--profile", choices=["generic", "asc_rc"], default="generic", help="asc_rc : données réalistes (benchmarks.synthetic_data)")
+    parser.add_argument("--start", default="2024-01", help="Profil asc_rc : premier mois (YYYY-MM)")
+    parser.add_argument("--months", type=int, default=12, help="Profil asc_rc : nombre de mois d'events")
+
+
+def mock_from_args(args) -> MockDhis2:
+    return MockDhis2(
+        n_orgunits=args.orgunits,
+        teis_per_orgunit=args.teis_per_orgunit,
+        events_per_enrollment=args.events_per_enrollment,
+        data_values_per_event=args.data_values_per_event,
+        deletion_rate=args.deletion_rate,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        failure_rate=args.failure_rate,
+        fixtures_dir=args.fixtures,
+        compress=not args.no_gzip,
+        profile=args.profile,
+        start=args.start,
+        months=args.months,
+    )
+
+
+def main():
+    args = build_parser().parse_args()
+    app = create_mock_app(mock_from_args(args))
+    app.run(host=args.host, port=args.port, threaded=True, use_reloader=False)
+
+
+if __name__ == "__main__":
+    main()
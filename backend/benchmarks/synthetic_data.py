@@ -0,0 +1,389 @@
+# benchmarks/synthetic_data.py
+"""
+Générateur de données synthétiques réalistes pour le programme ASC/RC.
+
+Produit des TEI (agents ASC/RC) au format DHIS2, avec enrollment, attributs et events
+mensuels répartis sur les 4 program stages utilisés par indicators_matview.sql :
+    uYjFHpdIZ1n  Informations générales (équipements, ménages couverts, supervision)
+    vYuCO9VE4VO  Formations
+    HVs2gZcENZX  Réunion mensuelle
+    cOlFW2LHdud  Etat personne (démission, abandon, décès, ...)
+Les identifiants des colonnes sont lus dans indicators_matview.sql (events_bool_cols,
+events_text_cols, events_int_cols, attributes_bool_cols, attributes_text_cols) :
+toute colonne ajoutée au SQL est automatiquement couverte.
+
+Les données sont aplaties par le TrackerFlattener de production puis chargées par COPY,
+orgunit par orgunit (mémoire constante), ou écrites comme fixtures pour le mock DHIS2.
+
+Usage (depuis backend/) :
+    python -m benchmarks.synthetic_data --orgunits 4000 --agents-per-orgunit 5 --start 2023-01 --months 24 --truncate
+    python -m benchmarks.synthetic_data --orgunits 50 --out outputs_files/dhis2_fixtures
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import re
+import time
+import zlib
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterator, List
+
+from psycopg2 import sql
+
+from benchmarks.dhis2_fixtures import PROGRAM_ID, TEI_TYPE_ID, generate_dataelements, generate_orgunits
+from utils.tracker_flattener import ColumnarBuffer, TrackerFlattener
+
+MATVIEW_SQL = os.path.join(os.path.dirname(__file__), "..", "postgresql", "indicators_matview.sql")
+MATVIEW_ARRAYS = ("events_bool_cols", "events_text_cols", "events_int_cols", "attributes_bool_cols", "attributes_text_cols")
+
+STAGE_INFOS = "uYjFHpdIZ1n"
+STAGE_FORMATION = "vYuCO9VE4VO"
+STAGE_REUNION = "HVs2gZcENZX"
+STAGE_ETAT = "cOlFW2LHdud"
+
+# Equipement présent (booléen) → état de l'équipement (texte)
+EQUIPMENTS = {
+    "LVEhpIZQPlc": "Lw3FqC66H8f", "d3njr4pj5Np": "JvpHtpl24Iw", "HV4SzqtMkDZ": "o1ImyFA4GN5",
+    "Daj1R7CbEEv": "YlFqhP3b6up", "oV9wAqcGQLh": "yZx9U6ExftO", "DzoAFCqUpEV": "aJP29JC9lRG",
+    "L0uyCnLsw7U": "EJ4cukfCCNI", "HFaA8rTyEjo": "XTVAi3UbimG", "nVoHOk96mki": "pEmu10xfoBu",
+    "HNqYMoPV5FX": "LAFrQ2XGw6c", "sxXW0hhf3B0": "AgnRPmeEvcX", "eHcZTpdz5Jm": "hfrgBauAXHH",
+    "krGPBkPoypn": "fv3D2nuPL54", "VUw7r4npSPy": "WbgApzYRexi",
+}
+FORMATIONS = [
+    "uaMxLFFBpO4", "fKg4j7LyDvx", "TA3vzccc5bL", "urpAtvlPq9c", "KgGKMku690L", "ZLApDELSxee", "wVaK6DCgouW",
+    "OeUsVjtu6xU", "jAmm3DLrXRA", "sV01jFwrJzb", "obXiOVy1W8E", "jvAwC2yN080", "W5yUnYU2aXk", "WSmH5J3vW6j",
+    "rUyAVcnsjR1", "ld9SceWeuaw", "PEo9RiQ3vnt", "d6r9ZbTIxMd", "oU7OlvYyq9m",
+]
+REUNION_FLAGS = ["WNSaYn90Sh4", "RFXrTPSVOce", "o5ekXKzI6QG"]
+SUPERVISION_FLAGS = ["DrPiZYvBKj1", "we67w0fFoas"]
+SUPERVISION_PERSON = "ZSIPhlUprHh"
+SUPERVISORS = ["RFS", "RM", "ASC superviseur", "Niveau District", "Niveau Regions", "Niveau Central"]
+SUIVI_ENDOGENE = "IByG3B7EKq6"
+OBSTACLE = "D63bI4wkZvL"
+ETAT_REASON = "Qdy5VdNU6yb"
+ETAT_REASONS = ["DEMISSION", "ABANDON", "DECES", "LICENCIEMENT", "FAUTE GRAVE"]
+INT_RANGES = {"bTBv9y0xr2c": (200, 2500), "AqJgPz8KxFX": (30, 400), "J0vbT2fjVpi": (0, 25)}
+
+ATTR_AGE, ATTR_SEX, ATTR_STATUS, ATTR_VIE, ATTR_BIRTH_YEAR = "K9wH3KPlohz", "UrdrExJmPcF", "EimePKtHtUd", "sYY4FnnQLAK", "hUl1tJSC0pV"
+ATTR_WORK_YEAR, ATTR_BIRTH_DATE, ATTR_WORK_DATE, ATTR_DEATH_DATE = "g5AD18Pyx7g", "lpAqrE3CvLZ", "HZm1SrVlxN5", "S7OKlFbZsDd"
+ATTR_ACCREDITATION, ATTR_PROPOSITION_DATE, ATTR_VALIDATION_DATE = "xLqd2FibwYZ", "STUQ4XtZ805", "l1JVuc7BP1W"
+ATTR_PROPOSITION, ATTR_VALID_PROPOSITION = "wfwjAVT0gVA", "nalzdP5XUMZ"
+
+
+def matview_columns(path: str = MATVIEW_SQL) -> Dict[str, List[str]]:
+    """Identifiants déclarés dans les tableaux du bloc DO de indicators_matview.sql."""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    columns = {}
+    for name in MATVIEW_ARRAYS:
+        m = re.search(rf"{name}\s+TEXT\[\]\s*:=\s*ARRAY\[(.*?)\];", content, re.S)
+        ids = re.findall(r"'([^']+)'", m.group(1)) if m else []
+        # 'deleted' est une colonne technique, pas un dataElement
+        columns[name] = [c for c in ids if c != "deleted"]
+    return columns
+
+
+def month_range(start: str, months: int) -> List[date]:
+    """['2024-01', ...] → premiers jours des `months` mois à partir de `start` (YYYY-MM ou YYYYMM)."""
+    digits = start.replace("-", "")
+    year, month = int(digits[:4]), int(digits[4:6])
+    result = []
+    for _ in range(months):
+        result.append(date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return result
+
+
+def _b36(n: int, width: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    for _ in range(width):
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+    return out
+
+
+class _IdSequence:
+    """Identifiants DHIS2 (11 caractères) uniques par orgunit : préfixe + orgunit (4) + compteur (6)."""
+
+    def __init__(self, ou_id: str):
+        digits = "".join(c for c in ou_id if c.isdigit())
+        self.ou_key = _b36(int(digits) if digits else zlib.crc32(ou_id.encode()), 4)
+        self.n = 0
+
+    def next(self, prefix: str) -> str:
+        self.n += 1
+        return f"{prefix}{self.ou_key}{_b36(self.n, 6)}"
+
+
+def _iso(d: date, day: int = 1) -> str:
+    return f"{d.year:04d}-{d.month:02d}-{day:02d}T00:00:00.000"
+
+
+class AscRcGenerator:
+    """TEI ASC/RC au format DHIS2 (déterministes par orgunit et seed)."""
+
+    def __init__(
+        self,
+        periods: List[date],
+        agents_per_orgunit: int = 5,
+        deletion_rate: float = 0.01,
+        formation_rate: float = 0.2,
+        etat_rate: float = 0.02,
+        program: str = PROGRAM_ID,
+        seed: int = 42,
+    ):
+        self.periods = periods
+        self.agents_per_orgunit = agents_per_orgunit
+        self.deletion_rate = deletion_rate
+        self.formation_rate = formation_rate
+        self.etat_rate = etat_rate
+        self.program = program
+        self.seed = seed
+
+        cols = matview_columns()
+        known = set(EQUIPMENTS) | set(EQUIPMENTS.values()) | set(FORMATIONS) | set(REUNION_FLAGS) | set(SUPERVISION_FLAGS)
+        known |= {SUPERVISION_PERSON, SUIVI_ENDOGENE, OBSTACLE, ETAT_REASON} | set(INT_RANGES)
+        # Colonnes du SQL sans sémantique connue : valeurs génériques dans l'event "infos générales"
+        self.extra_bool = [c for c in cols["events_bool_cols"] if c not in known]
+        self.extra_text = [c for c in cols["events_text_cols"] if c not in known]
+        self.extra_int = [c for c in cols["events_int_cols"] if c not in known]
+        self.attr_bool = cols["attributes_bool_cols"]
+        self.attr_text = cols["attributes_text_cols"]
+        self.dataelement_ids = sorted(set(cols["events_bool_cols"] + cols["events_text_cols"] + cols["events_int_cols"]))
+
+    # ------------------------
+    # TEI
+    # ------------------------
+    def teis_for_orgunit(self, ou_id: str) -> List[Dict]:
+        rnd = random.Random(zlib.crc32(f"{self.seed}:{ou_id}".encode()))
+        ids = _IdSequence(ou_id)
+        return [self._tei(rnd, ids, ou_id) for _ in range(self.agents_per_orgunit)]
+
+    def _tei(self, rnd: random.Random, ids: _IdSequence, ou_id: str) -> Dict:
+        tei_id, enr_id = ids.next("T"), ids.next("E")
+        first = self.periods[0]
+        birth_year = rnd.randint(first.year - 70, first.year - 19)
+        work_year = rnd.randint(max(birth_year + 18, first.year - 15), first.year)
+        tei_deleted = rnd.random() < self.deletion_rate
+        enrollment_deleted = rnd.random() < self.deletion_rate
+
+        attributes = self._attributes(rnd, birth_year, work_year)
+        events = []
+        for period in self.periods:
+            events.extend(self._monthly_events(rnd, ids, period, ou_id, tei_id, enr_id))
+
+        created = _iso(date(work_year, rnd.randint(1, 12), 1))
+        return {
+            "trackedEntityInstance": tei_id, "orgUnit": ou_id, "trackedEntityType": TEI_TYPE_ID,
+            "created": created, "lastUpdated": _iso(self.periods[-1], 28), "deleted": tei_deleted,
+            "attributes": attributes,
+            "enrollments": [{
+                "enrollment": enr_id, "trackedEntityInstance": tei_id, "orgUnit": ou_id, "program": self.program,
+                "trackedEntityType": TEI_TYPE_ID, "status": "ACTIVE", "enrollmentDate": created, "incidentDate": created,
+                "created": created, "lastUpdated": _iso(self.periods[-1], 28), "deleted": enrollment_deleted,
+                "attributes": attributes, "events": events,
+            }],
+        }
+
+    def _attributes(self, rnd: random.Random, birth_year: int, work_year: int) -> List[Dict]:
+        alive = rnd.random() > 0.01
+        accreditation = date(work_year, rnd.randint(1, 12), rnd.randint(1, 28))
+        proposed = rnd.random() < 0.3
+        values: Dict[str, Any] = {
+            ATTR_AGE: str(self.periods[0].year - birth_year),
+            ATTR_SEX: rnd.choice("MF"),
+            ATTR_STATUS: "ASC" if rnd.random() < 0.7 else "RC",
+            ATTR_VIE: "Vivant" if alive else "Décédé",
+            ATTR_BIRTH_YEAR: str(birth_year),
+            ATTR_WORK_YEAR: str(work_year),
+            ATTR_BIRTH_DATE: date(birth_year, rnd.randint(1, 12), rnd.randint(1, 28)).isoformat(),
+            ATTR_WORK_DATE: date(work_year, 1, 1).isoformat(),
+            ATTR_DEATH_DATE: None if alive else self.periods[-1].isoformat(),
+            ATTR_ACCREDITATION: accreditation.isoformat(),
+            ATTR_PROPOSITION_DATE: accreditation.isoformat() if proposed else None,
+            ATTR_VALIDATION_DATE: accreditation.isoformat() if proposed and rnd.random() < 0.6 else None,
+            ATTR_PROPOSITION: "true" if proposed else "false",
+            ATTR_VALID_PROPOSITION: "true" if proposed and rnd.random() < 0.6 else "false",
+        }
+        for col in self.attr_bool:
+            values.setdefault(col, rnd.choice(["true", "false"]))
+        for col in self.attr_text:
+            values.setdefault(col, f"{col[:4]}-{rnd.randint(1, 999)}")
+        return [{"attribute": k, "value": v} for k, v in values.items() if v is not None]
+
+    def _event(self, rnd: random.Random, ids: _IdSequence, stage: str, period: date, ou_id: str, tei_id: str, enr_id: str, values: Dict[str, Any]) -> Dict:
+        day = rnd.randint(1, 28)
+        return {
+            "event": ids.next("V"), "programStage": stage, "orgUnit": ou_id,
+            "enrollment": enr_id, "trackedEntityInstance": tei_id, "enrollmentStatus": "ACTIVE",
+            "status": "COMPLETED" if rnd.random() < 0.9 else "ACTIVE",
+            "eventDate": _iso(period, day), "dueDate": _iso(period, day),
+            "created": _iso(period, day), "lastUpdated": _iso(period, min(28, day + 1)),
+            "attributeOptionCombo": "HllvX50cXC0", "attributeCategoryOptions": "xYerKDKCefk",
+            "deleted": rnd.random() < self.deletion_rate,
+            "dataValues": [{"dataElement": k, "value": v} for k, v in values.items() if v is not None],
+        }
+
+    def _monthly_events(self, rnd: random.Random, ids: _IdSequence, period: date, ou_id: str, tei_id: str, enr_id: str) -> Iterator[Dict]:
+        # Informations générales : équipements, couverture, supervision
+        infos: Dict[str, Any] = {OBSTACLE: rnd.choice(["true", "false"]), SUIVI_ENDOGENE: rnd.choice(["true", "false"])}
+        for has_col, state_col in EQUIPMENTS.items():
+            has = rnd.random() < 0.8
+            infos[has_col] = "true" if has else "false"
+            infos[state_col] = ("BON ETAT" if rnd.random() < 0.75 else "MAUVAIS ETAT") if has else None
+        for col, (lo, hi) in INT_RANGES.items():
+            infos[col] = str(rnd.randint(lo, hi))
+        for col in self.extra_bool:
+            infos[col] = rnd.choice(["true", "false"])
+        for col in self.extra_text:
+            infos[col] = f"{col[:4]}-{rnd.randint(1, 99)}"
+        for col in self.extra_int:
+            infos[col] = str(rnd.randint(0, 100))
+        supervised = rnd.random() < 0.4
+        infos[SUPERVISION_PERSON] = rnd.choice(SUPERVISORS) if supervised else None
+        yield self._event(rnd, ids, STAGE_INFOS, period, ou_id, tei_id, enr_id, infos)
+
+        # Réunion mensuelle
+        reunion = {col: "true" if rnd.random() < 0.7 else "false" for col in REUNION_FLAGS}
+        reunion.update({col: "true" if supervised and rnd.random() < 0.7 else "false" for col in SUPERVISION_FLAGS})
+        yield self._event(rnd, ids, STAGE_REUNION, period, ou_id, tei_id, enr_id, reunion)
+
+        # Formations (occasionnelles)
+        if rnd.random() < self.formation_rate:
+            followed = set(rnd.sample(FORMATIONS, rnd.randint(1, 3)))
+            yield self._event(rnd, ids, STAGE_FORMATION, period, ou_id, tei_id, enr_id, {col: "true" if col in followed else "false" for col in FORMATIONS})
+
+        # Etat personne (rare)
+        if rnd.random() < self.etat_rate:
+            yield self._event(rnd, ids, STAGE_ETAT, period, ou_id, tei_id, enr_id, {ETAT_REASON: rnd.choice(ETAT_REASONS)})
+
+
+# ------------------------
+# Chargement Postgres (COPY)
+# ------------------------
+def copy_buffer(pg, table: str, buffer: ColumnarBuffer) -> int:
+    """
+    Charge un tampon colonnaire dans `table` par COPY FROM STDIN (CSV).
+    Table, colonnes et clé primaire sont créées comme pour PostgresClient.bulk_upsert_columns.
+    COPY n'effectue pas d'UPSERT : à utiliser sur des tables vides (--truncate).
+    """
+    from clients.postgres_client import DHIS2_TABLE_KEY
+
+    if buffer is None or len(buffer) == 0:
+        return 0
+
+    id_field = DHIS2_TABLE_KEY[table]
+    table = pg.normalize_tablename(table)
+    buffer.finish()
+    buffer.columns["synced_at"] = [datetime.now(timezone.utc)] * len(buffer)
+
+    sample = buffer.first_values()
+    pg.ensure_table_exist_create_if_not(table, sample, id_field)
+    pg.ensure_columns_exist(table, sample, id_field)
+    pg.ensure_pk_or_unique(table, id_field)
+
+    columns = buffer.column_names
+    data = io.StringIO()
+    csv.writer(data).writerows(buffer.iter_tuples(columns))
+    data.seek(0)
+
+    query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(table), sql.SQL(", ").join(sql.Identifier(c) for c in columns)
+    )
+    with pg.conn.cursor() as cur:
+        cur.copy_expert(query.as_string(pg.conn), data)
+    pg.conn.commit()
+    return len(buffer)
+
+
+def truncate_tracker_tables(pg):
+    with pg.conn.cursor() as cur:
+        for table in ("events", "attributes", "enrollments", "trackedEntityInstances"):
+            cur.execute("SELECT to_regclass(%s);", (f'"{pg.normalize_tablename(table)}"',))
+            if cur.fetchone()[0]:
+                cur.execute(sql.SQL("TRUNCATE {}").format(sql.Identifier(pg.normalize_tablename(table))))
+    pg.conn.commit()
+
+
+def load_into_postgres(generator: AscRcGenerator, orgunits: List[Dict], chunk_orgunits: int = 50, truncate: bool = False) -> Dict[str, int]:
+    """Génère, aplatit (TrackerFlattener) et charge par COPY, par paquets de `chunk_orgunits` orgunits."""
+    from clients.postgres_client import PostgresClient
+
+    pg = PostgresClient()
+    pg.bulk_upsert_data("organisationUnits", [dict(o) for o in orgunits])
+    pg.rebuild_orgunit_closure(orgunits)
+    if truncate:
+        truncate_tracker_tables(pg)
+
+    totals = {"trackedEntityInstances": 0, "enrollments": 0, "attributes": 0, "events": 0}
+    level5 = [o["id"] for o in orgunits if o.get("level") == 5]
+    for start in range(0, len(level5), chunk_orgunits):
+        flat = TrackerFlattener(generator.program)
+        for ou_id in level5[start:start + chunk_orgunits]:
+            flat.add_teis(generator.teis_for_orgunit(ou_id))
+        flat.finish()
+        totals["trackedEntityInstances"] += copy_buffer(pg, "trackedEntityInstances", flat.teis)
+        totals["enrollments"] += copy_buffer(pg, "enrollments", flat.enrollments)
+        totals["attributes"] += copy_buffer(pg, "attributes", flat.attributes)
+        totals["events"] += copy_buffer(pg, "events", flat.events)
+    return totals
+
+
+def write_fixtures(generator: AscRcGenerator, orgunits: List[Dict], out_dir: str) -> int:
+    """Fixtures au format attendu par benchmarks.dhis2_mock_server --fixtures."""
+    os.makedirs(os.path.join(out_dir, "trackedEntityInstances"), exist_ok=True)
+    with open(os.path.join(out_dir, "organisationUnits.json"), "w", encoding="utf-8") as f:
+        json.dump({"organisationUnits": orgunits}, f)
+    with open(os.path.join(out_dir, "dataElements.json"), "w", encoding="utf-8") as f:
+        json.dump({"dataElements": generate_dataelements(generator.dataelement_ids)}, f)
+    count = 0
+    for ou in orgunits:
+        if ou.get("level") != 5:
+            continue
+        teis = generator.teis_for_orgunit(ou["id"])
+        count += len(teis)
+        with open(os.path.join(out_dir, "trackedEntityInstances", f"{ou['id']}.json"), "w", encoding="utf-8") as f:
+            json.dump({"trackedEntityInstances": teis}, f, separators=(",", ":"))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génération de données ASC/RC synthétiques")
+    parser.add_argument("--orgunits", type=int, default=400, help="Nombre d'orgunits de niveau 5")
+    parser.add_argument("--agents-per-orgunit", type=int, default=5, help="TEI (ASC/RC) par orgunit")
+    parser.add_argument("--start", default="2024-01", help="Premier mois (YYYY-MM)")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--deletion-rate", type=float, default=0.01)
+    parser.add_argument("--formation-rate", type=float, default=0.2, help="Probabilité mensuelle d'un event Formation")
+    parser.add_argument("--etat-rate", type=float, default=0.02, help="Probabilité mensuelle d'un event Etat personne")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-orgunits", type=int, default=50, help="Orgunits générés/chargés par COPY")
+    parser.add_argument("--truncate", action="store_true", help="Vide les tables tracker avant le chargement")
+    parser.add_argument("--out", help="Écrit des fixtures DHIS2 (mock server) au lieu de charger Postgres")
+    args = parser.parse_args()
+
+    generator = AscRcGenerator(
+        month_range(args.start, args.months), agents_per_orgunit=args.agents_per_orgunit,
+        deletion_rate=args.deletion_rate, formation_rate=args.formation_rate, etat_rate=args.etat_rate, seed=args.seed,
+    )
+    orgunits = generate_orgunits(args.orgunits)
+
+    started = time.perf_counter()
+    if args.out:
+        count = write_fixtures(generator, orgunits, args.out)
+        print(f"✅ {count} TEI écrits dans {args.out} ({time.perf_counter() - started:.1f}s)")
+        return
+
+    totals = load_into_postgres(generator, orgunits, chunk_orgunits=args.chunk_orgunits, truncate=args.truncate)
+    elapsed = time.perf_counter() - started
+    for table, rows in totals.items():
+        print(f"{table:<24}{rows:>12} lignes")
+    print(f"✅ Chargé en {elapsed:.1f}s ({sum(totals.values()) / elapsed:,.0f} lignes/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import ssl
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from urllib3.util import make_headers
+
+from utils.config import config
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+
+# Contexte TLS partagé : chargé une seule fois pour toutes les sessions / pools
+_ssl_context: Optional[ssl.SSLContext] = None
+_ssl_lock = threading.Lock()
+
+# Adaptateurs enregistrés par nom (pour les métriques)
+_adapters: Dict[str, "PooledHTTPAdapter"] = {}
+
+
+def shared_ssl_context() -> ssl.SSLContext:
+    global _ssl_context
+    if _ssl_context is None:
+        with _ssl_lock:
+            if _ssl_context is None:
+                _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+def accept_encoding() -> str:
+    """ 'gzip,deflate' (+ ',br' si brotli est installé) selon ce que urllib3 sait décoder. """
+    return make_headers(accept_encoding=True)["accept-encoding"]
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter dont le pool est dimensionné sur la concurrence réelle, avec
+    contexte TLS partagé et compteurs de saturation du pool.
+    """
+
+    def __init__(self, name: str, pool_maxsize: int, **kwargs):
+        self.name = name
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests_total = 0
+        self.saturated_total = 0
+        self.bytes_received = 0
+        super().__init__(pool_connections=max(1, pool_maxsize // 10), pool_maxsize=pool_maxsize, pool_block=True, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if config.USE_SSL:
+            kwargs.setdefault("ssl_context", shared_ssl_context())
+        return super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        with self._stats_lock:
+            self.in_flight += 1
+            self.requests_total += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            if self.in_flight > self._pool_maxsize:
+                # Tous les sockets du pool sont occupés → cette requête attend (pool_block)
+                self.saturated_total += 1
+        try:
+            response = super().send(request, **kwargs)
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit():
+                with self._stats_lock:
+                    self.bytes_received += int(length)
+            return response
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "name": self.name,
+                "pool_maxsize": self._pool_maxsize,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "requests_total": self.requests_total,
+                "saturated_total": self.saturated_total,
+                "bytes_received": self.bytes_received,
+            }
+
+
+def build_session(name: str, auth=None, pool_maxsize: Optional[int] = None, retries: Optional[Retry] = None) -> requests.Session:
+    """
+    Session HTTP partagée par les clients DHIS2 (source et destination) :
+    - pool dimensionné sur la concurrence (HTTP_POOL_MAXSIZE, défaut MAX_WORKERS)
+    - keep-alive (connexions et sessions TLS réutilisées par le pool)
+    - compression gzip/br négociée (décompression transparente par urllib3)
+    """
+    pool_maxsize = pool_maxsize or config.HTTP_POOL_MAXSIZE
+    adapter = PooledHTTPAdapter(name, pool_maxsize=pool_maxsize, max_retries=retries or 0)
+    _adapters[name] = adapter
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if auth is not None:
+        session.auth = auth
+    session.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+    if config.HTTP_COMPRESSION:
+        session.headers["Accept-Encoding"] = accept_encoding()
+
+    logger.info("🔌 Session HTTP '%s' : pool_maxsize=%s, compression=%s", name, pool_maxsize, session.headers.get("Accept-Encoding"))
+    return session
+
+
+def transport_stats() -> Dict[str, Dict[str, Any]]:
+    """ Métriques de saturation des pools HTTP, par session. """
+    return {name: adapter.stats() for name, adapter in _adapters.items()}
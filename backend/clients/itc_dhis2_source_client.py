@@ -1,13 +1,20 @@
+import json
 import requests
 from requests.auth import HTTPBasicAuth
 from utils.config import config
-from time import sleep
-from typing import Any, List, Dict, Union, Callable
+from time import sleep, perf_counter
+from typing import Any, List, Dict, Union, Callable, Iterable, Iterator
 from datetime import datetime, timezone
 import concurrent.futures
 from utils.interfaces import EndpointSpec
+from utils.tracker_flattener import TrackerFlattener, ColumnarBuffer
+from utils.json_decoder import decode_json, JsonDecodeError, SCHEMAS, ITEM_SCHEMAS
+from utils.json_stream import iter_json_array
 from clients.postgres_client import PostgresClient
-from utils.functions import clean_object_from_data, clean, store_to_local_file, build_date
+from clients.http_transport import build_session
+from utils.sync_runs import record_rows, record_bytes, record_retry
+from utils.metrics import DHIS2_REQUEST_SECONDS, DHIS2_REQUEST_ERRORS, DHIS2_RETRIES, DHIS2_PAGES, DHIS2_BYTES, ROWS_FLATTENED, ROWS_TO_DELETE, endpoint_label
+from utils.functions import clean_object_from_data, store_to_local_file, build_date
 
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -49,9 +56,7 @@ class ItcDhis2SourceClient:
 
         # Session HTTP unique
         self.auth = HTTPBasicAuth(self.username, self.password)
-        self.session = requests.Session()
-        self.session.auth = self.auth
-        self.session.headers.update({"Content-Type": "application/json"})
+        self.session = build_session("dhis2_source", auth=self.auth, pool_maxsize=max(config.HTTP_POOL_MAXSIZE, config.MAX_WORKERS))
 
         # Caches internes (facultatif, ex: cache endpoint si très volumineux)
         self._endpoint_cache: Dict[str, Any] = {}
@@ -59,15 +64,26 @@ class ItcDhis2SourceClient:
         self._initialized = True
 
 
-    def _get(self, endpoint, params=None):
+    def _get(self, endpoint, params=None, data_key: str = None):
         url = f"{self.base_url.rstrip('/')}/{endpoint.lstrip('/')}"
+        label = endpoint_label(endpoint)
         for attempt in range(1, config.MAX_RETRIES + 1):
             try:
-                res = self.session.get(url, params=params, timeout=config.TIMEOUT, verify=config.USE_SSL)
+                with DHIS2_REQUEST_SECONDS.time(client="source", endpoint=label):
+                    res = self.session.get(url, params=params, timeout=config.TIMEOUT, verify=config.USE_SSL)
                 res.raise_for_status()
+                DHIS2_BYTES.inc(len(res.content), client="source", endpoint=label)
+                record_bytes(len(res.content))
+                if config.FAST_JSON:
+                    # Décodage rapide des bytes bruts (schéma typé si disponible pour data_key)
+                    return decode_json(res.content, SCHEMAS.get(data_key))
                 return res.json()
-            except requests.exceptions.RequestException as e:
+            except (requests.exceptions.RequestException, JsonDecodeError) as e:
+                # JsonDecodeError : corps tronqué / invalide (décodage rapide), retenté comme une erreur réseau
+                DHIS2_REQUEST_ERRORS.inc(client="source", endpoint=label)
                 if attempt < config.MAX_RETRIES:
+                    DHIS2_RETRIES.inc(client="source", endpoint=label)
+                    record_retry()
                     logger.warning("⏳ Erreur DHIS2 GET %s (tentative %d/%d): %s", endpoint, attempt, config.MAX_RETRIES, e)
                     # logger.warning(f"⏳ Retry {attempt}/{config.MAX_RETRIES} dans {config.RETRY_DELAY}s...")
                     sleep(config.RETRY_DELAY)
@@ -92,7 +108,8 @@ class ItcDhis2SourceClient:
         params.update({"paging": "true","pageSize": page_size, "page": page})
 
         while True:
-            data = self._get(dhis2_endpoint, params=params)
+            data = self._get(dhis2_endpoint, params=params, data_key=data_key)
+            DHIS2_PAGES.inc(endpoint=endpoint_label(dhis2_endpoint))
             results = data.get(data_key) or []
             all_results.extend(results)
             pager = data.get("pager")
@@ -107,6 +124,67 @@ class ItcDhis2SourceClient:
 
         return all_results
     
+    def _stream(self, endpoint, params=None) -> Iterator[Any]:
+        """
+        Requête unique paging=false lue en flux : les éléments du tableau de données
+        sont décodés et rendus un à un depuis response.raw (mémoire constante).
+        endpoint peut être : "trackedEntityInstances" ou ("trackedEntityInstances.json", "trackedEntityInstances")
+        """
+        if isinstance(endpoint, (list, tuple)):
+            dhis2_endpoint, data_key = endpoint
+        else:
+            dhis2_endpoint = endpoint
+            data_key = endpoint.replace(".json", "")
+
+        params = params.copy() if params else {}
+        params["paging"] = "false"
+        url = f"{self.base_url.rstrip('/')}/{dhis2_endpoint.lstrip('/')}"
+
+        item_schema = ITEM_SCHEMAS.get(data_key) if config.FAST_JSON else None
+        item_decoder = (lambda raw: decode_json(raw, item_schema)) if config.FAST_JSON else json.loads
+
+        # Retry uniquement sur l'ouverture du flux (aucun élément encore rendu)
+        label = endpoint_label(dhis2_endpoint)
+        res = None
+        for attempt in range(1, config.MAX_RETRIES + 1):
+            try:
+                res = self.session.get(url, params=params, timeout=config.TIMEOUT, verify=config.USE_SSL, stream=True)
+                res.raise_for_status()
+                break
+            except requests.exceptions.RequestException as e:
+                res = None
+                DHIS2_REQUEST_ERRORS.inc(client="source", endpoint=label)
+                if attempt < config.MAX_RETRIES:
+                    DHIS2_RETRIES.inc(client="source", endpoint=label)
+                    record_retry()
+                    logger.warning("⏳ Erreur DHIS2 GET (stream) %s (tentative %d/%d): %s", dhis2_endpoint, attempt, config.MAX_RETRIES, e)
+                    sleep(config.RETRY_DELAY)
+        if res is None:
+            raise Exception(f"Échec après {config.MAX_RETRIES} tentatives sur {dhis2_endpoint}")
+
+        DHIS2_PAGES.inc(endpoint=label)
+        started = perf_counter()
+
+        def counted(chunks):
+            for chunk in chunks:
+                DHIS2_BYTES.inc(len(chunk), client="source", endpoint=label)
+                record_bytes(len(chunk))
+                yield chunk
+
+        try:
+            chunks = counted(res.iter_content(chunk_size=config.STREAM_CHUNK_SIZE))
+            yield from iter_json_array(chunks, data_key, item_decoder)
+        finally:
+            res.close()
+            # Durée complète du flux (ouverture → dernier élément consommé)
+            DHIS2_REQUEST_SECONDS.observe(perf_counter() - started + res.elapsed.total_seconds(), client="source", endpoint=label)
+
+    def _iter_items(self, endpoint, params=None, page_size=100) -> Iterable[Any]:
+        """ Éléments d'un endpoint : flux incrémental si STREAM_JSON, sinon pagination classique. """
+        if config.STREAM_JSON:
+            return self._stream(endpoint, params=params)
+        return self._paginate(endpoint, params=params, page_size=page_size)
+
     # --- Multi async request ---
     def get_multi_async_request(self,payload_method: Callable[..., Any],payloads: List[tuple]) -> Any:
         """
@@ -145,6 +223,10 @@ class ItcDhis2SourceClient:
                     # Vérification du type
                     if isinstance(data, dict):
                         for key, items in data.items():
+                            # Compteurs (ex: fetch_teis_enrollments_events_attributes) → somme
+                            if isinstance(items, int) and not isinstance(items, bool):
+                                result_dict[key] = result_dict.get(key, 0) + items
+                                continue
                             if key not in result_dict:
                                 result_dict[key] = []
                             # Vérifie que items est bien itérable
@@ -205,6 +287,8 @@ class ItcDhis2SourceClient:
                     try:
                         if self.pg.upsert_data(endpoint, item):
                             saved.append(item)
+                        else:
+                            errors.append(item)
                     except Exception as e:
                         logger.error("Erreur lors du upsert %s : %s", endpoint, e)
                         errors.append(item)
@@ -220,8 +304,9 @@ class ItcDhis2SourceClient:
                     store_to_local_file(saved, endpoint, data_length, index, self.store_in_local_file)
 
                 if len(errors) > 0:
-                    # Sauvegarde locale des enregistrements réellement insérés en DB
-                    store_to_local_file(errors, f'{endpoint}/data_errors', len(errors), index, self.store_in_local_file)
+                    # Enregistrements en échec toujours conservés, quel que soit le mode de stockage
+                    logger.error(f"❌ UPSERT {endpoint} : {len(errors)} enregistrements en échec conservés dans data_errors")
+                    store_to_local_file(errors, f'{endpoint}/data_errors', len(errors), index, True)
 
             if data_to_delete_length > 0:
                 deleteError = []
@@ -235,7 +320,7 @@ class ItcDhis2SourceClient:
                         deleteError.append({f"{endpoint}": d_id})
 
                 if len(deleteError) > 0:
-                    store_to_local_file(deleteError, f'{endpoint}/delete_errors', len(deleteError), index, self.store_in_local_file)
+                    store_to_local_file(deleteError, f'{endpoint}/delete_errors', len(deleteError), index, True)
 
 
                 # try:
@@ -252,6 +337,41 @@ class ItcDhis2SourceClient:
                 store_to_local_file(data, endpoint, data_length, index, self.store_in_local_file)
             return False
 
+    def _store_columns(self, buffer: ColumnarBuffer, dataEndpoint: EndpointSpec, dataIdsToDelete: List[str] = None):
+        """ Stockage d'un tampon colonnaire : bulk UPSERT direct, puis suppressions. """
+        spec = EndpointSpec.parse(dataEndpoint)
+        endpoint, index = spec.to_tuple()
+        data_ids_to_delete = [d for d in (dataIdsToDelete or []) if d]
+        data_length = len(buffer) if buffer is not None else 0
+
+        if data_length == 0 and len(data_ids_to_delete) == 0:
+            return False
+
+        # Si pas de DB → sauver en local et sortir
+        if not self.store_in_db or not getattr(self, "pg", None):
+            if data_length > 0:
+                store_to_local_file(buffer.to_rows(), endpoint, data_length, index, self.store_in_local_file)
+            return self.store_in_db is False
+
+        if data_length > 0:
+            logger.debug(f"📦 Stockage colonnaire endpoint='{endpoint}', index={index}, rows={data_length}, deleted_ids={len(data_ids_to_delete)}")
+            if self.pg.bulk_upsert_columns(endpoint, buffer):
+                if self.store_in_local_file:
+                    store_to_local_file(buffer.to_rows(), endpoint, len(buffer), index, self.store_in_local_file)
+            else:
+                # Lignes en échec toujours conservées (rejouables : l'UPSERT est idempotent), quel que soit le mode de stockage
+                logger.error(f"❌ UPSERT {endpoint} en échec : {len(buffer)} lignes conservées dans outputs_files/{index}_{endpoint}/data_errors.json")
+                store_to_local_file(buffer.to_rows(), f'{endpoint}/data_errors', len(buffer), index, True)
+
+        if len(data_ids_to_delete) > 0:
+            try:
+                self.pg.bulk_delete_data(endpoint, data_ids_to_delete)
+            except Exception as e:
+                logger.error("❌ Erreur lors du delete %s : %s", endpoint, e)
+                store_to_local_file([{f"{endpoint}": d_id} for d_id in data_ids_to_delete], f'{endpoint}/delete_errors', len(data_ids_to_delete), index, True)
+
+        return True
+
     def fetch_organisation_units(self, level: int = None, fetch_index:int = 0) -> List[Dict]:
         """
         Récupère la liste des unités d’organisation (orgUnits) depuis DHIS2,
@@ -260,7 +380,7 @@ class ItcDhis2SourceClient:
         """
         # === Mode sans pagination ===
         params = {
-            "fields": "id,name,shortName,level,parent[id,name,shortName,level]",
+            "fields": "id,name,shortName,level,path,parent[id,name,shortName,level]",
             "paging": "false"
         }
 
@@ -270,7 +390,7 @@ class ItcDhis2SourceClient:
         endpoint = "organisationUnits"
 
         logger.info("🏢 Récupération des unités d’organisation...")
-        orgunits = self._paginate(endpoint, params=params)
+        orgunits = list(self._iter_items(endpoint, params=params))
         # Aplatissement au cas où DHIS2 renverrait un tableau imbriqué
         if any(isinstance(o, list) for o in orgunits):
             orgunits = [item for sublist in orgunits for item in (sublist if isinstance(sublist, list) else [sublist])]
@@ -326,203 +446,38 @@ class ItcDhis2SourceClient:
         logger.info("Récupération des TEI et ses Enrollments et ses Events depuis DHIS2...")
         # "/".join(["trackedEntityInstances", tei_id])
         endpoint = "trackedEntityInstances"
-        keys_to_remove = ["lastUpdatedAtClient","lastUpdatedByUserInfo","createdByUserInfo","storedBy","href"]
-        
-        raw_data = self._paginate(endpoint, params=params,keys_to_remove=keys_to_remove)
-
-        # enrollment_data = extend_from_json(raw_data)
-
-        # Résultats nettoyés
-        teis: List[Dict] = []
-        enrollments: List[Dict] = []
-        attributes: List[Dict] = []
-        events: List[Dict] = []
-
-        # IDs à supprimer
-        teis_to_delete_ids: List[str] = []
-        enrollments_to_delete_ids: List[str] = []
-        attributes_to_delete_ids: List[str] = []
-        events_to_delete_ids: List[str] = []
-
-        for tei in raw_data:
-            if not isinstance(tei, dict):
-                continue
-
-            # 🔹 Copie locale pour éviter toute modification sur les données d'origine
-            tei = tei.copy()
-            is_tei_deleted = tei.get("deleted", False)
-
-            # 🔸 Extraire et nettoyer les événements
-            enrollments_list = tei.pop("enrollments", [])
-            for enrollment in enrollments_list:
-                if not isinstance(enrollment, dict):
-                    continue
-
-                # 🔹 Copie locale pour éviter toute modification sur les données d'origine
-                enrollment = enrollment.copy()
-                is_enrollment_deleted = enrollment.get("deleted", False)
-
-                # 🔸 Extraire et nettoyer les événements
-                event_list = enrollment.pop("events", [])
-                for event in event_list:
-                    if not isinstance(event, dict):
-                        continue
-
-                    # 🔹 Copie locale pour éviter toute modification sur les données d'origine
-                    event = event.copy()
-                    is_event_deleted = event.get("deleted", False)
-
-                    if is_tei_deleted or is_enrollment_deleted or is_event_deleted:
-                        events_to_delete_ids.append(event.get("event"))
-                        continue
-                
-                    for key in ["relationships", "notes"]:
-                        event.pop(key, None)
-
-                    eventToStore = {
-                        "id": event.get('event'),
-                        "due_date": event.get('dueDate'),
-                        "program": program,
-                        "program_stage_id": event.get('programStage'),
-                        "orgunit_id": event.get('orgUnit'),
-                        # "orgunit_name": event.get('orgUnitName'),
-                        "enrollment_id": event.get('enrollment'),
-                        "tei_id": event.get('trackedEntityInstance'),
-                        "enrollment_status": event.get('enrollmentStatus'),
-                        "status": event.get('status'),
-                        "event_date": event.get('eventDate'),
-                        "attribute_category_options": event.get('attributeCategoryOptions'),
-                        "last_updated": event.get('lastUpdated'),
-                        "created": event.get("createdAtClient") or event.get("created"),
-                        "deleted": bool(event.get("deleted", False)),
-                        "attribute_option_combo": event.get('attributeOptionCombo'),
-                        # "dataValues": [
-                        #     {"value": dv.get('value'), "dataElement": dv.get('dataElement')} 
-                        #     for dv in (event.get('dataValues') or [])
-                        #     if isinstance(dv, dict)
-                        # ]
-                    }
-
-                    # Ajouter dynamiquement les dataValues comme colonnes
-                    data_values = event.get("dataValues") or []
-
-                    for dv in data_values:
-                        if isinstance(dv, dict):
-                            de_id = dv.get("dataElement")
-                            value = dv.get("value")
-
-                            if de_id:  # éviter une clé None
-                                eventToStore[de_id] = value
-
-                    eventToStore = {k: clean(v) for k, v in eventToStore.items()}
-                    events.append(eventToStore)
-
-
-                trackedEntityInstanceId = enrollment.get('trackedEntityInstance')
-                enrollmentId = enrollment.get('enrollment')
-                # 🔸 Extraire et nettoyer les événements
-                attributes_list = enrollment.pop("attributes", [])
-
-                attribute_id = f"{trackedEntityInstanceId}-{enrollmentId}"
-
-                # Chaque enrollment_id sera une ligne
-                formated_attributs = {
-                    "id": attribute_id,
-                    "tei_id": trackedEntityInstanceId,
-                    "enrollment_id": enrollmentId,
-                    "orgunit_id": enrollment.get("orgUnit"),
-                    "program": program,
-                    "created": enrollment.get("created"),
-                    "status": enrollment.get("status"),
-                    "deleted": enrollment.get("deleted"),
-                }
-
-                for attribute in attributes_list:
-                    if not isinstance(attribute, dict):
-                        continue
-
-                    # 🔹 Copie locale pour éviter toute modification sur les données d'origine
-                    attribute = attribute.copy()
-                    is_attribute_deleted = attribute.get("deleted", False)
-
-                    if is_tei_deleted or is_enrollment_deleted or is_attribute_deleted:
-                        attributes_to_delete_ids.append(attribute_id)
-                        continue
-
-                    attribute_id = attribute.get("attribute")
-                    # displayName = attribute.get("displayName")
-                    # valueType = attribute.get("valueType")
-                    value = clean(attribute.get("value"))
-
-                    # 🔹 Ajouter la valeur sous la colonne correspondant à attribute_id
-                    formated_attributs[attribute_id] = value
-
-                attributeToStore = {k: clean(v) for k, v in formated_attributs.items()}
-                attributes.append(attributeToStore)
-
-                # Ajouter ou supprimer l’enrollment
-                if is_tei_deleted or is_enrollment_deleted:
-                    enrollments_to_delete_ids.append(enrollment.get("enrollment"))
-                    continue
 
-                for key in ["relationships", "notes"]:
-                    enrollment.pop(key, None)
-
-                enrollmentToStore = {
-                    "id": enrollmentId,
-                    "program": program,
-                    "orgunit_id": enrollment.get("orgUnit"),
-                    "tei_id": trackedEntityInstanceId,
-                    "tei_type": enrollment.get("trackedEntityType"),
-                    # "orgunit_name": enrollment.get("orgUnitName"),
-                    "enrollment_date": enrollment.get("enrollmentDate"),
-                    "incident_date": enrollment.get("incidentDate"),
-                    "last_updated": enrollment.get("lastUpdated"),
-                    "created": enrollment.get("createdAtClient") or enrollment.get("created"),
-                    "status": enrollment.get("status"),
-                    "deleted": bool(enrollment.get("deleted", False)),
-                }
-                enrollmentToStore = {k: clean(v) for k, v in enrollmentToStore.items()}
-                enrollments.append(enrollmentToStore)
-
-            # Ajouter TEI nettoyé
-            if is_tei_deleted:
-                teis_to_delete_ids.append(tei.get("trackedEntityInstance"))
-                continue
-
-            # 🔸 Supprimer les champs inutiles dans l'enrollment
-            for key in ["attributes","potentialDuplicate", "featureType", 
-                        "inactive", "relationships", "notes", "programOwners"]:
-                tei.pop(key, None)
-
-            teiToStore = {
-                "id": tei.get("trackedEntityInstance"),
-                "orgunit_id": tei.get("orgUnit"),
-                "created": tei.get("createdAtClient") or tei.get("created"),
-                "last_updated": tei.get("lastUpdated"),
-                "type": tei.get("trackedEntityType"),
-                "deleted": bool(tei.get("deleted", False)),
-                "program": program
-            }
-            teiToStore = {k: clean(v) for k, v in teiToStore.items()}
-            teis.append(teiToStore)
+        # Pas de nettoyage récursif (keys_to_remove) : le flattener ne lit que les clés utiles
+        # En mode STREAM_JSON, chaque TEI est aplati dès sa réception
+        raw_data = self._iter_items(endpoint, params=params)
+
+        # Aplatissement en une passe dans des tampons colonnaires
+        flat = TrackerFlattener(program).add_teis(raw_data).finish()
+        for entity, buffer, to_delete in (
+            ("trackedEntityInstances", flat.teis, flat.teis_to_delete_ids),
+            ("enrollments", flat.enrollments, flat.enrollments_to_delete_ids),
+            ("attributes", flat.attributes, flat.attributes_to_delete_ids),
+            ("events", flat.events, flat.events_to_delete_ids),
+        ):
+            ROWS_FLATTENED.inc(len(buffer), entity=entity)
+            ROWS_TO_DELETE.inc(len(to_delete), entity=entity)
+            record_rows(entity, fetched=len(buffer))
 
         # Enregistrement dans la DB
         if doTei == True:
-            self._store(teis, EndpointSpec("trackedEntityInstances", fetch_index), teis_to_delete_ids)
+            self._store_columns(flat.teis, EndpointSpec("trackedEntityInstances", fetch_index), flat.teis_to_delete_ids)
         if doEnroll == True:
-            self._store(enrollments, EndpointSpec("enrollments", fetch_index), enrollments_to_delete_ids)
+            self._store_columns(flat.enrollments, EndpointSpec("enrollments", fetch_index), flat.enrollments_to_delete_ids)
         if doAttribute == True:
-            self._store(attributes, EndpointSpec("attributes", fetch_index), attributes_to_delete_ids)
+            self._store_columns(flat.attributes, EndpointSpec("attributes", fetch_index), flat.attributes_to_delete_ids)
         if doEvent == True:
-            self._store(events, EndpointSpec("events", fetch_index), events_to_delete_ids)
+            self._store_columns(flat.events, EndpointSpec("events", fetch_index), flat.events_to_delete_ids)
 
-        
         return {
-            "teis": len(teis) if doTei == True else 0, 
-            "events": len(events) if doEvent == True else 0, 
-            "enrollments": len(enrollments) if doEnroll == True else 0, 
-            "attributes": len(attributes) if doAttribute == True else 0
+            "teis": len(flat.teis) if doTei == True else 0, 
+            "events": len(flat.events) if doEvent == True else 0, 
+            "enrollments": len(flat.enrollments) if doEnroll == True else 0, 
+            "attributes": len(flat.attributes) if doAttribute == True else 0
         }
     
     # Dataelements
@@ -536,6 +491,6 @@ class ItcDhis2SourceClient:
         }
         endpoint = "dataElements"
         logger.info("Récupération des Data Elements depuis DHIS2...")
-        data = self._paginate(endpoint, params=params)
+        data = list(self._iter_items(endpoint, params=params))
         self._store(data, EndpointSpec(endpoint, fetch_index))
         return data
@@ -1,10 +1,13 @@
-from time import sleep
+from time import sleep, perf_counter
+from itertools import islice
 from typing import Any
 from psycopg2 import sql, OperationalError, DatabaseError, InterfaceError
 from psycopg2.extras import Json, execute_values, RealDictCursor
 from utils.config import config
 from datetime import datetime, date, timezone, time
 from utils.db import get_connection
+from utils.sync_runs import record_rows, record_retry, record_error
+from utils.metrics import UPSERT_BATCH_SECONDS, UPSERT_ROWS, UPSERT_RETRIES, UPSERT_FAILURES
 from utils.functions import to_datetime
 from utils.hasher_uitls import hash_password
 
@@ -154,6 +157,19 @@ class PostgresClient:
                     );
                 """)
                     
+                # Table de fermeture (closure) de la hiérarchie des orgunits
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS orgunit_closure (
+                        ancestor_id TEXT NOT NULL,
+                        descendant_id TEXT NOT NULL,
+                        depth INT NOT NULL,
+                        synced_at TIMESTAMP DEFAULT now(),
+                        PRIMARY KEY (ancestor_id, descendant_id)
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_orgunit_closure_descendant ON orgunit_closure(descendant_id, depth);
+                    CREATE INDEX IF NOT EXISTS idx_orgunit_closure_ancestor_depth ON orgunit_closure(ancestor_id, depth);
+                """)
+
                 cur.execute("""
                     CREATE TABLE IF NOT EXISTS sync_state (
                         id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -162,6 +178,46 @@ class PostgresClient:
                     --INSERT INTO sync_state (last_sync) SELECT now() - INTERVAL '90 days' WHERE NOT EXISTS (SELECT 1 FROM sync_state);
                 """)
 
+                # Rapports d'exécution (sync / arrimage) et détail par orgunit
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS sync_runs (
+                        id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'running',
+                        params JSONB,
+                        triggered_by TEXT,
+                        started_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                        finished_at TIMESTAMP WITH TIME ZONE,
+                        duration_ms BIGINT,
+                        orgunits_total INT NOT NULL DEFAULT 0,
+                        orgunits_failed INT NOT NULL DEFAULT 0,
+                        rows JSONB,
+                        bytes BIGINT NOT NULL DEFAULT 0,
+                        retries INT NOT NULL DEFAULT 0,
+                        errors INT NOT NULL DEFAULT 0,
+                        error TEXT
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_sync_runs_kind_started ON sync_runs(kind, started_at DESC);
+
+                    CREATE TABLE IF NOT EXISTS sync_run_orgunits (
+                        id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                        run_id BIGINT NOT NULL REFERENCES sync_runs(id) ON DELETE CASCADE,
+                        orgunit_id TEXT,
+                        period TEXT,
+                        status TEXT NOT NULL,
+                        started_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                        finished_at TIMESTAMP WITH TIME ZONE,
+                        duration_ms BIGINT,
+                        rows JSONB,
+                        bytes BIGINT NOT NULL DEFAULT 0,
+                        retries INT NOT NULL DEFAULT 0,
+                        errors INT NOT NULL DEFAULT 0,
+                        error TEXT
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_sync_run_orgunits_run ON sync_run_orgunits(run_id, duration_ms DESC);
+                    CREATE INDEX IF NOT EXISTS idx_sync_run_orgunits_orgunit ON sync_run_orgunits(orgunit_id, started_at DESC);
+                """)
+
             
             self.conn.commit()  # <- commit après création
             self._verified_tables.add("base_tables")
@@ -448,40 +504,74 @@ class PostgresClient:
             self.ensure_columns_exist(table, sample, id_field)
             self.ensure_pk_or_unique(table, id_field)
 
+            # 🔑 Une ligne par id (la dernière gagne) : ON CONFLICT DO UPDATE ne touche pas deux fois la même ligne
+            unique_rows = {}
+            for row in data:
+                unique_rows.pop(row.get(id_field), None)
+                unique_rows[row.get(id_field)] = row
+            if len(unique_rows) < len(data):
+                logger.warning(f"  {table} -> ⚠ {len(data) - len(unique_rows)} doublon(s) de '{id_field}' ignoré(s) (dernière version conservée)")
+                data = list(unique_rows.values())
+
             columns = list(sample.keys())
-            pg_columns = ', '.join(f'"{c}"' for c in columns)
+            batch_tuples_iter = (tuple(row.get(c) for c in columns) for row in data)
+            return self._execute_upsert_batches(table, columns, id_field, batch_tuples_iter, len(data))
 
-            # 🔥 Colonnes à update (toutes sauf id_field)
-            update_columns = [c for c in columns if c != id_field]
-            update_clause = ', '.join([f'"{c}" = EXCLUDED."{c}"' for c in update_columns])
+        except Exception as e:
+            logger.error(f"  {table} -> ❌ ERREUR critique Bulk UPSERT: {e}")
+            try:
+                self.conn.rollback()
+            except:
+                pass
+            return False
 
-            # Requête UPSERT (INSERT ... ON CONFLICT)
-            base_query = (f'INSERT INTO "{table}" ({pg_columns}) VALUES %s '
-                        f'ON CONFLICT ("{id_field}") DO UPDATE SET {update_clause};')
+    def _execute_upsert_batches(self, table: str, columns: list, id_field: str, rows, total_rows: int) -> bool:
+        """
+        Exécute l'UPSERT (INSERT ... ON CONFLICT) par batch de config.BATCH_SIZE.
+        `rows` est un itérable de tuples alignés sur `columns`.
+        """
+        pg_columns = ', '.join(f'"{c}"' for c in columns)
 
-            total_rows = len(data)
-            logger.info(f"🚀 BULK UPSERT de {total_rows} lignes → {table}")
+        # 🔥 Colonnes à update (toutes sauf id_field)
+        update_columns = [c for c in columns if c != id_field]
+        update_clause = ', '.join([f'"{c}" = EXCLUDED."{c}"' for c in update_columns])
 
-            cur = self.conn.cursor()
+        # Requête UPSERT (INSERT ... ON CONFLICT)
+        # xmax = 0 → ligne nouvellement insérée, sinon ligne existante mise à jour
+        base_query = (f'INSERT INTO "{table}" ({pg_columns}) VALUES %s '
+                    f'ON CONFLICT ("{id_field}") DO UPDATE SET {update_clause} '
+                    f'RETURNING (xmax = 0);')
 
+        logger.info(f"🚀 BULK UPSERT de {total_rows} lignes → {table}")
 
-            # 🚚 2. Process par batch
-            for start in range(0, total_rows, config.BATCH_SIZE):
+        convert = self.convert_value_for_pg
+        rows_iter = iter(rows)
+        cur = self.conn.cursor()
 
-                batch = data[start:start + config.BATCH_SIZE]
+        try:
+            # 🚚 Process par batch
+            batch_num = 0
+            while True:
                 batch_tuples = [
-                    tuple(self.convert_value_for_pg(row.get(c)) for c in columns)
-                    for row in batch
+                    tuple(convert(v) for v in row)
+                    for row in islice(rows_iter, config.BATCH_SIZE)
                 ]
+                if not batch_tuples:
+                    break
 
                 retries = 0
-                batch_num = (start // config.BATCH_SIZE) + 1
+                batch_num += 1
 
                 while retries <= config.MAX_RETRIES:
                     try:
-                        execute_values(cur, base_query, batch_tuples)
+                        started = perf_counter()
+                        returned = execute_values(cur, base_query, batch_tuples, fetch=True)
                         self.conn.commit()
-                        logger.info(f"✔ Batch {batch_num} ({len(batch)} rows) upserted")
+                        UPSERT_BATCH_SECONDS.observe(perf_counter() - started, table=table)
+                        UPSERT_ROWS.inc(len(batch_tuples), table=table)
+                        inserted = sum(1 for (is_insert,) in returned if is_insert)
+                        record_rows(table, inserted=inserted, updated=len(returned) - inserted)
+                        logger.info(f"✔ Batch {batch_num} ({len(batch_tuples)} rows) upserted")
                         break
 
                     except (OperationalError, InterfaceError) as e:
@@ -489,14 +579,19 @@ class PostgresClient:
                         retries += 1
 
                         if retries > config.MAX_RETRIES:
+                            UPSERT_FAILURES.inc(table=table)
+                            record_error()
                             logger.error(f"  {table} -> ❌ ÉCHEC FINAL batch {batch_num} après retries. Erreur: {e}")
                             return False
 
+                        UPSERT_RETRIES.inc(table=table)
+                        record_retry()
+
                         logger.warning(
                             f"⚠ Erreur temporaire batch {batch_num}: {e}. "
                             f"Retry {retries}/{config.MAX_RETRIES} dans {config.RETRY_DELAY}s"
                         )
-                        time.sleep(config.RETRY_DELAY)
+                        sleep(config.RETRY_DELAY)
 
                     except DatabaseError as e:
                         # Erreur SQL (colonne, type, table) → non récupérable
@@ -519,18 +614,55 @@ class PostgresClient:
                         # Dump the tuple that causes the crash
                         logger.error("📌 Exemple valeurs : %s", batch_tuples[:3])
 
+                        UPSERT_FAILURES.inc(table=table)
+                        record_error()
                         return False
 
                     except Exception as e:
                         # Erreur inconnue → non récupérable
                         self.conn.rollback()
+                        UPSERT_FAILURES.inc(table=table)
+                        record_error()
                         logger.error(f"❌ ERREUR inconnu batch {batch_num}: {e}")
                         return False
-
+        finally:
             cur.close()
 
-            logger.info(f"  {table} -> 🏁 Bulk UPSERT terminé : {total_rows} lignes → {table}")
-            return True
+        logger.info(f"  {table} -> 🏁 Bulk UPSERT terminé : {total_rows} lignes → {table}")
+        return True
+
+    def bulk_upsert_columns(self, table: str, buffer) -> bool:
+        """
+        Bulk UPSERT depuis un tampon colonnaire (utils.tracker_flattener.ColumnarBuffer).
+        Les tuples sont produits directement par zip des colonnes, sans dict par ligne.
+        Toutes les colonnes du tampon sont écrites (None → NULL) pour chaque ligne ;
+        une seule ligne par id est envoyée (la dernière gagne).
+        """
+        if buffer is None or len(buffer) == 0:
+            logger.warning(f"Aucune donnée à insérer pour {table}")
+            return False
+
+        id_field = DHIS2_TABLE_KEY[table]
+        if id_field not in buffer.columns:
+            logger.error(f"  {table} -> ❌ Missing id_field '{id_field}' in buffer columns")
+            return False
+
+        try:
+            table = self.normalize_tablename(table)
+            buffer.finish()
+            duplicates = buffer.dedupe(id_field)
+            if duplicates:
+                logger.warning(f"  {table} -> ⚠ {duplicates} doublon(s) de '{id_field}' ignoré(s) (dernière version conservée)")
+            buffer.columns["synced_at"] = [datetime.now(timezone.utc)] * len(buffer)
+
+            # 🔧 Création auto table + colonnes (types devinés sur la 1ère valeur non nulle)
+            sample = buffer.first_values()
+            self.ensure_table_exist_create_if_not(table, sample, id_field)
+            self.ensure_columns_exist(table, sample, id_field)
+            self.ensure_pk_or_unique(table, id_field)
+
+            columns = buffer.column_names
+            return self._execute_upsert_batches(table, columns, id_field, buffer.iter_tuples(columns), len(buffer))
 
         except Exception as e:
             logger.error(f"  {table} -> ❌ ERREUR critique Bulk UPSERT: {e}")
@@ -658,6 +790,7 @@ class PostgresClient:
                     try:
                         cur.execute(delete_query, (batch,))
                         self.conn.commit()
+                        record_rows(table, deleted=cur.rowcount)
 
                         logger.info(
                             f"✔ Batch {batch_num} DELETE ({cur.rowcount} lignes supprimées)"
@@ -675,7 +808,7 @@ class PostgresClient:
                             f"⚠ Erreur réseau batch {batch_num}: {e}. "
                             f"Retry {retries}/{config.MAX_RETRIES} dans {config.RETRY_DELAY}s"
                         )
-                        time.sleep(config.RETRY_DELAY)
+                        sleep(config.RETRY_DELAY)
 
                     except DatabaseError as e:
                         self.conn.rollback()
@@ -697,7 +830,7 @@ class PostgresClient:
         return True
 
     # Récupération en base de donnée
-    def _list_data(self, table: str,fields: list | tuple | None = None,*,limit: int | None = None,offset: int | None = None,filters: dict | None = None,order_by: str = "synced_at",order_dir: str = "DESC") -> list[dict[str, Any]]:
+    def _list_data(self, table: str,fields: list | tuple | None = None,*,limit: int | None = None,offset: int | None = None,filters: dict | None = None,order_by: str = "synced_at",order_dir: str = "DESC",conn=None) -> list[dict[str, Any]]:
         """
         Récupère une liste générique depuis n'importe quelle table PostgreSQL.
 
@@ -709,6 +842,7 @@ class PostgresClient:
             filters     : dict {col: value} pour WHERE
             order_by    : colonne de tri
             order_dir   : ASC ou DESC
+            conn        : connexion à utiliser (ex. réplica en lecture), sinon self.conn
         """
 
         # --- Validation sécurisée ---
@@ -759,7 +893,7 @@ class PostgresClient:
         query = f'SELECT {fields_sql} FROM "{table}" {where_sql} {order_sql} {limit_sql}'
 
         # --- Execution ---
-        with self.conn.cursor() as cur:
+        with (conn or self.conn).cursor() as cur:
             cur.execute(query, tuple(values))
             colnames = [desc[0] for desc in cur.description]
             rows = cur.fetchall()
@@ -778,12 +912,12 @@ class PostgresClient:
 
         return result
 
-    def list_orgunits(self, level:int=None, only_ids:bool=False) -> list[dict[str, Any]]:
+    def list_orgunits(self, level:int=None, only_ids:bool=False, conn=None) -> list[dict[str, Any]]:
         # id_field = 'id'
         isGoodLevel = level is not None and isinstance(level,int) and level > 0
         filters={"level": level} if isGoodLevel else None
         
-        orgunits = self._list_data("organisationUnits", filters=filters)
+        orgunits = self._list_data("organisationUnits", filters=filters, conn=conn)
 
         if only_ids is True:
             orgunits_ids = [ou["id"] for ou in orgunits]
@@ -791,6 +925,98 @@ class PostgresClient:
         
         return orgunits
         
+    def _orgunit_closure_rows(self, orgunit: dict) -> list[tuple]:
+        """
+        Construit les lignes (ancestor_id, descendant_id, depth) d'un orgunit.
+        Utilise `path` DHIS2 ("/A/B/C") si présent, sinon le `parent` direct.
+        """
+        ou_id = orgunit.get("id")
+        if not ou_id:
+            return []
+
+        path = orgunit.get("path")
+        if isinstance(path, str) and path.strip("/"):
+            chain = [p for p in path.strip("/").split("/") if p]
+            if chain[-1] != ou_id:
+                chain.append(ou_id)
+        else:
+            parent = orgunit.get("parent")
+            parent_id = parent.get("id") if isinstance(parent, dict) else None
+            chain = [parent_id, ou_id] if parent_id else [ou_id]
+
+        # depth 0 = lui-même, 1 = parent, 2 = grand-parent, ...
+        return [(ancestor_id, ou_id, depth) for depth, ancestor_id in enumerate(reversed(chain))]
+
+    def rebuild_orgunit_closure(self, orgunits: list[dict]) -> int:
+        """
+        Reconstruction incrémentale de la table `orgunit_closure`.
+        Seules les lignes des orgunits fournis (descendant_id) sont remplacées.
+        Retourne le nombre de lignes insérées.
+        """
+        if not isinstance(orgunits, list) or len(orgunits) == 0:
+            return 0
+
+        rows = []
+        for ou in orgunits:
+            if isinstance(ou, dict):
+                rows.extend(self._orgunit_closure_rows(ou))
+
+        descendant_ids = list({r[1] for r in rows})
+        if not descendant_ids:
+            return 0
+
+        batch_size = getattr(config, "BATCH_SIZE", 5000)
+        try:
+            with self.conn.cursor() as cur:
+                for start in range(0, len(descendant_ids), batch_size):
+                    batch = descendant_ids[start:start + batch_size]
+                    cur.execute("DELETE FROM orgunit_closure WHERE descendant_id = ANY(%s);", (batch,))
+
+                for start in range(0, len(rows), batch_size):
+                    execute_values(
+                        cur,
+                        "INSERT INTO orgunit_closure (ancestor_id, descendant_id, depth) VALUES %s "
+                        "ON CONFLICT (ancestor_id, descendant_id) DO UPDATE SET depth = EXCLUDED.depth, synced_at = now();",
+                        rows[start:start + batch_size],
+                    )
+            self.conn.commit()
+            logger.info(f"🌳 orgunit_closure → {len(rows)} lignes pour {len(descendant_ids)} orgunits")
+            return len(rows)
+        except Exception as e:
+            self.conn.rollback()
+            logger.exception(f"Erreur reconstruction orgunit_closure: {e}")
+            raise
+
+    def list_descendants(self, ou_id: str, max_depth: int | None = None, include_self: bool = False) -> list[str]:
+        """Retourne les ids des descendants de `ou_id` (jointure indexée sur orgunit_closure)."""
+        if not ou_id:
+            raise ValueError("ou_id must not be empty")
+
+        min_depth = 0 if include_self else 1
+        query = "SELECT descendant_id FROM orgunit_closure WHERE ancestor_id = %s AND depth >= %s"
+        values = [ou_id, min_depth]
+        if isinstance(max_depth, int) and max_depth >= 0:
+            query += " AND depth <= %s"
+            values.append(max_depth)
+        query += " ORDER BY depth, descendant_id;"
+
+        with self.conn.cursor() as cur:
+            cur.execute(query, tuple(values))
+            return [row[0] for row in cur.fetchall()]
+
+    def list_ancestors(self, ou_id: str, include_self: bool = False) -> list[dict[str, Any]]:
+        """Retourne les ancêtres de `ou_id` du plus proche au plus lointain : [{id, depth}]."""
+        if not ou_id:
+            raise ValueError("ou_id must not be empty")
+
+        min_depth = 0 if include_self else 1
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT ancestor_id, depth FROM orgunit_closure WHERE descendant_id = %s AND depth >= %s ORDER BY depth;",
+                (ou_id, min_depth),
+            )
+            return [{"id": row[0], "depth": row[1]} for row in cur.fetchall()]
+
     def list_dataelement(self) -> list[dict[str, Any]]:
         # id_field = 'id'
         # fields=["id","name","code","shortName", "created", "synced_at"]
@@ -832,6 +1058,79 @@ class PostgresClient:
             return default_date
 
 
+    # --------------------------
+    # RAPPORTS D'EXÉCUTION (sync_runs)
+    # --------------------------
+    SYNC_RUN_FIELDS = ("kind", "status", "params", "triggered_by", "started_at", "finished_at", "duration_ms",
+                       "orgunits_total", "orgunits_failed", "rows", "bytes", "retries", "errors", "error")
+    SYNC_RUN_ORGUNIT_FIELDS = ("run_id", "orgunit_id", "period", "status", "started_at", "finished_at",
+                               "duration_ms", "rows", "bytes", "retries", "errors", "error")
+
+    def create_sync_run(self, kind: str, params: dict = None, triggered_by: str = None, started_at: datetime = None) -> int | None:
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO sync_runs (kind, params, triggered_by, started_at) VALUES (%s, %s, %s, %s) RETURNING id;",
+                    (kind, Json(params or {}), triggered_by, started_at or datetime.now(timezone.utc)),
+                )
+                run_id = cur.fetchone()[0]
+            self.conn.commit()
+            return run_id
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"❌ Création du rapport sync_runs impossible : {e}")
+            return None
+
+    def finish_sync_run(self, run_id: int, run: dict, orgunits: list[dict]) -> bool:
+        """ Enregistre les lignes par orgunit puis met à jour le run (totaux, statut, fin). """
+        try:
+            with self.conn.cursor() as cur:
+                if orgunits:
+                    columns = ", ".join(self.SYNC_RUN_ORGUNIT_FIELDS)
+                    rows = [tuple(Json(v) if isinstance(v, dict) else v for v in ((run_id,) + tuple(ou.get(f) for f in self.SYNC_RUN_ORGUNIT_FIELDS[1:]))) for ou in orgunits]
+                    execute_values(cur, f"INSERT INTO sync_run_orgunits ({columns}) VALUES %s", rows, page_size=1000)
+
+                fields = [f for f in self.SYNC_RUN_FIELDS if f in run and f not in ("kind", "params", "triggered_by", "started_at")]
+                assignments = sql.SQL(", ").join(sql.SQL("{} = %s").format(sql.Identifier(f)) for f in fields)
+                values = [Json(run[f]) if isinstance(run[f], dict) else run[f] for f in fields]
+                cur.execute(sql.SQL("UPDATE sync_runs SET {} WHERE id = %s").format(assignments), (*values, run_id))
+            self.conn.commit()
+            return True
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"❌ Enregistrement du rapport sync_runs {run_id} impossible : {e}")
+            return False
+
+    def list_sync_runs(self, kind: str = None, status: str = None, limit: int = 50, offset: int = 0) -> list[dict]:
+        filters, values = [], []
+        if kind:
+            filters.append("kind = %s")
+            values.append(kind)
+        if status:
+            filters.append("status = %s")
+            values.append(status)
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"SELECT id, {', '.join(self.SYNC_RUN_FIELDS)} FROM sync_runs {where} ORDER BY started_at DESC LIMIT %s OFFSET %s;", (*values, limit, offset))
+            return [dict(r) for r in cur.fetchall()]
+
+    def get_sync_run(self, run_id: int, order_by: str = "duration_ms", limit: int = None) -> dict | None:
+        """ Run + lignes par orgunit (par défaut les plus lentes d'abord). """
+        order_by = order_by if order_by in ("duration_ms", "started_at", "bytes", "retries", "errors") else "duration_ms"
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"SELECT id, {', '.join(self.SYNC_RUN_FIELDS)} FROM sync_runs WHERE id = %s;", (run_id,))
+            run = cur.fetchone()
+            if not run:
+                return None
+            cur.execute(
+                f"SELECT id, {', '.join(self.SYNC_RUN_ORGUNIT_FIELDS[1:])} FROM sync_run_orgunits "
+                f"WHERE run_id = %s ORDER BY {order_by} DESC NULLS LAST LIMIT %s;",
+                (run_id, limit),
+            )
+            run = dict(run)
+            run["orgunits"] = [dict(r) for r in cur.fetchall()]
+            return run
+
     def update_last_sync(self, new_dt: datetime):
         try:
             with self.conn.cursor() as cur:
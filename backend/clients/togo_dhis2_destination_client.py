@@ -9,10 +9,13 @@ from typing import List, Dict, Tuple, Optional
 
 import psycopg2.extras
 import requests
-from requests.adapters import HTTPAdapter, Retry
+from requests.adapters import Retry
 from requests.auth import HTTPBasicAuth
 
 from utils.config import config
+from utils.sync_runs import record_rows, record_error, record_retry
+from utils.metrics import DHIS2_REQUEST_SECONDS, DHIS2_REQUEST_ERRORS, DHIS2_RETRIES, ARRIMAGE_PAYLOADS, endpoint_label
+from clients.http_transport import build_session, shared_ssl_context, accept_encoding
 from utils.db import get_connection
 from utils.functions import generate_dhis2_dates
 from utils.logger import get_logger
@@ -51,16 +54,20 @@ class AsyncDhis2Sender:
         period = payload.get("period")
         orgunit = payload.get("orgUnit")
 
+        started = time.perf_counter()
         try:
             async with session.post(url, json=payload, timeout=self.timeout) as resp:
                 resp_json = await resp.json()
+                DHIS2_REQUEST_SECONDS.observe(time.perf_counter() - started, client="destination", endpoint="dataValueSets")
                 if resp.status in (200, 201):
                     logger.info(f"✅ Sent {data_set} | {period} | {orgunit} successfully")
                     return {"success": True, "payload": payload}
                 else:
+                    DHIS2_REQUEST_ERRORS.inc(client="destination", endpoint="dataValueSets")
                     logger.warning(f"⚠️ Failed {data_set} | {period} | {orgunit} - HTTP {resp.status}: {resp_json}")
                     return {"success": False, "payload": payload, "error": resp_json}
         except Exception as e:
+            DHIS2_REQUEST_ERRORS.inc(client="destination", endpoint="dataValueSets")
             logger.error(f"❌ Exception sending {data_set} | {period} | {orgunit}: {e}")
             return {"success": False, "payload": payload, "error": str(e)}
 
@@ -70,8 +77,11 @@ class AsyncDhis2Sender:
         :param payloads: liste de payloads à envoyer
         :param max_concurrent: nombre max de requêtes simultanées
         """
-        connector = aiohttp.TCPConnector(ssl=self.verify_ssl, limit=max_concurrent)
-        async with aiohttp.ClientSession(auth=self.auth, timeout=self.timeout, connector=connector) as session:
+        # Même politique de transport que les sessions requests : TLS partagé, keep-alive, compression
+        ssl_param = shared_ssl_context() if self.verify_ssl else False
+        connector = aiohttp.TCPConnector(ssl=ssl_param, limit=max_concurrent, keepalive_timeout=config.HTTP_KEEPALIVE_SECONDS)
+        headers = {"Accept-Encoding": accept_encoding()} if config.HTTP_COMPRESSION else None
+        async with aiohttp.ClientSession(auth=self.auth, timeout=self.timeout, connector=connector, headers=headers) as session:
             tasks = [self._send_payload(session, p) for p in payloads]
             results = await asyncio.gather(*tasks, return_exceptions=False)
         return results
@@ -109,26 +119,28 @@ class TogoDhis2DestinationClient:
 
         self.auth = HTTPBasicAuth(self.username, self.password)
         
-        # Session persistante avec retry
-        self.session = requests.Session()
+        # Session persistante avec retry (pool, keep-alive et compression partagés)
         retries = Retry(total=self.MAX_RETRIES, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-        self.session.mount("https://", HTTPAdapter(max_retries=retries))
-        self.session.mount("http://", HTTPAdapter(max_retries=retries))
-        self.session.auth = self.auth
-        self.session.headers.update({"Content-Type": "application/json"})
+        self.session = build_session("dhis2_destination", auth=self.auth, retries=retries)
 
     def _safe_request(self, method: str, url: str, **kwargs) -> dict:
         """Request avec retry et logging"""
+        label = endpoint_label(url)
         for attempt in range(1, self.MAX_RETRIES + 1):
             try:
-                response = self.session.request(method, url, timeout=self.TIMEOUT, verify=self.verify_ssl, **kwargs)
+                with DHIS2_REQUEST_SECONDS.time(client="destination", endpoint=label):
+                    response = self.session.request(method, url, timeout=self.TIMEOUT, verify=self.verify_ssl, **kwargs)
                 if response.status_code in (200, 201):
                     return response.json()
                 else:
                     logger.warning(f"[DHIS2] HTTP {response.status_code}: {response.text}")
             except requests.RequestException as e:
                 logger.warning(f"[DHIS2] Attempt {attempt} failed: {e}")
-            
+
+            DHIS2_REQUEST_ERRORS.inc(client="destination", endpoint=label)
+            if attempt < self.MAX_RETRIES:
+                DHIS2_RETRIES.inc(client="destination", endpoint=label)
+                record_retry()
             time.sleep(self.RETRY_DELAY * attempt)
         
         raise ConnectionError(f"Failed to request {url} after {self.MAX_RETRIES} retries")
@@ -238,13 +250,19 @@ class TogoDhis2DestinationClient:
                 )
                 # Envoi max 10 payloads simultanément
                 results = sender.run(data_to_send)
-                success_all = all(r["success"] for r in results) if results else True
+                res_results = [r["success"] for r in results]
             else:
                 res_results = []
                 for payload in data_to_send:
                     res = self._create_or_update_aggregated_data(payload)
                     res_results.append(res["success"])
-                success_all = all(res_results) if res_results else True
+            success_all = all(res_results) if res_results else True
+            sent = sum(1 for ok in res_results if ok)
+            ARRIMAGE_PAYLOADS.inc(sent, status="sent")
+            ARRIMAGE_PAYLOADS.inc(len(res_results) - sent, status="failed")
+            record_rows("dataValueSets", fetched=dataToSendLength, inserted=sent)
+            for _ in range(len(res_results) - sent):
+                record_error()
 
 
         if self.save_to_local_file:
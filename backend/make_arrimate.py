@@ -1,6 +1,7 @@
 
 from utils.config import config
 from clients.togo_dhis2_destination_client import TogoDhis2DestinationClient
+from utils.sync_runs import SyncRunRecorder
 from typing import Tuple, List, Dict, Any
 
 from utils.logger import get_logger
@@ -153,10 +154,11 @@ class Dhis2ArrimateMaker:
         return (message, status, length)
     
 
-    def start_indicators_arrimage_with_dhis2(self,periods: List[str] = None,orgunit_ids: List[str] = None) -> List[Dict[str, Any]]:
+    def start_indicators_arrimage_with_dhis2(self,periods: List[str] = None,orgunit_ids: List[str] = None, triggered_by: str = None, progress=None) -> List[Dict[str, Any]]:
         """
         Transforme et envoie les données DHIS2 pour les périodes/orgunit donnés.
         Retourne une liste d'objets { message, size, status }.
+        Chaque exécution est enregistrée dans sync_runs (kind='arrimage', une ligne par orgunit/période).
         """
 
         output: Dict[str, Dict[str, Any]] = {}
@@ -165,23 +167,32 @@ class Dhis2ArrimateMaker:
         periods = periods or []
         orgunit_ids = orgunit_ids or []
 
-        # Mode multi (periode + orgunits)
-        if periods and orgunit_ids:
-            for orgunit_id in orgunit_ids:
-                for period in periods:
-                    message, status, length = self._transform_and_send_data_to_dhis2(period, orgunit_id)
-
-                    if message not in output:
-                        output[message] = {"message": message,"size": 0,"status": True}  # Par défaut tout va bien
-                    # Accumuler la taille
-                    output[message]["size"] += length
-                    # Combiner le status (si un seul est False → False)
-                    output[message]["status"] = output[message]["status"] and status
-
-        # Mode single-run (pas d'entrée)
-        else:
-            message, status, length = self._transform_and_send_data_to_dhis2()
-            output[message] = {"message": message,"size": length,"status": status}
+        run = SyncRunRecorder("arrimage", {"periods": periods, "orgunits": len(orgunit_ids), "send_to_dhis2": self.dhis2.send_to_dhis2}, triggered_by, progress)
+        with run:
+            # Mode multi (periode + orgunits)
+            if periods and orgunit_ids:
+                run.set_total(len(orgunit_ids) * len(periods))
+                for orgunit_id in orgunit_ids:
+                    for period in periods:
+                        with run.orgunit(orgunit_id, period):
+                            message, status, length = self._transform_and_send_data_to_dhis2(period, orgunit_id)
+                        if status is False:
+                            run.mark_orgunit_failed(orgunit_id, message, period)
+
+                        if message not in output:
+                            output[message] = {"message": message,"size": 0,"status": True}  # Par défaut tout va bien
+                        # Accumuler la taille
+                        output[message]["size"] += length
+                        # Combiner le status (si un seul est False → False)
+                        output[message]["status"] = output[message]["status"] and status
+
+            # Mode single-run (pas d'entrée)
+            else:
+                with run.track():
+                    message, status, length = self._transform_and_send_data_to_dhis2()
+                output[message] = {"message": message,"size": length,"status": status}
+                if status is False:
+                    run.stats.add(errors=1)
 
         # Log final
         for message, data in output.items():
@@ -142,6 +142,13 @@
     CREATE INDEX IF NOT EXISTS idx_enroll_tei_org ON enrollments(tei_id, orgunit_id, enrollment_date) WHERE deleted IS NOT TRUE;
     -- ORGUNITS (if frequently used in joins)
     CREATE INDEX IF NOT EXISTS idx_orgunit_id ON "organisationUnits"(id);
+    -- ORGUNIT_CLOSURE (créée par PostgresClient, alimentée par la sync des orgunits)
+    -- Agrégation à n'importe quel niveau (district, région, national) via une seule jointure indexée :
+    --   SELECT c.ancestor_id AS orgunit_id, m.period, SUM(m.total) AS total
+    --   FROM indicators_matview m
+    --   JOIN orgunit_closure c ON c.descendant_id = m.orgunit_id
+    --   WHERE c.ancestor_id = '<district_id>'
+    --   GROUP BY c.ancestor_id, m.period;
 
 
     CREATE MATERIALIZED VIEW indicators_matview AS
@@ -9,7 +9,7 @@ from utils.auth import (
     create_access_token,
     create_refresh_token_and_hashed,
     db_save_refresh_token,
-    check_rate_limit,
+    refresh_rate_limiter,
     db_get_refresh_token_by_hashed,
     db_revoke_refresh_token,
     require_auth,
@@ -107,8 +107,9 @@ def refresh():
       - Or cookie "refresh_token" (HttpOnly)
     """
     client_id = request.remote_addr or "unknown"
-    if not check_rate_limit(client_id):
-        return jsonify({"error": "Too many attempts"}), 429
+    allowed, retry_after = refresh_rate_limiter.hit(client_id)
+    if not allowed:
+        return jsonify({"error": "Too many attempts"}), 429, {"Retry-After": str(retry_after)}
 
     data = request.get_json(silent=True) or {}
     incoming = data.get("refresh_token") or request.cookies.get("refresh_token")
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify
 from utils.auth import require_auth
 from clients.postgres_client import PostgresClient
+from utils.replicas import get_read_connection
 
 from utils.logger import get_logger
 logger = get_logger(__name__)
@@ -16,10 +17,14 @@ def fetch_orgunits():
     """
     Retourne la liste des objets à synchroniser.
     """
+    conn = None
     try:
         pg = PostgresClient() 
-        result = pg.list_orgunits()
+        conn = get_read_connection()
+        result = pg.list_orgunits(conn=conn)
         return jsonify(result), 200
     except Exception as e:
         logger.exception("Failed to fetch data")
-        return jsonify({"error": "Failed to fetch data"}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to fetch data"}), 500
+    finally:
+        if conn: conn.close()
\ No newline at end of file
@@ -0,0 +1,40 @@
+# backend/routes/jobs_routes.py
+from flask import Blueprint, request, jsonify, g
+from utils.auth import require_auth
+from utils.background_jobs import JobError, get_job, list_jobs
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/api/jobs")
+
+
+@jobs_bp.route("/", methods=["GET"])
+@require_auth
+def get_jobs():
+    """Jobs d'arrière-plan (les siens ; tous pour un admin). Filtre : ?kind=sync_teis"""
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 200)
+    except ValueError:
+        return jsonify({"error": "limit doit être un entier"}), 400
+    try:
+        return jsonify(list_jobs(g.current_user, request.args.get("kind"), limit)), 200
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status
+
+
+@jobs_bp.route("/<job_id>", methods=["GET"])
+@require_auth
+def get_job_status(job_id):
+    """
+    État du job : status, progress (total, done, failed, rows), result et http_status une fois terminé.
+    Suivi de la progression : ?after=<seq> ajoute les événements suivants (status, total, orgunit, done),
+    `last_seq` à repasser au prochain appel et `poll_after_ms` tant qu'il faut revenir.
+    """
+    after = request.args.get("after")
+    if after is not None and not after.isdigit():
+        return jsonify({"error": "after doit être un entier positif"}), 400
+    try:
+        return jsonify(get_job(job_id, g.current_user, int(after) if after is not None else None)), 200
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status
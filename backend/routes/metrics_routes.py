@@ -0,0 +1,42 @@
+import hmac
+
+from flask import Blueprint, Response, jsonify, request
+from utils.auth import require_auth
+from utils.admission import admission_status
+from utils.config import config
+from utils.metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+
+metrics_bp = Blueprint("metrics", __name__, url_prefix="/api")
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Métriques au format texte Prometheus.
+    Protégé par METRICS_TOKEN (Bearer) s'il est défini, pour un scrape sans JWT utilisateur.
+    """
+    if not config.METRICS_ENABLED:
+        return jsonify({"msg": "metrics disabled"}), 404
+
+    if config.METRICS_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        token = auth.split(" ", 1)[1] if auth.startswith("Bearer ") else ""
+        if not hmac.compare_digest(token, config.METRICS_TOKEN):
+            return jsonify({"msg": "unauthorized"}), 401
+
+    try:
+        return Response(REGISTRY.render(), status=200, mimetype=None, content_type=PROMETHEUS_CONTENT_TYPE)
+    except Exception:
+        logger.exception("Failed to render metrics")
+        return jsonify({"error": "Failed to render metrics"}), 500
+
+
+@metrics_bp.route("/admission", methods=["GET"])
+@require_auth(roles=["admin", "superadmin"])
+def admission():
+    """ État du contrôle d'admission de ce worker : requêtes en cours / en attente par classe. """
+    return jsonify({"enabled": config.ADMISSION_ENABLED, "classes": admission_status()}), 200
@@ -0,0 +1,80 @@
+from flask import Blueprint, Response, jsonify, request
+from utils.auth import require_auth
+from utils.config import config
+from utils.profiler import PROFILES, ADMIN_ROLES
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+
+profiler_bp = Blueprint("profiler", __name__, url_prefix="/api/profiler")
+
+DEFAULT_DURATION_SECONDS = 60
+
+
+def _disabled():
+    return jsonify({"error": "Profiler disabled (PROFILER_ENABLED=false)"}), 404
+
+
+@profiler_bp.post("/start")
+@require_auth(roles=list(ADMIN_ROLES))
+def start_profile():
+    """
+    Échantillonne toutes les threads du processus pendant `duration` secondes (arrêt automatique).
+    Le profil est servi par n'importe quel worker une fois terminé (PROFILE_DIR).
+    """
+    if not config.PROFILER_ENABLED:
+        return _disabled()
+    payload = request.get_json(silent=True) or {}
+    try:
+        duration = float(payload.get("duration", DEFAULT_DURATION_SECONDS))
+        interval_ms = float(payload.get("interval_ms", config.PROFILE_INTERVAL_MS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "duration et interval_ms doivent être numériques"}), 400
+    if duration <= 0 or interval_ms < 1:
+        return jsonify({"error": "duration > 0 et interval_ms >= 1 requis"}), 400
+    try:
+        profiler = PROFILES.start(payload.get("name") or "process", interval=interval_ms / 1000, max_duration=duration)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"id": profiler.id, "duration_s": profiler.max_duration, "interval_ms": interval_ms}), 202
+
+
+@profiler_bp.post("/stop/<profile_id>")
+@require_auth(roles=list(ADMIN_ROLES))
+def stop_profile(profile_id):
+    """ Arrêt anticipé (uniquement sur le processus qui échantillonne). """
+    profiler = PROFILES.stop(profile_id)
+    if profiler is None:
+        return jsonify({"error": "profile not running in this process"}), 404
+    return jsonify(profiler.summary()), 200
+
+
+@profiler_bp.post("/jobs/<job_id>")
+@require_auth(roles=list(ADMIN_ROLES))
+def arm_job_profile(job_id):
+    """ Profile la prochaine exécution du job APScheduler `job_id` (à appeler sur le processus scheduler). """
+    if not config.PROFILER_ENABLED:
+        return _disabled()
+    payload = request.get_json(silent=True) or {}
+    PROFILES.arm_job(job_id, payload.get("max_duration"))
+    return jsonify({"job_id": job_id, "armed": True}), 200
+
+
+@profiler_bp.get("/profiles")
+@require_auth(roles=list(ADMIN_ROLES))
+def list_profiles():
+    return jsonify(PROFILES.list()), 200
+
+
+@profiler_bp.get("/profiles/<profile_id>")
+@require_auth(roles=list(ADMIN_ROLES))
+def get_profile(profile_id):
+    """ format=json (résumé, fonctions les plus chaudes) | collapsed (piles pour flamegraph.pl / speedscope). """
+    fmt = request.args.get("format", "json")
+    content = PROFILES.read(profile_id, fmt)
+    if content is None:
+        return jsonify({"error": "profile not found"}), 404
+    if fmt == "collapsed":
+        return Response(content, mimetype="text/plain", headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed"'})
+    return Response(content, mimetype="application/json")
@@ -1,7 +1,18 @@
 # backend/query_routes.py
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, request, jsonify, g
 from utils.auth import require_auth
+from utils.admission import admit
 from utils.db import get_connection
+from utils.replicas import get_read_connection, mark_write
+from utils.saved_queries import (
+    ensure_saved_queries_schema,
+    compile_query,
+    validate_params_spec,
+    execute_saved_query,
+    get_snapshot,
+    refresh_snapshots,
+)
 import psycopg2
 import psycopg2.extras
 from datetime import datetime, date
@@ -10,21 +21,15 @@ from uuid import UUID
 
 query_bp = Blueprint("query", __name__, url_prefix="/api/query")
 
+ADMIN_ROLES = ("admin", "superadmin")
+QUERY_COLUMNS = "id, name, sql, params, prepared, snapshot, created_at, updated_at"
+
 # --------------------------
 # Ensure Table Exists
 # --------------------------
 def ensure_table_exists(conn):
-    with conn.cursor() as cur:
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS saved_queries (
-                id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
-                name TEXT NOT NULL,
-                sql TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT NOW(),
-                updated_at TIMESTAMP DEFAULT NOW()
-            );
-        """)
-        conn.commit()
+    """ Schéma vérifié une seule fois par processus (au démarrage, cf. server.create_app). """
+    ensure_saved_queries_schema(conn)
 
 # Sérialisation universelle
 def jsonify_value(val):
@@ -38,6 +43,25 @@ def jsonify_value(val):
         return val.decode("utf-8", errors="ignore")
     return val
 
+def _current_role():
+    return (g.get("current_user") or {}).get("role")
+
+def _query_options(payload, current=None):
+    """ params / prepared / snapshot du payload (valeurs actuelles par défaut) ; retourne (options, (erreur, statut)). """
+    current = current or {}
+    params, error = validate_params_spec(payload.get("params", current.get("params")))
+    if error:
+        return None, (error, 400)
+    snapshot = bool(payload.get("snapshot", current.get("snapshot", False)))
+    if snapshot and not current.get("snapshot") and _current_role() not in ADMIN_ROLES:
+        return None, ("Only admin can enable snapshots", 403)
+    return {"params": params, "prepared": bool(payload.get("prepared", current.get("prepared", False))), "snapshot": snapshot}, None
+
+def _fetch_query(conn, query_id):
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute(f"SELECT {QUERY_COLUMNS} FROM saved_queries WHERE id = %s;", (query_id,))
+        return cur.fetchone()
+
 # --------------------------
 # List Queries
 # --------------------------
@@ -45,14 +69,14 @@ def jsonify_value(val):
 @require_auth
 def get_queries():
     """Récupère toutes les requêtes sauvegardées"""
-    conn = get_connection()
-    ensure_table_exists(conn)
+    ensure_table_exists(None)
+    conn = get_read_connection()
 
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("""
-                SELECT id, name, sql, created_at, updated_at 
-                FROM saved_queries 
+            cur.execute(f"""
+                SELECT {QUERY_COLUMNS}
+                FROM saved_queries
                 ORDER BY updated_at DESC;
             """)
             data = [dict(row) for row in cur.fetchall()]
@@ -74,21 +98,25 @@ def save_query():
     if not name or not sql_text:
         return jsonify({"error": "Name and query are required"}), 400
 
+    options, error = _query_options(payload)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
     conn = get_connection()
-    # --- Auto-create table if not exists ---
     ensure_table_exists(conn)
-    
+
     try:
         with conn.cursor() as cur:
             # --- Insert new query ---
             cur.execute(
-                "INSERT INTO saved_queries (name, sql) VALUES (%s, %s) RETURNING id;",
-                (name, sql_text)
+                "INSERT INTO saved_queries (name, sql, params, prepared, snapshot) VALUES (%s, %s, %s, %s, %s) RETURNING id;",
+                (name, sql_text, json.dumps(options["params"]), options["prepared"], options["snapshot"])
             )
             saved_id = cur.fetchone()[0]
             conn.commit()
+        mark_write()
 
-        return jsonify({ "id": saved_id, "message": "Query saved successfully" })
+        return jsonify({ "id": saved_id, "placeholders": list(compile_query(sql_text).names), "message": "Query saved successfully" })
     except Exception as e:
         if conn:
             conn.rollback()
@@ -102,18 +130,16 @@ def save_query():
 @query_bp.route("/<int:query_id>", methods=["GET"])
 @require_auth
 def get_query(query_id):
-    conn = get_connection()
-    ensure_table_exists(conn)
+    ensure_table_exists(None)
+    conn = get_read_connection()
 
     try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, name, sql FROM saved_queries WHERE id = %s;", (query_id,))
-            row = cur.fetchone()
-
+        row = _fetch_query(conn, query_id)
         if not row:
             return jsonify({"error": "Not found"}), 404
 
-        return jsonify({"id": row[0], "name": row[1], "sql": row[2]}), 200
+        row["placeholders"] = list(compile_query(row["sql"]).names)
+        return jsonify(row), 200
     except Exception as e:
         if conn: conn.rollback()
         return jsonify({"error": str(e)}), 500
@@ -124,7 +150,7 @@ def get_query(query_id):
 @query_bp.route("/<int:query_id>", methods=["PUT"])
 @require_auth
 def update_query(query_id):
-    """Met à jour une requête existante"""
+    """Met à jour une requête existante (le snapshot éventuel est invalidé si le SQL change)"""
     payload = request.get_json() or {}
     query_name = payload.get("name")
     query_sql = payload.get("sql")
@@ -136,17 +162,28 @@ def update_query(query_id):
     ensure_table_exists(conn)
 
     try:
+        current = _fetch_query(conn, query_id)
+        if not current:
+            return jsonify({"error": "Query not found"}), 404
+
+        options, error = _query_options(payload, current)
+        if error:
+            return jsonify({"error": error[0]}), error[1]
+
         with conn.cursor() as cur:
             cur.execute("""
-                UPDATE saved_queries 
-                SET name=%s, sql=%s, updated_at=NOW() 
+                UPDATE saved_queries
+                SET name=%s, sql=%s, params=%s, prepared=%s, snapshot=%s, updated_at=NOW()
                 WHERE id=%s RETURNING id;""",
-                (query_name, query_sql, query_id)
+                (query_name, query_sql, json.dumps(options["params"]), options["prepared"], options["snapshot"], query_id)
             )
             if cur.rowcount == 0:
                 return jsonify({"error": "Query not found"}), 404
+            if query_sql != current["sql"] or not options["snapshot"]:
+                cur.execute("DELETE FROM saved_query_snapshots WHERE query_id=%s;", (query_id,))
             conn.commit()
-        return jsonify({"id": query_id, "message": "Query updated successfully"}), 200
+        mark_write()
+        return jsonify({"id": query_id, "placeholders": list(compile_query(query_sql).names), "message": "Query updated successfully"}), 200
     except Exception as e:
         if conn: conn.rollback()
         return jsonify({"error": str(e)}), 500
@@ -166,9 +203,88 @@ def delete_query(query_id):
             if cur.rowcount == 0:
                 return jsonify({"error": "Query not found"}), 404
             conn.commit()
+        mark_write()
         return jsonify({"message": "Query deleted successfully"})
     except Exception as e:
         if conn: conn.rollback()
         return jsonify({"error": str(e)}), 500
     finally:
         if conn: conn.close()
+
+
+# --------------------------
+# Run / Snapshots
+# --------------------------
+@query_bp.route("/<int:query_id>/run", methods=["POST"])
+@require_auth
+@admit("sql")
+def run_query(query_id):
+    """
+    Exécute une requête sauvegardée.
+    POST payload: { "params": {"period": "202401"}, "max_rows": 1000, "prepared": true }
+    Les garde-fous de /api/sql/execute sont évalués une fois par version du SQL (compile_query).
+    """
+    from routes.run_sql_routes import MAX_ALLOWED_ROWS, DEFAULT_NON_ADMIN_MAX_ROWS
+
+    payload = request.get_json(silent=True) or {}
+    values = payload.get("params") or {}
+    if not isinstance(values, dict):
+        return jsonify({"error": "params must be an object"}), 400
+
+    role = _current_role()
+    max_rows = payload.get("max_rows")
+    if isinstance(max_rows, str) and max_rows.isdigit():
+        max_rows = int(max_rows)
+    if not isinstance(max_rows, int) or max_rows <= 0:
+        max_rows = DEFAULT_NON_ADMIN_MAX_ROWS
+    if max_rows > MAX_ALLOWED_ROWS:
+        return jsonify({"error": f"max_rows too large (>{MAX_ALLOWED_ROWS})", "hint": "Use pagination"}), 400
+
+    ensure_table_exists(None)
+    conn = get_read_connection()
+    try:
+        query = _fetch_query(conn, query_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn: conn.close()
+    if not query:
+        return jsonify({"error": "Query not found"}), 404
+
+    compiled = compile_query(query["sql"])
+    if role != "superadmin" and compiled.denied:
+        return jsonify({"error": compiled.denied}), 403
+
+    result, status = execute_saved_query(
+        query, values,
+        read_only=role not in ADMIN_ROLES,
+        max_rows=max_rows,
+        prepared=bool(payload.get("prepared", query["prepared"])),
+        role=role,
+    )
+    return jsonify(result), status
+
+
+@query_bp.route("/<int:query_id>/snapshot", methods=["GET"])
+@require_auth
+def get_query_snapshot(query_id):
+    """Dernier résultat précalculé (rafraîchi après chaque refresh de la vue matérialisée)."""
+    ensure_table_exists(None)
+    try:
+        snapshot = get_snapshot(query_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if not snapshot:
+        return jsonify({"error": "No snapshot for this query"}), 404
+    return jsonify(snapshot), 200
+
+
+@query_bp.route("/snapshots/refresh", methods=["POST"])
+@require_auth(roles=list(ADMIN_ROLES))
+def refresh_query_snapshots():
+    """Rafraîchit les snapshots (toutes les requêtes `snapshot`, ou { "ids": [1, 2] })."""
+    payload = request.get_json(silent=True) or {}
+    ids = payload.get("ids")
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        return jsonify({"error": "ids must be a list of integers"}), 400
+    return jsonify(refresh_snapshots(ids)), 200
@@ -1,5 +1,4 @@
 # backend/sql_routes.py
-import re
 import json
 import time
 import logging
@@ -9,10 +8,16 @@ import psycopg2.extras
 from uuid import UUID
 from decimal import Decimal
 from datetime import datetime, date
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from utils.auth import require_auth
+from utils.admission import admit
 from utils.models import User
 from utils.db import get_connection
+from utils.replicas import get_read_connection, mark_write
+from utils.metrics import SQL_EXECUTE_SECONDS
+from utils.sql_analyzer import analyze_sql, normalize_statement
+from utils.sql_cost_guard import check_cost
+from utils.sql_cursors import CursorError, CURSOR_QUERY_KEYWORDS, open_cursor, fetch_next, close_cursor
 
 logger = logging.getLogger("sql_routes")
 
@@ -29,14 +34,10 @@ BLOCKED_SQL = [
 ]
 
 # Tables totalement exclues pour tout le monde sauf superadmin
-EXCLUDES_TABLE = ["users", "refresh_tokens", "saved_queries"]
+EXCLUDES_TABLE = ["users", "refresh_tokens", "saved_queries", "saved_query_snapshots", "sql_jobs", "sql_job_rows",
+                  "background_jobs", "background_job_events"]
 
-# Regex pour détecter référence à tables protégées (schema.table, "quoted", simple)
-# On match : optional schema + dot + table, or quoted table with optional schema
-EXCLUDES_PATTERN = re.compile(
-    r'(?:\b\w+\.)?(?:"(?:' + r'|"|'.join(re.escape(t) for t in EXCLUDES_TABLE) + r')"|(?:' + r'|'.join(re.escape(t) for t in EXCLUDES_TABLE) + r'))\b',
-    re.IGNORECASE
-)
+EXCLUDES_TABLE_SET = frozenset(t.lower() for t in EXCLUDES_TABLE)
 
 # Mots-clés dangereux à rechercher au début de la requête
 DANGEROUS_KEYWORDS = [
@@ -44,23 +45,6 @@ DANGEROUS_KEYWORDS = [
     "VACUUM", "ANALYZE", "REFRESH"
 ]
 
-# Multi-statement detection (improved: semicolons outside quotes)
-MULTI_STATEMENT_SEMICOLON_RE = re.compile(r";\s*(SELECT|INSERT|UPDATE|DELETE|DROP|ALTER|TRUNCATE)", re.IGNORECASE)  # re.compile(r";")
-
-# Helper patterns
-_LEADING_WORD_RE = re.compile(r"^\s*(?P<first>\w+)", re.IGNORECASE)
-
-# # Mots-clés SQL à surveiller (toutes les opérations)
-EXCLUDES_PATTERN_DANGEROUS_KEYWORDS = [
-    "from", "join", "update", "insert", "delete", "drop", "truncate", "refresh",
-    "alter", "into", "table", "grant", "revoke", "create", "vacuum", "analyse"
-]
-
-KEYWORDS_REGEX = re.compile(
-    r"\b(" + "|".join(re.escape(t) for t in EXCLUDES_PATTERN_DANGEROUS_KEYWORDS) + r")\b",
-    re.IGNORECASE
-)
-
 
 # ------------------ SERIALIZATION ------------------
 def jsonify_value(val):
@@ -80,68 +64,63 @@ def jsonify_value(val):
     return val
 
 # ------------------ SQL CLEANING & ANALYSIS ------------------
-def remove_sql_comments(sql: str) -> str:
-    """
-    Remove -- comments and /* */ comments.
-    Not perfect for nested, but covers most practical attacks.
-    """
-    # Remove block comments first
-    sql_no_block = re.sub(r"/\*.*?\*/", " ", sql, flags=re.S)
-    # Remove line comments
-    sql_no_lines = re.sub(r"--.*?$", " ", sql_no_block, flags=re.M)
-    return sql_no_lines
-
-def normalize_sql(sql: str) -> str:
-    """Lowercase + collapse whitespace for easier lexical checks (but keep original case for execution)."""
-    cleaned = remove_sql_comments(sql)
-    return " ".join(cleaned.strip().split())
-
 def get_first_keyword(sql: str) -> str | None:
     """Return first token/word of the SQL (SELECT, INSERT, etc.)"""
-    m = _LEADING_WORD_RE.search(remove_sql_comments(sql))
-    return m.group("first").upper() if m else None
+    return analyze_sql(sql).first_keyword or None
 
 def contains_excluded_table(sql: str) -> bool:
     """
-    Detect if SQL touches an excluded table.
-    Uses a robust regex that matches schema.table, quoted, and simple occurrences.
+    Detect if SQL touches an excluded table: any identifier (bare, quoted or schema-qualified part)
+    or any word inside a string literal (query_to_xml('select ... from users'), ...).
     """
     if not sql:
         return False
-    
-    sql = " ".join(sql.lower().split())  # supprime les doubles espaces, \n, \t
-    tokens = sql.split()
-    for i, token in enumerate(tokens):
-        if KEYWORDS_REGEX.match(token):
-            if i + 1 < len(tokens):
-                next_token = tokens[i + 1].replace('"', '').replace("'", "")
-                if EXCLUDES_PATTERN.search(next_token):
-                    return True
-        if EXCLUDES_PATTERN.search(sql):
-            return True
-
-    cleaned = remove_sql_comments(sql)
-    return bool(EXCLUDES_PATTERN.search(cleaned))
+    analysis = analyze_sql(sql)
+    return not (EXCLUDES_TABLE_SET.isdisjoint(analysis.identifiers) and EXCLUDES_TABLE_SET.isdisjoint(analysis.literal_words))
 
 def contains_blocked_keyword(sql: str) -> str | None:
     """Return the blocked keyword found (exact) or None"""
-    upper = normalize_sql(sql).upper()
-    for kw in DANGEROUS_KEYWORDS:
-        # word boundary
-        if re.search(r"\b" + re.escape(kw) + r"\b", upper):
-            return kw
-    return None
+    analysis = analyze_sql(sql)
+    return next((kw for kw in DANGEROUS_KEYWORDS if kw in analysis.keywords or kw.lower() in analysis.literal_words), None)
 
 def has_multiple_statements(sql: str) -> bool:
+    """More than one non-empty statement (semicolons inside strings, identifiers and comments are ignored)."""
+    return analyze_sql(sql).statement_count > 1
+
+
+def check_sql_permissions(sql_text: str, role: str) -> str | None:
     """
-    Heuristic: detect semicolons that act as statement separators.
-    We reject if there's more than one non-empty statement.
-    This avoids naive ';' in strings by a simple heuristic: count semicolons after removing quoted strings.
+    Garde-fous par rôle de /api/sql/execute (et des requêtes sauvegardées), sur une seule analyse lexicale.
+    Retourne None si la requête est autorisée, sinon le message d'erreur (403).
     """
-    # remove single and double quoted strings to avoid semicolons inside them
-    tmp = re.sub(r"'.*?'|\".*?\"", " ", sql, flags=re.S)
-    semi_count = tmp.count(";")
-    return semi_count > 0  # any semicolon treated as multi-statement; conservative
+    is_admin = role in ("admin", "superadmin")
+    is_superadmin = role == "superadmin"
+    analysis = analyze_sql(sql_text)
+
+    # Commentaire / chaîne non fermé : découpage incertain, refusé pour tous les rôles
+    if analysis.unterminated:
+        return "Unterminated comment, string or quoted identifier"
+
+    # Block multi-statements for non-admin; even admins can be restricted if you prefer
+    if analysis.statement_count > 1 and not is_admin:
+        return "Multiple statements are not allowed"
+
+    if is_superadmin:
+        return None
+
+    # Block dangerous keywords presence for non-superadmin
+    blocked_kw = next((kw for kw in DANGEROUS_KEYWORDS if kw in analysis.keywords or kw.lower() in analysis.literal_words), None)
+    if blocked_kw:
+        return f"Command '{blocked_kw}' is not allowed for your role"
+
+    # If non-admin: only allow SELECT or EXPLAIN (explain handled separately)
+    if analysis.first_keyword not in ("SELECT", "WITH", "EXPLAIN"):
+        return "Only SELECT/EXPLAIN queries are allowed for your role"
+
+    # Disallow any reference to excluded tables
+    if not (EXCLUDES_TABLE_SET.isdisjoint(analysis.identifiers) and EXCLUDES_TABLE_SET.isdisjoint(analysis.literal_words)):
+        return "Operation on a protected table is not allowed"
+    return None
 
 
 # ------------------ EXECUTION ------------------
@@ -150,6 +129,13 @@ def start_execute_sql(conn, sql_text, max_rows=None, explain: bool = False, read
     Execute a SQL and return (result_dict, status_code).
     Uses statement_timeout and, for read_only, sets transaction read-only.
     """
+    start_ts = time.perf_counter()
+    result, status = _start_execute_sql(conn, sql_text, max_rows=max_rows, explain=explain, read_only=read_only)
+    SQL_EXECUTE_SECONDS.observe(time.perf_counter() - start_ts, mode="explain" if explain else "statement", status=str(status))
+    return (result, status)
+
+
+def _start_execute_sql(conn, sql_text, max_rows=None, explain: bool = False, read_only: bool = False):
     if not conn:
         return ({"error": "PostgreSQL connection failed"}, 500)
 
@@ -255,20 +241,77 @@ def start_execute_sql(conn, sql_text, max_rows=None, explain: bool = False, read
 
 
 
+def start_cursor_sql(conn, sql_text, page_size, read_only: bool = False):
+    """
+    Open a server-side cursor session and return (first page, status_code).
+    The connection is owned by the session (closed on eviction / exhaustion).
+    """
+    start_ts = time.perf_counter()
+    try:
+        result, _ = open_cursor(conn, sql_text, g.current_user.get("username"), page_size=min(page_size, MAX_ALLOWED_ROWS),
+                                read_only=read_only, timeout_ms=STATEMENT_TIMEOUT_MS)
+        result["message"] = "Query executed successfully"
+        status = 200
+    except CursorError as e:
+        result, status = dict({"error": str(e)}, **e.details), e.status
+    except psycopg2.errors.QueryCanceled as e:
+        result, status = {"error": "Query timeout", "details": str(e), "timeout_ms": STATEMENT_TIMEOUT_MS}, 408
+    except psycopg2.Error as e:
+        result, status = {"error": "Database error", "details": getattr(e, "pgerror", None) or str(e)}, 400
+    duration = time.perf_counter() - start_ts
+    result["timing_ms"] = round(duration * 1000, 2)
+    SQL_EXECUTE_SECONDS.observe(duration, mode="cursor", status=str(status))
+    return (result, status)
+
+
+def paged_sql(sql_text, offset: int, limit: int) -> str:
+    """
+    Stateless page of a read query: re-executed for each page, so any gunicorn worker can serve it.
+    Pages are only stable if the query has an ORDER BY.
+    """
+    return f"SELECT * FROM (\n{normalize_statement(sql_text)}\n) AS _page OFFSET {int(offset)} LIMIT {int(limit)}"
+
+
+def start_paged_sql(conn, sql_text, offset: int, page_size: int, read_only: bool = False):
+    """ One page (offset, page_size) + {"page": {"offset", "has_more"}} ; one extra row tells if more remain. """
+    page_size = min(page_size, MAX_ALLOWED_ROWS - 1)
+    result, status = start_execute_sql(conn, paged_sql(sql_text, offset, page_size + 1), max_rows=page_size + 1, read_only=read_only)
+    if status == 200:
+        has_more = len(result["rows"]) > page_size
+        result["rows"] = result["rows"][:page_size]
+        result["rowcount"] = len(result["rows"])
+        result["page"] = {"offset": offset, "has_more": has_more}
+    return (result, status)
+
+
+def _cursor_error_response(e: CursorError):
+    response = jsonify(dict({"error": str(e)}, **e.details))
+    if e.details.get("retry_after"):
+        response.headers["Retry-After"] = str(e.details["retry_after"])
+    return response, e.status
+
+
 # ------------------ ROUTE ------------------
 run_sql_bp = Blueprint("sql", __name__, url_prefix="/api/sql")
 
 @run_sql_bp.route("/execute", methods=["POST"])
 @require_auth
+@admit("sql")
 def execute_sql():
     """
-    POST payload: { "sql": "...", "user_id": 1, "max_rows": 1000, "explain": false }
+    POST payload: { "sql": "...", "user_id": 1, "max_rows": 1000, "explain": false, "cursor": false, "offset": null }
+    With "offset": n (single read statement), max_rows is the page size and the response carries
+    "page": { "offset", "has_more" }; the next page is another request with offset + rows.
+    With "cursor": true, the remaining rows are read with GET /api/sql/cursor/<id>/next?n=
+    (server-side cursor, no re-execution, but held by the worker that opened it).
     """
     payload = request.get_json() or {}
     sql_text = payload.get("sql")
     user_id = payload.get("user_id")
     max_rows = payload.get("max_rows", None)
     explain = bool(payload.get("explain", False))
+    use_cursor = bool(payload.get("cursor", False))
+    offset = payload.get("offset", None)
 
     # basic validation
     if "sql" not in payload:
@@ -284,31 +327,11 @@ def execute_sql():
         return jsonify({"error": "User not found / unauthorized"}), 401
 
     is_admin = user.role in ("admin", "superadmin")
-    is_superadmin = user.role == "superadmin"
-
-    # Normalize and inspect SQL
-    normalized = normalize_sql(sql_text)
     first_kw = get_first_keyword(sql_text) or ""
 
-    # Block multi-statements for non-admin; even admins can be restricted if you prefer
-    if has_multiple_statements(sql_text) and not is_admin:
-        return jsonify({"error": "Multiple statements are not allowed"}), 403
-
-    # Block dangerous keywords presence for non-superadmin
-    if not is_superadmin:
-        blocked_kw = contains_blocked_keyword(sql_text)
-        if blocked_kw:
-            return jsonify({"error": f"Command '{blocked_kw}' is not allowed for your role"}), 403
-
-    # If non-admin: only allow SELECT or EXPLAIN (explain handled separately)
-    if not is_superadmin:
-        first = first_kw.strip().upper()
-        if first not in ("SELECT", "WITH", "EXPLAIN"):
-            return jsonify({"error": "Only SELECT/EXPLAIN queries are allowed for your role"}), 403
-
-        # Disallow any reference to excluded tables
-        if contains_excluded_table(sql_text):
-            return jsonify({"error": "Operation on a protected table is not allowed"}), 403
+    denied = check_sql_permissions(sql_text, user.role)
+    if denied:
+        return jsonify({"error": denied}), 403
 
     # Validate max_rows param
     if isinstance(max_rows, str) and max_rows.isdigit():
@@ -318,27 +341,54 @@ def execute_sql():
     else:
         max_rows = None
 
+    if offset is not None and (isinstance(offset, bool) or not isinstance(offset, int) or offset < 0):
+        return jsonify({"error": "offset must be a non-negative integer"}), 400
+
     # safety upper bound
     if max_rows is not None and max_rows > MAX_ALLOWED_ROWS:
         return jsonify({"error": f"max_rows too large (>{MAX_ALLOWED_ROWS})", "hint": "Use pagination"}), 400
 
-    # Connect to database
+    # For non-admins, enforce read_only and a safe fetch limit
+    read_only = not is_admin
+
+    # Connect to database: read-only work may go to a replica
     conn = None
     try:
-        conn = get_connection()
+        conn = get_read_connection() if read_only else get_connection()
     except Exception as e:
         logger.exception("DB connection failed")
         return jsonify({"error": "DB connection error", "details": str(e)}), 500
 
-    # For non-admins, enforce read_only and a safe fetch limit
-    read_only = not is_admin
-
     # If non-admin and no max_rows provided, we will use safe default
     if read_only and (max_rows is None):
         max_rows = DEFAULT_NON_ADMIN_MAX_ROWS
 
+    # Admission: estimated cost / rows (EXPLAIN without ANALYZE) against the role limits.
+    # A user-written EXPLAIN is only planned, never executed: no need to check it.
+    plan = None
+    if conn and first_kw != "EXPLAIN" and analyze_sql(sql_text).statement_count == 1:
+        plan, rejected = check_cost(conn, sql_text, user.role)
+        if rejected:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            body, status = rejected
+            logger.info("SQL_EXEC user_id=%s role=%s first_kw=%s status=%s (cost guard)", user_id, user.role, first_kw, status)
+            return jsonify(body), status
+
     # Execute and return result
-    result, status = start_execute_sql(conn, sql_text, max_rows=max_rows, explain=explain, read_only=read_only)
+    pageable = conn and not explain and first_kw in CURSOR_QUERY_KEYWORDS and analyze_sql(sql_text).statement_count == 1
+    if pageable and use_cursor and not offset:
+        result, status = start_cursor_sql(conn, sql_text, page_size=max_rows or DEFAULT_NON_ADMIN_MAX_ROWS, read_only=read_only)
+    elif pageable and offset is not None:
+        result, status = start_paged_sql(conn, sql_text, offset, page_size=max_rows or DEFAULT_NON_ADMIN_MAX_ROWS, read_only=read_only)
+    else:
+        result, status = start_execute_sql(conn, sql_text, max_rows=max_rows, explain=explain, read_only=read_only)
+    if not read_only and status == 200 and first_kw not in CURSOR_QUERY_KEYWORDS:
+        mark_write()  # les lectures suivantes du client attendent un réplica ayant rejoué cette écriture
+    if plan is not None and status == 200:
+        result["plan"] = plan
 
     # Audit logging (do NOT log full SQL in prod or strip secrets)
     try:
@@ -348,3 +398,39 @@ def execute_sql():
         pass
 
     return jsonify(result), status
+
+
+@run_sql_bp.route("/cursor/<cursor_id>/next", methods=["GET"])
+@require_auth
+@admit("sql")
+def cursor_next(cursor_id):
+    """
+    Next page of a cursor session opened by /execute with "cursor": true.
+    GET /api/sql/cursor/<id>/next?n=1000  ->  { "columns", "rows", "rowcount", "cursor": { "has_more", ... } }
+    """
+    n = request.args.get("n", "")
+    n = int(n) if n.isdigit() and int(n) > 0 else DEFAULT_NON_ADMIN_MAX_ROWS
+    if n > MAX_ALLOWED_ROWS:
+        return jsonify({"error": f"n too large (>{MAX_ALLOWED_ROWS})"}), 400
+
+    start_ts = time.perf_counter()
+    try:
+        result, status = fetch_next(cursor_id, g.current_user.get("username"), n), 200
+    except CursorError as e:
+        SQL_EXECUTE_SECONDS.observe(time.perf_counter() - start_ts, mode="cursor_next", status=str(e.status))
+        return _cursor_error_response(e)
+    duration = time.perf_counter() - start_ts
+    SQL_EXECUTE_SECONDS.observe(duration, mode="cursor_next", status=str(status))
+    result["timing_ms"] = round(duration * 1000, 2)
+    return jsonify(result), status
+
+
+@run_sql_bp.route("/cursor/<cursor_id>", methods=["DELETE"])
+@require_auth
+def cursor_close(cursor_id):
+    """Close a cursor session before its TTL (releases its connection)."""
+    try:
+        close_cursor(cursor_id, g.current_user.get("username"))
+    except CursorError as e:
+        return _cursor_error_response(e)
+    return jsonify({"message": "Cursor closed"}), 200
@@ -1,7 +1,7 @@
 # backend/sql_routes.py
 from flask import Blueprint, jsonify
 from utils.auth import require_auth
-from utils.db import get_connection
+from utils.replicas import get_read_connection
 import psycopg2.extras
 
 
@@ -14,7 +14,7 @@ schema_bp = Blueprint("schema", __name__, url_prefix="/api/schema")
 def get_schema_info():
     conn = None
     try:
-        conn = get_connection()
+        conn = get_read_connection()
         if not conn:
             return jsonify({"error": "PostgreSQL connection failed"}), 500
 
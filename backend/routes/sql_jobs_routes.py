@@ -0,0 +1,98 @@
+# backend/routes/sql_jobs_routes.py
+from flask import Blueprint, request, jsonify, g
+from utils.auth import require_auth
+from utils.sql_jobs import JobError, submit_job, get_job, list_jobs, get_results, cancel_job, delete_job
+
+sql_jobs_bp = Blueprint("sql_jobs", __name__, url_prefix="/api/sql/jobs")
+
+MAX_PAGE_SIZE = 5000
+DEFAULT_PAGE_SIZE = 1000
+
+
+def _int_arg(name, default):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    if not value.isdigit():
+        raise JobError(f"{name} must be a non-negative integer", 400)
+    return int(value)
+
+
+@sql_jobs_bp.route("/", methods=["POST"])
+@require_auth
+def create_job():
+    """
+    Soumet une requête longue en arrière-plan.
+    POST payload: { "sql": "SELECT ...", "max_rows": 100000 }
+    Réponse 202 : { "id": "...", "status": "queued" } ; suivre via GET /api/sql/jobs/<id>.
+    """
+    payload = request.get_json(silent=True) or {}
+    sql_text = (payload.get("sql") or "").strip()
+    if not sql_text:
+        return jsonify({"error": "SQL query is required"}), 400
+    max_rows = payload.get("max_rows")
+    if max_rows is not None and (not isinstance(max_rows, int) or max_rows <= 0):
+        return jsonify({"error": "max_rows must be a positive integer"}), 400
+    try:
+        return jsonify(submit_job(sql_text, g.current_user, max_rows)), 202
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status
+
+
+@sql_jobs_bp.route("/", methods=["GET"])
+@require_auth
+def get_jobs():
+    """Jobs de l'utilisateur courant, du plus récent au plus ancien."""
+    try:
+        limit = min(_int_arg("limit", 50), 200)
+        return jsonify(list_jobs(g.current_user, limit)), 200
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status
+
+
+@sql_jobs_bp.route("/<job_id>", methods=["GET"])
+@require_auth
+def get_job_status(job_id):
+    """État du job : queued / running / cancelling / succeeded / failed / cancelled, lignes déjà déversées."""
+    try:
+        return jsonify(get_job(job_id, g.current_user)), 200
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status
+
+
+@sql_jobs_bp.route("/<job_id>/results", methods=["GET"])
+@require_auth
+def get_job_results(job_id):
+    """
+    Page de résultats : ?after=<dernier rn reçu>&limit=1000 (pagination par clé),
+    ou ?offset=2000&limit=1000 (rn commence à 1, offset équivaut à after).
+    """
+    try:
+        after = _int_arg("after", None)
+        if after is None:
+            after = _int_arg("offset", 0)
+        limit = min(_int_arg("limit", DEFAULT_PAGE_SIZE) or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        return jsonify(get_results(job_id, g.current_user, after, limit)), 200
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status
+
+
+@sql_jobs_bp.route("/<job_id>/cancel", methods=["POST"])
+@require_auth
+def cancel_sql_job(job_id):
+    """Annule le job (pg_cancel_backend s'il est en cours)."""
+    try:
+        return jsonify(cancel_job(job_id, g.current_user)), 200
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status
+
+
+@sql_jobs_bp.route("/<job_id>", methods=["DELETE"])
+@require_auth
+def delete_sql_job(job_id):
+    """Supprime le job et ses résultats."""
+    try:
+        delete_job(job_id, g.current_user)
+        return jsonify({"message": "Job deleted successfully"}), 200
+    except JobError as e:
+        return jsonify({"error": str(e)}), e.status
@@ -1,23 +1,50 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from utils.auth import require_auth
+from utils.admission import AdmissionRejected, acquire_slot, rejection_response
+from clients.postgres_client import PostgresClient
 from routes.sync_routes_utils import sync_orgunits, sync_dataelements, sync_teis_enrollments_events_attributes
+from utils.background_jobs import JobError, submit_job
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
 
 
 sync_bp = Blueprint("sync", __name__, url_prefix="/api/sync")
 
 
+def _current_username():
+    return (getattr(g, "current_user", None) or {}).get("username")
+
+
+def submit_background(kind, params, func, admission_class="sync"):
+    """
+    Lance `func(progress=...)` en arrière-plan : 202 + id du job (progression sur /api/jobs/<id>?after=<seq>).
+    La place d'admission (`admission_class`) est prise ici et tenue jusqu'à la fin du job (429 si refusée).
+    """
+    user = getattr(g, "current_user", None) or {}
+    try:
+        slot = acquire_slot(admission_class, user)
+    except AdmissionRejected as e:
+        logger.warning(f"⏳ Admission refusée ({admission_class}, {user.get('username')}) : {e}")
+        return rejection_response(admission_class, e)
+    try:
+        return jsonify(submit_job(kind, params, user.get("username"), func, on_finish=slot.release if slot else None)), 202
+    except JobError as e:
+        return jsonify(dict({"error": str(e)}, **e.details)), e.status
+
+
 @sync_bp.post("/orgunits")
 @require_auth
 def sync_orgunits_query():
-    result, status = sync_orgunits()
-    return jsonify(result), status
+    username = _current_username()
+    return submit_background("sync_orgunits", {"level": 5}, lambda progress: sync_orgunits(triggered_by=username, progress=progress))
     
 
 @sync_bp.post("/dataElements")
 @require_auth
 def sync_dataelements_query():
-    result, status = sync_dataelements()
-    return jsonify(result), status
+    username = _current_username()
+    return submit_background("sync_dataelements", {}, lambda progress: sync_dataelements(triggered_by=username, progress=progress))
 
 
 @sync_bp.post("/teis_enrollments_events_attributes")
@@ -31,9 +58,40 @@ def sync_teis_enrollments_events_attributes_query():
         doAttribute =  True if payload.get("attributes") == True else False
         doEvent =  True if payload.get("events") == True else False
 
-        result, status = sync_teis_enrollments_events_attributes(orgunit_id, doTei, doEnroll, doAttribute, doEvent)
-        return jsonify(result), status
-    
+        username = _current_username()
+        params = {"orgunit_id": orgunit_id, "teis": doTei, "enrollments": doEnroll, "attributes": doAttribute, "events": doEvent}
+        return submit_background("sync_teis", params, lambda progress: sync_teis_enrollments_events_attributes(
+            orgunit_id, doTei, doEnroll, doAttribute, doEvent, triggered_by=username, progress=progress))
+
     except Exception as ex:
         return jsonify({"error": str(ex)}), 500
 
+
+@sync_bp.get("/runs")
+@require_auth
+def list_sync_runs():
+    """ Historique des runs (sync / arrimage), du plus récent au plus ancien. Filtres : kind, status. """
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit et offset doivent être des entiers"}), 400
+    try:
+        runs = PostgresClient().list_sync_runs(request.args.get("kind"), request.args.get("status"), limit, offset)
+        return jsonify({"runs": runs, "limit": limit, "offset": offset}), 200
+    except Exception as ex:
+        return jsonify({"error": str(ex)}), 500
+
+
+@sync_bp.get("/runs/<int:run_id>")
+@require_auth
+def get_sync_run(run_id: int):
+    """ Détail d'un run avec ses orgunits (les plus lentes d'abord ; order_by=duration_ms|bytes|retries|errors|started_at). """
+    try:
+        limit = request.args.get("limit", type=int)
+        run = PostgresClient().get_sync_run(run_id, request.args.get("order_by", "duration_ms"), limit)
+        if not run:
+            return jsonify({"error": "run not found"}), 404
+        return jsonify(run), 200
+    except Exception as ex:
+        return jsonify({"error": str(ex)}), 500
@@ -2,35 +2,51 @@ from datetime import datetime, timezone
 from clients.postgres_client import PostgresClient
 from clients.itc_dhis2_source_client import ItcDhis2SourceClient
 from utils.config import config
+from utils.sync_runs import SyncRunRecorder, record_rows
+from utils.sync_shards import run_sharded
+from utils.dates_utils import build_dhis2_period_list
 
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
 
 
-def sync_orgunits():
+def sync_orgunits(triggered_by: str = None, progress=None):
     """ Lance la synchronisation DHIS2 côté serveur. """
+    run = SyncRunRecorder("orgunits", {"level": 5}, triggered_by, progress).start()
     try:
-        pg = PostgresClient()            
-        dhis = ItcDhis2SourceClient(store_in_db=True)
-        orgunits = dhis.fetch_organisation_units(level=5)
-        pg.bulk_upsert_data("organisationUnits", orgunits)
-        return ({"status": "ok", "synced": len(orgunits)}, 200)
+        with run.track():
+            pg = PostgresClient()            
+            dhis = ItcDhis2SourceClient(store_in_db=True)
+            orgunits = dhis.fetch_organisation_units(level=5)
+            record_rows("organisationUnits", fetched=len(orgunits))
+            pg.bulk_upsert_data("organisationUnits", orgunits)
+            pg.rebuild_orgunit_closure(orgunits)
+        summary = run.finish()
+        return ({"status": "ok", "synced": len(orgunits), "run_id": summary["run_id"]}, 200)
     except Exception as ex:
         logger.exception("Sync failed")
-        return ({"error": "sync failed", "detail": str(ex)}, 500)
+        run.finish(error=str(ex))
+        return ({"error": "sync failed", "detail": str(ex), "run_id": run.run_id}, 500)
     
-def sync_dataelements():
+def sync_dataelements(triggered_by: str = None, progress=None):
     """ Lance la synchronisation DHIS2 côté serveur. """
+    run = SyncRunRecorder("dataelements", {}, triggered_by, progress).start()
     try:
-        dhis = ItcDhis2SourceClient(store_in_db=True)
-        elements = dhis.fetch_dataelements()
-        return ({"status": "ok", "synced": len(elements)}, 200)
+        with run.track():
+            dhis = ItcDhis2SourceClient(store_in_db=True)
+            elements = dhis.fetch_dataelements()
+            record_rows("dataElements", fetched=len(elements))
+        summary = run.finish()
+        return ({"status": "ok", "synced": len(elements), "run_id": summary["run_id"]}, 200)
     except Exception as ex:
         logger.exception("Sync failed")
-        return ({"error": "sync failed", "detail": str(ex)}, 500)
+        run.finish(error=str(ex))
+        return ({"error": "sync failed", "detail": str(ex), "run_id": run.run_id}, 500)
 
-def sync_teis_enrollments_events_attributes(orgunit_id=None, doTei =  True, doEnroll = True, doAttribute = True, doEvent = True):
+def sync_teis_enrollments_events_attributes(orgunit_id=None, doTei =  True, doEnroll = True, doAttribute = True, doEvent = True, triggered_by: str = None, progress=None):
+    params = {"orgunit_id": orgunit_id, "teis": doTei, "enrollments": doEnroll, "attributes": doAttribute, "events": doEvent}
+    run = SyncRunRecorder("teis", params, triggered_by, progress).start()
     try:
         pg = PostgresClient()            
         dhis = ItcDhis2SourceClient(store_in_db=True)
@@ -40,17 +56,57 @@ def sync_teis_enrollments_events_attributes(orgunit_id=None, doTei =  True, doEn
         orgunit_ids = ([orgunit_id] if orgunit_id else [ou["id"] for ou in pg.list_orgunits(level=5) if ou.get("id")])
         # Combinaisons (ou_id, index)
         payloads = [(program, ou_id, ou_index,doTei,doEnroll,doAttribute,doEvent,last_sync_date) for ou_index, ou_id  in enumerate(orgunit_ids)]
-        # Appel async multipayload
-        data = dhis.get_multi_async_request(payload_method=dhis.fetch_teis_enrollments_events_attributes,payloads=payloads)
+        run.set_total(len(payloads))
+
+        def fetch_orgunit(program, ou_id, *args):
+            # Une ligne sync_run_orgunits par orgunit (durée, lignes, octets, retries, erreur)
+            with run.orgunit(ou_id):
+                return dhis.fetch_teis_enrollments_events_attributes(program, ou_id, *args)
+
+        if config.SYNC_PROCESSES > 1:
+            # Orgunits réparties sur plusieurs processus (décodage / aplatissement hors GIL)
+            data = run_sharded(run, program, orgunit_ids, (doTei, doEnroll, doAttribute, doEvent), last_sync_date)
+        else:
+            # Appel async multipayload (compteurs par orgunit additionnés)
+            data = dhis.get_multi_async_request(payload_method=fetch_orgunit,payloads=payloads)
+            data = data if isinstance(data, dict) else {}  # aucun résultat exploitable (toutes les orgunits en échec)
+        summary = run.finish()
         if doTei and doEnroll and doAttribute and doEvent:
             now = datetime.now(timezone.utc)
             pg.update_last_sync(now)
         return ({
-            "teis": len(data.get("teis", [])),
-            "enrollments": len(data.get("enrollments", [])),
-            "events": len(data.get("events", [])),
-            "attributes": len(data.get("attributes", [])),
+            "teis": data.get("teis", 0),
+            "enrollments": data.get("enrollments", 0),
+            "events": data.get("events", 0),
+            "attributes": data.get("attributes", 0),
+            "run_id": summary["run_id"],
+            "status": summary["status"],
+            "orgunits_failed": summary["orgunits_failed"],
         }, 200)
     except Exception as ex:
-        return ({"error": str(ex)}, 500)
+        run.finish(error=str(ex))
+        return ({"error": str(ex), "run_id": run.run_id}, 500)
+
+
+def arrimage_indicators(start_date=None, end_date=None, orgunits=None, triggered_by: str = None, progress=None):
+    """ Arrimage des indicateurs vers DHIS2 ; retourne (réponse, statut HTTP). """
+    from make_arrimate import Dhis2ArrimateMaker
+
+    periods = build_dhis2_period_list(start_date, end_date)
+    orgunit_ids = [orgunits] if orgunits and isinstance(orgunits,str) else (orgunits or [])
+
+    arr = Dhis2ArrimateMaker(send_to_dhis2 = True, save_to_local_file = False)
+    outputs = arr.start_indicators_arrimage_with_dhis2(periods,orgunit_ids, triggered_by=triggered_by, progress=progress)
+
+    result = { "success":0, "error":0 }
+    for output in outputs:
+        if output["status"] is True:
+            result["success"] += output["size"]
+        else:
+            result["error"] += output["size"]
+
+    if result["success"] > 0 or result["success"] == 0 and result["error"] == 0:
+        status = 201 if result["error"] > 0 else 200
+        return ({"status":status, "success": f'SUCCESS de {result["success"]}',"error": f'ECHEC de {result["error"]}'}, 200)
 
+    return ({"error": "Erreur lors de l'arrimage", "status": "ERROR"}, 500)
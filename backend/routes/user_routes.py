@@ -1,6 +1,6 @@
 # backend/query_routes.py
 from flask import Blueprint, request, jsonify, g
-from utils.auth import require_auth
+from utils.auth import require_auth, invalidate_user_cache
 from utils.hasher_uitls import verify_password, hash_password
 from utils.db import get_connection
 from utils.models import db, User
@@ -124,6 +124,7 @@ def update_user(user_id):
 
     try:
         db.session.commit()
+        invalidate_user_cache(target.username)
         return jsonify(target.to_dict_safe()), 200
     except Exception as e:
         db.session.rollback()
@@ -169,6 +170,7 @@ def update_password(user_id):
         target.password = hash_password(new_password)
 
         db.session.commit()
+        invalidate_user_cache(target.username)
 
         return jsonify({
             "message": "Password updated successfully",
@@ -235,6 +237,7 @@ def admin_update_password(user_id):
 
         updated_user = cur.fetchone()
         conn.commit()
+        invalidate_user_cache(updated_user[1] if updated_user else None)
 
         return jsonify({
             "message": "Password updated successfully",
@@ -265,6 +268,7 @@ def delete_user(user_id):
     try:
         db.session.delete(user)
         db.session.commit()
+        invalidate_user_cache(user.username)
         return jsonify({"message": "User deleted"}), 200
     except Exception as e:
         db.session.rollback()
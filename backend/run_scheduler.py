@@ -1,5 +1,6 @@
 # run_scheduler.py
 from server import create_app
+from utils.metrics import start_metrics_server
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -10,6 +11,8 @@ app = create_app(init_scheduler=True)
 # Scheduler déjà initialisé dans app
 if hasattr(app, "scheduler"):
     logger.info("Scheduler process started. Jobs are scheduled automatically.")
+    # Pas de serveur web dans ce processus : seul /metrics est servi sur SCHEDULER_METRICS_PORT
+    start_metrics_server()
     # app.scheduler.start()
 else:
     raise RuntimeError("Scheduler non initialisé dans l'app")
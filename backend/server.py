@@ -2,22 +2,33 @@
 import os
 import time
 import urllib3
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g
 from flask_cors import CORS
 from utils.config import config
 from utils.models import User, db
 from utils.auth import require_auth
+from utils.admission import admit
 from routes.run_sql_routes import run_sql_bp
 from routes.schema_routes import schema_bp
 from routes.query_routes import query_bp
 from routes.user_routes import user_bp
 from routes.auth_routes import auth_bp
-from routes.sync_routes import sync_bp
+from routes.sync_routes import sync_bp, submit_background
+from routes.sync_routes_utils import arrimage_indicators
+from routes.jobs_routes import jobs_bp
 from routes.fetch_routes import fetch_bp
+from routes.metrics_routes import metrics_bp
+from routes.profiler_routes import profiler_bp
+from routes.sql_jobs_routes import sql_jobs_bp
+from utils.metrics import init_request_metrics
+from utils.profiler import init_request_profiler
+from utils.query_tracer import init_query_tracer
+from utils.saved_queries import ensure_saved_queries_schema
+from utils.sql_jobs import ensure_sql_jobs_schema
+from utils.background_jobs import ensure_background_jobs_schema
 from utils.scheduler_app import SchedulerApp
 from utils.build_views import build_materialize_view
-from make_arrimate import Dhis2ArrimateMaker
-from utils.dates_utils import build_dhis2_period_list
+from utils.pg_locks import advisory_lock
 from utils.logger import get_logger
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -49,6 +60,9 @@ def create_app(init_scheduler: bool = False):
     with app.app_context():
         db.create_all()
         User.create_default_admin()  # Crée automatiquement l'admin si nécessaire
+        ensure_saved_queries_schema()  # DDL des requêtes sauvegardées, une fois au démarrage
+        ensure_sql_jobs_schema()  # Tables des jobs SQL asynchrones
+        ensure_background_jobs_schema()  # Jobs d'arrière-plan (sync, arrimage)
         logger.info("Database tables ensured (use Alembic in production).")
 
         # Scheduler optionnel
@@ -69,6 +83,17 @@ def create_app(init_scheduler: bool = False):
     app.register_blueprint(auth_bp)
     app.register_blueprint(sync_bp)
     app.register_blueprint(fetch_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(profiler_bp)
+    app.register_blueprint(sql_jobs_bp)
+    app.register_blueprint(jobs_bp)
+
+    # Latence des requêtes API (exposée sur /api/metrics)
+    init_request_metrics(app)
+    # Profil d'une requête à la demande (en-tête X-Profile, admin, PROFILER_ENABLED)
+    init_request_profiler(app)
+    # Requêtes SQL par requête HTTP : Server-Timing + slow-query log
+    init_query_tracer(app)
 
     # ---------------------------
     # API Routes
@@ -80,8 +105,13 @@ def create_app(init_scheduler: bool = False):
 
     @app.post("/api/build-matview")
     @require_auth
+    @admit("matview")
     def build_matview():
-        result, success = build_materialize_view()
+        # Même verrou que le refresh du scheduler : jamais de build et de refresh simultanés
+        with advisory_lock(f"matview:{config.MATVIEW_NAME}") as acquired:
+            if not acquired:
+                return jsonify({"error": "Materialized view build/refresh already in progress"}), 409
+            result, success = build_materialize_view()
         if success:
             return jsonify({"matview": 1}), 200
         return jsonify(result), 500
@@ -89,31 +119,17 @@ def create_app(init_scheduler: bool = False):
     @app.post("/api/arrimate-indicators")
     @require_auth
     def arrimage_with_dhis2():
+        """ Arrimage en arrière-plan : 202 + id du job, progression sur /api/jobs/<id>?after=<seq>. """
         payload = request.get_json(silent=True) or {}
         start_date = payload.get("start_date")
         end_date =  payload.get("end_date")
         orgunits =  payload.get("orgunits") or []
+        username = (getattr(g, "current_user", None) or {}).get("username")
 
-        periods = build_dhis2_period_list(start_date, end_date)
-        orgunit_ids = [orgunits] if orgunits and isinstance(orgunits,str) else orgunits
+        params = {"start_date": start_date, "end_date": end_date, "orgunits": orgunits}
+        return submit_background("arrimage", params, lambda progress: arrimage_indicators(
+            start_date, end_date, orgunits, triggered_by=username, progress=progress), admission_class="arrimage")
 
-        arr = Dhis2ArrimateMaker(send_to_dhis2 = True, save_to_local_file = False)
-        outputs = arr.start_indicators_arrimage_with_dhis2(periods,orgunit_ids)
-
-
-        result = { "success":0, "error":0 }
-        for output in outputs:
-            if output["status"] is True:
-                result["success"] += output["size"]
-            else:
-                result["error"] += output["size"]
-
-        if result["success"] > 0 or result["success"] == 0 and result["error"] == 0:
-            status = 201 if result["error"] > 0 else 200
-            return jsonify({"status":status, "success": f'SUCCESS de {result["success"]}',"error": f'ECHEC de {result["error"]}'}), 200
-        
-        return jsonify({"status":500, "error": "Erreur lors de l'arrimage","status": "ERROR"}), 500
-        
 
     # ---------------------------
     # FRONTEND (React/Vue/Angular SPA)
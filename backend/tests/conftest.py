@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les modules du backend s'importent depuis backend/ (python server.py, gunicorn wsgi:app)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
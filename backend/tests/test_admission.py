@@ -0,0 +1,45 @@
+"""
+utils/admission : les routes sync/arrimage répondent 202 puis le job tourne en arrière-plan ;
+leur place d'admission doit être tenue jusqu'à la fin du job, pas seulement pendant la requête.
+"""
+import pytest
+
+from utils import admission, background_jobs
+from utils.admission import AdmissionRejected, acquire_slot
+from utils.background_jobs import JobError
+
+
+@pytest.fixture
+def sync_class(monkeypatch):
+    monkeypatch.setattr(admission.config, "ADMISSION_ENABLED", True)
+    resource = admission.ResourceClass("sync", 1, 0, 0)
+    monkeypatch.setitem(admission._classes, "sync", resource)
+    return resource
+
+
+def test_slot_is_held_until_released(sync_class):
+    slot = acquire_slot("sync", {"username": "alice", "role": "admin"})
+    with pytest.raises(AdmissionRejected):
+        acquire_slot("sync", {"username": "bob", "role": "admin"})
+
+    slot.release()
+    slot.release()
+    assert sync_class.snapshot()["active"] == 0
+    acquire_slot("sync", {"username": "bob", "role": "admin"}).release()
+
+
+def test_job_releases_slot_when_it_ends(sync_class, monkeypatch):
+    monkeypatch.setattr(background_jobs, "get_connection", lambda: None)
+    slot = acquire_slot("sync", {"username": "alice", "role": "admin"})
+
+    background_jobs._run_job("job", "sync_orgunits", lambda progress: ({}, 200), on_finish=slot.release)
+    assert sync_class.snapshot()["active"] == 0
+
+
+def test_job_not_started_releases_slot(sync_class, monkeypatch):
+    monkeypatch.setattr(background_jobs, "ensure_background_jobs_schema", lambda: False)
+    slot = acquire_slot("sync", {"username": "alice", "role": "admin"})
+
+    with pytest.raises(JobError):
+        background_jobs.submit_job("sync_orgunits", {}, "alice", lambda progress: ({}, 200), on_finish=slot.release)
+    assert sync_class.snapshot()["active"] == 0
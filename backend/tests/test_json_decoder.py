@@ -0,0 +1,72 @@
+"""
+utils/json_decoder : un corps tronqué doit lever JsonDecodeError quel que soit le décodeur,
+pour que le retry de ItcDhis2SourceClient._get le traite comme une erreur réseau.
+"""
+import pytest
+
+from utils import json_decoder
+from utils.config import config
+from utils.json_decoder import JsonDecodeError, SCHEMAS, decode_json
+
+TRUNCATED = b'{"trackedEntityInstances": [{"trackedEntityInstance": "a'
+VALID = b'{"trackedEntityInstances": [], "pager": {"page": 1, "pageCount": 1}}'
+
+
+@pytest.mark.parametrize("backend", ["msgspec", "orjson", "json"])
+@pytest.mark.parametrize("schema", [None, SCHEMAS["trackedEntityInstances"]])
+def test_truncated_body_raises_json_decode_error(monkeypatch, backend, schema):
+    if backend != "msgspec":
+        monkeypatch.setattr(json_decoder, "msgspec", None)
+    if backend == "json":
+        monkeypatch.setattr(json_decoder, "orjson", None)
+    with pytest.raises(JsonDecodeError):
+        decode_json(TRUNCATED, schema)
+
+
+class _Response:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class _Session:
+    def __init__(self, bodies):
+        self.bodies = list(bodies)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return _Response(self.bodies.pop(0))
+
+
+def _client(session):
+    from clients.itc_dhis2_source_client import ItcDhis2SourceClient
+
+    client = object.__new__(ItcDhis2SourceClient)
+    client.base_url = "https://dhis2.example"
+    client.session = session
+    return client
+
+
+def test_get_retries_truncated_body(monkeypatch):
+    monkeypatch.setattr(config, "FAST_JSON", True)
+    monkeypatch.setattr(config, "MAX_RETRIES", 3)
+    monkeypatch.setattr(config, "RETRY_DELAY", 0)
+    session = _Session([TRUNCATED, VALID])
+
+    data = _client(session)._get("trackedEntityInstances.json", data_key="trackedEntityInstances")
+    assert data["trackedEntityInstances"] == []
+    assert session.calls == 2
+
+
+def test_get_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(config, "FAST_JSON", True)
+    monkeypatch.setattr(config, "MAX_RETRIES", 2)
+    monkeypatch.setattr(config, "RETRY_DELAY", 0)
+    session = _Session([TRUNCATED, TRUNCATED])
+
+    with pytest.raises(Exception, match="Échec après 2 tentatives"):
+        _client(session)._get("trackedEntityInstances.json", data_key="trackedEntityInstances")
+    assert session.calls == 2
@@ -0,0 +1,75 @@
+"""
+utils/saved_queries : les `:nom` sont trouvés par le même découpage que les garde-fous
+(sql_analyzer), et le texte lié doit rester une instruction unique.
+"""
+from psycopg2.extensions import adapt
+
+from utils.saved_queries import _bound_sql, compile_query
+
+
+class _Cursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, sql, params):
+        return (sql % {k: adapt(v).getquoted().decode() for k, v in (params or {}).items()}).encode()
+
+
+class _Conn:
+    def cursor(self, *args, **kwargs):
+        return _Cursor()
+
+
+def _bind(sql, **values):
+    compiled = compile_query(sql)
+    bound = {name: values[name] for name in compiled.names}
+    return compiled, _bound_sql(_Conn(), compiled, bound)
+
+
+def test_dollar_quoted_text_is_not_a_parameter():
+    compiled, (sql_text, rejected) = _bind("SELECT $$ :x $$ AS v", x="$$; COMMIT; DELETE FROM events; SELECT $$")
+    assert compiled.names == ()
+    assert compiled.denied is None
+    assert rejected is None
+    assert sql_text == "SELECT $$ :x $$ AS v"
+
+
+def test_escape_string_is_not_a_parameter():
+    compiled = compile_query(r"SELECT E'\' :x' AS v, :y AS w")
+    assert compiled.names == ("y",)
+
+
+def test_nested_comment_is_not_a_parameter():
+    compiled = compile_query("SELECT /* /* :x */ :y */ :z AS v")
+    assert compiled.names == ("z",)
+    assert compiled.positional_sql == "SELECT /* /* :x */ :y */ $1 AS v"
+
+
+def test_casts_and_repeated_parameters():
+    compiled = compile_query("SELECT :a::int, :b, :a FROM events WHERE x = ':c' -- :d")
+    assert compiled.names == ("a", "b")
+    assert compiled.positional_sql == "SELECT $1::int, $2, $1 FROM events WHERE x = ':c' -- :d"
+
+
+def test_bound_values_stay_literals():
+    _, (sql_text, rejected) = _bind("SELECT * FROM events WHERE id = :id", id="x'; DELETE FROM events; --")
+    assert rejected is None
+    assert "DELETE" in sql_text
+
+
+def test_bound_text_must_be_a_single_statement():
+    compiled = compile_query("SELECT :x AS v")
+
+    class _Unsafe(_Cursor):
+        def mogrify(self, sql, params):
+            return sql.replace("%(x)s", "1; DELETE FROM events").encode()
+
+    class _UnsafeConn:
+        def cursor(self, *args, **kwargs):
+            return _Unsafe()
+
+    _, rejected = _bound_sql(_UnsafeConn(), compiled, {"x": 1})
+    assert rejected is not None and rejected[1] == 400
@@ -0,0 +1,127 @@
+"""
+Analyse lexicale de utils/sql_analyzer : c'est elle qui décide du nombre d'instructions
+et des mots-clés vus par check_sql_permissions, elle doit découper comme PostgreSQL.
+"""
+import pytest
+
+from utils.sql_analyzer import analyze_sql, normalize_statement
+from routes.run_sql_routes import check_sql_permissions
+
+
+# ------------------------
+# Commentaires imbriqués
+# ------------------------
+def test_nested_block_comment_hides_nothing():
+    sql = "SELECT 1 /* /* */ ' */; COMMIT; DELETE FROM events --'"
+    analysis = analyze_sql(sql)
+    assert analysis.statement_count == 3
+    assert {"COMMIT", "DELETE"} <= analysis.keywords
+    assert check_sql_permissions(sql, "user") is not None
+
+
+def test_nested_block_comment_is_skipped_entirely():
+    analysis = analyze_sql("SELECT /* outer /* inner */ still comment; DROP TABLE x */ 1")
+    assert analysis.statement_count == 1
+    assert "DROP" not in analysis.keywords
+    assert analysis.first_keyword == "SELECT"
+
+
+def test_comment_closing_sequences():
+    assert analyze_sql("SELECT /**/ 1").statement_count == 1
+    analysis = analyze_sql("SELECT 2 /* a */* 3")
+    assert not analysis.unterminated
+    assert analysis.statement_count == 1
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1 /* never closed",
+    "SELECT 1 /* /* */ only one level closed",
+    "SELECT 1 /*/",
+])
+def test_unterminated_comment_is_rejected(sql):
+    assert analyze_sql(sql).unterminated
+    for role in ("user", "admin", "superadmin"):
+        assert check_sql_permissions(sql, role) is not None
+
+
+def test_normalize_strips_nested_comments():
+    assert normalize_statement("SELECT /* a /* b */ c */ 1 ;").split() == ["SELECT", "1"]
+
+
+# ------------------------
+# Chaînes
+# ------------------------
+def test_dollar_quoted_string_hides_semicolons():
+    analysis = analyze_sql("SELECT $body$ ; DELETE FROM events $body$, $$ ; $$")
+    assert analysis.statement_count == 1
+    assert "DELETE" not in analysis.keywords
+    assert "delete" in analysis.literal_words
+
+
+def test_dollar_tag_must_match():
+    analysis = analyze_sql("SELECT $a$ $b$ ; $a$; DROP TABLE x")
+    assert analysis.statement_count == 2
+    assert "DROP" in analysis.keywords
+
+
+def test_escape_string_backslash_quote():
+    analysis = analyze_sql(r"SELECT E'it\'s ; still a string' ; DELETE FROM events")
+    assert analysis.statement_count == 2
+    assert "DELETE" in analysis.keywords
+    assert check_sql_permissions(r"SELECT E'it\'s ; still a string'", "user") is None
+
+
+def test_standard_string_backslash_is_literal():
+    # standard_conforming_strings : '\' est une chaîne complète
+    analysis = analyze_sql(r"SELECT '\'; DELETE FROM events")
+    assert analysis.statement_count == 2
+
+
+@pytest.mark.parametrize("sql", ["SELECT 'open", "SELECT E'open\\'", 'SELECT "open', "SELECT $t$ open"])
+def test_unterminated_literals_are_rejected(sql):
+    assert analyze_sql(sql).unterminated
+    assert check_sql_permissions(sql, "user") is not None
+
+
+# ------------------------
+# Plusieurs instructions
+# ------------------------
+def test_multi_statement_counts():
+    assert analyze_sql("SELECT 1; SELECT 2;").statement_count == 2
+    assert analyze_sql("SELECT 1;;  ; -- fin").statement_count == 1
+    assert analyze_sql("SELECT ';' AS a, \";\" FROM t").statement_count == 1
+
+
+def test_multi_statement_rejected_for_users_only():
+    sql = "SELECT 1; SELECT 2"
+    assert check_sql_permissions(sql, "user") == "Multiple statements are not allowed"
+    assert check_sql_permissions(sql, "admin") is None
+
+
+def test_single_select_allowed():
+    assert check_sql_permissions("SELECT * FROM events /* ok */ WHERE x = 'a;b'", "user") is None
+
+
+# ------------------------
+# Pagination sans état (offset)
+# ------------------------
+def test_paged_sql_wraps_normalized_statement():
+    from routes.run_sql_routes import paged_sql
+
+    sql = paged_sql("SELECT id FROM events ORDER BY id; -- fin", 2000, 1001)
+    assert sql.startswith("SELECT * FROM (\n")
+    assert sql.endswith("\n) AS _page OFFSET 2000 LIMIT 1001")
+    assert "--" not in sql and ";" not in sql
+    assert analyze_sql(sql).statement_count == 1
+
+
+# ------------------------
+# Fin de commentaire -- : \n, \r ou \r\n (comme PostgreSQL)
+# ------------------------
+@pytest.mark.parametrize("newline", ["\r", "\r\n", "\n"])
+def test_line_comment_ends_at_any_newline(newline):
+    sql = f"SELECT 1; --x{newline}COMMIT; DELETE FROM events"
+    analysis = analyze_sql(sql)
+    assert analysis.statement_count == 3
+    assert {"COMMIT", "DELETE"} <= analysis.keywords
+    assert check_sql_permissions(sql, "user") is not None
@@ -0,0 +1,68 @@
+"""
+utils/sql_cost_guard : l'EXPLAIN de contrôle ne reçoit qu'une instruction unique, dans une
+transaction READ ONLY bornée par statement_timeout et toujours annulée.
+"""
+import json
+
+from utils import sql_cost_guard
+from utils.config import config
+
+PLAN = json.dumps([{"Plan": {"Node Type": "Seq Scan", "Relation Name": "events", "Total Cost": 10.0,
+                             "Startup Cost": 0.0, "Plan Rows": 100, "Plan Width": 8}}])
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.log.append((sql, params, self.conn.autocommit))
+
+    def fetchone(self):
+        return (PLAN,)
+
+
+class _Conn:
+    def __init__(self):
+        self.autocommit = True
+        self.log = []
+        self.rollbacks = 0
+
+    def cursor(self, *args, **kwargs):
+        return _Cursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def _setup(monkeypatch):
+    monkeypatch.setattr(config, "SQL_COST_GUARD_ENABLED", True)
+    monkeypatch.setattr(config, "SQL_COST_EXPLAIN_TIMEOUT_MS", 1234)
+    sql_cost_guard._plan_cache.clear()
+
+
+def test_explain_runs_in_read_only_bounded_transaction(monkeypatch):
+    _setup(monkeypatch)
+    conn = _Conn()
+    summary, rejected = sql_cost_guard.check_cost(conn, "SELECT * FROM events", "user")
+    assert rejected is None and summary["relations"] == ["events"]
+    statements = [sql for sql, _, _ in conn.log]
+    assert statements[0] == "SET TRANSACTION READ ONLY;"
+    assert conn.log[1][1] == (1234,)
+    assert statements[2] == "EXPLAIN (FORMAT JSON) SELECT * FROM events"
+    assert all(autocommit is False for _, _, autocommit in conn.log)
+    assert conn.rollbacks == 1 and conn.autocommit is True
+
+
+def test_multi_statement_text_is_never_explained(monkeypatch):
+    _setup(monkeypatch)
+    conn = _Conn()
+    _, rejected = sql_cost_guard.check_cost(conn, "SELECT 1; --x\rCOMMIT; DELETE FROM events", "user")
+    assert rejected is not None and rejected[1] == 400
+    assert conn.log == []
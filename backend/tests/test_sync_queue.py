@@ -0,0 +1,67 @@
+"""
+Clôture des lots de la file de sync (utils/sync_queue.drain) : un lot ouvert sans tâche
+restante doit être clôturé même si ce worker n'en a traité aucune tâche.
+"""
+import pytest
+
+import utils.sync_queue as sync_queue
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """ File simulée : un lot ouvert dont la dernière tâche a épuisé ses tentatives (bail expiré). """
+    state = {
+        "batches": {"b1": "open"},
+        "tasks": {1: {"batch_id": "b1", "status": "running", "lease_expired": True, "attempts": 3}},
+    }
+    conn = FakeConn()
+
+    def expire_exhausted(_conn):
+        for task in state["tasks"].values():
+            if task["status"] == "running" and task["lease_expired"] and task["attempts"] >= 3:
+                task["status"] = "failed"
+
+    def finalize_idle(_conn):
+        finalized = []
+        for batch_id, status in state["batches"].items():
+            remaining = [t for t in state["tasks"].values()
+                         if t["batch_id"] == batch_id and t["status"] in ("pending", "running")]
+            if status == "open" and not remaining:
+                state["batches"][batch_id] = "done"
+                finalized.append({"id": batch_id})
+        return finalized
+
+    monkeypatch.setattr(sync_queue, "ensure_sync_queue_schema", lambda: True)
+    monkeypatch.setattr(sync_queue, "get_connection", lambda: conn)
+    monkeypatch.setattr(sync_queue, "_expire_exhausted", expire_exhausted)
+    monkeypatch.setattr(sync_queue, "claim_tasks", lambda _conn, limit: [])
+    monkeypatch.setattr(sync_queue, "finalize_idle_batches", finalize_idle)
+    return state, conn
+
+
+def test_drain_finalizes_batch_it_did_not_claim_from(queue):
+    state, conn = queue
+    summary = sync_queue.drain(triggered_by="test")
+
+    assert state["tasks"][1]["status"] == "failed"
+    assert state["batches"]["b1"] == "done"
+    assert summary["finalized"] == [{"id": "b1"}]
+    assert summary["done"] == summary["failed"] == 0
+    assert conn.closed
+
+
+def test_drain_keeps_batch_open_while_tasks_remain(queue):
+    state, _ = queue
+    state["tasks"][2] = {"batch_id": "b1", "status": "pending", "lease_expired": False, "attempts": 0}
+    summary = sync_queue.drain(triggered_by="test")
+
+    assert state["batches"]["b1"] == "open"
+    assert summary["finalized"] == []
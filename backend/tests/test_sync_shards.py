@@ -0,0 +1,67 @@
+"""
+utils/sync_shards.run_sharded : la mort d'un processus fils casse tout le pool ; les paquets
+non terminés doivent être relancés dans un nouveau pool plutôt que comptés en échec.
+"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from utils import sync_shards
+from utils.config import config
+from utils.sync_runs import SyncRunRecorder
+
+
+class _FakePool:
+    """ ProcessPoolExecutor factice : les `broken_pools` premiers pools perdent tous leurs paquets sauf le premier. """
+    created = 0
+    broken_pools = 0
+
+    def __init__(self, **kwargs):
+        type(self).created += 1
+        self.broken = type(self).created <= type(self).broken_pools
+        self.submitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, func, program, chunk, flags, last_sync):
+        future = Future()
+        self.submitted += 1
+        if self.broken and self.submitted > 1:
+            future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        else:
+            future.set_result({"pid": 1, "counts": dict.fromkeys(sync_shards.ENTITIES, len(chunk)), "orgunits": [
+                {"orgunit_id": ou_id, "period": None, "status": "success", "error": None, "rows": {},
+                 "bytes": 0, "retries": 0, "errors": 0} for _, ou_id in chunk]})
+        return future
+
+
+def _run(monkeypatch, broken_pools, restarts):
+    _FakePool.created, _FakePool.broken_pools = 0, broken_pools
+    monkeypatch.setattr(sync_shards, "ProcessPoolExecutor", _FakePool)
+    monkeypatch.setattr(config, "SYNC_PROCESSES", 2)
+    monkeypatch.setattr(config, "SYNC_PROCESS_CHUNK_SIZE", 2)
+    monkeypatch.setattr(config, "SYNC_PROCESS_POOL_RESTARTS", restarts)
+    run = SyncRunRecorder("teis")
+    totals = sync_shards.run_sharded(run, "program", [f"ou{i}" for i in range(6)], (True, True, True, True), None)
+    return run, totals
+
+
+def test_broken_pool_chunks_are_resubmitted(monkeypatch):
+    run, totals = _run(monkeypatch, broken_pools=1, restarts=2)
+    assert _FakePool.created == 2
+    assert totals["teis"] == 6
+    assert sorted(r["orgunit_id"] for r in run.orgunit_records()) == [f"ou{i}" for i in range(6)]
+    assert all(r["status"] == "success" for r in run.orgunit_records())
+
+
+def test_chunks_fail_once_restarts_are_exhausted(monkeypatch):
+    run, totals = _run(monkeypatch, broken_pools=10, restarts=1)
+    assert _FakePool.created == 2
+    records = run.orgunit_records()
+    assert len(records) == 6
+    # 1er pool : un paquet réussi ; 2e pool : un autre ; le dernier paquet est perdu
+    assert sum(r["status"] == "failed" for r in records) == 2
+    assert totals["teis"] == 4
@@ -0,0 +1,54 @@
+"""
+utils/tracker_flattener : un même id répété dans un tampon ferait échouer tout le batch
+INSERT ... ON CONFLICT DO UPDATE ("cannot affect row a second time") ; dedupe() garde la dernière ligne.
+"""
+from utils.tracker_flattener import ColumnarBuffer, TrackerFlattener
+
+
+def _tei(tei_id, org_unit, events):
+    return {
+        "trackedEntityInstance": tei_id, "orgUnit": org_unit, "lastUpdated": "2026-01-01",
+        "enrollments": [{
+            "enrollment": f"en-{tei_id}", "trackedEntityInstance": tei_id, "orgUnit": org_unit,
+            "attributes": [{"attribute": "age", "value": "12"}],
+            "events": events,
+        }],
+    }
+
+
+def test_dedupe_keeps_last_row():
+    buf = ColumnarBuffer(["id", "value"])
+    for row_id, value in (("a", 1), ("b", 2), ("a", 3), ("c", 4)):
+        buf.start_row()
+        buf.set("id", row_id)
+        buf.set("value", value)
+    buf.start_row()
+    buf.set("id", "b")
+    buf.set("extra", "x")
+    buf.finish()
+
+    assert buf.dedupe("id") == 2
+    assert len(buf) == 3
+    assert buf.to_rows() == [
+        {"id": "a", "value": 3, "extra": None},
+        {"id": "c", "value": 4, "extra": None},
+        {"id": "b", "value": None, "extra": "x"},
+    ]
+    assert buf.dedupe("id") == 0
+
+
+def test_repeated_ids_across_pages_are_deduped():
+    flattener = TrackerFlattener("prog")
+    flattener.add_tei(_tei("t1", "ou-old", [{"event": "ev1", "orgUnit": "ou-old", "dataValues": [{"dataElement": "de", "value": "1"}]}]))
+    flattener.add_tei(_tei("t2", "ou-2", []))
+    flattener.add_tei(_tei("t1", "ou-new", [{"event": "ev1", "orgUnit": "ou-new", "dataValues": [{"dataElement": "de", "value": "2"}]}]))
+    flattener.finish()
+
+    for buf in (flattener.teis, flattener.enrollments, flattener.attributes, flattener.events):
+        buf.dedupe("id")
+        ids = buf.columns["id"]
+        assert len(ids) == len(set(ids)) == len(buf)
+
+    assert {r["id"]: r["orgunit_id"] for r in flattener.teis.to_rows()} == {"t2": "ou-2", "t1": "ou-new"}
+    assert flattener.events.to_rows()[0]["de"] == "2"
+    assert len(flattener.attributes) == 2
@@ -0,0 +1,203 @@
+"""
+Contrôle d'admission des routes lourdes en base (sync, arrimage, vue matérialisée, SQL).
+
+Chaque route est rattachée à une classe de ressources (ADMISSION_CLASSES) :
+- max_concurrency : requêtes exécutées simultanément dans le processus
+- max_queue       : requêtes pouvant attendre une place (0 = refus immédiat si tout est occupé)
+- queue_timeout   : attente maximale (s) avant refus
+
+Quotas par rôle (ADMISSION_ROLE_QUOTAS) : requêtes en cours + en attente d'un même utilisateur
+dans une classe (0 = illimité). Un refus renvoie 429 avec Retry-After, estimé à partir de la
+durée moyenne d'occupation de la classe.
+
+Les routes qui lancent un job d'arrière-plan (sync, arrimage) répondent 202 aussitôt : elles
+prennent leur place avec acquire_slot() et la passent au job, qui la libère à la fin de son
+exécution (la place couvre tout le job, pas seulement la requête HTTP).
+
+Les compteurs sont locaux au processus : avec N workers gunicorn, la concurrence effective
+d'une classe est N × max_concurrency (les threads de chaque worker restent ainsi disponibles
+pour les lectures du tableau de bord). Une requête en file occupe elle aussi un thread :
+max_concurrency + max_queue doit rester sous WEB_THREADS, sinon une file pleine bloque le worker.
+"""
+import math
+import threading
+import time
+from functools import wraps
+from typing import Dict, Optional
+
+from flask import g, jsonify
+
+from utils.config import config
+from utils.metrics import REGISTRY
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+ADMISSION_DECISIONS = REGISTRY.counter("admission_decisions_total", "Décisions du contrôle d'admission", ["cls", "result"])
+ADMISSION_WAIT = REGISTRY.histogram("admission_queue_wait_seconds", "Attente en file avant admission", ["cls"],
+                                    buckets=(0.005, 0.05, 0.25, 1, 2.5, 5, 10, 30))
+ADMISSION_ACTIVE = REGISTRY.gauge("admission_active", "Requêtes admises en cours", ["cls"])
+ADMISSION_QUEUED = REGISTRY.gauge("admission_queued", "Requêtes en attente d'admission", ["cls"])
+
+
+class AdmissionRejected(Exception):
+    """ Refus d'admission (message, secondes avant nouvel essai). """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ResourceClass:
+    """ Sémaphore avec file d'attente bornée, quotas par utilisateur et durée moyenne d'occupation. """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = max(0.0, queue_timeout)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._per_user: Dict[str, int] = {}
+        self._avg_hold = 1.0  # moyenne mobile exponentielle des durées d'occupation (s)
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self._avg_hold * (self._waiting + 1) / self.max_concurrency))
+
+    def acquire(self, user: Optional[str], quota: int) -> float:
+        """ Bloque jusqu'à admission ; retourne l'attente (s) ou lève AdmissionRejected. """
+        started = time.monotonic()
+        with self._cond:
+            if quota and user is not None and self._per_user.get(user, 0) >= quota:
+                ADMISSION_DECISIONS.inc(cls=self.name, result="quota")
+                raise AdmissionRejected(f"Too many concurrent '{self.name}' requests for your role (max {quota})", self.retry_after())
+            if self._active >= self.max_concurrency:
+                if self._waiting >= self.max_queue:
+                    ADMISSION_DECISIONS.inc(cls=self.name, result="queue_full")
+                    raise AdmissionRejected(f"Server busy ('{self.name}' queue is full)", self.retry_after())
+                self._waiting += 1
+                self._track(user, +1)
+                ADMISSION_QUEUED.set(self._waiting, cls=self.name)
+                try:
+                    admitted = self._cond.wait_for(lambda: self._active < self.max_concurrency, timeout=self.queue_timeout)
+                finally:
+                    self._waiting -= 1
+                    ADMISSION_QUEUED.set(self._waiting, cls=self.name)
+                if not admitted:
+                    self._track(user, -1)
+                    ADMISSION_DECISIONS.inc(cls=self.name, result="timeout")
+                    raise AdmissionRejected(f"Server busy (waited {self.queue_timeout:g}s for '{self.name}')", self.retry_after())
+            else:
+                self._track(user, +1)
+            self._active += 1
+            ADMISSION_ACTIVE.set(self._active, cls=self.name)
+        waited = time.monotonic() - started
+        ADMISSION_WAIT.observe(waited, cls=self.name)
+        ADMISSION_DECISIONS.inc(cls=self.name, result="admitted")
+        return waited
+
+    def release(self, user: Optional[str], held: float):
+        with self._cond:
+            self._active -= 1
+            self._track(user, -1)
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            ADMISSION_ACTIVE.set(self._active, cls=self.name)
+            self._cond.notify()
+
+    def _track(self, user: Optional[str], delta: int):
+        if user is None:
+            return
+        count = self._per_user.get(user, 0) + delta
+        if count > 0:
+            self._per_user[user] = count
+        else:
+            self._per_user.pop(user, None)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._cond:
+            return {"active": self._active, "waiting": self._waiting, "max_concurrency": self.max_concurrency,
+                    "max_queue": self.max_queue, "avg_hold_seconds": round(self._avg_hold, 3)}
+
+
+_classes: Dict[str, ResourceClass] = {
+    name: ResourceClass(name, *limits) for name, limits in config.ADMISSION_CLASSES.items()
+}
+
+for _cls in _classes.values():
+    if _cls.max_concurrency + _cls.max_queue >= config.WEB_THREADS:
+        logger.warning(f"⚠️ Admission '{_cls.name}' : {_cls.max_concurrency} en cours + {_cls.max_queue} en file "
+                       f"occupent les {config.WEB_THREADS} threads du worker (WEB_THREADS)")
+
+
+def role_quota(role: Optional[str]) -> int:
+    """ Requêtes simultanées (en cours + en attente) par utilisateur et par classe ; 0 = illimité. """
+    return config.ADMISSION_ROLE_QUOTAS.get(role or "user", config.ADMISSION_ROLE_QUOTAS["user"])
+
+
+def admission_status() -> Dict[str, Dict[str, float]]:
+    return {name: cls.snapshot() for name, cls in _classes.items()}
+
+
+class AdmissionSlot:
+    """ Place tenue au-delà de la requête (job d'arrière-plan) ; release() est idempotent. """
+
+    def __init__(self, resource: ResourceClass, user: Optional[str]):
+        self.resource = resource
+        self.user = user
+        self._started = time.monotonic()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.resource.release(self.user, time.monotonic() - self._started)
+
+
+def acquire_slot(class_name: str, user: Optional[Dict]) -> Optional[AdmissionSlot]:
+    """ Place dans `class_name` pour `user` (g.current_user) ; None si l'admission est désactivée. Lève AdmissionRejected. """
+    if not config.ADMISSION_ENABLED:
+        return None
+    user = user or {}
+    resource = _classes[class_name]
+    resource.acquire(user.get("username"), role_quota(user.get("role")))
+    return AdmissionSlot(resource, user.get("username"))
+
+
+def rejection_response(class_name: str, error: AdmissionRejected):
+    """ Réponse 429 + Retry-After d'un refus d'admission. """
+    response = jsonify({"error": str(error), "resource_class": class_name, "retry_after": error.retry_after})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 429
+
+
+def admit(class_name: str):
+    """
+    Décorateur de route, placé après @require_auth (g.current_user) :
+        @require_auth
+        @admit("sql")
+    """
+    resource = _classes[class_name]
+
+    def decorator(func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            if not config.ADMISSION_ENABLED:
+                return func(*args, **kwargs)
+            user = getattr(g, "current_user", None) or {}
+            username = user.get("username")
+            try:
+                resource.acquire(username, role_quota(user.get("role")))
+            except AdmissionRejected as e:
+                logger.warning(f"⏳ Admission refusée ({class_name}, {username}) : {e}")
+                return rejection_response(class_name, e)
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                resource.release(username, time.monotonic() - started)
+        return wrapped
+    return decorator
@@ -2,15 +2,19 @@
 from __future__ import annotations
 import os
 import secrets
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Tuple, Optional, Dict
+from typing import Tuple, Optional
 
 import jwt
 from flask import request, jsonify, g
 
 from utils.config import config
 from utils.models import User, RefreshToken, db
+from utils.metrics import REGISTRY
+from utils.rate_limit import RateLimiter
 from utils.logger import get_logger
 
 from functools import wraps
@@ -27,10 +31,15 @@ JWT_ALGORITHM = getattr(config, "JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRES_MINUTES = int(getattr(config, "ACCESS_TOKEN_EXPIRES_MINUTES", 15))
 REFRESH_TOKEN_EXPIRES_DAYS = int(getattr(config, "REFRESH_TOKEN_EXPIRES_DAYS", 30))
 
-# Rate limit for refresh endpoint (simple in-memory)
+# Rate limit for refresh endpoint (backend: RATE_LIMIT_BACKEND, see utils/rate_limit.py)
 _REFRESH_RATE_LIMIT_MAX = int(getattr(config, "REFRESH_RATE_LIMIT_MAX", 10))
 _REFRESH_RATE_LIMIT_WINDOW_SECONDS = int(getattr(config, "REFRESH_RATE_LIMIT_WINDOW_SECONDS", 60))
-_rate_limit_store: Dict[str, Tuple[int, int]] = {}  # client_id -> (count, first_ts)
+refresh_rate_limiter = RateLimiter("refresh", _REFRESH_RATE_LIMIT_MAX, _REFRESH_RATE_LIMIT_WINDOW_SECONDS)
+
+# Cache des utilisateurs authentifiés (require_auth) : TTL + LRU, local à chaque worker
+USER_CACHE_TTL_SECONDS = float(getattr(config, "AUTH_USER_CACHE_TTL_SECONDS", 30))
+USER_CACHE_MAXSIZE = int(getattr(config, "AUTH_USER_CACHE_MAXSIZE", 1024))
+USER_CACHE_LOOKUPS = REGISTRY.counter("auth_user_cache_lookups_total", "Recherches d'utilisateur par require_auth", ["result"])
 
 
 
@@ -67,20 +76,73 @@ def create_refresh_token_and_hashed(expires_days: Optional[int] = None) -> Tuple
     return raw, hashed, expires_at
 
 def check_rate_limit(client_id: str) -> bool:
-    """Simple sliding window per-client rate limit (in-memory)."""
-    now = int(time.time())
-    entry = _rate_limit_store.get(client_id)
-    if not entry:
-        _rate_limit_store[client_id] = (1, now)
-        return True
-    count, first_ts = entry
-    if now - first_ts > _REFRESH_RATE_LIMIT_WINDOW_SECONDS:
-        _rate_limit_store[client_id] = (1, now)
-        return True
-    if count >= _REFRESH_RATE_LIMIT_MAX:
-        return False
-    _rate_limit_store[client_id] = (count + 1, first_ts)
-    return True
+    """Sliding window per-client rate limit (shared store when RATE_LIMIT_BACKEND=postgres)."""
+    return refresh_rate_limiter.allow(client_id)
+
+class UserCache:
+    """
+    username -> payload utilisateur (to_payload_dict), expiré après `ttl` secondes,
+    éviction LRU au-delà de `maxsize`. Invalidé par user_routes (mise à jour, suppression) ;
+    entre workers gunicorn, l'écart est borné par le TTL.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    def get(self, username: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return payload
+
+    def set(self, username: str, payload: dict):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[username] = (time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None):
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+
+_user_cache = UserCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAXSIZE)
+
+
+def invalidate_user_cache(username: Optional[str] = None) -> None:
+    """ À appeler après modification / suppression d'un utilisateur (None = tout vider). """
+    _user_cache.invalidate(username)
+
+
+def get_auth_user(username: str) -> Optional[dict]:
+    """ Payload de l'utilisateur (id, fullname, username, role) : cache, sinon table users. """
+    payload = _user_cache.get(username)
+    if payload is not None:
+        USER_CACHE_LOOKUPS.inc(result="hit")
+        return dict(payload)
+
+    USER_CACHE_LOOKUPS.inc(result="miss")
+    user: Optional[User] = User.query.filter_by(username=username).first()
+    if not user:
+        return None
+    payload = user.to_payload_dict()
+    _user_cache.set(username, payload)
+    return dict(payload)
 
 # Utilities: DB helpers (SQLAlchemy)
 def db_save_refresh_token(username: str, hashed_token: str, expires_at: datetime) -> RefreshToken:
@@ -122,17 +184,17 @@ def require_auth(f=None, *, roles: Optional[list[str]] = None):
             if not username:
                 return jsonify({"error": "Invalid token payload"}), 401
 
-            # 3. Validate user exists in PostgreSQL
-            user: Optional[User] = User.query.filter_by(username=username).first()
+            # 3. Validate user exists in PostgreSQL (cache TTL + LRU)
+            user = get_auth_user(username)
             if not user:
                 return jsonify({"error": "User not found"}), 401
 
             # 4. Validate role if required
-            if roles and user.role not in roles:
+            if roles and user["role"] not in roles:
                 return jsonify({"error": "Forbidden"}), 403
 
             # 5. Attach user context to g
-            g.current_user = user.to_payload_dict()
+            g.current_user = user
 
             return func(*args, **kwargs)
         return wrapped
@@ -0,0 +1,403 @@
+"""
+Exécution en arrière-plan des déclencheurs HTTP longs (sync DHIS2, arrimage).
+
+La route enregistre le job dans background_jobs et répond 202 { "id" } ; le travail tourne
+dans le pool de threads du processus (BACKGROUND_JOB_WORKERS), le thread gunicorn est libéré.
+
+Progression : chaque événement (total, orgunit terminée, lignes par entité, erreur, fin) est
+ajouté à background_job_events (seq croissant). Le client interroge GET /api/jobs/<id>?after=<seq>
+toutes les BACKGROUND_JOB_POLL_SECONDS (n'importe quel worker) : état du job + événements
+seq > after. Chaque appel est court : aucun thread gunicorn n'est tenu pendant le job.
+
+- un seul job actif par type (index unique partiel) : un second déclenchement renvoie 409
+  avec l'id du job en cours
+- `on_finish` (ex. AdmissionSlot.release) est appelé une seule fois : à la fin du job, ou
+  aussitôt si le job n'a pas pu être lancé
+- chaque processus signale ses jobs actifs (heartbeat) ; un job dont le processus a disparu
+  est marqué en échec, les jobs et événements sont purgés après BACKGROUND_JOB_TTL_HOURS
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extras
+
+from utils.config import config
+from utils.db import get_connection
+from utils.metrics import REGISTRY
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+BACKGROUND_JOBS = REGISTRY.counter("background_jobs_total", "Jobs d'arrière-plan terminés", ["kind", "status"])
+BACKGROUND_JOB_SECONDS = REGISTRY.histogram("background_job_seconds", "Durée des jobs d'arrière-plan", ["kind"],
+                                            buckets=(1, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200))
+BACKGROUND_JOBS_ACTIVE = REGISTRY.gauge("background_jobs_active", "Jobs d'arrière-plan en cours dans le processus")
+
+ACTIVE_STATUSES = ("queued", "running")
+FINAL_STATUSES = ("succeeded", "failed")
+JOB_COLUMNS = ("id, kind, params, triggered_by, status, progress, result, http_status, error, worker, "
+               "created_at, started_at, finished_at, heartbeat_at")
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_active: Dict[str, str] = {}  # job_id -> kind, jobs en cours dans ce processus
+_active_lock = threading.Lock()
+_heartbeat: Optional[threading.Thread] = None
+_last_cleanup = 0.0
+
+
+class JobError(Exception):
+    """ Refus de soumission / d'accès (message, statut HTTP, champs additionnels). """
+
+    def __init__(self, message: str, status: int = 400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+# ------------------------
+# Schéma
+# ------------------------
+def ensure_background_jobs_schema() -> bool:
+    """ Tables background_jobs / background_job_events ; exécuté une seule fois par processus. """
+    global _schema_ready
+    if _schema_ready:
+        return True
+    with _schema_lock:
+        if _schema_ready:
+            return True
+        conn = get_connection()
+        if conn is None:
+            logger.error("❌ Schéma background_jobs non vérifié : connexion PostgreSQL indisponible")
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS background_jobs (
+                        id TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        params JSONB NOT NULL DEFAULT '{}'::jsonb,
+                        triggered_by TEXT,
+                        status TEXT NOT NULL,
+                        progress JSONB NOT NULL DEFAULT '{}'::jsonb,
+                        result JSONB,
+                        http_status INT,
+                        error TEXT,
+                        worker TEXT,
+                        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                        started_at TIMESTAMP WITH TIME ZONE,
+                        finished_at TIMESTAMP WITH TIME ZONE,
+                        heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_background_jobs_created ON background_jobs(created_at DESC);
+                    -- Un seul job actif par type (sync orgunits, sync TEI, arrimage...)
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_background_jobs_active_kind
+                        ON background_jobs(kind) WHERE status IN ('queued', 'running');
+
+                    CREATE TABLE IF NOT EXISTS background_job_events (
+                        seq BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                        job_id TEXT NOT NULL REFERENCES background_jobs(id) ON DELETE CASCADE,
+                        event TEXT NOT NULL,
+                        data JSONB NOT NULL,
+                        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_background_job_events_job ON background_job_events(job_id, seq);
+                """)
+            conn.commit()
+            _schema_ready = True
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.exception(f"❌ Création du schéma background_jobs impossible : {e}")
+            return False
+        finally:
+            conn.close()
+
+
+# ------------------------
+# Progression
+# ------------------------
+class JobProgress:
+    """
+    Émetteur d'événements d'un job, partagé par les threads qui traitent ses orgunits.
+    `progress` (dernier état agrégé) est recopié dans background_jobs à chaque événement.
+    """
+
+    def __init__(self, job_id: str, conn):
+        self.job_id = job_id
+        self._conn = conn
+        self._lock = threading.Lock()
+        self.state: Dict[str, Any] = {"total": None, "done": 0, "failed": 0, "rows": {}}
+
+    def __call__(self, event: str, data: Dict[str, Any]):
+        """ Appelé par SyncRunRecorder (événements total / orgunit) ou directement. """
+        with self._lock:
+            if event == "total":
+                self.state["total"] = data.get("total")
+            elif event == "orgunit":
+                self.state.update(done=data.get("done", self.state["done"]), failed=data.get("failed", self.state["failed"]))
+                for entity, counts in (data.get("rows") or {}).items():
+                    entry = self.state["rows"].setdefault(entity, {})
+                    for name, value in counts.items():
+                        entry[name] = entry.get(name, 0) + int(value or 0)
+            try:
+                with self._conn.cursor() as cur:
+                    cur.execute("INSERT INTO background_job_events (job_id, event, data) VALUES (%s, %s, %s);",
+                                (self.job_id, event, json.dumps(data, default=str)))
+                    cur.execute("UPDATE background_jobs SET progress = %s WHERE id = %s;",
+                                (json.dumps(self.state), self.job_id))
+            except Exception as e:
+                # La progression ne doit jamais faire échouer le job
+                logger.warning(f"Événement {event} du job {self.job_id} non enregistré : {e}")
+
+
+# ------------------------
+# Soumission / consultation
+# ------------------------
+def _executor_instance() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=config.BACKGROUND_JOB_WORKERS, thread_name_prefix="bg-job")
+    return _executor
+
+
+def _serialize(job: Dict[str, Any]) -> Dict[str, Any]:
+    for key in ("created_at", "started_at", "finished_at", "heartbeat_at"):
+        if job.get(key):
+            job[key] = job[key].isoformat()
+    return job
+
+
+def submit_job(kind: str, params: Dict[str, Any], triggered_by: Optional[str],
+               func: Callable[..., Tuple[Dict[str, Any], int]],
+               on_finish: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """
+    Enregistre puis lance `func(progress=JobProgress)` en arrière-plan ; func retourne (résultat, statut HTTP).
+    Lève JobError(409, job_id=...) si un job du même type est déjà actif.
+    """
+    try:
+        return _submit_job(kind, params, triggered_by, func, on_finish)
+    except BaseException:
+        if on_finish is not None:
+            on_finish()
+        raise
+
+
+def _submit_job(kind: str, params: Dict[str, Any], triggered_by: Optional[str],
+                func: Callable[..., Tuple[Dict[str, Any], int]],
+                on_finish: Optional[Callable[[], None]]) -> Dict[str, Any]:
+    if not ensure_background_jobs_schema():
+        raise JobError("PostgreSQL connection failed", 500)
+    _maybe_cleanup()
+
+    job_id = uuid.uuid4().hex
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO background_jobs (id, kind, params, triggered_by, status)
+                VALUES (%s, %s, %s, %s, 'queued')
+                ON CONFLICT DO NOTHING
+                RETURNING id;
+            """, (job_id, kind, json.dumps(params, default=str), triggered_by))
+            if cur.fetchone() is None:
+                cur.execute("SELECT id FROM background_jobs WHERE kind = %s AND status IN %s;", (kind, ACTIVE_STATUSES))
+                running = cur.fetchone()
+                raise JobError(f"A '{kind}' job is already running", 409, job_id=running[0] if running else None)
+    finally:
+        conn.close()
+
+    with _active_lock:
+        _active[job_id] = kind
+    _start_heartbeat()
+    _executor_instance().submit(_run_job, job_id, kind, func, on_finish)
+    logger.info(f"🧾 Job {kind} {job_id} en file ({triggered_by})")
+    return {"id": job_id, "kind": kind, "status": "queued", "poll": f"/api/jobs/{job_id}?after=0"}
+
+
+def _can_access(job: Dict[str, Any], user: Dict[str, Any]) -> bool:
+    return job["triggered_by"] == user.get("username") or user.get("role") in ("admin", "superadmin")
+
+
+def get_job(job_id: str, user: Dict[str, Any], after: Optional[int] = None) -> Dict[str, Any]:
+    """
+    État du job ; avec `after`, ajoute les événements seq > after (au plus 500, dans l'ordre),
+    `last_seq` (valeur de `after` pour l'appel suivant) et `poll_after_ms` tant qu'il est actif.
+    """
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(f"SELECT {JOB_COLUMNS} FROM background_jobs WHERE id = %s;", (job_id,))
+            job = cur.fetchone()
+        if not job or not _can_access(job, user):
+            raise JobError("Job not found", 404)
+        # Événements lus après l'état : un job terminé a déjà écrit tous les siens
+        events = read_events(conn, job_id, after) if after is not None else None
+    finally:
+        conn.close()
+    job = _serialize(job)
+    if events is not None:
+        job["events"] = [{"seq": seq, "event": event, "data": data} for seq, event, data in events]
+        job["last_seq"] = events[-1][0] if events else after
+        if len(events) == 500:
+            job["poll_after_ms"] = 0  # d'autres événements attendent déjà
+        elif job["status"] not in FINAL_STATUSES:
+            job["poll_after_ms"] = int(config.BACKGROUND_JOB_POLL_SECONDS * 1000)
+    return job
+
+
+def list_jobs(user: Dict[str, Any], kind: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """ Jobs de l'utilisateur (tous pour un admin), du plus récent au plus ancien. """
+    is_admin = user.get("role") in ("admin", "superadmin")
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT {JOB_COLUMNS} FROM background_jobs
+                WHERE (%s OR triggered_by = %s) AND (%s::text IS NULL OR kind = %s)
+                ORDER BY created_at DESC LIMIT %s;
+            """, (is_admin, user.get("username"), kind, kind, limit))
+            return [_serialize(job) for job in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def read_events(conn, job_id: str, after: int, limit: int = 500) -> List[Tuple[int, str, Any]]:
+    """ Événements seq > after, dans l'ordre. """
+    with conn.cursor() as cur:
+        cur.execute("SELECT seq, event, data FROM background_job_events WHERE job_id = %s AND seq > %s ORDER BY seq LIMIT %s;",
+                    (job_id, after, limit))
+        return cur.fetchall()
+
+
+# ------------------------
+# Exécution (thread du pool)
+# ------------------------
+def _run_job(job_id: str, kind: str, func: Callable[..., Tuple[Dict[str, Any], int]],
+             on_finish: Optional[Callable[[], None]] = None):
+    started = time.perf_counter()
+    status = "failed"
+    conn = get_connection()
+    BACKGROUND_JOBS_ACTIVE.inc()
+    try:
+        if conn is None:
+            raise psycopg2.OperationalError("PostgreSQL connection failed")
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE background_jobs SET status = 'running', started_at = now(), heartbeat_at = now(), worker = %s
+                WHERE id = %s;
+            """, (WORKER_ID, job_id))
+        progress = JobProgress(job_id, conn)
+        progress("status", {"status": "running"})
+
+        try:
+            result, http_status = func(progress=progress)
+            error = None if http_status < 400 else (result.get("error") or result.get("detail"))
+        except Exception as e:
+            logger.exception(f"❌ Job {kind} {job_id} en échec")
+            result, http_status, error = {"error": str(e)}, 500, str(e)
+
+        status = "succeeded" if http_status < 400 else "failed"
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE background_jobs SET status = %s, result = %s, http_status = %s, error = %s, finished_at = now()
+                WHERE id = %s;
+            """, (status, json.dumps(result, default=str), http_status, error, job_id))
+        progress("done", {"status": status, "http_status": http_status, "result": result})
+        logger.info(f"✅ Job {kind} {job_id} : {status} en {time.perf_counter() - started:.1f} s")
+    except Exception as e:
+        logger.error(f"❌ Job {kind} {job_id} : statut non enregistré ({e})")
+    finally:
+        BACKGROUND_JOBS.inc(kind=kind, status=status)
+        BACKGROUND_JOB_SECONDS.observe(time.perf_counter() - started, kind=kind)
+        BACKGROUND_JOBS_ACTIVE.dec()
+        with _active_lock:
+            _active.pop(job_id, None)
+        if conn is not None:
+            conn.close()
+        if on_finish is not None:
+            on_finish()
+
+
+# ------------------------
+# Heartbeat / purge
+# ------------------------
+def _start_heartbeat():
+    global _heartbeat
+    if _heartbeat is not None and _heartbeat.is_alive():
+        return
+    with _active_lock:
+        if _heartbeat is not None and _heartbeat.is_alive():
+            return
+        _heartbeat = threading.Thread(target=_heartbeat_loop, name="bg-job-heartbeat", daemon=True)
+        _heartbeat.start()
+
+
+def _heartbeat_loop():
+    """ Signale périodiquement les jobs actifs de ce processus. """
+    while True:
+        time.sleep(config.BACKGROUND_JOB_HEARTBEAT_SECONDS)
+        with _active_lock:
+            job_ids = list(_active)
+        if not job_ids:
+            continue
+        conn = get_connection()
+        if conn is None:
+            continue
+        try:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE background_jobs SET heartbeat_at = now() WHERE id = ANY(%s);", (job_ids,))
+        except Exception as e:
+            logger.warning(f"Heartbeat des jobs impossible : {e}")
+        finally:
+            conn.close()
+
+
+def _maybe_cleanup():
+    """ Au plus une fois par minute : jobs orphelins en échec, purge des anciens jobs. """
+    global _last_cleanup
+    now = time.monotonic()
+    if now - _last_cleanup < 60:
+        return
+    _last_cleanup = now
+    conn = get_connection()
+    if conn is None:
+        return
+    try:
+        with conn.cursor() as cur:
+            # Processus disparu : plus de heartbeat depuis 3 intervalles
+            cur.execute("""
+                UPDATE background_jobs SET status = 'failed', error = 'Worker lost', finished_at = now()
+                WHERE status IN %s AND heartbeat_at < now() - make_interval(secs => %s)
+                RETURNING id;
+            """, (ACTIVE_STATUSES, 3 * config.BACKGROUND_JOB_HEARTBEAT_SECONDS))
+            lost = [row[0] for row in cur.fetchall()]
+            for job_id in lost:
+                cur.execute("INSERT INTO background_job_events (job_id, event, data) VALUES (%s, 'done', %s);",
+                            (job_id, json.dumps({"status": "failed", "http_status": 500, "result": {"error": "Worker lost"}})))
+            cur.execute("DELETE FROM background_jobs WHERE created_at < now() - make_interval(hours => %s);",
+                        (config.BACKGROUND_JOB_TTL_HOURS,))
+            if lost or cur.rowcount:
+                logger.info(f"🧹 Jobs d'arrière-plan : {len(lost)} orphelins en échec, {cur.rowcount} purgés")
+    except Exception as e:
+        logger.warning(f"Purge des jobs d'arrière-plan impossible : {e}")
+    finally:
+        conn.close()
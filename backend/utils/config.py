@@ -17,6 +17,15 @@ class Config:
     JWT_SECRET = os.getenv("JWT_SECRET", "change_this_secret_in_prod")
     ACCESS_TOKEN_EXPIRES_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRES_MINUTES", 15))  # 15 min default
     REFRESH_TOKEN_EXPIRES_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRES_DAYS", 30))  # 30 days
+    # Cache des utilisateurs dans require_auth (0 = désactivé)
+    AUTH_USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", 30))
+    AUTH_USER_CACHE_MAXSIZE = int(os.getenv("AUTH_USER_CACHE_MAXSIZE", 1024))
+    # Rate limit (/api/auth/refresh) : backend memory (par worker) ou postgres (partagé)
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+    RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 10000))
+    RATE_LIMIT_SWEEP_SECONDS = float(os.getenv("RATE_LIMIT_SWEEP_SECONDS", 60))
+    REFRESH_RATE_LIMIT_MAX = int(os.getenv("REFRESH_RATE_LIMIT_MAX", 10))
+    REFRESH_RATE_LIMIT_WINDOW_SECONDS = int(os.getenv("REFRESH_RATE_LIMIT_WINDOW_SECONDS", 60))
 
     TOGO_DHIS2_URL = os.getenv('TOGO_DHIS2_URL')
     TOGO_DHIS2_USER = os.getenv('TOGO_DHIS2_USER')
@@ -33,6 +42,14 @@ class Config:
     POSTGRES_DB = os.getenv('POSTGRES_DB')
     POSTGRES_USER = os.getenv('POSTGRES_USER')
     POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+    # Réplicas en lecture (DSN libpq séparés par des virgules) ; vide = tout sur le primaire
+    POSTGRES_REPLICA_DSNS = [dsn.strip() for dsn in os.getenv('POSTGRES_REPLICA_DSNS', '').split(',') if dsn.strip()]
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '10'))
+    REPLICA_CHECK_SECONDS = int(os.getenv('REPLICA_CHECK_SECONDS', '5'))
+    REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '30'))
+    REPLICA_COOKIE_NAME = os.getenv('REPLICA_COOKIE_NAME', 'itc_read_after')
+    REPLICA_COOKIE_SECURE = os.getenv('REPLICA_COOKIE_SECURE', 'false') == 'true'
+    REPLICA_CONNECT_TIMEOUT = int(os.getenv('REPLICA_CONNECT_TIMEOUT', '3'))
 
     FORCE_INIT_CLASS = os.getenv('FORCE_INIT_CLASS') == 'true'
 
@@ -53,7 +70,115 @@ class Config:
     BACK_OFF = int(os.getenv('BACK_OFF', '2'))
     MAX_WORKERS = int(os.getenv('MAX_WORKERS', '50'))
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', '10000'))
+    # Transport HTTP partagé (clients DHIS2 source/destination)
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', os.getenv('MAX_WORKERS', '50')))
+    HTTP_COMPRESSION = os.getenv('HTTP_COMPRESSION', 'true') == 'true'
+    HTTP_KEEPALIVE_SECONDS = int(os.getenv('HTTP_KEEPALIVE_SECONDS', '30'))
+    # Décodage JSON rapide (msgspec/orjson si installés, sinon json)
+    FAST_JSON = os.getenv('FAST_JSON', 'true') == 'true'
+    # Parsing incrémental des réponses paging=false (élément par élément depuis le flux HTTP)
+    STREAM_JSON = os.getenv('STREAM_JSON', 'false') == 'true'
+    STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', str(256 * 1024)))
+
+    # Métriques Prometheus (/api/metrics)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true') == 'true'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # si défini : "Authorization: Bearer <token>" requis
+    METRICS_DIR = os.getenv('METRICS_DIR')  # dossier partagé pour agréger les workers gunicorn
+    METRICS_FLUSH_SECONDS = int(os.getenv('METRICS_FLUSH_SECONDS', '10'))
+    SCHEDULER_METRICS_PORT = int(os.getenv('SCHEDULER_METRICS_PORT', '5802'))
+    SCHEDULER_METRICS_HOST = os.getenv('SCHEDULER_METRICS_HOST', '0.0.0.0')
+
+    # Profileur statistique opt-in (admin) : /api/profiler
+    PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false') == 'true'
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'outputs_files/profiles')
+    PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+    PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '1800'))
+    PROFILE_MAX_ACTIVE = int(os.getenv('PROFILE_MAX_ACTIVE', '2'))
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))
+    PROFILE_JOBS = [j.strip() for j in os.getenv('PROFILE_JOBS', '').split(',') if j.strip()]
+
+    # Traçage SQL par requête HTTP (Server-Timing) et slow-query log (logs/slow_queries.log)
+    QUERY_TRACE_ENABLED = os.getenv('QUERY_TRACE_ENABLED', 'true') == 'true'
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '500'))
+    QUERY_COUNT_WARN = int(os.getenv('QUERY_COUNT_WARN', '50'))
+    QUERY_TRACE_TOP = int(os.getenv('QUERY_TRACE_TOP', '5'))
+    # Analyse lexicale des requêtes de /api/sql/execute (cache LRU par empreinte)
+    SQL_ANALYZER_CACHE_SIZE = int(os.getenv('SQL_ANALYZER_CACHE_SIZE', '2048'))
+    # Contrôle de coût EXPLAIN avant exécution (0 = illimité ; superadmin jamais limité)
+    SQL_COST_GUARD_ENABLED = os.getenv('SQL_COST_GUARD_ENABLED', 'true') == 'true'
+    SQL_COST_LIMITS = {
+        "user": (float(os.getenv('SQL_MAX_COST_USER', '1000000')), float(os.getenv('SQL_MAX_PLAN_ROWS_USER', '5000000'))),
+        "admin": (float(os.getenv('SQL_MAX_COST_ADMIN', '50000000')), float(os.getenv('SQL_MAX_PLAN_ROWS_ADMIN', '0'))),
+    }
+    SQL_COST_CACHE_SECONDS = int(os.getenv('SQL_COST_CACHE_SECONDS', '300'))
+    SQL_COST_CACHE_SIZE = int(os.getenv('SQL_COST_CACHE_SIZE', '1024'))
+    SQL_COST_EXPLAIN_TIMEOUT_MS = int(os.getenv('SQL_COST_EXPLAIN_TIMEOUT_MS', '5000'))  # planification seule
+
+    # Requêtes sauvegardées : exécution préparée et snapshots rafraîchis après le refresh de la vue
+    SAVED_QUERY_PREPARED = os.getenv('SAVED_QUERY_PREPARED', 'true') == 'true'
+    SAVED_QUERY_SNAPSHOTS_ENABLED = os.getenv('SAVED_QUERY_SNAPSHOTS_ENABLED', 'true') == 'true'
+    SAVED_QUERY_SNAPSHOT_MAX_ROWS = int(os.getenv('SAVED_QUERY_SNAPSHOT_MAX_ROWS', '50000'))
+    SAVED_QUERY_SNAPSHOT_TIMEOUT_MS = int(os.getenv('SAVED_QUERY_SNAPSHOT_TIMEOUT_MS', '120000'))
+
+    # Jobs SQL asynchrones (POST /api/sql/jobs) : pool dédié, résultats déversés dans sql_job_rows
+    SQL_JOB_WORKERS = int(os.getenv('SQL_JOB_WORKERS', '2'))
+    SQL_JOB_MAX_ROWS = int(os.getenv('SQL_JOB_MAX_ROWS', '1000000'))
+    SQL_JOB_TIMEOUT_MS = int(os.getenv('SQL_JOB_TIMEOUT_MS', '600000'))
+    SQL_JOB_BATCH_SIZE = int(os.getenv('SQL_JOB_BATCH_SIZE', '5000'))
+    SQL_JOB_MAX_ACTIVE_PER_USER = int(os.getenv('SQL_JOB_MAX_ACTIVE_PER_USER', '3'))
+    SQL_JOB_RESULT_TTL_HOURS = int(os.getenv('SQL_JOB_RESULT_TTL_HOURS', '24'))
+    SQL_JOB_CLEANUP_SECONDS = int(os.getenv('SQL_JOB_CLEANUP_SECONDS', '300'))
+
+    # Sessions de curseur serveur ({"cursor": true} sur /api/sql/execute, puis /api/sql/cursor/<id>/next)
+    SQL_CURSOR_TTL_SECONDS = int(os.getenv('SQL_CURSOR_TTL_SECONDS', '300'))
+    SQL_CURSOR_MAX_PER_USER = int(os.getenv('SQL_CURSOR_MAX_PER_USER', '2'))
+    SQL_CURSOR_MAX_SESSIONS = int(os.getenv('SQL_CURSOR_MAX_SESSIONS', '32'))
+    SQL_CURSOR_SWEEP_SECONDS = int(os.getenv('SQL_CURSOR_SWEEP_SECONDS', '30'))
+
+    # Jobs d'arrière-plan (sync / arrimage déclenchés par HTTP) ; progression par polling client
+    BACKGROUND_JOB_WORKERS = int(os.getenv('BACKGROUND_JOB_WORKERS', '2'))
+    BACKGROUND_JOB_HEARTBEAT_SECONDS = int(os.getenv('BACKGROUND_JOB_HEARTBEAT_SECONDS', '15'))
+    BACKGROUND_JOB_TTL_HOURS = int(os.getenv('BACKGROUND_JOB_TTL_HOURS', '72'))
+    BACKGROUND_JOB_POLL_SECONDS = float(os.getenv('BACKGROUND_JOB_POLL_SECONDS', '2'))
+
+    # Sync TEI multi-processus (> 1 : orgunits réparties sur N processus, sinon threads)
+    SYNC_PROCESSES = int(os.getenv('SYNC_PROCESSES', '0'))
+    SYNC_PROCESS_THREADS = int(os.getenv('SYNC_PROCESS_THREADS', '0'))  # 0 = MAX_WORKERS / SYNC_PROCESSES
+    SYNC_PROCESS_CHUNK_SIZE = int(os.getenv('SYNC_PROCESS_CHUNK_SIZE', '20'))
+    SYNC_PROCESS_POOL_RESTARTS = int(os.getenv('SYNC_PROCESS_POOL_RESTARTS', '2'))  # pools recréés après la mort d'un processus
+
+    # File de sync PostgreSQL (SKIP LOCKED) partagée par plusieurs replicas du scheduler
+    SYNC_QUEUE_ENABLED = os.getenv('SYNC_QUEUE_ENABLED', 'false') == 'true'
+    SYNC_QUEUE_CONCURRENCY = int(os.getenv('SYNC_QUEUE_CONCURRENCY', os.getenv('MAX_WORKERS', '50')))
+    SYNC_QUEUE_LEASE_SECONDS = int(os.getenv('SYNC_QUEUE_LEASE_SECONDS', '300'))
+    SYNC_QUEUE_MAX_ATTEMPTS = int(os.getenv('SYNC_QUEUE_MAX_ATTEMPTS', '3'))
+    SYNC_QUEUE_POLL_SECONDS = int(os.getenv('SYNC_QUEUE_POLL_SECONDS', '60'))
+    SYNC_QUEUE_TTL_DAYS = int(os.getenv('SYNC_QUEUE_TTL_DAYS', '30'))
+
+    # Contrôle d'admission par classe de ressources : (concurrence max, file max, attente max en s), par processus
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true') == 'true'
+    # Threads par worker gunicorn (--threads, cf. Dockerfile.backend) : une requête en file occupe un thread
+    WEB_THREADS = int(os.getenv('WEB_THREADS', '4'))
+    # Par défaut, exécution + file SQL ≤ WEB_THREADS - 1 : un thread reste libre pour les autres routes
+    ADMISSION_SQL_CONCURRENCY = int(os.getenv('ADMISSION_SQL_CONCURRENCY', str(max(1, WEB_THREADS // 2))))
+    ADMISSION_SQL_QUEUE = int(os.getenv('ADMISSION_SQL_QUEUE', str(max(0, WEB_THREADS - 1 - ADMISSION_SQL_CONCURRENCY))))
+    ADMISSION_CLASSES = {
+        "sync": (int(os.getenv('ADMISSION_SYNC_CONCURRENCY', '1')), int(os.getenv('ADMISSION_SYNC_QUEUE', '0')), float(os.getenv('ADMISSION_SYNC_QUEUE_TIMEOUT', '0'))),
+        "arrimage": (int(os.getenv('ADMISSION_ARRIMAGE_CONCURRENCY', '1')), int(os.getenv('ADMISSION_ARRIMAGE_QUEUE', '0')), float(os.getenv('ADMISSION_ARRIMAGE_QUEUE_TIMEOUT', '0'))),
+        "matview": (int(os.getenv('ADMISSION_MATVIEW_CONCURRENCY', '1')), int(os.getenv('ADMISSION_MATVIEW_QUEUE', '0')), float(os.getenv('ADMISSION_MATVIEW_QUEUE_TIMEOUT', '0'))),
+        "sql": (ADMISSION_SQL_CONCURRENCY, ADMISSION_SQL_QUEUE, float(os.getenv('ADMISSION_SQL_QUEUE_TIMEOUT', '10'))),
+    }
+    # Requêtes simultanées par utilisateur et par classe (0 = illimité)
+    ADMISSION_ROLE_QUOTAS = {
+        "user": int(os.getenv('ADMISSION_QUOTA_USER', '2')),
+        "admin": int(os.getenv('ADMISSION_QUOTA_ADMIN', '4')),
+        "superadmin": int(os.getenv('ADMISSION_QUOTA_SUPERADMIN', '0')),
+    }
+
 
+    # Élection du leader (advisory lock PostgreSQL) : seul le leader exécute les jobs cron
+    SCHEDULER_LEADER_ELECTION = os.getenv('SCHEDULER_LEADER_ELECTION', 'true') == 'true'
+    SCHEDULER_LEADER_CHECK_SECONDS = int(os.getenv('SCHEDULER_LEADER_CHECK_SECONDS', '5'))
 
     # APScheduler configuration keys (Flask-APScheduler expects APSCHEDULER_* keys)
     SCHEDULER_API_ENABLED = os.getenv("SCHEDULER_API_ENABLED", "false") == 'true'
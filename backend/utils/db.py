@@ -1,5 +1,6 @@
 from psycopg2 import connect, sql, OperationalError
 from utils.config import config
+from utils.query_tracer import connection_factory
 
 def get_connection():
     """
@@ -13,6 +14,7 @@ def get_connection():
             database=config.POSTGRES_DB,
             user=config.POSTGRES_USER,
             password=config.POSTGRES_PASSWORD,
+            connection_factory=connection_factory(),
         )
         conn.autocommit = True
         return conn
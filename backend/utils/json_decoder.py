@@ -0,0 +1,170 @@
+"""
+Décodage rapide des réponses DHIS2.
+
+Ordre de préférence (selon les librairies installées) :
+  1. msgspec + schémas typés (TypedDict) : les clés non déclarées
+     (href, lastUpdatedByUserInfo, createdByUserInfo, storedBy, ...) sont ignorées
+     pendant le décodage, sans jamais être matérialisées.
+  2. orjson : décodage générique rapide en dict/list.
+  3. json (stdlib) : repli.
+Les schémas produisent des dicts ordinaires, compatibles avec TrackerFlattener.
+
+Un corps invalide ou tronqué lève toujours JsonDecodeError (sous-classe de ValueError),
+quel que soit le décodeur : les appelants (retry HTTP) n'ont qu'une exception à traiter.
+"""
+import json
+from typing import Any, Dict, List, Optional, TypedDict, Union
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    orjson = None
+
+# Erreurs de syntaxe des décodeurs disponibles (orjson.JSONDecodeError est un ValueError)
+_SYNTAX_ERRORS = (ValueError,) + ((msgspec.DecodeError,) if msgspec is not None else ())
+
+
+class JsonDecodeError(ValueError):
+    """ Corps JSON invalide ou tronqué (msgspec, orjson ou json). """
+
+
+# ------------------------
+# Schémas DHIS2 (tracker)
+# ------------------------
+class DataValue(TypedDict, total=False):
+    dataElement: str
+    value: Any
+
+
+class Attribute(TypedDict, total=False):
+    attribute: str
+    value: Any
+    deleted: bool
+
+
+class Event(TypedDict, total=False):
+    event: str
+    dueDate: Optional[str]
+    programStage: Optional[str]
+    orgUnit: Optional[str]
+    enrollment: Optional[str]
+    trackedEntityInstance: Optional[str]
+    enrollmentStatus: Optional[str]
+    status: Optional[str]
+    eventDate: Optional[str]
+    attributeCategoryOptions: Optional[str]
+    attributeOptionCombo: Optional[str]
+    lastUpdated: Optional[str]
+    created: Optional[str]
+    createdAtClient: Optional[str]
+    deleted: bool
+    dataValues: List[DataValue]
+
+
+class Enrollment(TypedDict, total=False):
+    enrollment: str
+    trackedEntityInstance: Optional[str]
+    trackedEntityType: Optional[str]
+    orgUnit: Optional[str]
+    status: Optional[str]
+    enrollmentDate: Optional[str]
+    incidentDate: Optional[str]
+    lastUpdated: Optional[str]
+    created: Optional[str]
+    createdAtClient: Optional[str]
+    deleted: bool
+    attributes: List[Attribute]
+    events: List[Event]
+
+
+class TrackedEntityInstance(TypedDict, total=False):
+    trackedEntityInstance: str
+    orgUnit: Optional[str]
+    trackedEntityType: Optional[str]
+    lastUpdated: Optional[str]
+    created: Optional[str]
+    createdAtClient: Optional[str]
+    deleted: bool
+    enrollments: List[Enrollment]
+
+
+class Pager(TypedDict, total=False):
+    page: int
+    pageCount: int
+    total: int
+    pageSize: int
+
+
+class TrackedEntityInstancesPage(TypedDict, total=False):
+    pager: Pager
+    trackedEntityInstances: List[TrackedEntityInstance]
+
+
+class DataValueSet(TypedDict, total=False):
+    dataSet: str
+    period: str
+    orgUnit: str
+    completeDate: Optional[str]
+    dataValues: List[Dict[str, Any]]
+
+
+# Schéma typé par clé de données DHIS2
+SCHEMAS: Dict[str, Any] = {
+    "trackedEntityInstances": TrackedEntityInstancesPage,
+    "dataValueSets": DataValueSet,
+}
+
+# Schéma typé d'un élément du tableau (parsing incrémental, utils.json_stream)
+ITEM_SCHEMAS: Dict[str, Any] = {
+    "trackedEntityInstances": TrackedEntityInstance,
+}
+
+_decoders: Dict[Any, Any] = {}
+
+
+def _get_decoder(schema):
+    decoder = _decoders.get(schema)
+    if decoder is None:
+        decoder = _decoders[schema] = msgspec.json.Decoder(schema)
+    return decoder
+
+
+def decode_json(raw: Union[bytes, str], schema: Any = None) -> Any:
+    """
+    Décode un corps JSON (bytes) avec le décodeur le plus rapide disponible.
+    `schema` : type TypedDict (ex: TrackedEntityInstancesPage) utilisé si msgspec est installé.
+    """
+    if schema is not None and msgspec is not None:
+        try:
+            return _get_decoder(schema).decode(raw)
+        except msgspec.ValidationError as e:
+            # Réponse non conforme au schéma → décodage générique
+            logger.warning("Schéma %s non respecté (%s) → décodage générique", getattr(schema, "__name__", schema), e)
+        except msgspec.DecodeError as e:
+            raise JsonDecodeError(str(e)) from e
+
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        if msgspec is not None:
+            return msgspec.json.decode(raw)
+        return json.loads(raw)
+    except _SYNTAX_ERRORS as e:
+        raise JsonDecodeError(str(e)) from e
+
+
+def available_backend() -> str:
+    """Nom du décodeur effectivement utilisé (pour logs / diagnostics)."""
+    if msgspec is not None:
+        return "msgspec"
+    if orjson is not None:
+        return "orjson"
+    return "json"
@@ -0,0 +1,127 @@
+"""
+Parsing JSON incrémental pour les réponses DHIS2 `paging=false`.
+
+Extrait un à un les éléments du tableau `{"<data_key>": [ ... ]}` à partir d'un flux
+de chunks (bytes), sans jamais bufferiser le document complet : seul l'élément en
+cours de lecture est conservé en mémoire, puis décodé (utils.json_decoder) et rendu.
+"""
+import re
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from utils.json_decoder import decode_json
+
+# Caractères structurants hors chaîne / dans une chaîne
+_STRUCT_RE = re.compile(rb'[{}\[\]"\\]')
+_STRING_RE = re.compile(rb'["\\]')
+_SKIP_RE = re.compile(rb'[\s,]*')
+_SCALAR_END_RE = re.compile(rb'[,\]\s]')
+
+_OPEN = (ord("{"), ord("["))
+_CLOSE = (ord("}"), ord("]"))
+_QUOTE = ord('"')
+_BACKSLASH = ord("\\")
+_ARRAY_END = ord("]")
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+def iter_json_array(chunks: Iterable[bytes], data_key: str, item_decoder: Optional[Callable[[bytes], Any]] = None) -> Iterator[Any]:
+    """
+    Itère sur les éléments du tableau associé à `data_key` dans un flux JSON.
+    `item_decoder(bytes)` décode chaque élément (par défaut decode_json).
+    """
+    decode = item_decoder or decode_json
+    key_re = re.compile(rb'"' + re.escape(data_key.encode("utf-8")) + rb'"\s*:\s*\[')
+    keep_tail = len(data_key) + 64
+
+    buf = bytearray()
+    chunk_iter = iter(chunks)
+
+    def more() -> bool:
+        for chunk in chunk_iter:
+            if chunk:
+                buf.extend(chunk)
+                return True
+        return False
+
+    # 1. Recherche de `"data_key": [`
+    while True:
+        m = key_re.search(buf)
+        if m:
+            del buf[:m.end()]
+            break
+        if len(buf) > keep_tail:
+            del buf[:len(buf) - keep_tail]
+        if not more():
+            return  # clé absente → tableau vide
+
+    # 2. Extraction des éléments
+    pos = 0
+    while True:
+        # Sauter espaces / virgules
+        pos = _SKIP_RE.match(buf, pos).end()
+        if pos >= len(buf):
+            del buf[:pos]
+            pos = 0
+            if not more():
+                raise JsonStreamError(f"Flux JSON tronqué dans le tableau '{data_key}'")
+            continue
+
+        first = buf[pos]
+        if first == _ARRAY_END:
+            return
+
+        start = pos
+        if first in _OPEN or first == _QUOTE:
+            end = None
+            depth, in_string, i = 0, first == _QUOTE, pos + (first == _QUOTE)
+            while end is None:
+                if in_string:
+                    m = _STRING_RE.search(buf, i)
+                    if m is None or (buf[m.start()] == _BACKSLASH and m.start() + 1 >= len(buf)):
+                        i = len(buf) if m is None else m.start()
+                    elif buf[m.start()] == _BACKSLASH:
+                        i = m.start() + 2
+                        continue
+                    else:
+                        in_string = False
+                        i = m.end()
+                        if depth == 0:
+                            end = i  # chaîne scalaire terminée
+                        continue
+                else:
+                    m = _STRUCT_RE.search(buf, i)
+                    if m is not None:
+                        c = buf[m.start()]
+                        i = m.end()
+                        if c == _QUOTE:
+                            in_string = True
+                        elif c in _OPEN:
+                            depth += 1
+                        elif c in _CLOSE:
+                            depth -= 1
+                            if depth == 0:
+                                end = i
+                        continue
+                    i = len(buf)
+
+                # Besoin de données supplémentaires
+                if not more():
+                    raise JsonStreamError(f"Flux JSON tronqué dans le tableau '{data_key}'")
+        else:
+            # Scalaire (nombre, true/false/null)
+            while True:
+                m = _SCALAR_END_RE.search(buf, pos + 1)
+                if m is not None:
+                    end = m.start()
+                    break
+                if not more():
+                    raise JsonStreamError(f"Flux JSON tronqué dans le tableau '{data_key}'")
+
+        yield decode(bytes(buf[start:end]))
+
+        # Libérer la mémoire de l'élément consommé
+        del buf[:end]
+        pos = 0
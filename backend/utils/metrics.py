@@ -0,0 +1,395 @@
+"""
+Instrumentation des chemins critiques (sync DHIS2, UPSERT, matview, arrimage, SQL)
+et export au format texte Prometheus sur /api/metrics.
+
+- Compteurs, jauges et histogrammes thread-safe, avec labels.
+- Multi-processus (gunicorn --workers N) : si METRICS_DIR est défini, chaque processus
+  écrit périodiquement un instantané JSON de ses compteurs/histogrammes dans ce dossier
+  et /api/metrics agrège tous les instantanés (sinon : métriques du seul processus interrogé).
+- Le scheduler (run_scheduler.py) expose les mêmes métriques sur GET /metrics
+  (SCHEDULER_METRICS_HOST:SCHEDULER_METRICS_PORT), sans aucune route de l'API.
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from utils.config import config
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+# Buckets de latence (secondes) : du ms aux longues requêtes DHIS2 / refresh matview
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Dict[str, str] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in (extra or {}).items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} : labels attendus {self.labelnames}, reçus {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def snapshot(self) -> Dict[LabelKey, object]:
+        with self._lock:
+            return {k: (dict(v) if isinstance(v, dict) else v) for k, v in self._values.items()}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not config.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        if not config.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        if not config.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not config.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {k: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]} for k, v in self._values.items()}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+        self._flusher: Optional[threading.Thread] = None
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            self._ensure_flusher()
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]):
+        """ Collecteur appelé au rendu : itérable de (nom, type, aide, labels, valeur). Valeurs locales au processus. """
+        with self._lock:
+            self._collectors.append(collector)
+
+    # ------------------------
+    # Agrégation multi-processus (METRICS_DIR)
+    # ------------------------
+    def _snapshot_file(self) -> str:
+        return os.path.join(config.METRICS_DIR, f"metrics_{os.getpid()}.json")
+
+    def _ensure_flusher(self):
+        if self._flusher is not None or not config.METRICS_DIR:
+            return
+        os.makedirs(config.METRICS_DIR, exist_ok=True)
+        self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(config.METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Écriture des métriques impossible : %s", e)
+
+    def flush(self):
+        """ Écrit l'instantané des compteurs/histogrammes du processus (écriture atomique). """
+        if not config.METRICS_DIR:
+            return
+        data = {}
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, Gauge):
+                continue  # jauges : valeur instantanée propre au processus, non agrégée
+            data[metric.name] = {"samples": [[list(k), v] for k, v in metric.snapshot().items()]}
+        path = self._snapshot_file()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def _merged_samples(self) -> Dict[str, Dict[LabelKey, object]]:
+        merged: Dict[str, Dict[LabelKey, object]] = {}
+        if not config.METRICS_DIR:
+            for metric in self._metrics.values():
+                merged[metric.name] = metric.snapshot()
+            return merged
+
+        self.flush()
+        for metric in self._metrics.values():
+            merged[metric.name] = metric.snapshot() if isinstance(metric, Gauge) else {}
+        for filename in os.listdir(config.METRICS_DIR):
+            if not (filename.startswith("metrics_") and filename.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(config.METRICS_DIR, filename), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, payload in data.items():
+                target = merged.setdefault(name, {})
+                for labels, value in payload.get("samples", []):
+                    key = tuple(labels)
+                    current = target.get(key)
+                    if isinstance(value, dict):
+                        if current is None:
+                            target[key] = {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                        else:
+                            current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                            current["sum"] += value["sum"]
+                            current["count"] += value["count"]
+                    else:
+                        target[key] = (current or 0) + value
+        return merged
+
+    # ------------------------
+    # Rendu Prometheus
+    # ------------------------
+    def render(self) -> str:
+        lines: List[str] = []
+        samples = self._merged_samples()
+
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for key, value in sorted(samples.get(metric.name, {}).items()):
+                if isinstance(metric, Histogram):
+                    cumulative = value["buckets"]
+                    for bound, count in zip(metric.buckets, cumulative):
+                        lines.append(f"{metric.name}_bucket{_format_labels(metric.labelnames, key, {'le': _format_value(bound)})} {count}")
+                    lines.append(f"{metric.name}_bucket{_format_labels(metric.labelnames, key, {'le': '+Inf'})} {value['count']}")
+                    lines.append(f"{metric.name}_sum{_format_labels(metric.labelnames, key)} {_format_value(value['sum'])}")
+                    lines.append(f"{metric.name}_count{_format_labels(metric.labelnames, key)} {value['count']}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+
+        declared = set()
+        for collector in self._collectors:
+            try:
+                for name, mtype, documentation, labels, value in collector():
+                    if name not in declared:
+                        lines.append(f"# HELP {name} {documentation}")
+                        lines.append(f"# TYPE {name} {mtype}")
+                        declared.add(name)
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+            except Exception as e:
+                logger.warning("Collecteur de métriques en erreur : %s", e)
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+# ---------------------------------------------------------------------------
+# Métriques des chemins critiques
+# ---------------------------------------------------------------------------
+DHIS2_REQUEST_SECONDS = REGISTRY.histogram("dhis2_request_seconds", "Durée des requêtes DHIS2 (réponse complète)", ["client", "endpoint"])
+DHIS2_REQUEST_ERRORS = REGISTRY.counter("dhis2_request_errors_total", "Requêtes DHIS2 en erreur (avant retry)", ["client", "endpoint"])
+DHIS2_RETRIES = REGISTRY.counter("dhis2_retries_total", "Nouvelles tentatives de requêtes DHIS2", ["client", "endpoint"])
+DHIS2_PAGES = REGISTRY.counter("dhis2_pages_fetched_total", "Pages (ou flux paging=false) récupérées depuis DHIS2", ["endpoint"])
+DHIS2_BYTES = REGISTRY.counter("dhis2_bytes_downloaded_total", "Octets de réponse DHIS2 reçus (après décompression)", ["client", "endpoint"])
+
+ROWS_FLATTENED = REGISTRY.counter("sync_rows_flattened_total", "Lignes produites par l'aplatissement TEI", ["entity"])
+ROWS_TO_DELETE = REGISTRY.counter("sync_rows_deleted_total", "Lignes marquées supprimées dans DHIS2", ["entity"])
+
+UPSERT_BATCH_SECONDS = REGISTRY.histogram("pg_upsert_batch_seconds", "Durée d'un batch UPSERT (execute_values + commit)", ["table"])
+UPSERT_ROWS = REGISTRY.counter("pg_upsert_rows_total", "Lignes écrites par UPSERT", ["table"])
+UPSERT_RETRIES = REGISTRY.counter("pg_upsert_retries_total", "Nouvelles tentatives de batch UPSERT", ["table"])
+UPSERT_FAILURES = REGISTRY.counter("pg_upsert_failures_total", "Batches UPSERT en échec définitif", ["table"])
+
+MATVIEW_REFRESH_SECONDS = REGISTRY.histogram("matview_refresh_seconds", "Durée de REFRESH MATERIALIZED VIEW", ["view", "mode"])
+MATVIEW_REFRESH_TOTAL = REGISTRY.counter("matview_refresh_total", "Rafraîchissements de vue matérialisée", ["view", "status"])
+SCHEDULER_JOB_RETRIES = REGISTRY.counter("scheduler_job_retries_total", "Nouvelles tentatives des jobs du scheduler", ["job"])
+
+ARRIMAGE_PAYLOADS = REGISTRY.counter("arrimage_payloads_total", "Payloads dataValueSets envoyés au DHIS2 destination", ["status"])
+
+SQL_EXECUTE_SECONDS = REGISTRY.histogram("sql_execute_seconds", "Durée d'exécution SQL (start_execute_sql)", ["mode", "status"])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "Durée des requêtes HTTP de l'API", ["method", "route", "status"])
+
+
+def endpoint_label(endpoint) -> str:
+    """ 'trackedEntityInstances.json' / ('x.json','x') / 'dataValueSets?...' → nom court borné. """
+    if isinstance(endpoint, (list, tuple)):
+        endpoint = endpoint[0]
+    endpoint = str(endpoint).split("?", 1)[0]
+    if "://" in endpoint:
+        path = urlsplit(endpoint).path
+        endpoint = path.rsplit("/api/", 1)[-1] if "/api/" in path else path.rsplit("/", 1)[-1]
+    endpoint = endpoint.strip("/")
+    return endpoint.split("/", 1)[0].replace(".json", "") or "root"
+
+
+def _transport_collector():
+    from clients.http_transport import transport_stats
+
+    for name, stats in transport_stats().items():
+        labels = {"session": name}
+        yield "http_pool_in_flight", "gauge", "Requêtes HTTP en cours par session", labels, stats["in_flight"]
+        yield "http_pool_peak_in_flight", "gauge", "Pic de requêtes HTTP simultanées par session", labels, stats["peak_in_flight"]
+        yield "http_pool_maxsize", "gauge", "Taille du pool de connexions par session", labels, stats["pool_maxsize"]
+        yield "http_pool_requests_total", "counter", "Requêtes HTTP envoyées par session", labels, stats["requests_total"]
+        yield "http_pool_saturated_total", "counter", "Requêtes ayant attendu un socket libre (pool saturé)", labels, stats["saturated_total"]
+
+
+REGISTRY.register_collector(_transport_collector)
+
+
+# ---------------------------------------------------------------------------
+# Intégration Flask
+# ---------------------------------------------------------------------------
+def init_request_metrics(app):
+    """ Latence de chaque requête API (label route = règle Flask, cardinalité bornée). """
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_stop(response):
+        started = getattr(g, "_metrics_started", None)
+        if started is not None and request.path.startswith("/api/") and request.path != "/api/metrics":
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=str(response.status_code))
+        return response
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics_wsgi_app(environ, start_response):
+    """
+    Application WSGI minimale du processus scheduler : seul GET /metrics répond
+    (aucune route /api/* n'est exposée hors du backend). METRICS_TOKEN appliqué comme sur /api/metrics.
+    """
+    import hmac
+
+    def reply(status: str, body: str, content_type: str = "text/plain; charset=utf-8"):
+        data = body.encode("utf-8")
+        start_response(status, [("Content-Type", content_type), ("Content-Length", str(len(data)))])
+        return [data]
+
+    if environ.get("PATH_INFO") != "/metrics" or not config.METRICS_ENABLED:
+        return reply("404 Not Found", "not found\n")
+    if environ.get("REQUEST_METHOD") not in ("GET", "HEAD"):
+        return reply("405 Method Not Allowed", "method not allowed\n")
+    if config.METRICS_TOKEN:
+        auth = environ.get("HTTP_AUTHORIZATION", "")
+        token = auth.split(" ", 1)[1] if auth.startswith("Bearer ") else ""
+        if not hmac.compare_digest(token, config.METRICS_TOKEN):
+            return reply("401 Unauthorized", "unauthorized\n")
+    try:
+        return reply("200 OK", REGISTRY.render(), PROMETHEUS_CONTENT_TYPE)
+    except Exception:
+        logger.exception("Failed to render metrics")
+        return reply("500 Internal Server Error", "failed to render metrics\n")
+
+
+def start_metrics_server(host: str = None, port: int = None) -> Optional[threading.Thread]:
+    """ Serveur HTTP minimal (thread) pour les processus sans serveur web (scheduler) : GET /metrics uniquement. """
+    from werkzeug.serving import make_server
+
+    host = host or config.SCHEDULER_METRICS_HOST
+    port = port or config.SCHEDULER_METRICS_PORT
+    if not port:
+        return None
+    try:
+        server = make_server(host, port, metrics_wsgi_app, threaded=True)
+    except OSError as e:
+        logger.error("❌ Serveur de métriques indisponible sur le port %s : %s", port, e)
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info("📈 Métriques exposées sur http://%s:%s/metrics", host, port)
+    return thread
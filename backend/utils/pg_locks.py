@@ -0,0 +1,189 @@
+"""
+Verrous inter-processus / inter-conteneurs par advisory locks PostgreSQL.
+
+- advisory_lock(name) : verrou de job (session dédiée, tenu pendant tout le bloc, libéré
+  à la sortie ou automatiquement si le processus / la connexion meurt). Sans délai, c'est un
+  essai (pg_try_advisory_lock) ; avec `timeout`, attente bornée par lock_timeout.
+- LeaderElector : élection du scheduler leader. Chaque nœud tente périodiquement de prendre
+  un advisory lock sur une connexion qu'il garde ouverte ; le détenteur est leader et exécute
+  les jobs cron, les autres restent prêts (jobs enregistrés) et prennent le relais dès que la
+  session du leader disparaît (au plus SCHEDULER_LEADER_CHECK_SECONDS + détection TCP).
+
+Métriques : attente et durée de détention des verrous, tentatives, statut de leader.
+"""
+import hashlib
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import psycopg2
+from psycopg2 import errors
+
+from utils.config import config
+from utils.metrics import REGISTRY
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+JOB_LOCK_WAIT_SECONDS = REGISTRY.histogram("job_lock_wait_seconds", "Attente d'un verrou de job (advisory lock)", ["lock"])
+JOB_LOCK_HOLD_SECONDS = REGISTRY.histogram("job_lock_hold_seconds", "Durée de détention d'un verrou de job", ["lock"],
+                                           buckets=(0.1, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200))
+JOB_LOCK_ATTEMPTS = REGISTRY.counter("job_lock_attempts_total", "Tentatives de prise d'un verrou de job", ["lock", "result"])
+SCHEDULER_LEADER = REGISTRY.gauge("scheduler_leader", "1 si ce processus est le leader du scheduler")
+SCHEDULER_LEADER_CHANGES = REGISTRY.counter("scheduler_leader_changes_total", "Prises / pertes du rôle de leader", ["change"])
+
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lock_key(name: str) -> int:
+    """ Clé bigint stable (advisory locks) dérivée du nom du verrou. """
+    return int.from_bytes(hashlib.blake2b(f"itc-arrimage:{name}".encode(), digest_size=8).digest(), "big", signed=True)
+
+
+def _lock_connection():
+    """
+    Connexion dédiée au verrou (hors query_tracer, autocommit) avec keepalives TCP :
+    une session morte est détectée par PostgreSQL, qui libère alors ses advisory locks.
+    """
+    conn = psycopg2.connect(
+        host=config.POSTGRES_HOST,
+        port=config.POSTGRES_PORT,
+        database=config.POSTGRES_DB,
+        user=config.POSTGRES_USER,
+        password=config.POSTGRES_PASSWORD,
+        application_name=f"itc-lock:{NODE_ID}",
+        connect_timeout=10,
+        keepalives=1,
+        keepalives_idle=max(config.SCHEDULER_LEADER_CHECK_SECONDS, 1),
+        keepalives_interval=2,
+        keepalives_count=3,
+    )
+    conn.autocommit = True
+    return conn
+
+
+@contextmanager
+def advisory_lock(name: str, timeout: float = 0):
+    """
+    with advisory_lock("matview:indicators_matview") as acquired:
+        if not acquired: ...  # déjà pris ailleurs (ou PostgreSQL indisponible)
+
+    Le verrou est de niveau session sur une connexion propre : il couvre tout le bloc,
+    quelles que soient les connexions / transactions utilisées à l'intérieur.
+    """
+    key = lock_key(name)
+    started = time.perf_counter()
+    conn = None
+    acquired = False
+    try:
+        conn = _lock_connection()
+        with conn.cursor() as cur:
+            if timeout > 0:
+                cur.execute("SET lock_timeout = %s;", (int(timeout * 1000),))
+                try:
+                    cur.execute("SELECT pg_advisory_lock(%s);", (key,))
+                    acquired = True
+                except errors.LockNotAvailable:
+                    acquired = False
+            else:
+                cur.execute("SELECT pg_try_advisory_lock(%s);", (key,))
+                acquired = bool(cur.fetchone()[0])
+    except psycopg2.Error as e:
+        logger.error(f"❌ Verrou '{name}' indisponible : {e}")
+        JOB_LOCK_ATTEMPTS.inc(lock=name, result="error")
+        if conn is not None:
+            conn.close()
+        yield False
+        return
+
+    JOB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started, lock=name)
+    JOB_LOCK_ATTEMPTS.inc(lock=name, result="acquired" if acquired else "busy")
+    if not acquired:
+        conn.close()
+        yield False
+        return
+
+    held = time.perf_counter()
+    try:
+        yield True
+    finally:
+        JOB_LOCK_HOLD_SECONDS.observe(time.perf_counter() - held, lock=name)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (key,))
+        except psycopg2.Error as e:
+            logger.warning(f"Libération du verrou '{name}' : {e} (libéré à la fermeture de la session)")
+        finally:
+            conn.close()
+
+
+class LeaderElector:
+    """ Élection de leader par advisory lock tenu sur une connexion persistante. """
+
+    def __init__(self, name: str = "scheduler-leader"):
+        self.name = name
+        self.key = lock_key(name)
+        self._conn = None
+        self._leader = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_leader(self) -> bool:
+        return self._leader
+
+    def start(self) -> "LeaderElector":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="scheduler-leader", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._set_leader(False)
+        self._close()
+
+    def _set_leader(self, leader: bool):
+        if leader == self._leader:
+            return
+        self._leader = leader
+        SCHEDULER_LEADER.set(1 if leader else 0)
+        SCHEDULER_LEADER_CHANGES.inc(change="acquired" if leader else "lost")
+        if leader:
+            logger.info(f"👑 {NODE_ID} devient leader du scheduler ({self.name})")
+        else:
+            logger.warning(f"⚠️ {NODE_ID} n'est plus leader du scheduler ({self.name})")
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _tick(self):
+        """ Leader : vérifie que la session (donc le verrou) est vivante. Suiveur : tente le verrou. """
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn = _lock_connection()
+            with self._conn.cursor() as cur:
+                if self._leader:
+                    cur.execute("SELECT 1;")
+                else:
+                    cur.execute("SELECT pg_try_advisory_lock(%s);", (self.key,))
+                    self._set_leader(bool(cur.fetchone()[0]))
+        except psycopg2.Error as e:
+            # Session perdue : PostgreSQL a libéré (ou libérera) le verrou, un autre nœud prend le relais
+            if self._leader:
+                logger.error(f"❌ Session de leader perdue : {e}")
+            self._set_leader(False)
+            self._close()
+
+    def _loop(self):
+        SCHEDULER_LEADER.set(0)
+        while not self._stop.is_set():
+            self._tick()
+            self._stop.wait(config.SCHEDULER_LEADER_CHECK_SECONDS)
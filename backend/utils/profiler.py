@@ -0,0 +1,300 @@
+"""
+Profileur statistique opt-in (admin) pour le backend et le scheduler.
+
+Un thread échantillonneur lit sys._current_frames() toutes les `interval` secondes
+et agrège les piles au format « collapsed stacks » (une ligne par pile :
+`frame;frame;frame N`), directement exploitable par flamegraph.pl, speedscope
+ou inferno. Aucun hook n'est installé : désactivé, le coût est nul (aucun thread,
+aucun sys.setprofile), et actif il ne ralentit pas le code profilé lui-même.
+
+Cibles :
+- processus : toutes les threads pendant `duration` secondes (POST /api/profiler/start)
+- requête   : en-tête `X-Profile: 1` (ou `all`) envoyé par un admin → thread de la requête (ou tout le worker)
+- job       : job du scheduler armé (POST /api/profiler/jobs/<job_id>) ou listé dans PROFILE_JOBS
+
+Les profils terminés sont écrits dans PROFILE_DIR (partagé entre workers gunicorn).
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils.config import config
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+ADMIN_ROLES = ("admin", "superadmin")
+PROFILE_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,80}$")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    # Chemins courts : relatifs au backend ou au site-packages
+    for marker in ("site-packages" + os.sep, "backend" + os.sep):
+        idx = filename.rfind(marker)
+        if idx >= 0:
+            filename = filename[idx + len(marker):]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """ Échantillonneur de piles (une thread dédiée, lecture de sys._current_frames()). """
+
+    def __init__(self, name: str, interval: float = None, thread_ids: Iterable[int] = None, max_duration: float = None):
+        self.id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}_{re.sub(r'[^A-Za-z0-9_.-]', '_', name)[:40]}_{uuid.uuid4().hex[:6]}"
+        self.name = name
+        self.interval = interval or config.PROFILE_INTERVAL_MS / 1000
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.max_duration = min(max_duration or config.PROFILE_MAX_SECONDS, config.PROFILE_MAX_SECONDS)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[datetime] = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = self._started + self.max_duration
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            if time.perf_counter() >= deadline:
+                break
+        self.duration = time.perf_counter() - self._started
+        PROFILES.save(self)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 25) -> Dict[str, Any]:
+        """ Fonctions les plus présentes : self = en sommet de pile, total = n'importe où dans la pile. """
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for f in set(frames):
+                total_counts[f] += count
+        weight = sum(self.stacks.values()) or 1
+        return {
+            "id": self.id,
+            "name": self.name,
+            "pid": os.getpid(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "duration_s": round(self.duration, 3),
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "top_self": [{"frame": f, "samples": c, "pct": round(100 * c / weight, 1)} for f, c in self_counts.most_common(top)],
+            "top_total": [{"frame": f, "samples": c, "pct": round(100 * c / weight, 1)} for f, c in total_counts.most_common(top)],
+        }
+
+
+class ProfileStore:
+    """ Profils actifs (processus courant) et profils terminés (PROFILE_DIR). """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active: Dict[str, SamplingProfiler] = {}
+        self.armed_jobs: Dict[str, float] = {}  # job_id -> durée max
+
+    def _path(self, profile_id: str, ext: str) -> str:
+        return os.path.join(config.PROFILE_DIR, f"{profile_id}.{ext}")
+
+    def start(self, name: str, interval: float = None, thread_ids: Iterable[int] = None, max_duration: float = None) -> SamplingProfiler:
+        profiler = SamplingProfiler(name, interval, thread_ids, max_duration)
+        with self._lock:
+            if len(self.active) >= config.PROFILE_MAX_ACTIVE:
+                raise RuntimeError(f"Trop de profils actifs ({len(self.active)})")
+            self.active[profiler.id] = profiler
+        logger.info("🔬 Profil '%s' démarré (%s, intervalle %.1f ms)", profiler.id, name, profiler.interval * 1000)
+        return profiler.start()
+
+    def stop(self, profile_id: str) -> Optional[SamplingProfiler]:
+        with self._lock:
+            profiler = self.active.get(profile_id)
+        if profiler is None:
+            return None
+        return profiler.stop()
+
+    def save(self, profiler: SamplingProfiler):
+        with self._lock:
+            self.active.pop(profiler.id, None)
+        try:
+            os.makedirs(config.PROFILE_DIR, exist_ok=True)
+            with open(self._path(profiler.id, "collapsed"), "w", encoding="utf-8") as f:
+                f.write(profiler.collapsed())
+            with open(self._path(profiler.id, "json"), "w", encoding="utf-8") as f:
+                json.dump(profiler.summary(), f, indent=2)
+            logger.info("🔬 Profil '%s' enregistré (%d échantillons, %.1f s)", profiler.id, profiler.samples, profiler.duration)
+        except OSError as e:
+            logger.error("❌ Enregistrement du profil '%s' impossible : %s", profiler.id, e)
+        self._prune()
+
+    def _prune(self):
+        """ Ne conserve que les PROFILE_KEEP profils les plus récents. """
+        try:
+            summaries = sorted(f for f in os.listdir(config.PROFILE_DIR) if f.endswith(".json"))
+        except OSError:
+            return
+        for filename in summaries[:-config.PROFILE_KEEP] if len(summaries) > config.PROFILE_KEEP else []:
+            for ext in ("json", "collapsed"):
+                try:
+                    os.remove(self._path(filename[:-5], ext))
+                except OSError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        profiles = []
+        try:
+            filenames = sorted((f for f in os.listdir(config.PROFILE_DIR) if f.endswith(".json")), reverse=True)
+        except OSError:
+            filenames = []
+        for filename in filenames:
+            try:
+                with open(os.path.join(config.PROFILE_DIR, filename), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                profiles.append({k: data.get(k) for k in ("id", "name", "pid", "started_at", "duration_s", "samples")})
+            except (OSError, ValueError):
+                continue
+        with self._lock:
+            running = [{"id": p.id, "name": p.name, "pid": os.getpid(), "running": True} for p in self.active.values()]
+        return running + profiles
+
+    def read(self, profile_id: str, fmt: str = "json") -> Optional[str]:
+        if not PROFILE_ID_RE.match(profile_id) or fmt not in ("json", "collapsed"):
+            return None
+        try:
+            with open(self._path(profile_id, fmt), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    # ------------------------
+    # Jobs du scheduler
+    # ------------------------
+    def arm_job(self, job_id: str, max_duration: float = None):
+        with self._lock:
+            self.armed_jobs[job_id] = max_duration or config.PROFILE_MAX_SECONDS
+
+    def take_armed_job(self, job_id: str) -> Optional[float]:
+        with self._lock:
+            if job_id in self.armed_jobs:
+                return self.armed_jobs.pop(job_id)
+        if job_id in config.PROFILE_JOBS:
+            return config.PROFILE_MAX_SECONDS
+        return None
+
+
+PROFILES = ProfileStore()
+
+
+@contextmanager
+def profiling(name: str, all_threads: bool = False, max_duration: float = None):
+    """ Profile le bloc : thread courante seulement, ou toutes les threads (pools de sync). """
+    thread_ids = None if all_threads else [threading.get_ident()]
+    profiler = PROFILES.start(name, thread_ids=thread_ids, max_duration=max_duration)
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+
+
+def profiled_job(job_id: str, func: Callable) -> Callable:
+    """
+    Enveloppe un job APScheduler : profilé si armé (ou listé dans PROFILE_JOBS), sinon appel direct.
+    Toutes les threads sont échantillonnées : la sync TEI travaille dans un ThreadPoolExecutor.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not config.PROFILER_ENABLED:
+            return func(*args, **kwargs)
+        max_duration = PROFILES.take_armed_job(job_id)
+        if max_duration is None:
+            return func(*args, **kwargs)
+        try:
+            ctx = profiling(f"job_{job_id}", all_threads=True, max_duration=max_duration)
+            profiler = ctx.__enter__()
+        except RuntimeError as e:
+            logger.warning("Profil du job '%s' ignoré : %s", job_id, e)
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            ctx.__exit__(None, None, None)
+            logger.info("🔬 Job '%s' profilé → %s", job_id, profiler.id)
+    return wrapper
+
+
+def init_request_profiler(app):
+    """
+    `X-Profile: 1` (admin, jeton JWT valide) → profil de la thread de la requête ;
+    `X-Profile: all` → toutes les threads du worker (routes qui délèguent à un pool).
+    """
+    import jwt
+    from flask import g, request
+
+    @app.before_request
+    def _profiler_start():
+        mode = request.headers.get("X-Profile")
+        if not config.PROFILER_ENABLED or mode not in ("1", "true", "all"):
+            return
+        auth = request.headers.get("Authorization", "")
+        if not auth.startswith("Bearer "):
+            return
+        try:
+            payload = jwt.decode(auth.split(" ", 1)[1], config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
+        except jwt.InvalidTokenError:
+            return
+        if payload.get("role") not in ADMIN_ROLES:
+            return
+        try:
+            thread_ids = None if mode == "all" else [threading.get_ident()]
+            g._profiler = PROFILES.start(f"{request.method}_{request.path}", thread_ids=thread_ids)
+        except RuntimeError as e:
+            logger.warning("Profil de requête ignoré : %s", e)
+
+    @app.after_request
+    def _profiler_stop(response):
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.stop()
+            response.headers["X-Profile-Id"] = profiler.id
+        return response
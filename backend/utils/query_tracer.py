@@ -0,0 +1,219 @@
+"""
+Traçage des requêtes SQL par requête HTTP (psycopg2 + SQLAlchemy).
+
+- psycopg2 : les connexions de utils.db.get_connection (et le pool du scheduler) utilisent
+  TracingConnection ; chaque cursor (DictCursor, RealDictCursor, ... ) est dérivé d'une
+  version chronométrée de sa classe, execute_values / copy_expert compris.
+- SQLAlchemy : événements before/after_cursor_execute sur tous les Engine (User.query, ...).
+
+Chaque requête Flask ouvre une trace (portée : la thread de la requête). En sortie :
+en-tête `Server-Timing` (db;dur=…;desc="N queries"), requêtes > SLOW_QUERY_MS dans
+logs/slow_queries.log, et avertissement si le nombre de requêtes dépasse QUERY_COUNT_WARN
+(motif N+1 probable, avec les requêtes les plus répétées).
+Hors requête HTTP (scheduler, sync), seul le slow-query log est alimenté.
+"""
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from psycopg2.extensions import connection as _pg_connection, cursor as _pg_cursor
+
+from utils.config import config
+from utils.metrics import REGISTRY
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+slow_logger = get_logger("slow_queries")
+
+DB_QUERIES_PER_REQUEST = REGISTRY.histogram("http_db_queries_per_request", "Requêtes SQL par requête HTTP", ["route"], buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+DB_SECONDS_PER_REQUEST = REGISTRY.histogram("http_db_seconds_per_request", "Temps SQL cumulé par requête HTTP", ["route"])
+SLOW_QUERIES = REGISTRY.counter("db_slow_queries_total", "Requêtes SQL au-delà de SLOW_QUERY_MS", ["source"])
+
+_local = threading.local()
+
+MAX_STATEMENT_CHARS = 1000
+
+
+def _statement_text(query: Any, cursor=None) -> str:
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        # psycopg2.sql.Composable : rendu seulement pour les requêtes conservées
+        try:
+            query = query.as_string(cursor)
+        except Exception:
+            query = repr(query)
+    return " ".join(query[:MAX_STATEMENT_CHARS * 2].split())[:MAX_STATEMENT_CHARS]
+
+
+class QueryTrace:
+    """ Requêtes d'une requête HTTP : nombre, temps cumulé, plus lentes, plus répétées. """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.slowest: List[tuple] = []  # (durée, source, texte) triées décroissant, bornées
+        self.repeated: Counter = Counter()
+        self.started = time.perf_counter()
+
+    def add(self, duration: float, source: str, query: Any, cursor=None):
+        self.count += 1
+        self.total += duration
+        text = _statement_text(query, cursor)
+        self.repeated[text] += 1
+        if len(self.slowest) < config.QUERY_TRACE_TOP or duration > self.slowest[-1][0]:
+            self.slowest.append((duration, source, text))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[config.QUERY_TRACE_TOP:]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "queries": self.count,
+            "db_ms": round(self.total * 1000, 2),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "slowest": [{"ms": round(d * 1000, 2), "source": s, "sql": t} for d, s, t in self.slowest],
+            "repeated": [{"count": c, "sql": t} for t, c in self.repeated.most_common(3) if c > 1],
+        }
+
+
+def current_trace() -> Optional[QueryTrace]:
+    return getattr(_local, "trace", None)
+
+
+def record_query(duration: float, source: str, query: Any, cursor=None):
+    """ Point d'entrée commun psycopg2 / SQLAlchemy. """
+    trace = current_trace()
+    if trace is not None:
+        trace.add(duration, source, query, cursor)
+    if duration * 1000 >= config.SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(source=source)
+        where = f" [{trace.name}]" if trace is not None else ""
+        slow_logger.warning("🐢 %.1f ms (%s)%s : %s", duration * 1000, source, where, _statement_text(query, cursor))
+
+
+# ---------------------------------------------------------------------------
+# psycopg2
+# ---------------------------------------------------------------------------
+class TracingCursorMixin:
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(time.perf_counter() - started, "psycopg2", query, self)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(time.perf_counter() - started, "psycopg2", query, self)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(time.perf_counter() - started, "psycopg2", sql, self)
+
+
+_traced_cursor_classes: Dict[type, type] = {}
+_traced_lock = threading.Lock()
+
+
+def traced_cursor_class(base: type) -> type:
+    traced = _traced_cursor_classes.get(base)
+    if traced is None:
+        with _traced_lock:
+            traced = _traced_cursor_classes.get(base)
+            if traced is None:
+                traced = type(f"Traced{base.__name__}", (TracingCursorMixin, base), {})
+                _traced_cursor_classes[base] = traced
+    return traced
+
+
+class TracingConnection(_pg_connection):
+    """ Connexion psycopg2 dont tous les cursors sont chronométrés, quel que soit cursor_factory. """
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get("cursor_factory") or self.cursor_factory or _pg_cursor
+        kwargs["cursor_factory"] = traced_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+def connection_factory():
+    """ Argument connection_factory pour psycopg2.connect / pools (None si traçage désactivé). """
+    return TracingConnection if config.QUERY_TRACE_ENABLED else None
+
+
+# ---------------------------------------------------------------------------
+# SQLAlchemy
+# ---------------------------------------------------------------------------
+_sqlalchemy_installed = False
+
+
+def install_sqlalchemy_events():
+    global _sqlalchemy_installed
+    if _sqlalchemy_installed or not config.QUERY_TRACE_ENABLED:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("_query_started")
+        if stack:
+            record_query(time.perf_counter() - stack.pop(), "sqlalchemy", statement)
+
+    _sqlalchemy_installed = True
+
+
+# ---------------------------------------------------------------------------
+# Flask
+# ---------------------------------------------------------------------------
+def init_query_tracer(app):
+    if not config.QUERY_TRACE_ENABLED:
+        return
+    from flask import request
+
+    install_sqlalchemy_events()
+
+    @app.before_request
+    def _trace_start():
+        _local.trace = QueryTrace(f"{request.method} {request.path}")
+
+    @app.after_request
+    def _trace_stop(response):
+        trace = current_trace()
+        _local.trace = None
+        if trace is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        db_ms = trace.total * 1000
+        total_ms = (time.perf_counter() - trace.started) * 1000
+        response.headers.add("Server-Timing", f'db;dur={db_ms:.1f};desc="{trace.count} queries"')
+        response.headers.add("Server-Timing", f"app;dur={max(0.0, total_ms - db_ms):.1f}")
+
+        if request.path.startswith("/api/") and request.path != "/api/metrics":
+            DB_QUERIES_PER_REQUEST.observe(trace.count, route=route)
+            DB_SECONDS_PER_REQUEST.observe(trace.total, route=route)
+
+        if trace.count >= config.QUERY_COUNT_WARN:
+            summary = trace.summary()
+            logger.warning("⚠️ %s : %d requêtes SQL (%.1f ms) — N+1 probable, plus répétées : %s",
+                           trace.name, trace.count, db_ms, summary["repeated"])
+        elif db_ms >= config.SLOW_QUERY_MS:
+            logger.info("%s : %d requêtes SQL, %.1f ms, plus lentes : %s", trace.name, trace.count, db_ms, trace.summary()["slowest"])
+        return response
+
+    @app.teardown_request
+    def _trace_teardown(exception=None):
+        _local.trace = None
@@ -0,0 +1,213 @@
+"""
+Limitation de débit (rate limit) à backend interchangeable.
+
+- memory   : fenêtre glissante exacte (horodatages par clé), bornée en nombre de clés
+             (éviction LRU), protégée par un verrou, purge périodique des clés expirées.
+             Locale au processus : avec N workers gunicorn, la limite effective est N × max.
+- postgres : compteur à fenêtre glissante (fenêtre courante + fenêtre précédente pondérée)
+             dans une table UNLOGGED partagée par tous les workers et processus.
+             En cas d'indisponibilité de PostgreSQL, repli sur le backend mémoire.
+
+Backend choisi par RATE_LIMIT_BACKEND (memory | postgres).
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Tuple
+
+from utils.config import config
+from utils.metrics import REGISTRY
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+RATE_LIMIT_CHECKS = REGISTRY.counter("rate_limit_checks_total", "Contrôles de rate limit", ["scope", "backend", "result"])
+RATE_LIMIT_BACKEND_ERRORS = REGISTRY.counter("rate_limit_backend_errors_total", "Erreurs du backend de rate limit (repli mémoire)", ["backend"])
+RATE_LIMIT_KEYS = REGISTRY.gauge("rate_limit_memory_keys", "Clés suivies par le backend mémoire")
+
+# Résultat d'un contrôle : (autorisé, secondes avant nouvel essai)
+RateLimitResult = Tuple[bool, int]
+
+
+class MemoryRateLimitBackend:
+    """ Fenêtre glissante en mémoire, au plus `max_keys` clés (les moins récemment vues sont évincées). """
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = None, sweep_seconds: float = None):
+        self.max_keys = max_keys or config.RATE_LIMIT_MAX_KEYS
+        self.sweep_seconds = sweep_seconds or config.RATE_LIMIT_SWEEP_SECONDS
+        self._lock = threading.Lock()
+        self._hits: "OrderedDict[str, Tuple[float, Deque[float]]]" = OrderedDict()  # clé -> (fenêtre, horodatages)
+        self._next_sweep = time.monotonic() + self.sweep_seconds
+
+    def hit(self, key: str, limit: int, window: int) -> RateLimitResult:
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            entry = self._hits.get(key)
+            hits = entry[1] if entry else deque()
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if len(hits) >= limit:
+                self._hits[key] = (window, hits)
+                self._hits.move_to_end(key)
+                return False, max(1, int(hits[0] + window - now + 0.999))
+            hits.append(now)
+            self._hits[key] = (window, hits)
+            self._hits.move_to_end(key)
+            while len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+            RATE_LIMIT_KEYS.set(len(self._hits))
+            return True, 0
+
+    def _sweep(self, now: float):
+        """ Supprime les clés dont toutes les entrées sont sorties de leur fenêtre (verrou tenu). """
+        expired = [key for key, (window, hits) in self._hits.items() if not hits or hits[-1] <= now - window]
+        for key in expired:
+            del self._hits[key]
+        self._next_sweep = now + self.sweep_seconds
+        RATE_LIMIT_KEYS.set(len(self._hits))
+
+    def reset(self, key: Optional[str] = None):
+        with self._lock:
+            if key is None:
+                self._hits.clear()
+            else:
+                self._hits.pop(key, None)
+
+
+class PostgresRateLimitBackend:
+    """
+    Compteurs par (clé, début de fenêtre) dans rate_limit_counters (UNLOGGED : pas de WAL,
+    perdus en cas de crash, ce qui est acceptable pour des compteurs de quelques secondes).
+    Estimation glissante = courant + précédent × part de la fenêtre précédente encore couverte.
+    """
+
+    name = "postgres"
+
+    def __init__(self, fallback: MemoryRateLimitBackend, sweep_seconds: float = None):
+        self.fallback = fallback
+        self.sweep_seconds = sweep_seconds or config.RATE_LIMIT_SWEEP_SECONDS
+        self._local = threading.local()
+        self._table_ready = False
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+        self._max_window = 0  # plus grande fenêtre vue : la purge ne doit pas toucher les autres scopes
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            from utils.db import get_connection
+            conn = get_connection()
+            if conn is None:
+                raise ConnectionError("connexion PostgreSQL indisponible")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_table(self, cur):
+        if self._table_ready:
+            return
+        cur.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+                key TEXT NOT NULL,
+                window_start BIGINT NOT NULL,
+                hits INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (key, window_start)
+            );
+        """)
+        self._table_ready = True
+
+    def hit(self, key: str, limit: int, window: int) -> RateLimitResult:
+        try:
+            return self._hit(key, limit, window)
+        except Exception as e:
+            RATE_LIMIT_BACKEND_ERRORS.inc(backend=self.name)
+            logger.warning(f"⚠️ Rate limit PostgreSQL indisponible, repli mémoire : {e}")
+            self._local.conn = None
+            return self.fallback.hit(key, limit, window)
+
+    def _hit(self, key: str, limit: int, window: int) -> RateLimitResult:
+        now = time.time()
+        window_start = int(now // window) * window
+        weight = 1 - (now - window_start) / window
+        conn = self._connection()
+        with conn.cursor() as cur:
+            self._ensure_table(cur)
+            cur.execute("SELECT hits FROM rate_limit_counters WHERE key = %s AND window_start = %s;",
+                        (key, window_start - window))
+            row = cur.fetchone()
+            previous = (row[0] if row else 0) * weight
+            allowed = previous < limit
+            if allowed:
+                # Comme le backend mémoire, seule une tentative autorisée est comptée : la condition
+                # est réévaluée sur la ligne verrouillée, deux workers ne peuvent pas dépasser la limite
+                cur.execute("""
+                    INSERT INTO rate_limit_counters (key, window_start, hits) VALUES (%s, %s, 1)
+                    ON CONFLICT (key, window_start) DO UPDATE SET hits = rate_limit_counters.hits + 1
+                        WHERE rate_limit_counters.hits + %s < %s
+                    RETURNING hits;
+                """, (key, window_start, previous, limit))
+                allowed = cur.fetchone() is not None
+            self._maybe_sweep(cur, now, window)
+
+        if not allowed:
+            return False, max(1, int(window_start + window - now + 0.999))
+        return True, 0
+
+    def _maybe_sweep(self, cur, now: float, window: int):
+        with self._lock:
+            self._max_window = max(self._max_window, window)
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + self.sweep_seconds
+            horizon = int(now) - 2 * self._max_window
+        cur.execute("DELETE FROM rate_limit_counters WHERE window_start < %s;", (horizon,))
+
+    def reset(self, key: Optional[str] = None):
+        self.fallback.reset(key)
+        with self._connection().cursor() as cur:
+            self._ensure_table(cur)
+            if key is None:
+                cur.execute("TRUNCATE rate_limit_counters;")
+            else:
+                cur.execute("DELETE FROM rate_limit_counters WHERE key = %s;", (key,))
+
+
+class RateLimiter:
+    """ Limite nommée (`scope`) : `limit` tentatives par `window` secondes et par clé. """
+
+    def __init__(self, scope: str, limit: int, window: int, backend=None):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+        self.backend = backend or get_backend()
+
+    def hit(self, key: str) -> RateLimitResult:
+        allowed, retry_after = self.backend.hit(f"{self.scope}:{key}", self.limit, self.window)
+        RATE_LIMIT_CHECKS.inc(scope=self.scope, backend=self.backend.name, result="allowed" if allowed else "limited")
+        return allowed, retry_after
+
+    def allow(self, key: str) -> bool:
+        return self.hit(key)[0]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """ Backend partagé du processus (RATE_LIMIT_BACKEND). """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                memory = MemoryRateLimitBackend()
+                if config.RATE_LIMIT_BACKEND == "postgres":
+                    _backend = PostgresRateLimitBackend(memory)
+                else:
+                    if config.RATE_LIMIT_BACKEND != "memory":
+                        logger.warning(f"RATE_LIMIT_BACKEND inconnu '{config.RATE_LIMIT_BACKEND}', backend mémoire utilisé")
+                    _backend = memory
+    return _backend
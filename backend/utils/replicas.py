@@ -0,0 +1,193 @@
+"""
+Routage des lectures vers les réplicas PostgreSQL (POSTGRES_REPLICA_DSNS).
+
+get_read_connection() renvoie une connexion vers un réplica sain, à tour de rôle,
+ou vers le primaire (utils.db.get_connection) si :
+- aucun réplica n'est configuré, ou tous sont injoignables / trop en retard
+  (REPLICA_MAX_LAG_SECONDS) ; un réplica en échec est écarté REPLICA_CHECK_SECONDS
+- le client vient d'écrire (mark_write) et aucun réplica n'a encore rejoué cette écriture
+
+Lire ses propres écritures : mark_write() relève la position WAL du primaire après l'écriture
+et la renvoie au navigateur dans un cookie signé (REPLICA_COOKIE_NAME, valable
+REPLICA_STICKY_SECONDS). Le cookie accompagne les requêtes suivantes quel que soit le worker
+gunicorn qui les reçoit ; un réplica n'est utilisé que si pg_last_wal_replay_lsn() a atteint
+cette position, sinon la lecture va au primaire.
+
+Le retard est mesuré au plus toutes les REPLICA_CHECK_SECONDS par réplica, sur la connexion
+ouverte pour la lecture. Une instance hors recovery (ex. deux PostgreSQL locaux indépendants
+pour les tests) est considérée à jour.
+"""
+import itertools
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import psycopg2
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from utils.config import config
+from utils.db import get_connection
+from utils.metrics import REGISTRY
+from utils.query_tracer import connection_factory
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+DB_READ_ROUTES = REGISTRY.counter("db_read_route_total", "Routage des lectures", ["target", "reason"])
+DB_REPLICA_LAG = REGISTRY.gauge("db_replica_lag_seconds", "Dernier retard de réplication mesuré", ["replica"])
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END;
+"""
+
+# Le réplica a-t-il rejoué la position WAL `lsn` (écriture du client) ?
+CAUGHT_UP_SQL = "SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn;"
+
+_serializer = URLSafeTimedSerializer(config.JWT_SECRET, salt="replica-read-after")
+
+
+class Replica:
+    """ DSN d'un réplica + dernier état connu (retard, indisponibilité). """
+
+    def __init__(self, index: int, dsn: str):
+        self.name = f"replica{index}"
+        self.dsn = dsn
+        self.lag: Optional[float] = None
+        self.checked_at = 0.0
+        self.down_until = 0.0
+        self.lock = threading.Lock()
+
+    def available(self, now: float) -> bool:
+        if now < self.down_until:
+            return False
+        return self.lag is None or self.lag <= config.REPLICA_MAX_LAG_SECONDS or now - self.checked_at >= config.REPLICA_CHECK_SECONDS
+
+    def connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=connection_factory(), connect_timeout=config.REPLICA_CONNECT_TIMEOUT)
+        conn.autocommit = True
+        return conn
+
+    def refresh_lag(self, conn, now: float) -> float:
+        """ Mesure le retard si la dernière mesure est trop ancienne (une seule mesure à la fois). """
+        if self.lag is not None and now - self.checked_at < config.REPLICA_CHECK_SECONDS:
+            return self.lag
+        with self.lock:
+            if self.lag is None or now - self.checked_at >= config.REPLICA_CHECK_SECONDS:
+                with conn.cursor() as cur:
+                    cur.execute(LAG_SQL)
+                    self.lag = float(cur.fetchone()[0] or 0)
+                self.checked_at = now
+                DB_REPLICA_LAG.set(self.lag, replica=self.name)
+        return self.lag
+
+    def mark_down(self, now: float, error: Exception):
+        self.down_until = now + config.REPLICA_CHECK_SECONDS
+        logger.warning(f"⚠️ Réplica {self.name} écarté {config.REPLICA_CHECK_SECONDS}s : {error}")
+
+
+def _request_write_lsn() -> Optional[str]:
+    """ Position WAL de la dernière écriture du client (cookie signé, non expiré), ou None. """
+    from flask import has_request_context, request
+
+    if not has_request_context():
+        return None
+    token = request.cookies.get(config.REPLICA_COOKIE_NAME)
+    if not token:
+        return None
+    try:
+        return _serializer.loads(token, max_age=config.REPLICA_STICKY_SECONDS)
+    except BadSignature:
+        return None
+
+
+class ReplicaRouter:
+
+    def __init__(self, dsns: List[str]):
+        self.replicas = [Replica(i, dsn) for i, dsn in enumerate(dsns, start=1)]
+        self._turn = itertools.count()
+
+    def mark_write(self):
+        """ Les lectures suivantes du client attendent que le réplica ait rejoué cette écriture. """
+        from flask import after_this_request, has_request_context
+
+        if not self.replicas or not has_request_context():
+            return
+        conn = get_connection()
+        if conn is None:
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_current_wal_lsn()::text;")
+                lsn = cur.fetchone()[0]
+        except psycopg2.Error as e:
+            logger.warning(f"Position WAL du primaire non lue : {e}")
+            return
+        finally:
+            conn.close()
+
+        token = _serializer.dumps(lsn)
+
+        @after_this_request
+        def _set_cookie(response):
+            response.set_cookie(config.REPLICA_COOKIE_NAME, token, max_age=config.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite="Lax", secure=config.REPLICA_COOKIE_SECURE, path="/api")
+            return response
+
+    def read_connection(self) -> Tuple[Optional[object], str]:
+        """ (connexion, cible) ; cible = nom du réplica ou "primary". """
+        if not self.replicas:
+            return get_connection(), "primary"
+        write_lsn = _request_write_lsn()
+
+        start = next(self._turn)
+        reason = "unavailable"
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            now = time.monotonic()
+            if not replica.available(now):
+                continue
+            conn = None
+            try:
+                conn = replica.connect()
+                lag = replica.refresh_lag(conn, now)
+                caught_up = True
+                if write_lsn and lag <= config.REPLICA_MAX_LAG_SECONDS:
+                    with conn.cursor() as cur:
+                        cur.execute(CAUGHT_UP_SQL, (write_lsn,))
+                        caught_up = bool(cur.fetchone()[0])
+            except psycopg2.Error as e:
+                if conn is not None:
+                    conn.close()
+                replica.mark_down(now, e)
+                continue
+            if lag > config.REPLICA_MAX_LAG_SECONDS:
+                conn.close()
+                reason = "lag"
+                continue
+            if not caught_up:
+                conn.close()
+                reason = "sticky"
+                continue
+            DB_READ_ROUTES.inc(target="replica", reason="ok")
+            return conn, replica.name
+
+        DB_READ_ROUTES.inc(target="primary", reason=reason)
+        return get_connection(), "primary"
+
+
+router = ReplicaRouter(config.POSTGRES_REPLICA_DSNS)
+
+
+def get_read_connection():
+    """ Connexion pour une lecture (réplica si possible, sinon primaire) ; None si la connexion échoue. """
+    conn, _ = router.read_connection()
+    return conn
+
+
+def mark_write():
+    """ À appeler après une écriture réussie, dans la requête : lectures suivantes cohérentes (cookie). """
+    router.mark_write()
@@ -0,0 +1,468 @@
+"""
+Requêtes sauvegardées : paramètres nommés, exécution préparée et snapshots de résultats.
+
+- Paramètres : `:nom` dans le SQL (hors chaînes, identifiants entre guillemets, commentaires
+  et casts `::type`, selon le découpage de utils.sql_analyzer). Déclaration optionnelle dans
+  `params` : [{"name", "type", "default"}]. Le texte lié doit rester une instruction unique.
+- Compilation (LRU, par texte SQL) : texte psycopg2 (%(nom)s), texte PREPARE ($1, $2 ...)
+  et résultat des garde-fous de /api/sql/execute, calculés une seule fois par version du SQL.
+- Exécution préparée : PREPARE / EXECUTE sur une connexion persistante par thread,
+  ce qui évite l'analyse et la planification à chaque appel (tableaux de bord).
+- Snapshots : résultats des requêtes `snapshot = true` (valeurs par défaut des paramètres)
+  stockés dans saved_query_snapshots, rafraîchis après chaque refresh de la vue matérialisée.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import psycopg2
+import psycopg2.extras
+
+from utils.config import config
+from utils.db import get_connection
+from utils.replicas import get_read_connection
+from utils.metrics import REGISTRY
+from utils.sql_analyzer import analyze_sql, find_named_params
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+SAVED_QUERY_SECONDS = REGISTRY.histogram("saved_query_execute_seconds", "Exécution des requêtes sauvegardées", ["mode", "status"])
+SAVED_QUERY_SNAPSHOTS = REGISTRY.counter("saved_query_snapshots_total", "Rafraîchissements de snapshots", ["status"])
+
+_PARAM_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_PARAM_TYPE_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_ ]*(\[\])?$")
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+# ------------------------
+# Schéma (une fois au démarrage)
+# ------------------------
+def ensure_saved_queries_schema(conn=None) -> bool:
+    """ Tables saved_queries / saved_query_snapshots ; exécuté une seule fois par processus. """
+    global _schema_ready
+    if _schema_ready:
+        return True
+    with _schema_lock:
+        if _schema_ready:
+            return True
+        own = conn is None
+        conn = conn or get_connection()
+        if conn is None:
+            logger.error("❌ Schéma saved_queries non vérifié : connexion PostgreSQL indisponible")
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS saved_queries (
+                        id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        sql TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT NOW(),
+                        updated_at TIMESTAMP DEFAULT NOW()
+                    );
+                    ALTER TABLE saved_queries
+                        ADD COLUMN IF NOT EXISTS params JSONB NOT NULL DEFAULT '[]'::jsonb,
+                        ADD COLUMN IF NOT EXISTS prepared BOOLEAN NOT NULL DEFAULT false,
+                        ADD COLUMN IF NOT EXISTS snapshot BOOLEAN NOT NULL DEFAULT false;
+
+                    CREATE TABLE IF NOT EXISTS saved_query_snapshots (
+                        query_id BIGINT PRIMARY KEY REFERENCES saved_queries(id) ON DELETE CASCADE,
+                        params JSONB,
+                        columns JSONB,
+                        rows JSONB,
+                        rowcount INT,
+                        truncated BOOLEAN,
+                        duration_ms DOUBLE PRECISION,
+                        refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+                        error TEXT
+                    );
+                """)
+            conn.commit()
+            _schema_ready = True
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.exception(f"❌ Création du schéma saved_queries impossible : {e}")
+            return False
+        finally:
+            if own:
+                conn.close()
+
+
+# ------------------------
+# Compilation
+# ------------------------
+class CompiledQuery(NamedTuple):
+    names: Tuple[str, ...]      # paramètres, dans l'ordre de première apparition ($1, $2 ...)
+    pyformat_sql: str           # pour cursor.execute(sql, dict)
+    positional_sql: str         # pour PREPARE
+    denied: Optional[str]       # None si exécutable par un non-superadmin, sinon le motif
+
+
+@lru_cache(maxsize=256)
+def compile_query(sql_text: str) -> CompiledQuery:
+    from routes.run_sql_routes import check_sql_permissions
+
+    sql_text = sql_text.strip().rstrip(";").rstrip()
+    names: List[str] = []
+    pyformat, positional = [], []
+    last = 0
+    # Même découpage que les garde-fous (sql_analyzer) : $$...$$, E'...', /* /* */ */ compris
+    for start, end, name in find_named_params(sql_text):
+        chunk = sql_text[last:start]
+        pyformat.append(chunk.replace("%", "%%"))
+        positional.append(chunk)
+        if name not in names:
+            names.append(name)
+        pyformat.append(f"%({name})s")
+        positional.append(f"${names.index(name) + 1}")
+        last = end
+    tail = sql_text[last:]
+    pyformat.append(tail.replace("%", "%%"))
+    positional.append(tail)
+
+    # Garde-fous de /api/sql/execute pour un non-superadmin (instruction unique, SELECT/WITH, tables protégées)
+    denied = check_sql_permissions(sql_text, "user")
+    return CompiledQuery(tuple(names), "".join(pyformat), "".join(positional), denied)
+
+
+def validate_params_spec(spec: Any) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """ Normalise la déclaration des paramètres ; retourne (spec, erreur). """
+    if spec in (None, ""):
+        return [], None
+    if not isinstance(spec, list):
+        return [], "params must be a list of {name, type?, default?}"
+    normalized = []
+    for item in spec:
+        if isinstance(item, str):
+            item = {"name": item}
+        if not isinstance(item, dict) or not _PARAM_NAME_RE.match(str(item.get("name", ""))):
+            return [], f"Invalid parameter declaration: {item!r}"
+        ptype = item.get("type")
+        if ptype is not None and not _PARAM_TYPE_RE.match(str(ptype)):
+            return [], f"Invalid parameter type: {ptype!r}"
+        normalized.append({k: item[k] for k in ("name", "type", "default") if k in item})
+    return normalized, None
+
+
+def bind_params(compiled: CompiledQuery, spec: List[Dict[str, Any]], values: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    """ Valeurs fournies, sinon valeurs par défaut déclarées ; erreur si un paramètre manque. """
+    values = values or {}
+    defaults = {p["name"]: p["default"] for p in spec if "default" in p}
+    bound, missing = {}, []
+    for name in compiled.names:
+        if name in values:
+            bound[name] = values[name]
+        elif name in defaults:
+            bound[name] = defaults[name]
+        else:
+            missing.append(name)
+    if missing:
+        return {}, f"Missing parameter(s): {', '.join(missing)}"
+    return bound, None
+
+
+# ------------------------
+# Exécution
+# ------------------------
+class _PreparedSession(threading.local):
+    """ Connexion persistante du thread + instructions déjà préparées (nom -> texte). """
+    conn = None
+    prepared: Dict[str, str] = None
+
+
+_session = _PreparedSession()
+
+
+def _session_connection():
+    if _session.conn is None or _session.conn.closed:
+        _session.conn = get_connection()
+        _session.prepared = {}
+        if _session.conn is None:
+            raise psycopg2.OperationalError("PostgreSQL connection failed")
+        _session.conn.autocommit = False
+    return _session.conn
+
+
+def _statement_name(query_id: int, compiled: CompiledQuery, types: Optional[List[str]]) -> str:
+    digest = hashlib.sha1((compiled.positional_sql + "|" + ",".join(types or [])).encode("utf-8")).hexdigest()[:10]
+    return f"sq_{int(query_id)}_{digest}"
+
+
+def _prepare(cur, name: str, compiled: CompiledQuery, types: Optional[List[str]]):
+    """ PREPARE (hors transaction de la requête : survit aux rollbacks) ; remplace l'ancienne version. """
+    prefix = name.rsplit("_", 1)[0] + "_"
+    for stale in [n for n in _session.prepared if n.startswith(prefix) and n != name]:
+        cur.execute(f"DEALLOCATE {stale};")
+        _session.prepared.pop(stale, None)
+    type_list = f"({', '.join(types)})" if types else ""
+    cur.execute(f"PREPARE {name}{type_list} AS {compiled.positional_sql}")
+    cur.connection.commit()
+    _session.prepared[name] = compiled.positional_sql
+
+
+def _fetch_result(cur, max_rows: int) -> Dict[str, Any]:
+    from routes.run_sql_routes import jsonify_value
+
+    if not cur.description:
+        return {"columns": [], "rows": [], "rowcount": cur.rowcount, "truncated": False}
+    columns = [desc.name for desc in cur.description]
+    rows = cur.fetchmany(max_rows + 1)
+    truncated = len(rows) > max_rows
+    data = [{col: jsonify_value(row[col]) for col in columns} for row in rows[:max_rows]]
+    return {"columns": columns, "rows": data, "rowcount": len(data), "truncated": truncated}
+
+
+def _begin(cur, read_only: bool, timeout_ms: int):
+    if read_only:
+        cur.execute("SET TRANSACTION READ ONLY;")
+    cur.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)};")
+
+
+def _bound_sql(conn, compiled: CompiledQuery, bound: Dict[str, Any]) -> Tuple[str, Optional[Tuple[Dict[str, Any], int]]]:
+    """
+    Texte lié par psycopg2, tel que PostgreSQL le reçoit, et refus (corps, statut) s'il n'est pas
+    exactement une instruction : `denied` ne porte que sur le modèle, les valeurs liées doivent rester des littéraux.
+    """
+    with conn.cursor() as cur:
+        sql_text = cur.mogrify(compiled.pyformat_sql, bound).decode("utf-8")
+    analysis = analyze_sql(sql_text)
+    if analysis.unterminated or analysis.statement_count != 1:
+        return sql_text, ({"error": "Bound query must be a single statement", "params": list(compiled.names)}, 400)
+    return sql_text, None
+
+
+def _cost_rejection(conn, sql_text: str, role: Optional[str]):
+    """
+    Contrôle de coût EXPLAIN (utils.sql_cost_guard) sur le texte lié ; refus (corps, statut) ou None.
+    L'EXPLAIN tourne dans sa propre transaction, annulée : _begin reste la première instruction de la suivante.
+    """
+    from utils.sql_cost_guard import check_cost
+
+    _, rejected = check_cost(conn, sql_text, role)
+    return rejected
+
+
+def execute_saved_query(query: Dict[str, Any], values: Dict[str, Any], read_only: bool, max_rows: int,
+                        prepared: bool = False, timeout_ms: int = None, role: Optional[str] = None,
+                        allow_replica: bool = True) -> Tuple[Dict[str, Any], int]:
+    """
+    Exécute une requête sauvegardée (ligne saved_queries) ; retourne (résultat, statut HTTP).
+    En lecture seule et non préparée, elle peut être servie par un réplica (sauf allow_replica=False).
+    `role` : exécution demandée par un utilisateur, soumise au contrôle de coût de son rôle
+    (comme /api/sql/execute) ; None pour les exécutions internes (snapshots).
+    """
+    from routes.run_sql_routes import STATEMENT_TIMEOUT_MS
+
+    compiled = compile_query(query["sql"])
+    spec = query.get("params") or []
+    bound, error = bind_params(compiled, spec, values)
+    if error:
+        return {"error": error, "params": list(compiled.names)}, 400
+
+    timeout_ms = timeout_ms or STATEMENT_TIMEOUT_MS
+    prepared = prepared and config.SAVED_QUERY_PREPARED
+    mode = "prepared" if prepared else "direct"
+    started = time.perf_counter()
+    if prepared:
+        result, status = _execute_prepared(query, compiled, spec, bound, read_only, max_rows, timeout_ms, role)
+    else:
+        result, status = _execute_direct(query, compiled, spec, bound, read_only, max_rows, timeout_ms, role, allow_replica)
+    elapsed = time.perf_counter() - started
+    SAVED_QUERY_SECONDS.observe(elapsed, mode=mode, status=str(status))
+    if status == 200:
+        result.update(timing_ms=round(elapsed * 1000, 2), mode=mode)
+    return result, status
+
+
+def _execute_direct(query, compiled, spec, bound, read_only, max_rows, timeout_ms, role=None, allow_replica=True):
+    conn = get_read_connection() if read_only and allow_replica else get_connection()
+    if conn is None:
+        return {"error": "PostgreSQL connection failed"}, 500
+    conn.autocommit = False
+    try:
+        # Le texte contrôlé est celui qui est exécuté
+        sql_text, rejected = _bound_sql(conn, compiled, bound)
+        if rejected is None and role is not None:
+            rejected = _cost_rejection(conn, sql_text, role)
+        if rejected:
+            return rejected
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            _begin(cur, read_only, timeout_ms)
+            cur.execute(sql_text)
+            result = _fetch_result(cur, max_rows)
+        conn.rollback() if read_only else conn.commit()
+        return result, 200
+    except Exception as e:
+        conn.rollback()
+        return _error_response(e, timeout_ms)
+    finally:
+        conn.close()
+
+
+def _execute_prepared(query, compiled, spec, bound, read_only, max_rows, timeout_ms, role=None):
+    if role is not None:
+        # EXECUTE transmet les valeurs hors du texte SQL ; seul l'EXPLAIN du contrôle de coût utilise le texte lié
+        try:
+            conn = _session_connection()
+            sql_text, rejected = _bound_sql(conn, compiled, bound)
+            if rejected is None:
+                rejected = _cost_rejection(conn, sql_text, role)
+        except psycopg2.OperationalError as e:
+            _session.conn = None
+            return _error_response(e, timeout_ms)
+        if rejected:
+            return rejected
+
+    # Types déclarés pour tous les paramètres → PREPARE typé, sinon types inférés par PostgreSQL
+    declared = {p["name"]: p.get("type") for p in spec}
+    types = [declared.get(n) for n in compiled.names]
+    types = types if all(types) else None
+    name = _statement_name(query["id"], compiled, types)
+    args = [bound[n] for n in compiled.names]
+
+    for attempt in (1, 2):
+        try:
+            conn = _session_connection()
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                if name not in _session.prepared:
+                    _prepare(cur, name, compiled, types)
+                _begin(cur, read_only, timeout_ms)
+                cur.execute(f"EXECUTE {name}" + (f"({', '.join(['%s'] * len(args))})" if args else ""), args or None)
+                result = _fetch_result(cur, max_rows)
+            conn.rollback() if read_only else conn.commit()
+            return result, 200
+        except psycopg2.OperationalError as e:
+            # Connexion perdue : nouvelle session, instructions à préparer de nouveau
+            _session.conn = None
+            if attempt == 2:
+                return _error_response(e, timeout_ms)
+        except psycopg2.Error as e:
+            _session.conn.rollback()
+            # Plan invalidé (ex: vue recréée, « cached plan must not change result type ») ou instruction perdue
+            if attempt == 1 and e.pgcode in ("0A000", "26000"):
+                _drop_prepared(name)
+                continue
+            return _error_response(e, timeout_ms)
+        except Exception as e:
+            if _session.conn is not None and not _session.conn.closed:
+                _session.conn.rollback()
+            return _error_response(e, timeout_ms)
+    return {"error": "Internal server error"}, 500
+
+
+def _drop_prepared(name: str):
+    if _session.prepared is None or name not in _session.prepared:
+        return
+    try:
+        with _session.conn.cursor() as cur:
+            cur.execute(f"DEALLOCATE {name};")
+        _session.conn.commit()
+    except psycopg2.Error:
+        _session.conn.rollback()
+    _session.prepared.pop(name, None)
+
+
+def _error_response(e: Exception, timeout_ms: int) -> Tuple[Dict[str, Any], int]:
+    if isinstance(e, psycopg2.errors.QueryCanceled):
+        return {"error": "Query timeout", "details": str(e), "timeout_ms": timeout_ms}, 408
+    if isinstance(e, psycopg2.Error):
+        return {"error": "Database error", "details": getattr(e, "pgerror", None) or str(e)}, 400
+    logger.exception("Unexpected error executing saved query")
+    return {"error": "Internal server error", "details": str(e)}, 500
+
+
+# ------------------------
+# Snapshots
+# ------------------------
+def get_snapshot(query_id: int) -> Optional[Dict[str, Any]]:
+    conn = get_read_connection()
+    if conn is None:
+        raise psycopg2.OperationalError("PostgreSQL connection failed")
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("""
+                SELECT query_id, params, columns, rows, rowcount, truncated, duration_ms, refreshed_at, error
+                FROM saved_query_snapshots WHERE query_id = %s;
+            """, (query_id,))
+            row = cur.fetchone()
+        if row and row["refreshed_at"]:
+            row["refreshed_at"] = row["refreshed_at"].isoformat()
+        return row
+    finally:
+        conn.close()
+
+
+def refresh_snapshots(query_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Recalcule les snapshots (toutes les requêtes `snapshot = true`, ou `query_ids`).
+    Lecture seule, paramètres par défaut ; une requête en échec n'arrête pas les autres.
+    """
+    if not ensure_saved_queries_schema():
+        return {"refreshed": 0, "failed": 0, "skipped": 0}
+    conn = get_connection()
+    if conn is None:
+        return {"refreshed": 0, "failed": 0, "skipped": 0}
+
+    summary = {"refreshed": 0, "failed": 0, "skipped": 0}
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            if query_ids:
+                cur.execute("SELECT id, name, sql, params FROM saved_queries WHERE snapshot AND id = ANY(%s) ORDER BY id;", (list(query_ids),))
+            else:
+                cur.execute("SELECT id, name, sql, params FROM saved_queries WHERE snapshot ORDER BY id;")
+            queries = cur.fetchall()
+
+        for query in queries:
+            compiled = compile_query(query["sql"])
+            if compiled.denied:
+                summary["skipped"] += 1
+                logger.warning(f"Snapshot de la requête {query['id']} ignoré : {compiled.denied}")
+                continue
+            started = time.perf_counter()
+            result, status = execute_saved_query(query, {}, read_only=True, max_rows=config.SAVED_QUERY_SNAPSHOT_MAX_ROWS,
+                                                 timeout_ms=config.SAVED_QUERY_SNAPSHOT_TIMEOUT_MS,
+                                                 allow_replica=False)  # un snapshot ne doit pas figer un réplica en retard
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            ok = status == 200
+            bound, _ = bind_params(compiled, query["params"] or [], {})
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO saved_query_snapshots (query_id, params, columns, rows, rowcount, truncated, duration_ms, refreshed_at, error)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, now(), %s)
+                    ON CONFLICT (query_id) DO UPDATE SET
+                        params = EXCLUDED.params,
+                        columns = COALESCE(EXCLUDED.columns, saved_query_snapshots.columns),
+                        rows = COALESCE(EXCLUDED.rows, saved_query_snapshots.rows),
+                        rowcount = COALESCE(EXCLUDED.rowcount, saved_query_snapshots.rowcount),
+                        truncated = COALESCE(EXCLUDED.truncated, saved_query_snapshots.truncated),
+                        duration_ms = EXCLUDED.duration_ms,
+                        refreshed_at = CASE WHEN EXCLUDED.error IS NULL THEN now() ELSE saved_query_snapshots.refreshed_at END,
+                        error = EXCLUDED.error;
+                """, (
+                    query["id"], json.dumps(bound),
+                    json.dumps(result["columns"]) if ok else None,
+                    json.dumps(result["rows"]) if ok else None,
+                    result["rowcount"] if ok else None,
+                    bool(result.get("truncated")) if ok else None,
+                    duration_ms,
+                    None if ok else str(result.get("details") or result.get("error"))[:2000],
+                ))
+            conn.commit()
+            summary["refreshed" if ok else "failed"] += 1
+            SAVED_QUERY_SNAPSHOTS.inc(status="success" if ok else "failed")
+    except Exception as e:
+        conn.rollback()
+        logger.exception(f"❌ Rafraîchissement des snapshots interrompu : {e}")
+    finally:
+        conn.close()
+
+    logger.info(f"📸 Snapshots : {summary['refreshed']} rafraîchis, {summary['failed']} en échec, {summary['skipped']} ignorés")
+    return summary
@@ -1,6 +1,5 @@
 import time
-import threading
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from contextlib import contextmanager
 from functools import wraps
 
@@ -11,7 +10,13 @@ from apscheduler.triggers.cron import CronTrigger
 from psycopg2 import pool, OperationalError, DatabaseError
 
 from utils.config import config
+from utils.profiler import profiled_job
+from utils.query_tracer import connection_factory
+from utils.saved_queries import refresh_snapshots
+from utils.metrics import MATVIEW_REFRESH_SECONDS, MATVIEW_REFRESH_TOTAL, SCHEDULER_JOB_RETRIES
 from utils.dates_utils import get_previous_month
+from utils.sync_queue import ensure_sync_queue_schema, open_batch, drain
+from utils.pg_locks import advisory_lock, LeaderElector
 from make_arrimate import Dhis2ArrimateMaker
 from clients.postgres_client import PostgresClient
 
@@ -22,8 +27,6 @@ from routes.sync_routes_utils import sync_orgunits, sync_dataelements, sync_teis
 from utils.logger import get_logger, clear_logs
 logger = get_logger(__name__)
 
-lock = threading.Lock()
-
 
 class SchedulerApp:
     """Reusable scheduler + DB pool + retry + matview refresher."""
@@ -39,6 +42,8 @@ class SchedulerApp:
         self.view_field_id = 'uid'
 
         self.init_db_pool()
+        # Un seul nœud exécute les jobs cron ; les autres restent prêts à prendre le relais
+        self.leader = LeaderElector().start() if config.SCHEDULER_LEADER_ELECTION else None
         # Schedule job immediately at startup
         self.register_jobs()
 
@@ -56,6 +61,7 @@ class SchedulerApp:
                     user=config.POSTGRES_USER,
                     password=config.POSTGRES_PASSWORD,
                     database=config.POSTGRES_DB,
+                    connection_factory=connection_factory(),
                 )
                 logger.info("DB pool created successfully.")
 
@@ -87,6 +93,24 @@ class SchedulerApp:
                     pass
                 self.db_pool.putconn(conn)
 
+    # JOB CRON : LEADER UNIQUEMENT + VERROU DE JOB
+    def leader_job(self, job_id, fn):
+        """
+        Exécute `fn` seulement sur le leader et sous l'advisory lock `job:<job_id>` :
+        un même job ne tourne jamais deux fois en parallèle, même lors d'un changement de leader.
+        """
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if self.leader is not None and not self.leader.is_leader():
+                logger.info("[%s] Nœud suiveur → SKIPPED", job_id)
+                return False
+            with advisory_lock(f"job:{job_id}") as acquired:
+                if not acquired:
+                    logger.warning("[%s] Déjà en cours sur un autre nœud → SKIPPED", job_id)
+                    return False
+                return fn(*args, **kwargs)
+        return wrapper
+
     # RETRY DECORATOR (STATIC)
     @staticmethod
     def retry():
@@ -109,6 +133,7 @@ class SchedulerApp:
                             logger.error("[Retry] Max attempts reached.", exc_info=True)
                             raise
 
+                        SCHEDULER_JOB_RETRIES.inc(job=fn.__name__)
                         logger.info("[Retry] Retrying in %s seconds...", sleep_delay)
                         time.sleep(sleep_delay)
                         sleep_delay *= backoff
@@ -120,13 +145,14 @@ class SchedulerApp:
     def refresh_materialized_view(self, concurrent=True, view_name=None, field_id=None):
         """Refresh MV with optional concurrency and safe index creation."""
 
-        if not lock.acquire(blocking=False):
-            logger.warning("MV refresh already in progress → SKIPPED")
-            return False
+        view = view_name or self.view_name
+        field = field_id or self.view_field_id
 
-        try:
-            view = view_name or self.view_name
-            field = field_id or self.view_field_id
+        # Verrou partagé par tous les processus (scheduler(s), /api/build-matview du backend)
+        with advisory_lock(f"matview:{view}") as acquired:
+            if not acquired:
+                logger.warning("MV refresh already in progress → SKIPPED")
+                return False
 
             # VALIDATION DES PARAMÈTRES
             if not view or not field:
@@ -165,19 +191,27 @@ class SchedulerApp:
                     raise
 
                 # Rafraîchissement de la MV
+                mode = "concurrent" if concurrent else "full"
                 try:
-                    cur.execute(refresh_sql)
+                    with MATVIEW_REFRESH_SECONDS.time(view=view, mode=mode):
+                        cur.execute(refresh_sql)
+                    MATVIEW_REFRESH_TOTAL.inc(view=view, status="success")
                 except Exception as e:
+                    MATVIEW_REFRESH_TOTAL.inc(view=view, status="failed")
                     logger.error("MV refresh failed (%s)", e)
                     raise
 
             duration = (datetime.utcnow() - start).total_seconds()
             logger.info("MV '%s' refreshed in %.2f seconds", view, duration)
 
+            # Résultats précalculés des requêtes sauvegardées (tableaux de bord)
+            if config.SAVED_QUERY_SNAPSHOTS_ENABLED:
+                try:
+                    refresh_snapshots()
+                except Exception as e:
+                    logger.error("Saved query snapshots refresh failed: %s", e, exc_info=True)
+
             return True
-        finally:
-            lock.release()
-            return False
 
     # AUTO ARRIMAGE
     @retry()
@@ -194,7 +228,7 @@ class SchedulerApp:
             orgunit_ids = pg.list_orgunits(only_ids=True)
             # logger.info(f"[AUTO-ARRIMAGE] Orgunits found: {orgunit_ids}")
             arr = Dhis2ArrimateMaker(send_to_dhis2 = True, save_to_local_file = False)
-            outputs = arr.start_indicators_arrimage_with_dhis2([period],orgunit_ids)
+            outputs = arr.start_indicators_arrimage_with_dhis2([period],orgunit_ids, triggered_by="scheduler")
 
             result = { "success":0, "error":0 }
             for output in outputs:
@@ -261,8 +295,8 @@ class SchedulerApp:
         Raises exception on failure to allow retry mechanism.
         """
         try:
-            result1, status1 = sync_orgunits()
-            result2, status2 = sync_dataelements()
+            result1, status1 = sync_orgunits(triggered_by="scheduler")
+            result2, status2 = sync_dataelements(triggered_by="scheduler")
             if status1 != 200 or status2 != 200:
                 msg = f"[AUTO-sync_orgunits_dataelements] ERROR: Status codes {status1}, {status2}"
                 logger.error(msg, exc_info=True)
@@ -282,8 +316,10 @@ class SchedulerApp:
         Automatic synchronization of TEIs, enrollments, events, and attributes.
         Raises exception on failure to allow retry mechanism.
         """
+        if config.SYNC_QUEUE_ENABLED:
+            return self.queue_sync_teis_enrollments_events_attributes()
         try:
-            result, status = sync_teis_enrollments_events_attributes()
+            result, status = sync_teis_enrollments_events_attributes(triggered_by="scheduler")
             if status != 200:
                 msg = f"[AUTO-sync_teis_enrollments_events_attributes] ERROR: Status code {status}"
                 logger.error(msg, exc_info=True)
@@ -296,6 +332,43 @@ class SchedulerApp:
             logger.error(f"[AUTO-sync_teis_enrollments_events_attributes] Exception: {e}", exc_info=True)
             raise  # propager l'erreur pour le retry
     
+    # FILE DE SYNC PARTAGÉE (SYNC_QUEUE_ENABLED)
+    @retry()
+    def queue_sync_teis_enrollments_events_attributes(self):
+        """
+        Ouvre le lot de sync du mois (ou rejoint celui ouvert par un autre replica)
+        puis participe à son traitement ; les orgunits sont réparties entre replicas via sync_tasks.
+        """
+        try:
+            pg = PostgresClient()
+            program = config.PROGRAM_TRACKER_ID
+            orgunit_ids = [ou["id"] for ou in pg.list_orgunits(level=5) if ou.get("id")]
+            batch_id = open_batch(program, orgunit_ids, pg.get_last_sync(), datetime.now(timezone.utc),
+                                  {"teis": True, "enrollments": True, "attributes": True, "events": True},
+                                  triggered_by="scheduler")
+            if batch_id is None:
+                raise Exception("[QUEUE-sync_teis] Lot de sync non créé (PostgreSQL indisponible)")
+            return self.sync_queue_worker()
+        except Exception as e:
+            logger.error(f"[QUEUE-sync_teis] Exception: {e}", exc_info=True)
+            raise  # propager l'erreur pour le retry
+
+    def sync_queue_worker(self):
+        """
+        Vide la file de sync (tâches en attente ou au bail expiré, de tout replica).
+        Le worker qui clôt un lot met à jour last_sync puis rafraîchit la vue matérialisée.
+        """
+        summary = drain(triggered_by="scheduler")
+        if summary["done"] or summary["failed"] or summary["retried"]:
+            logger.info(f"[QUEUE-sync_teis] {summary['done']} orgunits OK, {summary['failed']} en échec, "
+                        f"{summary['retried']} remises en file")
+        for batch in summary["finalized"]:
+            params = batch["params"] or {}
+            if all(params.get(key, True) for key in ("teis", "enrollments", "attributes", "events")):
+                PostgresClient().update_last_sync(batch["window_end"])
+            self.refresh_mv_job()
+        return True
+
     @retry()
     def cleanup_old_refresh_tokens(older_than_days: int = 90):
         try:
@@ -313,12 +386,15 @@ class SchedulerApp:
 
     # JOB REGISTRATION
     def register_jobs(self):
-        """Register APScheduler jobs."""
+        """
+        Register APScheduler jobs.
+        Jobs cron : exécutés par le seul leader (leader_job) ; sync_queue_worker : sur tous les nœuds.
+        """
 
         # 1️⃣ Cron jobs : chaque 8 du mois à 06:30
         self.scheduler.add_job(
             id="monthly_log_cleaner",
-            func=self.clear_app_logs,
+            func=profiled_job("monthly_log_cleaner", self.leader_job("monthly_log_cleaner", self.clear_app_logs)),
             trigger=CronTrigger(day=8, hour=6, minute=30, timezone="UTC"),
             # trigger="interval",
             # seconds=10,
@@ -330,7 +406,7 @@ class SchedulerApp:
         # 2️⃣ Cron jobs: chaque 9 du mois à 00:30
         self.scheduler.add_job(
             id="monthly_sync_orgunits_dataelements",
-            func=self.auto_sync_orgunits_dataelements,
+            func=profiled_job("monthly_sync_orgunits_dataelements", self.leader_job("monthly_sync_orgunits_dataelements", self.auto_sync_orgunits_dataelements)),
             trigger=CronTrigger(day=9, hour=0, minute=30, timezone="UTC"),
             # trigger="interval",
             # seconds=10,
@@ -342,7 +418,7 @@ class SchedulerApp:
         # 3️⃣ Cron jobs: chaque 10 du mois à 01:00
         self.scheduler.add_job(
             id="monthly_sync_teis_enrollments_events_attributes",
-            func=self.auto_sync_teis_enrollments_events_attributes,
+            func=profiled_job("monthly_sync_teis_enrollments_events_attributes", self.leader_job("monthly_sync_teis_enrollments_events_attributes", self.auto_sync_teis_enrollments_events_attributes)),
             trigger=CronTrigger(day=10, hour=1, minute=0, timezone="UTC"),
             # trigger="interval",
             # seconds=10,
@@ -351,10 +427,22 @@ class SchedulerApp:
         )
         logger.info("Scheduled Cron jobs 'sync_teis_enrollments_events_attributes' : chaque 10 du mois à 01:00 UTC")
 
+        # File de sync partagée : chaque replica reprend les tâches en attente / abandonnées
+        if config.SYNC_QUEUE_ENABLED and ensure_sync_queue_schema():
+            self.scheduler.add_job(
+                id="sync_queue_worker",
+                func=profiled_job("sync_queue_worker", self.sync_queue_worker),
+                trigger="interval",
+                seconds=config.SYNC_QUEUE_POLL_SECONDS,
+                replace_existing=True,
+                max_instances=1,
+            )
+            logger.info(f"Scheduled interval job 'sync_queue_worker' chaque {config.SYNC_QUEUE_POLL_SECONDS}s")
+
         #✅ Cron jobs: chaque 15 du mois à minuit
         self.scheduler.add_job(
             id="monthly_indicators_arrimage",
-            func=self.auto_indicators_arrimage,
+            func=profiled_job("monthly_indicators_arrimage", self.leader_job("monthly_indicators_arrimage", self.auto_indicators_arrimage)),
             trigger=CronTrigger(day=15, hour=0, minute=0, timezone="UTC"),
             # trigger="interval",
             # seconds=10,
@@ -379,5 +467,5 @@ class SchedulerApp:
     def manual_trigger(self):
         """Call this from Flask route if needed."""
         job_id = f"manual_refresh_{int(time.time())}"
-        self.scheduler.add_job(id=job_id, func=self.refresh_mv_job, trigger="date")
+        self.scheduler.add_job(id=job_id, func=profiled_job("manual_refresh", self.refresh_mv_job), trigger="date")
         return {"status": "queued", "job_id": job_id}
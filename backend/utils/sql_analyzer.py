@@ -0,0 +1,277 @@
+"""
+Analyse lexicale de requêtes SQL en une seule passe (garde-fous de /api/sql/execute).
+
+Un seul parcours linéaire découpe le texte en lexèmes : espaces, commentaires (-- et /* */,
+imbriqués comme dans le lexer PostgreSQL), chaînes ('...', E'...', $tag$...$tag$),
+identifiants entre guillemets, mots, nombres et ponctuation. On en déduit :
+
+- first_keyword   : premier mot significatif (hors commentaires), en majuscules
+- statement_count : nombre d'instructions non vides séparées par `;`
+- keywords        : mots nus en majuscules (les mots-clés bloqués s'y cherchent)
+- identifiers     : mots nus et identifiants entre guillemets, en minuscules
+- relations       : relations citées après FROM / JOIN / UPDATE / INTO / TABLE (et listes FROM a, b)
+- literal_words   : mots contenus dans les chaînes — des fonctions comme query_to_xml()
+                    exécutent du SQL passé en chaîne, les garde-fous les examinent donc aussi
+- unterminated    : commentaire, chaîne ou identifiant non fermé — PostgreSQL et l'analyse
+                    pourraient découper le texte différemment, la requête est donc refusée
+
+Les résultats sont mis en cache (LRU) par empreinte du texte : une requête déjà vue
+est validée sans nouvelle analyse.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import FrozenSet, List, NamedTuple, Tuple
+
+from utils.config import config
+
+# Les commentaires /* */ (imbriquables) sont découpés par _block_comment_end, pas par la regex
+_TOKEN_RE = re.compile(r"""
+      (?P<ws>\s+)
+    | (?P<line_comment>--[^\n\r]*)
+    | (?P<string>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*')
+    | (?P<dollar>\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$)
+    | (?P<quoted>"(?:[^"]|"")*")
+    | (?P<unterminated>[eE]?'|"|\$(?:[A-Za-z_]\w*)?\$)
+    | (?P<word>[^\W\d]\w*(?:\$\w*)*)
+    | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+    | (?P<param>\$\d+)
+    | (?P<punct>.)
+""", re.S | re.X)
+
+_LITERAL_WORD_RE = re.compile(r"[^\W\d]\w*")
+
+# Mots introduisant une relation ; FROM ouvre une liste « a, b, c » jusqu'au mot-clé de clause suivant
+_RELATION_INTRODUCERS = {"FROM", "JOIN", "UPDATE", "INTO", "TABLE"}
+_RELATION_MODIFIERS = {"ONLY", "LATERAL"}
+_FROM_TERMINATORS = {"WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "OFFSET", "WINDOW", "UNION",
+                     "INTERSECT", "EXCEPT", "RETURNING", "SET", "FETCH", "FOR", "VALUES"}
+
+
+def _block_comment_end(sql: str, start: int):
+    """ Fin (exclusive) du commentaire /* ouvert en `start`, en suivant l'imbrication ; None si non fermé. """
+    depth, pos = 0, start
+    while True:
+        close = sql.find("*/", pos)
+        if close < 0:
+            return None
+        opening = sql.find("/*", pos, close)
+        if opening >= 0:
+            depth += 1
+            pos = opening + 2
+            continue
+        depth -= 1
+        pos = close + 2
+        if depth == 0:
+            return pos
+
+
+def _tokens(sql: str):
+    """ Lexèmes (type, texte) ; un commentaire / une chaîne non fermé(e) donne "unterminated" jusqu'à la fin. """
+    pos, end = 0, len(sql)
+    while pos < end:
+        if sql.startswith("/*", pos):
+            stop = _block_comment_end(sql, pos)
+            if stop is None:
+                yield "unterminated", sql[pos:]
+                return
+            yield "block_comment", sql[pos:stop]
+            pos = stop
+            continue
+        m = _TOKEN_RE.match(sql, pos)
+        kind = m.lastgroup
+        if kind == "unterminated":
+            yield kind, sql[pos:]
+            return
+        yield kind, m.group(kind)
+        pos = m.end()
+
+
+class SqlAnalysis(NamedTuple):
+    first_keyword: str
+    statement_count: int
+    keywords: FrozenSet[str]
+    identifiers: FrozenSet[str]
+    relations: FrozenSet[str]
+    literal_words: FrozenSet[str]
+    unterminated: bool = False
+
+
+def _identifier(kind: str, text: str) -> str:
+    if kind == "quoted":
+        return text[1:-1].replace('""', '"').lower()
+    return text.lower()
+
+
+def _literal_body(kind: str, text: str) -> str:
+    if kind == "dollar":
+        start = text.index("$", 1) + 1
+        return text[start:]
+    return text[text.index("'") + 1:]
+
+
+def _analyze(sql: str) -> SqlAnalysis:
+    first_keyword = ""
+    statements = 0
+    in_statement = False
+    keywords, identifiers, relations, literal_words = set(), set(), set(), set()
+
+    depth = 0
+    from_depths = []           # profondeurs de parenthèses où une liste FROM est ouverte
+    expect_relation = False    # le prochain identifiant est une relation
+    relation_parts = None      # parties de la relation en cours (schema.table)
+    pending_dot = False
+
+    def close_relation():
+        nonlocal relation_parts
+        if relation_parts:
+            relations.add(".".join(relation_parts))
+        relation_parts = None
+
+    unterminated = False
+    for kind, text in _tokens(sql):
+        if kind in ("ws", "line_comment", "block_comment"):
+            continue
+        if kind == "unterminated":
+            unterminated = True
+            break
+
+        if kind == "punct" and text == ";":
+            close_relation()
+            in_statement, expect_relation, pending_dot = False, False, False
+            from_depths.clear()
+            depth = 0
+            continue
+
+        if not in_statement:
+            in_statement = True
+            statements += 1
+            if statements == 1:
+                first_keyword = text.upper() if kind == "word" else ""
+
+        if kind in ("string", "dollar"):
+            literal_words.update(w.lower() for w in _LITERAL_WORD_RE.findall(_literal_body(kind, text)))
+            close_relation()
+            expect_relation = False
+            continue
+
+        if kind in ("word", "quoted"):
+            name = _identifier(kind, text)
+            identifiers.add(name)
+            upper = text.upper() if kind == "word" else None
+
+            if relation_parts is not None and pending_dot:
+                relation_parts.append(name)
+                pending_dot = False
+                continue
+            close_relation()
+
+            if upper in _RELATION_INTRODUCERS:
+                keywords.add(upper)
+                expect_relation = True
+                if upper == "FROM":
+                    from_depths.append(depth)
+                continue
+            if upper is not None:
+                keywords.add(upper)
+                if upper in _RELATION_MODIFIERS and expect_relation:
+                    continue
+                if upper in _FROM_TERMINATORS and from_depths and from_depths[-1] == depth:
+                    from_depths.pop()
+            if expect_relation:
+                relation_parts = [name]
+                expect_relation = False
+            continue
+
+        if kind == "punct":
+            if text == "." and relation_parts is not None:
+                pending_dot = True
+                continue
+            close_relation()
+            if text == "(":
+                depth += 1
+                expect_relation = False
+            elif text == ")":
+                while from_depths and from_depths[-1] >= depth:
+                    from_depths.pop()
+                depth = max(0, depth - 1)
+            elif text == "," and from_depths and from_depths[-1] == depth:
+                expect_relation = True
+            continue
+
+        close_relation()
+        expect_relation = False
+
+    close_relation()
+    return SqlAnalysis(first_keyword, statements, frozenset(keywords), frozenset(identifiers),
+                       frozenset(relations), frozenset(literal_words), unterminated)
+
+
+class _AnalysisCache:
+    """ LRU empreinte (blake2b) -> SqlAnalysis ; les textes eux-mêmes ne sont pas conservés. """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, SqlAnalysis]" = OrderedDict()
+
+    def get(self, key: bytes):
+        with self._lock:
+            analysis = self._entries.get(key)
+            if analysis is not None:
+                self._entries.move_to_end(key)
+            return analysis
+
+    def set(self, key: bytes, analysis: SqlAnalysis):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = analysis
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_cache = _AnalysisCache(config.SQL_ANALYZER_CACHE_SIZE)
+
+
+def analyze_sql(sql: str) -> SqlAnalysis:
+    """ Analyse (en cache) d'un texte SQL. """
+    key = hashlib.blake2b(sql.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    analysis = _cache.get(key)
+    if analysis is None:
+        analysis = _analyze(sql)
+        _cache.set(key, analysis)
+    return analysis
+
+
+_NAMED_PARAM_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def find_named_params(sql: str) -> List[Tuple[int, int, str]]:
+    """
+    Paramètres `:nom` (début, fin, nom) vus par le même découpage que l'analyse : rien n'est
+    cherché dans les chaînes, identifiants entre guillemets et commentaires ; `::` est un cast.
+    """
+    found = []
+    tokens = list(_tokens(sql))
+    pos = 0
+    for i, (kind, text) in enumerate(tokens):
+        if (kind == "punct" and text == ":" and i + 1 < len(tokens) and tokens[i + 1][0] == "word"
+                and _NAMED_PARAM_RE.fullmatch(tokens[i + 1][1])
+                and not (i > 0 and tokens[i - 1] == ("punct", ":"))):
+            name = tokens[i + 1][1]
+            found.append((pos, pos + 1 + len(name), name))
+        pos += len(text)
+    return found
+
+
+def normalize_statement(sql: str) -> str:
+    """ Texte sans commentaires, espaces réduits, sans `;` final (chaînes intactes). """
+    parts = []
+    for kind, text in _tokens(sql):
+        if kind in ("line_comment", "block_comment"):
+            continue
+        parts.append(" " if kind == "ws" else text)
+    return "".join(parts).strip().rstrip(";").strip()
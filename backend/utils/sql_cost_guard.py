@@ -0,0 +1,199 @@
+"""
+Contrôle d'admission de /api/sql/execute sur les estimations du planificateur.
+
+Avant exécution, `EXPLAIN (FORMAT JSON)` (sans ANALYZE : rien n'est exécuté) donne le coût
+total et le nombre de lignes estimés. Au-delà des limites du rôle (SQL_MAX_COST_<ROLE>,
+SQL_MAX_PLAN_ROWS_<ROLE>, 0 = illimité ; superadmin jamais limité), la requête est refusée
+avec le résumé du plan, affiché par le tableau de bord SQL.
+
+Seul un texte que utils.sql_analyzer voit comme une instruction unique est soumis à EXPLAIN,
+dans une transaction dédiée (READ ONLY, statement_timeout = SQL_COST_EXPLAIN_TIMEOUT_MS)
+toujours annulée : le contrôle lui-même ne peut ni écrire ni durer.
+
+Les résumés sont mis en cache par instruction normalisée (espaces et commentaires ignorés)
+pendant SQL_COST_CACHE_SECONDS : les statistiques ne changent qu'après une sync.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from utils.config import config
+from utils.metrics import REGISTRY
+from utils.sql_analyzer import analyze_sql, normalize_statement
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+SQL_COST_GUARD = REGISTRY.counter("sql_cost_guard_total", "Décisions du contrôle de coût EXPLAIN", ["role", "result"])
+SQL_COST_ESTIMATE = REGISTRY.histogram("sql_cost_guard_estimated_cost", "Coût total estimé des requêtes soumises", ["role"],
+                                       buckets=(1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9))
+SQL_COST_CACHE = REGISTRY.counter("sql_cost_guard_cache_total", "Cache des estimations de plan", ["result"])
+
+TOP_NODES = 5
+
+
+def role_limits(role: Optional[str]) -> Tuple[float, float]:
+    """ (coût max, lignes estimées max) du rôle ; 0 = illimité. """
+    if role == "superadmin":
+        return 0, 0
+    return config.SQL_COST_LIMITS.get(role or "user", config.SQL_COST_LIMITS["user"])
+
+
+def summarize_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """ Résumé du plan : racine + nœuds les plus coûteux (parcours séquentiels en tête). """
+    root = plan["Plan"]
+    nodes: List[Dict[str, Any]] = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append({
+            "node": node.get("Node Type"),
+            "relation": node.get("Relation Name"),
+            "rows": node.get("Plan Rows"),
+            "cost": node.get("Total Cost"),
+        })
+        stack.extend(node.get("Plans") or [])
+    seq_scans = sorted((n for n in nodes if n["node"] == "Seq Scan"), key=lambda n: n["cost"] or 0, reverse=True)
+    costliest = sorted((n for n in nodes if n["node"] != "Seq Scan"), key=lambda n: n["cost"] or 0, reverse=True)
+    return {
+        "total_cost": root.get("Total Cost"),
+        "startup_cost": root.get("Startup Cost"),
+        "rows": root.get("Plan Rows"),
+        "width": root.get("Plan Width"),
+        "node": root.get("Node Type"),
+        "relations": sorted({n["relation"] for n in nodes if n["relation"]}),
+        "top_nodes": (seq_scans + costliest)[:TOP_NODES],
+    }
+
+
+class _PlanCache:
+    """ LRU empreinte de l'instruction normalisée -> (expiration, résumé). """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: bytes, summary: Dict[str, Any]):
+        if self.maxsize <= 0 or config.SQL_COST_CACHE_SECONDS <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + config.SQL_COST_CACHE_SECONDS, summary)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_plan_cache = _PlanCache(config.SQL_COST_CACHE_SIZE)
+
+
+class NotSingleStatement(ValueError):
+    """ Texte que l'analyse ne voit pas comme exactement une instruction : jamais soumis à EXPLAIN. """
+
+
+def _explain(conn, statement: str):
+    """
+    EXPLAIN (FORMAT JSON) dans une transaction READ ONLY bornée par statement_timeout, annulée ensuite.
+    `conn` doit être hors transaction ; son mode autocommit est rétabli.
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION READ ONLY;")
+            cur.execute("SET LOCAL statement_timeout = %s;", (int(config.SQL_COST_EXPLAIN_TIMEOUT_MS),))
+            cur.execute("EXPLAIN (FORMAT JSON) " + statement)
+            return cur.fetchone()[0]
+    finally:
+        conn.rollback()
+        conn.autocommit = autocommit
+
+
+def estimate_plan(conn, sql_text: str) -> Dict[str, Any]:
+    """
+    Résumé du plan estimé (cache), via EXPLAIN (FORMAT JSON). Lève psycopg2.Error si la requête est invalide,
+    NotSingleStatement si l'analyse n'y voit pas exactement une instruction.
+    """
+    analysis = analyze_sql(sql_text)
+    if analysis.unterminated or analysis.statement_count != 1:
+        raise NotSingleStatement(f"{analysis.statement_count} statements")
+    normalized = normalize_statement(sql_text)
+    key = hashlib.blake2b(normalized.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    summary = _plan_cache.get(key)
+    if summary is not None:
+        SQL_COST_CACHE.inc(result="hit")
+        return dict(summary, cached=True)
+
+    SQL_COST_CACHE.inc(result="miss")
+    started = time.perf_counter()
+    raw = _explain(conn, normalized)
+    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+    summary = summarize_plan(plan)
+    summary["planning_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    _plan_cache.set(key, summary)
+    return dict(summary, cached=False)
+
+
+def check_cost(conn, sql_text: str, role: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Dict[str, Any], int]]]:
+    """
+    Retourne (résumé du plan, refus) ; refus = (corps de réponse, statut) ou None si la requête est admise.
+    Une requête que PostgreSQL ne sait pas planifier est refusée avec l'erreur du planificateur (400).
+    """
+    role_label = role or "user"
+    max_cost, max_rows = role_limits(role)
+    if not config.SQL_COST_GUARD_ENABLED or (not max_cost and not max_rows):
+        return None, None
+
+    try:
+        summary = estimate_plan(conn, sql_text)
+    except NotSingleStatement:
+        SQL_COST_GUARD.inc(role=role_label, result="invalid")
+        return None, ({"error": "Only a single SQL statement can be cost-checked"}, 400)
+    except psycopg2.Error as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        SQL_COST_GUARD.inc(role=role_label, result="invalid")
+        return None, ({"error": "Database error", "details": getattr(e, "pgerror", None) or str(e)}, 400)
+
+    SQL_COST_ESTIMATE.observe(summary["total_cost"] or 0, role=role_label)
+    summary["limits"] = {"max_cost": max_cost or None, "max_rows": max_rows or None}
+
+    reasons = []
+    if max_cost and (summary["total_cost"] or 0) > max_cost:
+        reasons.append(f"estimated cost {summary['total_cost']:.0f} > {max_cost:.0f}")
+    if max_rows and (summary["rows"] or 0) > max_rows:
+        reasons.append(f"estimated rows {summary['rows']} > {max_rows:.0f}")
+    if reasons:
+        SQL_COST_GUARD.inc(role=role_label, result="rejected")
+        logger.warning(f"⛔ Requête refusée par le contrôle de coût ({role_label}) : {', '.join(reasons)}")
+        return summary, ({
+            "error": "Query too expensive for your role",
+            "reasons": reasons,
+            "plan": summary,
+            "hint": "Add filters (period, orgunit) or a LIMIT, run it as a background job (POST /api/sql/jobs), or ask an admin",
+        }, 422)
+
+    SQL_COST_GUARD.inc(role=role_label, result="allowed")
+    return summary, None
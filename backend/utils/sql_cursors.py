@@ -0,0 +1,260 @@
+"""
+Sessions de curseurs serveur pour paginer les résultats de /api/sql/execute.
+
+Avec { "cursor": true }, execute_sql ouvre un curseur nommé (DECLARE ... dans une transaction
+dédiée, en lecture seule pour les non-admins), renvoie la première page et garde la session
+dans un registre : GET /api/sql/cursor/<id>/next?n= lit les pages suivantes (FETCH) sans
+réexécuter la requête.
+
+- une connexion par session ; au plus SQL_CURSOR_MAX_PER_USER sessions par utilisateur
+  (la moins récemment utilisée est fermée) et SQL_CURSOR_MAX_SESSIONS par processus (429)
+- une session inutilisée depuis SQL_CURSOR_TTL_SECONDS est fermée par un thread de purge,
+  tout comme une session épuisée : la transaction est annulée et la connexion fermée
+- le registre est local au processus : avec plusieurs workers gunicorn, un id inconnu
+  (expiré ou détenu par un autre worker) renvoie 404 et le client poursuit en pagination
+  sans état ({ "offset": lignes déjà chargées }, requête réexécutée par page). Le curseur est
+  donc une option de l'éditeur SQL, la pagination par offset restant le mode par défaut
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extras
+
+from utils.config import config
+from utils.metrics import REGISTRY
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+SQL_CURSOR_SESSIONS = REGISTRY.gauge("sql_cursor_sessions", "Sessions de curseur serveur ouvertes")
+SQL_CURSOR_EVENTS = REGISTRY.counter("sql_cursor_events_total", "Cycle de vie des sessions de curseur", ["event"])
+SQL_CURSOR_FETCH_SECONDS = REGISTRY.histogram("sql_cursor_fetch_seconds", "Durée des FETCH de pages de curseur")
+
+CURSOR_QUERY_KEYWORDS = ("SELECT", "WITH", "VALUES", "TABLE")
+
+# Page : (lignes, épuisé)
+Page = Tuple[List[Dict[str, Any]], bool]
+
+
+class CursorError(Exception):
+    """ Session refusée / introuvable / en erreur (message, statut HTTP). """
+
+    def __init__(self, message: str, status: int = 400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+class CursorSession:
+    """ Connexion + curseur nommé ouvert ; les FETCH d'une même session sont sérialisés. """
+
+    def __init__(self, username: str, conn, cursor):
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.conn = conn
+        self.cursor = cursor
+        self.columns: List[str] = [desc.name for desc in cursor.description] if cursor.description else []
+        self.fetched = 0
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.lock = threading.Lock()
+        self.closed = False
+        self._lookahead: List[Any] = []
+
+    def fetch(self, n: int) -> Page:
+        """ n lignes suivantes ; `épuisé` quand le curseur ne renvoie plus rien après cette page. """
+        from routes.run_sql_routes import jsonify_value
+
+        started = time.perf_counter()
+        # Une ligne d'avance (gardée pour la page suivante) indique s'il reste des lignes
+        rows = self._lookahead + self.cursor.fetchmany(n + 1 - len(self._lookahead))
+        SQL_CURSOR_FETCH_SECONDS.observe(time.perf_counter() - started)
+        rows, self._lookahead = rows[:n], rows[n:]
+        exhausted = not self._lookahead
+        if not self.columns and self.cursor.description:
+            self.columns = [desc.name for desc in self.cursor.description]
+        self.fetched += len(rows)
+        self.last_used = time.monotonic()
+        return [{col: jsonify_value(row[col]) for col in self.columns} for row in rows], exhausted
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for action in (self.cursor.close, self.conn.rollback, self.conn.close):
+            try:
+                action()
+            except Exception:
+                pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "fetched": self.fetched,
+            "expires_in": max(0, int(self.last_used + config.SQL_CURSOR_TTL_SECONDS - time.monotonic())),
+        }
+
+
+class CursorRegistry:
+    """ Sessions du processus (ordre = moins récemment utilisée en tête), purge périodique des inactives. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, CursorSession]" = OrderedDict()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def add(self, session: CursorSession):
+        evicted = []
+        with self._lock:
+            if len(self._sessions) >= config.SQL_CURSOR_MAX_SESSIONS:
+                SQL_CURSOR_EVENTS.inc(event="rejected")
+                raise CursorError("Too many open cursors, retry later", 429,
+                                  retry_after=max(1, config.SQL_CURSOR_SWEEP_SECONDS))
+            own = [s for s in self._sessions.values() if s.username == session.username]
+            while len(own) >= config.SQL_CURSOR_MAX_PER_USER:
+                oldest = own.pop(0)
+                evicted.append(self._sessions.pop(oldest.id))
+            self._sessions[session.id] = session
+            SQL_CURSOR_SESSIONS.set(len(self._sessions))
+            self._start_sweeper()
+        for old in evicted:
+            self._close(old, "replaced")
+        SQL_CURSOR_EVENTS.inc(event="opened")
+
+    def get(self, session_id: str, username: str) -> CursorSession:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.username != username:
+                raise CursorError("Cursor not found (expired, exhausted or held by another worker): re-run the query", 404)
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def discard(self, session_id: str, event: str = "closed") -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            SQL_CURSOR_SESSIONS.set(len(self._sessions))
+        if session is None:
+            return False
+        self._close(session, event)
+        return True
+
+    def sweep(self) -> int:
+        """ Ferme les sessions inactives depuis plus de SQL_CURSOR_TTL_SECONDS. """
+        deadline = time.monotonic() - config.SQL_CURSOR_TTL_SECONDS
+        with self._lock:
+            # Une session en cours de FETCH (verrou pris) n'est pas inactive
+            idle = [s for s in self._sessions.values() if s.last_used < deadline and not s.lock.locked()]
+            for session in idle:
+                del self._sessions[session.id]
+            SQL_CURSOR_SESSIONS.set(len(self._sessions))
+        for session in idle:
+            self._close(session, "evicted")
+        if idle:
+            logger.info(f"🧹 {len(idle)} curseur(s) SQL inactif(s) fermé(s)")
+        return len(idle)
+
+    def _close(self, session: CursorSession, event: str):
+        with session.lock:
+            session.close()
+        SQL_CURSOR_EVENTS.inc(event=event)
+
+    def _start_sweeper(self):
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="sql-cursor-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(config.SQL_CURSOR_SWEEP_SECONDS)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"Purge des curseurs SQL impossible : {e}")
+
+
+registry = CursorRegistry()
+
+
+def open_cursor(conn, sql_text: str, username: str, page_size: int, read_only: bool,
+                timeout_ms: int) -> Tuple[Dict[str, Any], Optional[CursorSession]]:
+    """
+    Déclare le curseur sur `conn` (qui appartient désormais à la session) et lit la première page.
+    Retourne (résultat, session) ; session None si tout tient dans la première page.
+    Lève psycopg2.Error (requête invalide, timeout) après avoir fermé la connexion.
+    """
+    conn.autocommit = False
+    try:
+        with conn.cursor() as setup:
+            if read_only:
+                setup.execute("SET TRANSACTION READ ONLY;")
+            # statement_timeout s'applique à chaque FETCH ; la transaction ne peut rester
+            # inactive plus longtemps que la session (filet de sécurité si la purge échoue)
+            setup.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)};")
+            setup.execute(f"SET LOCAL idle_in_transaction_session_timeout = {int((config.SQL_CURSOR_TTL_SECONDS + 60) * 1000)};")
+        cursor = conn.cursor(name=f"sql_cursor_{uuid.uuid4().hex[:16]}", cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute(sql_text)
+    except Exception:
+        for action in (conn.rollback, conn.close):
+            try:
+                action()
+            except Exception:
+                pass
+        raise
+
+    session = CursorSession(username, conn, cursor)
+    try:
+        rows, exhausted = session.fetch(page_size)
+    except Exception:
+        session.close()
+        raise
+
+    if exhausted:
+        session.close()
+        SQL_CURSOR_EVENTS.inc(event="exhausted")
+        return {"columns": session.columns, "rows": rows, "rowcount": len(rows), "cursor": None}, None
+
+    try:
+        registry.add(session)
+    except CursorError:
+        session.close()
+        raise
+    return {"columns": session.columns, "rows": rows, "rowcount": len(rows),
+            "cursor": dict(session.describe(), has_more=True)}, session
+
+
+def fetch_next(session_id: str, username: str, n: int) -> Dict[str, Any]:
+    """ Page suivante d'une session ; la session est fermée dès qu'elle est épuisée ou en erreur. """
+    session = registry.get(session_id, username)
+    with session.lock:
+        if session.closed:
+            raise CursorError("Cursor not found (expired, exhausted or held by another worker): re-run the query", 404)
+        try:
+            rows, exhausted = session.fetch(n)
+        except psycopg2.errors.QueryCanceled as e:
+            session.conn.rollback()
+            error = CursorError("Query timeout", 408, details=str(e))
+        except psycopg2.Error as e:
+            error = CursorError("Database error", 400, details=getattr(e, "pgerror", None) or str(e))
+        else:
+            error = None
+    if error is not None:
+        registry.discard(session_id, "failed")
+        raise error
+    if exhausted:
+        registry.discard(session_id, "exhausted")
+    return {
+        "columns": session.columns,
+        "rows": rows,
+        "rowcount": len(rows),
+        "cursor": dict(session.describe(), has_more=not exhausted),
+    }
+
+
+def close_cursor(session_id: str, username: str):
+    registry.get(session_id, username)
+    registry.discard(session_id, "closed")
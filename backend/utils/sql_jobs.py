@@ -0,0 +1,412 @@
+"""
+Jobs SQL asynchrones (requêtes longues du tableau de bord SQL).
+
+POST /api/sql/jobs enregistre le job dans sql_jobs puis le confie au pool de threads
+du processus (SQL_JOB_WORKERS). Le job ouvre sa propre connexion, exécute la requête
+dans un curseur serveur nommé et déverse les lignes par lots dans la table UNLOGGED
+sql_job_rows (job_id, rn, data) : n'importe quel worker gunicorn sert ensuite l'état
+et les pages de résultats (rn > after ORDER BY rn : pagination par offset ou par clé).
+
+Annulation : pg_cancel_backend(pid) sur la connexion du job (pid enregistré au démarrage),
+possible depuis n'importe quel processus. Les jobs et leurs lignes sont purgés après
+SQL_JOB_RESULT_TTL_HOURS ; un job dont le worker a disparu est marqué en échec.
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+import psycopg2.extras
+
+from utils.config import config
+from utils.db import get_connection
+from utils.metrics import REGISTRY
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+SQL_JOBS = REGISTRY.counter("sql_jobs_total", "Jobs SQL asynchrones terminés", ["status"])
+SQL_JOB_SECONDS = REGISTRY.histogram("sql_job_seconds", "Durée d'exécution des jobs SQL", ["status"],
+                                     buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800))
+SQL_JOB_ROWS = REGISTRY.counter("sql_job_rows_total", "Lignes déversées par les jobs SQL")
+
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+ROW_QUERY_KEYWORDS = ("SELECT", "WITH", "VALUES", "TABLE")
+JOB_COLUMNS = ("id, user_id, username, role, status, created_at, started_at, finished_at, updated_at, "
+               "rowcount, truncated, columns, error, max_rows, timeout_ms")
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+class JobError(Exception):
+    """ Refus de soumission / d'accès (message, statut HTTP). """
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+# ------------------------
+# Schéma
+# ------------------------
+def ensure_sql_jobs_schema() -> bool:
+    """ Tables sql_jobs / sql_job_rows ; exécuté une seule fois par processus. """
+    global _schema_ready
+    if _schema_ready:
+        return True
+    with _schema_lock:
+        if _schema_ready:
+            return True
+        conn = get_connection()
+        if conn is None:
+            logger.error("❌ Schéma sql_jobs non vérifié : connexion PostgreSQL indisponible")
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS sql_jobs (
+                        id TEXT PRIMARY KEY,
+                        user_id BIGINT,
+                        username TEXT,
+                        role TEXT,
+                        status TEXT NOT NULL,
+                        sql TEXT NOT NULL,
+                        max_rows BIGINT NOT NULL,
+                        timeout_ms BIGINT NOT NULL,
+                        backend_pid INT,
+                        rowcount BIGINT NOT NULL DEFAULT 0,
+                        truncated BOOLEAN NOT NULL DEFAULT false,
+                        columns JSONB,
+                        error TEXT,
+                        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                        started_at TIMESTAMP WITH TIME ZONE,
+                        finished_at TIMESTAMP WITH TIME ZONE,
+                        updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_sql_jobs_user_created ON sql_jobs(username, created_at DESC);
+                    CREATE INDEX IF NOT EXISTS idx_sql_jobs_status ON sql_jobs(status);
+
+                    -- Résultats : UNLOGGED (pas de WAL), perdus en cas de crash du serveur
+                    CREATE UNLOGGED TABLE IF NOT EXISTS sql_job_rows (
+                        job_id TEXT NOT NULL REFERENCES sql_jobs(id) ON DELETE CASCADE,
+                        rn BIGINT NOT NULL,
+                        data JSONB NOT NULL,
+                        PRIMARY KEY (job_id, rn)
+                    );
+                """)
+            conn.commit()
+            _schema_ready = True
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.exception(f"❌ Création du schéma sql_jobs impossible : {e}")
+            return False
+        finally:
+            conn.close()
+
+
+def _executor_instance() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=config.SQL_JOB_WORKERS, thread_name_prefix="sql-job")
+    return _executor
+
+
+def _serialize(job: Dict[str, Any]) -> Dict[str, Any]:
+    for key in ("created_at", "started_at", "finished_at", "updated_at"):
+        if job.get(key):
+            job[key] = job[key].isoformat()
+    return job
+
+
+# ------------------------
+# Soumission / consultation
+# ------------------------
+def submit_job(sql_text: str, user: Dict[str, Any], max_rows: Optional[int] = None) -> Dict[str, Any]:
+    """ Enregistre et met en file un job ; lève JobError si refusé. """
+    from routes.run_sql_routes import check_sql_permissions
+    from utils.sql_analyzer import analyze_sql
+
+    role = user.get("role")
+    denied = check_sql_permissions(sql_text, role)
+    if denied:
+        raise JobError(denied, 403)
+    analysis = analyze_sql(sql_text)
+    if analysis.statement_count != 1 or analysis.first_keyword not in ROW_QUERY_KEYWORDS:
+        raise JobError("Async jobs only run a single query returning rows (SELECT / WITH / VALUES / TABLE)", 400)
+
+    max_rows = min(max_rows or config.SQL_JOB_MAX_ROWS, config.SQL_JOB_MAX_ROWS)
+    if not ensure_sql_jobs_schema():
+        raise JobError("PostgreSQL connection failed", 500)
+    _maybe_cleanup()
+
+    job_id = uuid.uuid4().hex
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM sql_jobs WHERE username = %s AND status IN %s;", (user.get("username"), ACTIVE_STATUSES))
+            if cur.fetchone()[0] >= config.SQL_JOB_MAX_ACTIVE_PER_USER:
+                raise JobError(f"Too many active jobs (max {config.SQL_JOB_MAX_ACTIVE_PER_USER})", 429)
+            cur.execute("""
+                INSERT INTO sql_jobs (id, user_id, username, role, status, sql, max_rows, timeout_ms)
+                VALUES (%s, %s, %s, %s, 'queued', %s, %s, %s);
+            """, (job_id, user.get("id"), user.get("username"), role, sql_text, max_rows, config.SQL_JOB_TIMEOUT_MS))
+    finally:
+        conn.close()
+
+    _executor_instance().submit(_run_job, job_id)
+    logger.info(f"🧾 Job SQL {job_id} en file ({user.get('username')})")
+    return {"id": job_id, "status": "queued", "max_rows": max_rows, "timeout_ms": config.SQL_JOB_TIMEOUT_MS}
+
+
+def _can_access(job: Dict[str, Any], user: Dict[str, Any]) -> bool:
+    return job["username"] == user.get("username") or user.get("role") in ("admin", "superadmin")
+
+
+def get_job(job_id: str, user: Dict[str, Any]) -> Dict[str, Any]:
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(f"SELECT {JOB_COLUMNS} FROM sql_jobs WHERE id = %s;", (job_id,))
+            job = cur.fetchone()
+    finally:
+        conn.close()
+    if not job or not _can_access(job, user):
+        raise JobError("Job not found", 404)
+    return _serialize(job)
+
+
+def list_jobs(user: Dict[str, Any], limit: int = 50) -> List[Dict[str, Any]]:
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(f"SELECT {JOB_COLUMNS} FROM sql_jobs WHERE username = %s ORDER BY created_at DESC LIMIT %s;",
+                        (user.get("username"), limit))
+            return [_serialize(job) for job in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def get_results(job_id: str, user: Dict[str, Any], after: int = 0, limit: int = 1000) -> Dict[str, Any]:
+    """ Page de résultats : lignes rn > after (offset = after ; keyset = dernier rn reçu). """
+    job = get_job(job_id, user)
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT rn, data FROM sql_job_rows WHERE job_id = %s AND rn > %s ORDER BY rn LIMIT %s;",
+                        (job_id, after, limit))
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    columns = job["columns"] or []
+    last = rows[-1][0] if rows else after
+    return {
+        "id": job_id,
+        "status": job["status"],
+        "columns": columns,
+        "rows": [dict(zip(columns, row)) for _, row in rows],
+        "after": after,
+        "next_after": last if last < job["rowcount"] or job["status"] in ACTIVE_STATUSES else None,
+        "rowcount": job["rowcount"],
+        "truncated": job["truncated"],
+    }
+
+
+def cancel_job(job_id: str, user: Dict[str, Any]) -> Dict[str, Any]:
+    """ En file : annulé immédiatement ; en cours : pg_cancel_backend sur la connexion du job. """
+    job = get_job(job_id, user)
+    if job["status"] not in ACTIVE_STATUSES:
+        return job
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE sql_jobs SET
+                    status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE 'cancelling' END,
+                    finished_at = CASE WHEN status = 'queued' THEN now() ELSE finished_at END,
+                    updated_at = now()
+                WHERE id = %s AND status IN %s
+                RETURNING status, backend_pid;
+            """, (job_id, ACTIVE_STATUSES))
+            row = cur.fetchone()
+            if row and row[0] == "cancelling" and row[1]:
+                cur.execute("SELECT pg_cancel_backend(%s);", (row[1],))
+    finally:
+        conn.close()
+    logger.info(f"🛑 Annulation du job SQL {job_id} demandée par {user.get('username')}")
+    return get_job(job_id, user)
+
+
+def delete_job(job_id: str, user: Dict[str, Any]):
+    job = get_job(job_id, user)
+    if job["status"] in ACTIVE_STATUSES:
+        raise JobError("Cancel the job before deleting it", 409)
+    conn = get_connection()
+    if conn is None:
+        raise JobError("PostgreSQL connection failed", 500)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM sql_jobs WHERE id = %s;", (job_id,))
+    finally:
+        conn.close()
+
+
+# ------------------------
+# Exécution (thread du pool)
+# ------------------------
+def _finish(conn, job_id: str, status: str, **fields):
+    """ Statut final du job (finished_at = now(), pid effacé). """
+    assignments = "".join(f", {k} = %s" for k in fields)
+    with conn.cursor() as cur:
+        cur.execute(f"UPDATE sql_jobs SET status = %s, finished_at = now(), updated_at = now(), backend_pid = NULL{assignments} WHERE id = %s;",
+                    (status, *fields.values(), job_id))
+
+
+def _run_job(job_id: str):
+    from routes.run_sql_routes import jsonify_value
+
+    meta = get_connection()
+    if meta is None:
+        logger.error(f"❌ Job SQL {job_id} : connexion PostgreSQL indisponible")
+        return
+    started = time.perf_counter()
+    status, query_conn = "failed", None
+    try:
+        with meta.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("""
+                UPDATE sql_jobs SET status = 'running', started_at = now(), updated_at = now()
+                WHERE id = %s AND status = 'queued'
+                RETURNING sql, role, max_rows, timeout_ms;
+            """, (job_id,))
+            job = cur.fetchone()
+        if job is None:
+            return  # annulé avant démarrage
+
+        query_conn = get_connection()
+        if query_conn is None:
+            raise psycopg2.OperationalError("PostgreSQL connection failed")
+        query_conn.autocommit = False
+        with meta.cursor() as cur:
+            cur.execute("UPDATE sql_jobs SET backend_pid = %s WHERE id = %s;", (query_conn.get_backend_pid(), job_id))
+
+        rowcount, truncated, columns = 0, False, None
+        with query_conn.cursor() as setup:
+            if job["role"] not in ("admin", "superadmin"):
+                setup.execute("SET TRANSACTION READ ONLY;")
+            setup.execute(f"SET LOCAL statement_timeout = {int(job['timeout_ms'])};")
+        with query_conn.cursor(name=f"sql_job_{job_id[:12]}", cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.itersize = config.SQL_JOB_BATCH_SIZE
+            cur.execute(job["sql"])
+            while rowcount < job["max_rows"]:
+                batch = cur.fetchmany(min(config.SQL_JOB_BATCH_SIZE, job["max_rows"] - rowcount))
+                if columns is None and cur.description:
+                    columns = [desc.name for desc in cur.description]
+                    with meta.cursor() as mcur:
+                        mcur.execute("UPDATE sql_jobs SET columns = %s WHERE id = %s;", (json.dumps(columns), job_id))
+                if not batch:
+                    break
+                values = [(job_id, rowcount + i + 1, psycopg2.extras.Json([jsonify_value(v) for v in row]))
+                          for i, row in enumerate(batch)]
+                with meta.cursor() as mcur:
+                    psycopg2.extras.execute_values(mcur, "INSERT INTO sql_job_rows (job_id, rn, data) VALUES %s", values,
+                                                   page_size=len(values))
+                    rowcount += len(batch)
+                    mcur.execute("UPDATE sql_jobs SET rowcount = %s, updated_at = now() WHERE id = %s;", (rowcount, job_id))
+                SQL_JOB_ROWS.inc(len(batch))
+            else:
+                truncated = bool(cur.fetchmany(1))
+        query_conn.rollback()
+
+        status = "succeeded"
+        _finish(meta, job_id, status, rowcount=rowcount, truncated=truncated)
+        logger.info(f"✅ Job SQL {job_id} terminé : {rowcount} lignes en {time.perf_counter() - started:.1f} s")
+
+    except psycopg2.errors.QueryCanceled as e:
+        status = "cancelled" if _current_status(meta, job_id) == "cancelling" else "failed"
+        error = None if status == "cancelled" else f"Query timeout: {e}"
+        _safe_rollback(query_conn)
+        _finish(meta, job_id, status, error=error)
+        logger.warning(f"🛑 Job SQL {job_id} {status}")
+    except Exception as e:
+        status = "failed"
+        _safe_rollback(query_conn)
+        pg_err = getattr(e, "pgerror", None) or str(e)
+        try:
+            _finish(meta, job_id, status, error=pg_err[:2000])
+        except Exception:
+            logger.exception(f"❌ Job SQL {job_id} : statut non enregistré")
+        logger.error(f"❌ Job SQL {job_id} en échec : {pg_err}")
+    finally:
+        SQL_JOBS.inc(status=status)
+        SQL_JOB_SECONDS.observe(time.perf_counter() - started, status=status)
+        for conn in (query_conn, meta):
+            try:
+                if conn is not None:
+                    conn.close()
+            except Exception:
+                pass
+
+
+def _current_status(conn, job_id: str) -> Optional[str]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT status FROM sql_jobs WHERE id = %s;", (job_id,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _safe_rollback(conn):
+    try:
+        if conn is not None and not conn.closed:
+            conn.rollback()
+    except Exception:
+        pass
+
+
+# ------------------------
+# Purge
+# ------------------------
+def _maybe_cleanup():
+    """ Au plus une fois par SQL_JOB_CLEANUP_SECONDS : purge des anciens jobs, jobs orphelins en échec. """
+    global _last_cleanup
+    now = time.monotonic()
+    if now - _last_cleanup < config.SQL_JOB_CLEANUP_SECONDS:
+        return
+    _last_cleanup = now
+    conn = get_connection()
+    if conn is None:
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM sql_jobs WHERE created_at < now() - make_interval(hours => %s);",
+                        (config.SQL_JOB_RESULT_TTL_HOURS,))
+            purged = cur.rowcount
+            # Worker disparu (redémarrage gunicorn) : plus aucune activité depuis timeout + 5 min
+            cur.execute("""
+                UPDATE sql_jobs SET status = 'failed', error = 'Worker lost', finished_at = now(), updated_at = now()
+                WHERE status IN %s AND updated_at < now() - make_interval(secs => timeout_ms / 1000.0 + 300);
+            """, (ACTIVE_STATUSES,))
+            if purged or cur.rowcount:
+                logger.info(f"🧹 Jobs SQL : {purged} purgés, {cur.rowcount} orphelins marqués en échec")
+    except Exception as e:
+        logger.warning(f"Purge des jobs SQL impossible : {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,474 @@
+"""
+File de travail PostgreSQL pour la sync TEI / enrollments / events / attributes.
+
+Une sync est un lot (sync_batches) de tâches (sync_tasks), une par (programme, orgunit, fenêtre
+lastUpdated). N'importe quel nombre de processus / conteneurs scheduler vide la file en parallèle :
+
+- réservation par `SELECT ... FOR UPDATE SKIP LOCKED` : une tâche n'est prise que par un worker
+- bail (lease) de SYNC_QUEUE_LEASE_SECONDS, prolongé par le heartbeat du processus tant que
+  la tâche tourne ; une tâche dont le bail a expiré (worker mort) est reprise par un autre
+- échec : la tâche revient en file (délai croissant) jusqu'à SYNC_QUEUE_MAX_ATTEMPTS tentatives
+- un seul lot ouvert par programme (index unique partiel) : si plusieurs replicas déclenchent la
+  même sync, le premier crée le lot et les autres le rejoignent
+- le dernier worker qui termine clôt le lot (une seule clôture gagne) et reçoit le résumé :
+  c'est lui qui met à jour last_sync et rafraîchit la vue matérialisée ; tout worker clôt aussi
+  les lots ouverts sans tâche restante (dernière tâche en échec par expiration du bail...)
+
+La fenêtre est figée à la création du lot (last_sync → maintenant) ; last_sync prend la fin de
+fenêtre, pas l'heure de fin de la sync, pour ne rien perdre des mises à jour faites pendant.
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import psycopg2.extras
+
+from utils.config import config
+from utils.db import get_connection
+from utils.metrics import REGISTRY
+from utils.background_jobs import WORKER_ID
+from utils.sync_runs import SyncRunRecorder
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+SYNC_QUEUE_TASKS = REGISTRY.counter("sync_queue_tasks_total", "Tâches de la file de sync", ["status"])
+SYNC_QUEUE_TASK_SECONDS = REGISTRY.histogram("sync_queue_task_seconds", "Durée d'une tâche (orgunit) de la file de sync",
+                                             buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+SYNC_QUEUE_IN_FLIGHT = REGISTRY.gauge("sync_queue_tasks_in_flight", "Tâches de la file de sync en cours dans le processus")
+
+ENTITIES = ("teis", "enrollments", "events", "attributes")
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_held: Dict[int, str] = {}  # task_id -> orgunit_id, tâches détenues par ce processus
+_held_lock = threading.Lock()
+_heartbeat: Optional[threading.Thread] = None
+_last_cleanup = 0.0
+
+
+# ------------------------
+# Schéma
+# ------------------------
+def ensure_sync_queue_schema() -> bool:
+    """ Tables sync_batches / sync_tasks ; exécuté une seule fois par processus. """
+    global _schema_ready
+    if _schema_ready:
+        return True
+    with _schema_lock:
+        if _schema_ready:
+            return True
+        conn = get_connection()
+        if conn is None:
+            logger.error("❌ Schéma sync_queue non vérifié : connexion PostgreSQL indisponible")
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS sync_batches (
+                        id TEXT PRIMARY KEY,
+                        program TEXT NOT NULL,
+                        window_start TIMESTAMP WITH TIME ZONE,
+                        window_end TIMESTAMP WITH TIME ZONE NOT NULL,
+                        params JSONB NOT NULL DEFAULT '{}'::jsonb,
+                        triggered_by TEXT,
+                        status TEXT NOT NULL DEFAULT 'open',
+                        tasks_total INT NOT NULL DEFAULT 0,
+                        result JSONB,
+                        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                        finished_at TIMESTAMP WITH TIME ZONE
+                    );
+                    -- Un seul lot ouvert par programme : les replicas rejoignent le lot en cours
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_sync_batches_open
+                        ON sync_batches(program) WHERE status = 'open';
+
+                    CREATE TABLE IF NOT EXISTS sync_tasks (
+                        id BIGSERIAL PRIMARY KEY,
+                        batch_id TEXT NOT NULL REFERENCES sync_batches(id) ON DELETE CASCADE,
+                        program TEXT NOT NULL,
+                        orgunit_id TEXT NOT NULL,
+                        window_start TIMESTAMP WITH TIME ZONE,
+                        window_end TIMESTAMP WITH TIME ZONE NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INT NOT NULL DEFAULT 0,
+                        available_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                        lease_owner TEXT,
+                        lease_expires_at TIMESTAMP WITH TIME ZONE,
+                        heartbeat_at TIMESTAMP WITH TIME ZONE,
+                        rows JSONB,
+                        error TEXT,
+                        started_at TIMESTAMP WITH TIME ZONE,
+                        finished_at TIMESTAMP WITH TIME ZONE,
+                        UNIQUE (batch_id, orgunit_id)
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_sync_tasks_claim ON sync_tasks(status, available_at, id);
+                """)
+            _schema_ready = True
+            return True
+        except Exception as e:
+            logger.exception(f"❌ Création du schéma sync_queue impossible : {e}")
+            return False
+        finally:
+            conn.close()
+
+
+# ------------------------
+# Création du lot
+# ------------------------
+def open_batch(program: str, orgunit_ids: List[str], window_start: Optional[datetime], window_end: datetime,
+               params: Dict[str, Any], triggered_by: Optional[str] = None) -> Optional[str]:
+    """
+    Crée le lot et ses tâches (une transaction : un lot n'est jamais visible sans ses tâches).
+    Si un lot est déjà ouvert pour ce programme, retourne son id sans rien créer.
+    """
+    if not ensure_sync_queue_schema():
+        return None
+    _maybe_cleanup()
+
+    conn = get_connection()
+    if conn is None:
+        return None
+    try:
+        # Un lot ouvert mais sans tâche restante ne doit pas capter la nouvelle sync
+        _expire_exhausted(conn)
+        finalize_idle_batches(conn)
+    except Exception:
+        conn.close()
+        raise
+    conn.autocommit = False
+    try:
+        batch_id = uuid.uuid4().hex
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO sync_batches (id, program, window_start, window_end, params, triggered_by, tasks_total)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT DO NOTHING
+                RETURNING id;
+            """, (batch_id, program, window_start, window_end, json.dumps(params), triggered_by, len(orgunit_ids)))
+            if cur.fetchone() is None:
+                cur.execute("SELECT id FROM sync_batches WHERE program = %s AND status = 'open';", (program,))
+                row = cur.fetchone()
+                conn.rollback()
+                if row:
+                    logger.info(f"🔗 Lot de sync {row[0]} déjà ouvert pour {program} : rejoint")
+                return row[0] if row else None
+
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO sync_tasks (batch_id, program, orgunit_id, window_start, window_end) VALUES %s
+                ON CONFLICT DO NOTHING;
+            """, [(batch_id, program, ou_id, window_start, window_end) for ou_id in orgunit_ids], page_size=1000)
+        conn.commit()
+        logger.info(f"🧾 Lot de sync {batch_id} : {len(orgunit_ids)} orgunits, fenêtre {window_start} → {window_end}")
+        return batch_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# ------------------------
+# Réservation / fin de tâche
+# ------------------------
+def claim_tasks(conn, limit: int) -> List[Dict[str, Any]]:
+    """
+    Réserve jusqu'à `limit` tâches disponibles (en attente, ou bail expiré) d'un lot ouvert.
+    SKIP LOCKED : les workers concurrents ne se bloquent pas et ne prennent jamais la même tâche.
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            WITH claimable AS (
+                SELECT t.id, t.status AS previous_status
+                FROM sync_tasks t
+                JOIN sync_batches b ON b.id = t.batch_id AND b.status = 'open'
+                WHERE t.attempts < %(max_attempts)s
+                  AND ((t.status = 'pending' AND t.available_at <= now())
+                       OR (t.status = 'running' AND t.lease_expires_at < now()))
+                ORDER BY t.id
+                LIMIT %(limit)s
+                FOR UPDATE OF t SKIP LOCKED
+            )
+            UPDATE sync_tasks t
+            SET status = 'running', attempts = t.attempts + 1, lease_owner = %(owner)s,
+                lease_expires_at = now() + make_interval(secs => %(lease)s), heartbeat_at = now(),
+                started_at = now(), error = NULL
+            FROM claimable c
+            WHERE t.id = c.id
+            RETURNING t.id, t.batch_id, t.program, t.orgunit_id, t.window_start, t.window_end, t.attempts,
+                      c.previous_status;
+        """, {"max_attempts": config.SYNC_QUEUE_MAX_ATTEMPTS, "limit": limit, "owner": WORKER_ID,
+              "lease": config.SYNC_QUEUE_LEASE_SECONDS})
+        tasks = cur.fetchall()
+    for task in tasks:
+        if task["previous_status"] == "running":
+            SYNC_QUEUE_TASKS.inc(status="reclaimed")
+            logger.warning(f"♻️ Tâche {task['id']} ({task['orgunit_id']}) reprise : bail expiré (tentative {task['attempts']})")
+    return tasks
+
+
+def _expire_exhausted(conn):
+    """ Bail expiré sans tentative restante : la tâche passe en échec (sinon le lot ne se clôt jamais). """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE sync_tasks SET status = 'failed', error = 'Lease expired', finished_at = now(), lease_owner = NULL
+            WHERE status = 'running' AND lease_expires_at < now() AND attempts >= %s;
+        """, (config.SYNC_QUEUE_MAX_ATTEMPTS,))
+        if cur.rowcount:
+            SYNC_QUEUE_TASKS.inc(cur.rowcount, status="failed")
+
+
+def complete_task(conn, task_id: int, rows: Dict[str, int]) -> bool:
+    """ False si le bail a été perdu entre-temps (tâche reprise par un autre worker). """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE sync_tasks SET status = 'done', rows = %s, finished_at = now(), lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = %s AND status = 'running' AND lease_owner = %s;
+        """, (json.dumps(rows), task_id, WORKER_ID))
+        return cur.rowcount == 1
+
+
+def fail_task(conn, task_id: int, error: str) -> str:
+    """ Remet la tâche en file (délai croissant) ou la passe en échec ; retourne le nouveau statut. """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE sync_tasks
+            SET status = CASE WHEN attempts < %(max_attempts)s THEN 'pending' ELSE 'failed' END,
+                available_at = now() + make_interval(secs => %(delay)s * attempts),
+                finished_at = CASE WHEN attempts < %(max_attempts)s THEN NULL ELSE now() END,
+                error = %(error)s, lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = %(id)s AND status = 'running' AND lease_owner = %(owner)s
+            RETURNING status;
+        """, {"max_attempts": config.SYNC_QUEUE_MAX_ATTEMPTS, "delay": config.RETRY_DELAY, "error": error[:2000],
+              "id": task_id, "owner": WORKER_ID})
+        row = cur.fetchone()
+    return row[0] if row else "lost"
+
+
+def finalize_batch(conn, batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Clôt le lot s'il ne reste aucune tâche en attente / en cours.
+    Une seule clôture réussit (UPDATE conditionnel) : retourne le résumé au gagnant, None sinon.
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            UPDATE sync_batches b
+            SET status = 'done', finished_at = now(), result = (
+                SELECT jsonb_build_object(
+                    'teis', COALESCE(SUM((t.rows->>'teis')::bigint), 0),
+                    'enrollments', COALESCE(SUM((t.rows->>'enrollments')::bigint), 0),
+                    'events', COALESCE(SUM((t.rows->>'events')::bigint), 0),
+                    'attributes', COALESCE(SUM((t.rows->>'attributes')::bigint), 0),
+                    'orgunits', COUNT(*),
+                    'orgunits_failed', COUNT(*) FILTER (WHERE t.status = 'failed'))
+                FROM sync_tasks t WHERE t.batch_id = b.id)
+            WHERE b.id = %s AND b.status = 'open'
+              AND NOT EXISTS (SELECT 1 FROM sync_tasks t WHERE t.batch_id = b.id AND t.status IN ('pending', 'running'))
+            RETURNING b.id, b.program, b.window_end, b.params, b.result;
+        """, (batch_id,))
+        return cur.fetchone()
+
+
+def finalize_idle_batches(conn) -> List[Dict[str, Any]]:
+    """ Clôt chaque lot ouvert qui n'a plus de tâche en attente / en cours ; retourne les lots clôturés ici. """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT b.id FROM sync_batches b
+            WHERE b.status = 'open'
+              AND NOT EXISTS (SELECT 1 FROM sync_tasks t WHERE t.batch_id = b.id AND t.status IN ('pending', 'running'));
+        """)
+        batch_ids = [row[0] for row in cur.fetchall()]
+    finalized = []
+    for batch_id in batch_ids:
+        result = finalize_batch(conn, batch_id)
+        if result:
+            finalized.append(result)
+            logger.info(f"🏁 Lot de sync {batch_id} clôturé : {result['result']}")
+    return finalized
+
+
+def batch_status(batch_id: str) -> Optional[Dict[str, Any]]:
+    """ Avancement d'un lot : statut, fenêtre et nombre de tâches par statut. """
+    conn = get_connection()
+    if conn is None:
+        return None
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("""
+                SELECT b.id, b.program, b.window_start, b.window_end, b.status, b.tasks_total, b.result,
+                       (SELECT jsonb_object_agg(status, n) FROM
+                           (SELECT status, COUNT(*) AS n FROM sync_tasks WHERE batch_id = b.id GROUP BY status) s) AS tasks
+                FROM sync_batches b WHERE b.id = %s;
+            """, (batch_id,))
+            return cur.fetchone()
+    finally:
+        conn.close()
+
+
+# ------------------------
+# Worker
+# ------------------------
+def drain(triggered_by: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Traite les tâches disponibles de tous les lots ouverts jusqu'à ce qu'il n'y en ait plus
+    (SYNC_QUEUE_CONCURRENCY orgunits en parallèle dans ce processus).
+    Retourne le nombre de tâches traitées et les lots clôturés par ce processus.
+    """
+    from clients.itc_dhis2_source_client import ItcDhis2SourceClient
+
+    summary = {"worker": WORKER_ID, "done": 0, "failed": 0, "retried": 0, "lost": 0, "finalized": []}
+    if not ensure_sync_queue_schema():
+        raise RuntimeError("Schéma sync_queue indisponible")
+    conn = get_connection()
+    if conn is None:
+        raise RuntimeError("PostgreSQL connection failed")
+
+    run: Optional[SyncRunRecorder] = None
+    batches: Dict[str, Dict[str, Any]] = {}
+    in_flight = {}
+    try:
+        _expire_exhausted(conn)
+        with ThreadPoolExecutor(max_workers=config.SYNC_QUEUE_CONCURRENCY, thread_name_prefix="sync-queue") as executor:
+            while True:
+                free = config.SYNC_QUEUE_CONCURRENCY - len(in_flight)
+                claimed = claim_tasks(conn, free) if free > 0 else []
+                if claimed and run is None:
+                    # Un run sync_runs par worker, créé seulement s'il y a du travail
+                    run = SyncRunRecorder("teis", {"queue": True, "worker": WORKER_ID}, triggered_by).start()
+                    dhis = ItcDhis2SourceClient(store_in_db=True)
+                for task in claimed:
+                    if task["batch_id"] not in batches:
+                        batches[task["batch_id"]] = _batch_params(conn, task["batch_id"])
+                    _hold(task["id"], task["orgunit_id"])
+                    in_flight[executor.submit(_run_task, dhis, run, task, batches[task["batch_id"]])] = task
+                if not in_flight:
+                    break
+
+                finished, _ = wait(list(in_flight), timeout=config.SYNC_QUEUE_LEASE_SECONDS / 3, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = in_flight.pop(future)
+                    _release(task["id"])
+                    rows, error = future.result()
+                    if error is None:
+                        status = "done" if complete_task(conn, task["id"], rows) else "lost"
+                    else:
+                        status = fail_task(conn, task["id"], error)
+                        if status == "pending":
+                            status = "retried"
+                    SYNC_QUEUE_TASKS.inc(status=status)
+                    summary[status] += 1
+                    if status == "lost":
+                        logger.warning(f"⚠️ Tâche {task['id']} ({task['orgunit_id']}) : bail perdu, résultat ignoré")
+
+        # Tous les lots ouverts sans tâche restante, y compris ceux dont ce worker n'a rien traité
+        # (ex. dernière tâche passée en échec par _expire_exhausted) : sinon le lot resterait
+        # ouvert et toutes les syncs suivantes le rejoindraient
+        _expire_exhausted(conn)
+        summary["finalized"] = finalize_idle_batches(conn)
+        return summary
+    finally:
+        for task in in_flight.values():
+            _release(task["id"])
+        if run is not None:
+            run.finish()
+        conn.close()
+
+
+def _batch_params(conn, batch_id: str) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT params FROM sync_batches WHERE id = %s;", (batch_id,))
+        row = cur.fetchone()
+    return row[0] if row else {}
+
+
+def _run_task(dhis, run: SyncRunRecorder, task: Dict[str, Any], params: Dict[str, Any]):
+    """ Fetch + stockage d'une orgunit ; retourne (lignes, erreur). """
+    started = time.perf_counter()
+    SYNC_QUEUE_IN_FLIGHT.inc()
+    try:
+        with run.orgunit(task["orgunit_id"]):
+            counts = dhis.fetch_teis_enrollments_events_attributes(
+                task["program"], task["orgunit_id"], task["id"],
+                params.get("teis", True), params.get("enrollments", True), params.get("attributes", True), params.get("events", True),
+                start_date=task["window_start"], end_date=task["window_end"],
+            )
+        return {entity: int(counts.get(entity, 0)) for entity in ENTITIES}, None
+    except Exception as e:
+        logger.error(f"❌ Tâche {task['id']} ({task['orgunit_id']}) en échec : {e}")
+        return None, str(e)
+    finally:
+        SYNC_QUEUE_IN_FLIGHT.dec()
+        SYNC_QUEUE_TASK_SECONDS.observe(time.perf_counter() - started)
+
+
+# ------------------------
+# Heartbeat / purge
+# ------------------------
+def _hold(task_id: int, orgunit_id: str):
+    with _held_lock:
+        _held[task_id] = orgunit_id
+    _start_heartbeat()
+
+
+def _release(task_id: int):
+    with _held_lock:
+        _held.pop(task_id, None)
+
+
+def _start_heartbeat():
+    global _heartbeat
+    if _heartbeat is not None and _heartbeat.is_alive():
+        return
+    with _held_lock:
+        if _heartbeat is not None and _heartbeat.is_alive():
+            return
+        _heartbeat = threading.Thread(target=_heartbeat_loop, name="sync-queue-heartbeat", daemon=True)
+        _heartbeat.start()
+
+
+def _heartbeat_loop():
+    """ Prolonge le bail des tâches détenues par ce processus (3 fois par durée de bail). """
+    while True:
+        time.sleep(max(config.SYNC_QUEUE_LEASE_SECONDS / 3, 1))
+        with _held_lock:
+            task_ids = list(_held)
+        if not task_ids:
+            continue
+        conn = get_connection()
+        if conn is None:
+            continue
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE sync_tasks SET heartbeat_at = now(), lease_expires_at = now() + make_interval(secs => %s)
+                    WHERE id = ANY(%s) AND status = 'running' AND lease_owner = %s;
+                """, (config.SYNC_QUEUE_LEASE_SECONDS, task_ids, WORKER_ID))
+        except Exception as e:
+            logger.warning(f"Heartbeat de la file de sync impossible : {e}")
+        finally:
+            conn.close()
+
+
+def _maybe_cleanup():
+    """ Au plus une fois par heure : purge des lots clôturés depuis plus de SYNC_QUEUE_TTL_DAYS. """
+    global _last_cleanup
+    now = time.monotonic()
+    if _last_cleanup and now - _last_cleanup < 3600:
+        return
+    _last_cleanup = now
+    conn = get_connection()
+    if conn is None:
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM sync_batches WHERE status <> 'open' AND finished_at < now() - make_interval(days => %s);",
+                        (config.SYNC_QUEUE_TTL_DAYS,))
+            if cur.rowcount:
+                logger.info(f"🧹 File de sync : {cur.rowcount} lots purgés")
+    except Exception as e:
+        logger.warning(f"Purge de la file de sync impossible : {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,268 @@
+"""
+Rapport structuré de chaque exécution de sync / arrimage (tables sync_runs et sync_run_orgunits).
+
+Les compteurs (lignes récupérées/insérées/mises à jour/supprimées par entité, octets,
+retries, erreurs) sont alimentés depuis les chemins critiques via des fonctions
+record_* qui écrivent dans la portée du thread courant (run ou orgunit).
+Chaque orgunit d'une sync TEI est traitée entièrement dans un thread du pool,
+ce qui permet d'attribuer les compteurs sans les faire transiter par les retours.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+ROW_COUNTERS = ("fetched", "inserted", "updated", "deleted")
+
+_local = threading.local()
+
+
+class SyncStats:
+    """ Compteurs d'une portée (run ou orgunit). """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rows: Dict[str, Dict[str, int]] = {}
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+
+    def add_rows(self, entity: str, **counts: int):
+        with self._lock:
+            entry = self.rows.setdefault(entity, dict.fromkeys(ROW_COUNTERS, 0))
+            for name, value in counts.items():
+                entry[name] = entry.get(name, 0) + int(value or 0)
+
+    def add(self, size: int = 0, retries: int = 0, errors: int = 0):
+        with self._lock:
+            self.bytes += size
+            self.retries += retries
+            self.errors += errors
+
+    def merge(self, other: "SyncStats"):
+        for entity, counts in other.rows.items():
+            self.add_rows(entity, **counts)
+        self.add(other.bytes, other.retries, other.errors)
+
+    def totals(self) -> Dict[str, int]:
+        """ Lignes récupérées par entité (format historique de la réponse de sync). """
+        return {entity: counts.get("fetched", 0) for entity, counts in self.rows.items()}
+
+
+def current_stats() -> Optional[SyncStats]:
+    return getattr(_local, "stats", None)
+
+
+@contextmanager
+def tracking(stats: SyncStats):
+    """ Rattache les compteurs record_* du thread courant à `stats`. """
+    previous = current_stats()
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+def record_rows(entity: str, **counts: int):
+    stats = current_stats()
+    if stats is not None:
+        stats.add_rows(entity, **counts)
+
+
+def record_bytes(size: int):
+    stats = current_stats()
+    if stats is not None:
+        stats.add(size=size)
+
+
+def record_retry():
+    stats = current_stats()
+    if stats is not None:
+        stats.add(retries=1)
+
+
+def record_error():
+    stats = current_stats()
+    if stats is not None:
+        stats.add(errors=1)
+
+
+def _elapsed_ms(started: float) -> int:
+    return int((time.perf_counter() - started) * 1000)
+
+
+class SyncRunRecorder:
+    """
+    Enregistre un run dans sync_runs (+ une ligne par orgunit dans sync_run_orgunits).
+
+        with SyncRunRecorder("teis", params) as run:
+            with run.orgunit(ou_id):
+                ...  # fetch + stockage ; record_* alimente la ligne de l'orgunit
+
+    L'écriture du rapport ne doit jamais faire échouer la sync : erreurs journalisées uniquement.
+    `progress(event, data)` (optionnel, ex. job d'arrière-plan) reçoit le total attendu puis
+    chaque orgunit terminée.
+    """
+
+    def __init__(self, kind: str, params: Dict[str, Any] = None, triggered_by: str = None,
+                 progress: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        self.kind = kind
+        self.progress = progress
+        self.params = params or {}
+        self.triggered_by = triggered_by
+        self.run_id: Optional[int] = None
+        self.stats = SyncStats()
+        self.status = "running"
+        self.error: Optional[str] = None
+        self._orgunits: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._started_at: Optional[datetime] = None
+        self._started: Optional[float] = None
+
+    def start(self) -> "SyncRunRecorder":
+        from clients.postgres_client import PostgresClient
+
+        self._started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        try:
+            self.run_id = PostgresClient().create_sync_run(self.kind, self.params, self.triggered_by, self._started_at)
+        except Exception as e:
+            logger.error(f"❌ sync_runs indisponible ({self.kind}) : {e}")
+        return self
+
+    def set_total(self, total: int):
+        """ Nombre d'orgunits (ou orgunit × période) attendues, pour la progression. """
+        self._emit("total", {"total": total})
+
+    def _emit(self, event: str, data: Dict[str, Any]):
+        if self.progress is None:
+            return
+        try:
+            self.progress(event, data)
+        except Exception as e:
+            logger.warning(f"Progression {event} du run {self.kind} non transmise : {e}")
+
+    def _emit_orgunit(self, record: Dict[str, Any], rows: Optional[Dict[str, Any]]):
+        with self._lock:
+            done = len(self._orgunits)
+            failed = sum(1 for ou in self._orgunits if ou["status"] == "failed")
+        self._emit("orgunit", {"orgunit_id": record["orgunit_id"], "period": record["period"], "status": record["status"],
+                               "error": record["error"], "duration_ms": record.get("duration_ms"), "rows": rows,
+                               "done": done, "failed": failed})
+
+    @contextmanager
+    def track(self):
+        """ Compteurs hors orgunit (ex: sync orgunits / dataelements) → niveau run. """
+        with tracking(self.stats) as stats:
+            yield stats
+
+    @contextmanager
+    def orgunit(self, orgunit_id: Optional[str], period: Optional[str] = None):
+        """ Chronomètre une orgunit ; une exception est enregistrée puis propagée. """
+        stats = SyncStats()
+        record = {"orgunit_id": orgunit_id, "period": period, "started_at": datetime.now(timezone.utc), "status": "success", "error": None}
+        started = time.perf_counter()
+        try:
+            with tracking(stats):
+                yield stats
+        except Exception as e:
+            record.update(status="failed", error=str(e)[:2000])
+            stats.add(errors=1)
+            raise
+        finally:
+            record.update(finished_at=datetime.now(timezone.utc), duration_ms=_elapsed_ms(started), rows=stats.rows,
+                          bytes=stats.bytes, retries=stats.retries, errors=stats.errors)
+            if record["status"] == "success" and stats.errors:
+                record["status"] = "partial"
+            with self._lock:
+                self._orgunits.append(record)
+            self._emit_orgunit(record, stats.rows)
+
+    def mark_orgunit_failed(self, orgunit_id: Optional[str], error: str, period: Optional[str] = None):
+        """ Pour les échecs signalés par valeur de retour plutôt que par exception. """
+        with self._lock:
+            for record in reversed(self._orgunits):
+                if record["orgunit_id"] == orgunit_id and record["period"] == period:
+                    record.update(status="failed", error=error)
+                    record["errors"] = max(1, record["errors"])
+                    break
+            else:
+                return
+        self._emit_orgunit(record, None)
+
+    def orgunit_records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._orgunits)
+
+    def add_orgunit_record(self, record: Dict[str, Any]):
+        """ Ligne d'orgunit produite ailleurs (processus de sync fils, utils.sync_shards). """
+        with self._lock:
+            self._orgunits.append(record)
+        self._emit_orgunit(record, record.get("rows"))
+
+    def summary(self) -> Dict[str, Any]:
+        totals = SyncStats()
+        totals.merge(self.stats)
+        with self._lock:
+            orgunits = list(self._orgunits)
+        for ou in orgunits:
+            for entity, counts in (ou["rows"] or {}).items():
+                totals.add_rows(entity, **counts)
+            totals.add(ou["bytes"], ou["retries"], ou["errors"])
+        failed = sum(1 for ou in orgunits if ou["status"] == "failed")
+        return {
+            "run_id": self.run_id,
+            "kind": self.kind,
+            "status": self.status,
+            "orgunits_total": len(orgunits),
+            "orgunits_failed": failed,
+            "rows": totals.rows,
+            "bytes": totals.bytes,
+            "retries": totals.retries,
+            "errors": totals.errors,
+            "error": self.error,
+            "_orgunits": orgunits,
+        }
+
+    def finish(self, error: Optional[str] = None, status: Optional[str] = None) -> Dict[str, Any]:
+        from clients.postgres_client import PostgresClient
+
+        self.error = error
+        summary = self.summary()
+        if status:
+            self.status = status
+        elif error:
+            self.status = "failed"
+        elif summary["orgunits_failed"] or summary["errors"]:
+            self.status = "partial"
+        else:
+            self.status = "success"
+        summary["status"] = self.status
+        orgunits = summary.pop("_orgunits")
+
+        duration_ms = _elapsed_ms(self._started) if self._started is not None else None
+        summary["duration_ms"] = duration_ms
+        if self.run_id is not None:
+            run = {k: summary[k] for k in ("status", "orgunits_total", "orgunits_failed", "rows", "bytes", "retries", "errors", "error")}
+            run.update(finished_at=datetime.now(timezone.utc), duration_ms=duration_ms)
+            try:
+                PostgresClient().finish_sync_run(self.run_id, run, orgunits)
+            except Exception as e:
+                logger.error(f"❌ Finalisation du rapport sync_runs {self.run_id} impossible : {e}")
+
+        logger.info(f"📊 Run {self.kind} #{self.run_id} : {self.status} en {duration_ms} ms "
+                    f"({summary['orgunits_total']} orgunits, {summary['orgunits_failed']} en échec)")
+        return summary
+
+    def __enter__(self) -> "SyncRunRecorder":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.status == "running":
+            self.finish(error=str(exc) if exc else None)
+        return False
@@ -0,0 +1,150 @@
+"""
+Sync TEI multi-processus (SYNC_PROCESSES > 1).
+
+En mode threads (get_multi_async_request), le décodage JSON, l'aplatissement et la
+préparation des UPSERT de toutes les orgunits passent par un seul GIL. Ici les orgunits
+sont découpées en paquets de SYNC_PROCESS_CHUNK_SIZE, répartis sur SYNC_PROCESSES processus :
+
+- chaque processus a sa propre session HTTP DHIS2 et sa propre connexion PostgreSQL
+  (singletons recréés dans le processus, contexte "spawn" : rien n'est hérité du parent)
+- dans un processus, le paquet est traité par SYNC_PROCESS_THREADS threads (recouvrement réseau)
+- le processus stocke lui-même les lignes et ne renvoie qu'un résumé : compteurs par entité
+  et une ligne sync_run_orgunits par orgunit (durée, lignes, octets, retries, erreur)
+
+Si un processus fils meurt (OOM, kill...), le pool entier est cassé : tous les paquets non
+terminés échouent avec BrokenProcessPool. Ils sont relancés dans un nouveau pool, au plus
+SYNC_PROCESS_POOL_RESTARTS fois (le stockage est en UPSERT : rejouer un paquet partiellement
+stocké est sans effet de bord), puis comptés en échec.
+
+Le parent reporte ces lignes dans son SyncRunRecorder (rapport sync_runs et progression du job
+inchangés, à la granularité du paquet). Les métriques des processus fils ne sont agrégées
+sur /api/metrics que si METRICS_DIR est défini.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.config import config
+from utils.metrics import REGISTRY
+from utils.sync_runs import SyncRunRecorder
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+SYNC_SHARDS = REGISTRY.counter("sync_shards_total", "Paquets d'orgunits traités par les processus de sync", ["status"])
+
+ENTITIES = ("teis", "enrollments", "events", "attributes")
+
+Chunk = List[Tuple[int, str]]  # paquet de (index, orgunit_id)
+
+_dhis = None  # client DHIS2 du processus fils
+
+
+def _init_worker():
+    """ Initialiseur du processus fils : session HTTP + connexion PostgreSQL propres. """
+    global _dhis
+    from clients.itc_dhis2_source_client import ItcDhis2SourceClient
+    _dhis = ItcDhis2SourceClient(store_in_db=True)
+    logger.info(f"🧩 Processus de sync {os.getpid()} prêt")
+
+
+def _sync_chunk(program: str, orgunits: Chunk, flags: Tuple[bool, bool, bool, bool],
+                last_sync: Optional[datetime]) -> Dict[str, Any]:
+    """ Exécuté dans le processus fils : fetch + aplatissement + stockage d'un paquet d'orgunits. """
+    recorder = SyncRunRecorder("teis")  # non démarré : collecte les lignes d'orgunit, n'écrit rien
+    counts = dict.fromkeys(ENTITIES, 0)
+    lock = threading.Lock()
+
+    def fetch_orgunit(ou_index: int, ou_id: str):
+        try:
+            with recorder.orgunit(ou_id):
+                result = _dhis.fetch_teis_enrollments_events_attributes(program, ou_id, ou_index, *flags, last_sync)
+            with lock:
+                for entity in ENTITIES:
+                    counts[entity] += int(result.get(entity, 0))
+        except Exception as e:
+            logger.error("Erreur de sync de l'orgunit %s : %s", ou_id, e)
+
+    threads = config.SYNC_PROCESS_THREADS or max(1, config.MAX_WORKERS // config.SYNC_PROCESSES)
+    with ThreadPoolExecutor(max_workers=min(threads, len(orgunits))) as executor:
+        list(executor.map(lambda payload: fetch_orgunit(*payload), orgunits))
+
+    REGISTRY.flush()  # instantané des métriques avant un éventuel arrêt du processus
+    return {"pid": os.getpid(), "counts": counts, "orgunits": recorder.orgunit_records()}
+
+
+def _failed_records(orgunits: Chunk, error: str) -> List[Dict[str, Any]]:
+    now = datetime.now(timezone.utc)
+    return [{"orgunit_id": ou_id, "period": None, "started_at": now, "finished_at": now, "status": "failed",
+             "error": error[:2000], "duration_ms": 0, "rows": {}, "bytes": 0, "retries": 0, "errors": 1}
+            for _, ou_id in orgunits]
+
+
+def _add_failed(run: SyncRunRecorder, chunk: Chunk, error: str):
+    SYNC_SHARDS.inc(status="failed")
+    for record in _failed_records(chunk, error):
+        run.add_orgunit_record(record)
+
+
+def _run_pool(run: SyncRunRecorder, program: str, chunks: List[Chunk], flags: Tuple[bool, bool, bool, bool],
+              last_sync: Optional[datetime], totals: Dict[str, int]) -> Tuple[List[Chunk], Optional[BaseException]]:
+    """ Un pool de processus sur `chunks` ; retourne les paquets perdus avec le pool (BrokenProcessPool) et l'erreur. """
+    processes = min(config.SYNC_PROCESSES, len(chunks))
+    broken: List[Chunk] = []
+    error: Optional[BaseException] = None
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker) as executor:
+        futures = {executor.submit(_sync_chunk, program, chunk, flags, last_sync): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                summary = future.result()
+            except BrokenProcessPool as e:
+                # Processus fils mort : ce paquet n'est pas forcément en cause, il sera relancé
+                broken.append(chunk)
+                error = e
+                continue
+            except Exception as e:
+                logger.error(f"❌ Paquet de {len(chunk)} orgunits perdu : {e}")
+                _add_failed(run, chunk, f"Paquet de sync en échec : {e}")
+                continue
+            SYNC_SHARDS.inc(status="success")
+            for entity, value in summary["counts"].items():
+                totals[entity] += value
+            for record in summary["orgunits"]:
+                run.add_orgunit_record(record)
+    return broken, error
+
+
+def run_sharded(run: SyncRunRecorder, program: str, orgunit_ids: List[str], flags: Tuple[bool, bool, bool, bool],
+                last_sync: Optional[datetime]) -> Dict[str, int]:
+    """
+    Répartit les orgunits sur SYNC_PROCESSES processus ; retourne les lignes récupérées par entité
+    (même format que get_multi_async_request sur fetch_teis_enrollments_events_attributes).
+    """
+    indexed = list(enumerate(orgunit_ids))
+    size = max(1, config.SYNC_PROCESS_CHUNK_SIZE)
+    chunks = [indexed[i:i + size] for i in range(0, len(indexed), size)]
+    totals = dict.fromkeys(ENTITIES, 0)
+    if not chunks:
+        return totals
+
+    logger.info(f"🧩 Sync multi-processus : {len(orgunit_ids)} orgunits, {len(chunks)} paquets, "
+                f"{min(config.SYNC_PROCESSES, len(chunks))} processus")
+    pending, error = _run_pool(run, program, chunks, flags, last_sync, totals)
+    restarts = 0
+    while pending and restarts < config.SYNC_PROCESS_POOL_RESTARTS:
+        restarts += 1
+        SYNC_SHARDS.inc(len(pending), status="restarted")
+        logger.warning(f"⚠️ Pool de processus de sync perdu ({error}) : {len(pending)} paquet(s) relancé(s) "
+                       f"({restarts}/{config.SYNC_PROCESS_POOL_RESTARTS})")
+        pending, error = _run_pool(run, program, pending, flags, last_sync, totals)
+
+    for chunk in pending:
+        logger.error(f"❌ Paquet de {len(chunk)} orgunits perdu : {error}")
+        _add_failed(run, chunk, f"Processus de sync perdu : {error}")
+    return totals
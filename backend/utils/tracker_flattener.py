@@ -0,0 +1,236 @@
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from utils.functions import clean
+
+
+class ColumnarBuffer:
+    """
+    Tampon colonnaire (une liste par colonne) rempli ligne par ligne sans dict intermédiaire.
+    Les colonnes dynamiques (dataValues, attributs) sont créées à la volée et
+    complétées par None pour les lignes qui ne les renseignent pas.
+    """
+
+    __slots__ = ("columns", "length")
+
+    def __init__(self, base_columns: Iterable[str] = ()):
+        self.columns: Dict[str, List[Any]] = {c: [] for c in base_columns}
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def start_row(self) -> None:
+        self.length += 1
+
+    def set(self, column: str, value: Any) -> None:
+        """Affecte `value` à `column` pour la ligne courante (la dernière valeur gagne)."""
+        values = self.columns.get(column)
+        if values is None:
+            values = self.columns[column] = []
+        missing = self.length - len(values)
+        if missing > 0:
+            if missing > 1:
+                values.extend([None] * (missing - 1))
+            values.append(value)
+        else:
+            values[-1] = value
+
+    def finish(self) -> "ColumnarBuffer":
+        """Complète toutes les colonnes jusqu'au nombre de lignes."""
+        for values in self.columns.values():
+            missing = self.length - len(values)
+            if missing > 0:
+                values.extend([None] * missing)
+        return self
+
+    def dedupe(self, key: str) -> int:
+        """
+        Une seule ligne par valeur de `key` (la dernière gagne, à la position de sa dernière
+        occurrence) : un INSERT ... ON CONFLICT DO UPDATE refuse de toucher deux fois la même
+        ligne dans une même instruction. À appeler après finish(). Retourne le nombre de lignes retirées.
+        """
+        keys = self.columns.get(key)
+        if not keys:
+            return 0
+        last_row = {}
+        for pos, value in enumerate(keys):
+            last_row[value] = pos
+        removed = self.length - len(last_row)
+        if removed == 0:
+            return 0
+        kept = sorted(last_row.values())
+        for column, values in self.columns.items():
+            self.columns[column] = [values[pos] for pos in kept]
+        self.length = len(kept)
+        return removed
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self.columns.keys())
+
+    def first_values(self) -> Dict[str, Any]:
+        """Première valeur non nulle de chaque colonne (sert à deviner les types SQL)."""
+        sample = {}
+        for col, values in self.columns.items():
+            sample[col] = next((v for v in values if v is not None), None)
+        return sample
+
+    def iter_tuples(self, columns: List[str] = None) -> Iterator[Tuple]:
+        columns = columns or self.column_names
+        return zip(*(self.columns[c] for c in columns))
+
+    def to_rows(self) -> List[Dict[str, Any]]:
+        """Reconstruction en liste de dicts (sauvegarde locale / compatibilité)."""
+        columns = self.column_names
+        return [dict(zip(columns, row)) for row in self.iter_tuples(columns)]
+
+
+TEI_COLUMNS = ["id", "orgunit_id", "created", "last_updated", "type", "deleted", "program"]
+ENROLLMENT_COLUMNS = [
+    "id", "program", "orgunit_id", "tei_id", "tei_type", "enrollment_date",
+    "incident_date", "last_updated", "created", "status", "deleted",
+]
+ATTRIBUTE_COLUMNS = ["id", "tei_id", "enrollment_id", "orgunit_id", "program", "created", "status", "deleted"]
+EVENT_COLUMNS = [
+    "id", "due_date", "program", "program_stage_id", "orgunit_id", "enrollment_id", "tei_id",
+    "enrollment_status", "status", "event_date", "attribute_category_options", "last_updated",
+    "created", "deleted", "attribute_option_combo",
+]
+
+
+class TrackerFlattener:
+    """
+    Aplatissement en une seule passe de l'arbre DHIS2 TEI → enrollments → (attributes, events)
+    directement dans des tampons colonnaires. Les dicts DHIS2 sont lus sans copie ni
+    nettoyage préalable : seules les clés utiles sont accédées.
+    """
+
+    def __init__(self, program: str):
+        self.program = program
+        self.teis = ColumnarBuffer(TEI_COLUMNS)
+        self.enrollments = ColumnarBuffer(ENROLLMENT_COLUMNS)
+        self.attributes = ColumnarBuffer(ATTRIBUTE_COLUMNS)
+        self.events = ColumnarBuffer(EVENT_COLUMNS)
+
+        self.teis_to_delete_ids: List[str] = []
+        self.enrollments_to_delete_ids: List[str] = []
+        self.attributes_to_delete_ids: List[str] = []
+        self.events_to_delete_ids: List[str] = []
+
+    def add_teis(self, teis: Iterable[Dict]) -> "TrackerFlattener":
+        for tei in teis:
+            self.add_tei(tei)
+        return self
+
+    def add_tei(self, tei: Dict) -> None:
+        if not isinstance(tei, dict):
+            return
+
+        program = self.program
+        is_tei_deleted = tei.get("deleted", False)
+
+        for enrollment in tei.get("enrollments") or []:
+            if not isinstance(enrollment, dict):
+                continue
+            self._add_enrollment(enrollment, is_tei_deleted, program)
+
+        if is_tei_deleted:
+            self.teis_to_delete_ids.append(tei.get("trackedEntityInstance"))
+            return
+
+        buf = self.teis
+        buf.start_row()
+        buf.set("id", clean(tei.get("trackedEntityInstance")))
+        buf.set("orgunit_id", clean(tei.get("orgUnit")))
+        buf.set("created", clean(tei.get("createdAtClient") or tei.get("created")))
+        buf.set("last_updated", clean(tei.get("lastUpdated")))
+        buf.set("type", clean(tei.get("trackedEntityType")))
+        buf.set("deleted", bool(tei.get("deleted", False)))
+        buf.set("program", clean(program))
+
+    def _add_enrollment(self, enrollment: Dict, is_tei_deleted: bool, program: str) -> None:
+        is_enrollment_deleted = enrollment.get("deleted", False)
+        parent_deleted = is_tei_deleted or is_enrollment_deleted
+
+        # Events
+        for event in enrollment.get("events") or []:
+            if not isinstance(event, dict):
+                continue
+            if parent_deleted or event.get("deleted", False):
+                self.events_to_delete_ids.append(event.get("event"))
+                continue
+            self._add_event(event, program)
+
+        tei_id = enrollment.get("trackedEntityInstance")
+        enrollment_id = enrollment.get("enrollment")
+        attribute_row_id = f"{tei_id}-{enrollment_id}"
+
+        # Attributes : une ligne par enrollment, une colonne par attribut
+        buf = self.attributes
+        buf.start_row()
+        buf.set("id", clean(attribute_row_id))
+        buf.set("tei_id", clean(tei_id))
+        buf.set("enrollment_id", clean(enrollment_id))
+        buf.set("orgunit_id", clean(enrollment.get("orgUnit")))
+        buf.set("program", clean(program))
+        buf.set("created", clean(enrollment.get("created")))
+        buf.set("status", clean(enrollment.get("status")))
+        buf.set("deleted", clean(enrollment.get("deleted")))
+
+        for attribute in enrollment.get("attributes") or []:
+            if not isinstance(attribute, dict):
+                continue
+            if parent_deleted or attribute.get("deleted", False):
+                self.attributes_to_delete_ids.append(attribute_row_id)
+                continue
+            buf.set(attribute.get("attribute"), clean(attribute.get("value")))
+
+        # Enrollment
+        if parent_deleted:
+            self.enrollments_to_delete_ids.append(enrollment_id)
+            return
+
+        buf = self.enrollments
+        buf.start_row()
+        buf.set("id", clean(enrollment_id))
+        buf.set("program", clean(program))
+        buf.set("orgunit_id", clean(enrollment.get("orgUnit")))
+        buf.set("tei_id", clean(tei_id))
+        buf.set("tei_type", clean(enrollment.get("trackedEntityType")))
+        buf.set("enrollment_date", clean(enrollment.get("enrollmentDate")))
+        buf.set("incident_date", clean(enrollment.get("incidentDate")))
+        buf.set("last_updated", clean(enrollment.get("lastUpdated")))
+        buf.set("created", clean(enrollment.get("createdAtClient") or enrollment.get("created")))
+        buf.set("status", clean(enrollment.get("status")))
+        buf.set("deleted", bool(enrollment.get("deleted", False)))
+
+    def _add_event(self, event: Dict, program: str) -> None:
+        buf = self.events
+        buf.start_row()
+        buf.set("id", clean(event.get("event")))
+        buf.set("due_date", clean(event.get("dueDate")))
+        buf.set("program", clean(program))
+        buf.set("program_stage_id", clean(event.get("programStage")))
+        buf.set("orgunit_id", clean(event.get("orgUnit")))
+        buf.set("enrollment_id", clean(event.get("enrollment")))
+        buf.set("tei_id", clean(event.get("trackedEntityInstance")))
+        buf.set("enrollment_status", clean(event.get("enrollmentStatus")))
+        buf.set("status", clean(event.get("status")))
+        buf.set("event_date", clean(event.get("eventDate")))
+        buf.set("attribute_category_options", clean(event.get("attributeCategoryOptions")))
+        buf.set("last_updated", clean(event.get("lastUpdated")))
+        buf.set("created", clean(event.get("createdAtClient") or event.get("created")))
+        buf.set("deleted", bool(event.get("deleted", False)))
+        buf.set("attribute_option_combo", clean(event.get("attributeOptionCombo")))
+
+        # dataValues → une colonne par dataElement
+        for dv in event.get("dataValues") or []:
+            if isinstance(dv, dict):
+                de_id = dv.get("dataElement")
+                if de_id:
+                    buf.set(de_id, clean(dv.get("value")))
+
+    def finish(self) -> "TrackerFlattener":
+        for buf in (self.teis, self.enrollments, self.attributes, self.events):
+            buf.finish()
+        return self
@@ -1,7 +1,7 @@
 import { useState } from "react";
 
 // ----- ResultsTable -----
-export default function ResultsTable({ rows, error, loading }) {
+export default function ResultsTable({ rows, error, loading, hasMore, loadingMore, onLoadMore }) {
   const [hoveredRow, setHoveredRow] = useState(null);
 
   if (loading) {
@@ -48,6 +48,17 @@ export default function ResultsTable({ rows, error, loading }) {
           ))}
         </tbody>
       </table>
+      {hasMore && (
+        <div className="p-2 text-center">
+          <button
+            onClick={onLoadMore}
+            disabled={loadingMore}
+            className={`px-4 py-2 rounded text-white ${loadingMore ? "bg-gray-400" : "bg-blue-600 hover:bg-blue-700"}`}
+          >
+            {loadingMore ? "Chargement..." : `Charger plus (${rows.length} lignes affichées)`}
+          </button>
+        </div>
+      )}
     </div>
   );
 }
@@ -13,6 +13,7 @@ export default function SQLEditor({ onExecute, selectedQuery, setSelectedQuery }
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState(null);
     const [executeSql, setExecuteSql] = useState(true);
+    const [useCursor, setUseCursor] = useState(false); // curseur serveur (sinon pagination par offset)
     const [editorHeight, setEditorHeight] = useState(300); // hauteur initiale en px
     const { theme, toggleTheme } = useTheme();
     const { user } = useAuth();
@@ -71,10 +72,16 @@ export default function SQLEditor({ onExecute, selectedQuery, setSelectedQuery }
             const res = await api.post("/sql/execute", {
                 user_id: user.id,
                 sql: sqlToRun,
-                max_rows: null   // si undefined → null 
+                max_rows: null,   // si undefined → null (taille de page côté serveur)
+                cursor: useCursor, // pages suivantes via /sql/cursor/<id>/next (worker qui l'a ouvert)
+                offset: 0          // sinon pages suivantes en réexécutant avec offset
             });
 
-            onExecute(res?.data?.rows ?? [], null);
+            onExecute(res?.data?.rows ?? [], null, {
+                sql: sqlToRun,
+                cursor: res?.data?.cursor ?? null,
+                page: res?.data?.page ?? null
+            });
 
         } catch (err) {
             const msg = err.response?.data?.error || err.message;
@@ -237,6 +244,15 @@ export default function SQLEditor({ onExecute, selectedQuery, setSelectedQuery }
                 >
                     Réinitialiser
                 </button>
+
+                <label className="flex items-center space-x-1 text-sm text-gray-600">
+                    <input
+                        type="checkbox"
+                        checked={useCursor}
+                        onChange={(e) => setUseCursor(e.target.checked)}
+                    />
+                    <span>Curseur serveur</span>
+                </label>
             </div>
         </div>
     );
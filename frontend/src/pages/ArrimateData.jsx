@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from "react";
 import api from "../utils/api";
+import { runJob, formatProgress } from "../utils/jobs";
 import DatePicker from "react-datepicker";
 import "react-datepicker/dist/react-datepicker.css";
 import "./ArrimateData.css"; // Styles personnalisés
@@ -46,12 +47,16 @@ export default function ArrimateData() {
         setSelectAll(values.length === orgUnits.length);
     };
 
-    /** API POST wrapper */
+    /** Job d'arrière-plan (202 + progression par polling) */
     const apiCall = async (endpoint, params = {}) => {
-        const res = await api.post(endpoint, params).catch((error) => {
-            throw error.response?.data?.error || error.message;
+        let progress = { done: 0, failed: 0, total: null };
+        return runJob(endpoint, params, (event, data) => {
+            if (event === "total") progress = { ...progress, total: data.total };
+            else if (event === "orgunit") progress = { ...progress, done: data.done, failed: data.failed };
+            else if (event === "progress") progress = data;
+            else return;
+            setStatus(`⏳ ${formatProgress(progress)}`);
         });
-        return res.data;
     };
 
     /** Handle synchronization */
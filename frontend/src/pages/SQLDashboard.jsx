@@ -1,23 +1,67 @@
 import { useState } from "react";
+import api from "../utils/api";
+import { useAuth } from "../contexts/AuthContext";
 
 import SQLEditor from "../components/sql_components/SQLEditor";
 import ResultsTable from "../components/sql_components/ResultsTable";
 import SchemaViewer from "../components/sql_components/SchemaViewer";
 
 
+const PAGE_SIZE = 1000;
+
 export default function SQLDashboard() {
   const [selectedQuery, setSelectedQuery] = useState(null);
   const [results, setResults] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  // { sql, cursor } : de quoi charger la page suivante (null si tout est affiché)
+  const [paging, setPaging] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const { user } = useAuth();
 
-  const handleExecute = (rows, err) => {
+  const handleExecute = (rows, err, next = null) => {
     if (err) {
       setError(err);
       setResults([]);
+      setPaging(null);
     } else {
       setError(null);
       setResults(rows || []);
+      const cursor = next?.cursor?.has_more ? next.cursor : null;
+      setPaging(cursor || next?.page?.has_more ? { sql: next.sql, cursor } : null);
+    }
+  };
+
+  // Page suivante : par le curseur serveur s'il existe encore, sinon en réexécutant avec offset
+  const loadMore = async () => {
+    if (!paging) return;
+    setLoadingMore(true);
+    try {
+      if (paging.cursor) {
+        try {
+          const res = await api.get(`/sql/cursor/${paging.cursor.id}/next`, { params: { n: PAGE_SIZE } });
+          setResults((prev) => [...prev, ...(res?.data?.rows ?? [])]);
+          setPaging(res?.data?.cursor?.has_more ? { ...paging, cursor: res.data.cursor } : null);
+          return;
+        } catch (err) {
+          // 404 : curseur expiré ou ouvert par un autre worker → pagination par offset
+          if (err.response?.status !== 404) throw err;
+        }
+      }
+      const res = await api.post("/sql/execute", {
+        user_id: user.id,
+        sql: paging.sql,
+        max_rows: PAGE_SIZE,
+        offset: results.length
+      });
+      setResults((prev) => [...prev, ...(res?.data?.rows ?? [])]);
+      setPaging(res?.data?.page?.has_more ? { sql: paging.sql, cursor: null } : null);
+    } catch (err) {
+      // Les lignes déjà chargées restent affichées
+      setPaging(null);
+      alert(err.response?.data?.error || err.message);
+    } finally {
+      setLoadingMore(false);
     }
   };
 
@@ -41,6 +85,9 @@ export default function SQLDashboard() {
         rows={results}
         error={error}
         loading={loading}
+        hasMore={!!paging}
+        loadingMore={loadingMore}
+        onLoadMore={loadMore}
       />
 
       <SchemaViewer
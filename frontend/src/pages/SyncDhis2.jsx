@@ -1,6 +1,7 @@
 // frontend/src/pages/SyncDhis2.jsx
 import React, { useState } from "react";
 import api from "../utils/api";
+import { runJob, formatProgress } from "../utils/jobs";
 import { useAuth } from "../contexts/AuthContext";
 
 export default function SyncDhis2() {
@@ -31,15 +32,15 @@ export default function SyncDhis2() {
   const [err, setErr] = useState(null);
   const [success, setSuccess] = useState(null);
 
-  const apiCall = async (endpoint, params = {}) => {
-    let url = `/sync/${endpoint}`
+  const apiCall = async (endpoint, params = {}, onProgress) => {
     if (["build-matview"].includes(endpoint)){
-      url = endpoint
+      const res = await api.post(endpoint, params).catch((error) => {
+        throw error.response?.data?.error || error.message;
+      });
+      return res.data;
     }
-    const res = await api.post(url, params).catch((error) => {
-      throw error.response?.data?.error || error.message;
-    });
-    return res.data;
+    // Les syncs tournent en arrière-plan (202 + progression par polling)
+    return runJob(`/sync/${endpoint}`, params, onProgress);
   };
 
   const updateStatus = (key, value) => {
@@ -93,7 +94,19 @@ export default function SyncDhis2() {
           updateStatus(action.key, "En cours...");
         }
 
-        const result = await apiCall(action.endpoint, action.params);
+        const progressKeys = action.key === "data"
+          ? ["teis", "enrollments", "events", "attributes"].filter((k) => enabledSteps[k])
+          : [action.key];
+        let progress = { done: 0, failed: 0, total: null };
+        const onProgress = (event, data) => {
+          if (event === "total") progress = { ...progress, total: data.total };
+          else if (event === "orgunit") progress = { ...progress, done: data.done, failed: data.failed };
+          else if (event === "progress") progress = data;
+          else return;
+          for (const k of progressKeys) updateStatus(k, formatProgress(progress));
+        };
+
+        const result = await apiCall(action.endpoint, action.params, onProgress);
 
         // Mettre à jour le statut selon l'étape
         if (action.key === "orgunits") {
@@ -0,0 +1,54 @@
+import api from "./api";
+
+// ------------------------------------------------------
+// Jobs d'arrière-plan (sync / arrimage)
+// POST -> 202 { id } puis polling de /jobs/<id>?after=<seq> : état du job + événements
+// suivants (status, total, orgunit, done). Requêtes courtes, servies par n'importe quel worker.
+// ------------------------------------------------------
+
+const pollJob = async (jobId, onProgress) => {
+  let after = 0;
+  for (;;) {
+    const { data: job } = await api.get(`/jobs/${jobId}`, { params: { after } });
+    for (const evt of job.events ?? []) {
+      if (evt.event !== "done") onProgress?.(evt.event, evt.data);
+    }
+    after = job.last_seq ?? after;
+    if (job.poll_after_ms === undefined && (job.status === "succeeded" || job.status === "failed")) {
+      return { status: job.status, http_status: job.http_status, result: job.result };
+    }
+    await new Promise((resolve) => setTimeout(resolve, job.poll_after_ms ?? 2000));
+  }
+};
+
+/**
+ * Lance un job et attend sa fin ; onProgress(event, data) reçoit total / orgunit / progress.
+ * Retourne le résultat du job ; lève le message d'erreur en cas d'échec.
+ */
+export const runJob = async (url, params = {}, onProgress) => {
+  let job;
+  try {
+    ({ data: job } = await api.post(url, params));
+  } catch (error) {
+    throw error.response?.data?.error || error.message;
+  }
+
+  let final;
+  try {
+    final = await pollJob(job.id, onProgress);
+  } catch (error) {
+    throw error.response?.data?.error || error.message;
+  }
+  if (final.status !== "succeeded") {
+    throw final.result?.error || final.result?.detail || "Échec du job";
+  }
+  return final.result;
+};
+
+/** Texte de progression : "12/40 orgunits (1 en échec)". */
+export const formatProgress = (progress) => {
+  if (!progress || progress.done === undefined) return "En cours...";
+  const total = progress.total ? `/${progress.total}` : "";
+  const failed = progress.failed ? ` (${progress.failed} en échec)` : "";
+  return `En cours... ${progress.done}${total} orgunits${failed}`;
+};